@@ -0,0 +1,59 @@
+import argparse
+import os
+import time
+from pf_orchard_localization.utils import ParametersBagData
+from pf_orchard_localization.utils.bag_to_cache import BagToCacheSettings, convert_bags
+
+# Converts a directory of ros2 bags to cached data files without the app, running the trunk segmenter and analyzer on
+# every image. The topics are taken from the bag app config file. Bags that already have a cached data file in the
+# output directory are skipped, and bags that were interrupted continue from their .partial file.
+
+parser = argparse.ArgumentParser(description="Convert a directory of ros2 bags to cached data files")
+parser.add_argument("bag_dir", help="Directory of ros2 bags")
+parser.add_argument("output_dir", help="Directory to write the cached data files to")
+parser.add_argument("--config", required=True, help="Bag app config file with the topic names")
+parser.add_argument("--image_dir", default=None, help="Directory to save the segmented images to, not saved if not given")
+parser.add_argument("--image_format", default="png", choices=["png", "webp", "npy"], help="Format to save the images in")
+parser.add_argument("--ground_truth_dir", default=None, help="Directory of existing cached data files to copy the location estimates from, without it the cached data files can't be used to evaluate tests")
+parser.add_argument("--num_workers", type=int, default=2, help="Number of bags to convert at once, each worker holds a whole bag in memory")
+parser.add_argument("--batch_size", type=int, default=8, help="Number of images converted between writes to the .partial file and progress updates")
+parser.add_argument("--overwrite", action="store_true", help="Convert bags that already have cached data files again")
+args = parser.parse_args()
+
+if args.ground_truth_dir is None:
+    print("Warning: no --ground_truth_dir given, the location estimates will be NaN and the cached data files can't be "
+          "used to evaluate tests")
+
+parameters_data = ParametersBagData()
+parameters_data.load_from_yaml(args.config)
+
+settings = BagToCacheSettings(depth_topic=parameters_data.depth_topic,
+                              rgb_topic=parameters_data.rgb_topic,
+                              odom_topic=parameters_data.odom_topic,
+                              output_dir=args.output_dir,
+                              image_dir=args.image_dir,
+                              image_format=args.image_format,
+                              batch_size=args.batch_size,
+                              ground_truth_dir=args.ground_truth_dir,
+                              overwrite=args.overwrite)
+
+bag_paths = [os.path.join(args.bag_dir, name) for name in sorted(os.listdir(args.bag_dir))
+             if os.path.isdir(os.path.join(args.bag_dir, name))]
+
+start_time = time.time()
+run_start_times = {}
+
+
+def print_progress(run_name, num_imgs_done, num_imgs):
+    run_start_time = run_start_times.setdefault(run_name, time.time())
+    imgs_per_sec = num_imgs_done / max(time.time() - run_start_time, 1e-6)
+    print("{}: {}/{} images ({:.1f} images/s)".format(run_name, num_imgs_done, num_imgs, imgs_per_sec))
+
+
+results = convert_bags(bag_paths, settings, num_workers=args.num_workers, progress_callback=print_progress)
+
+num_failed = sum(isinstance(result, Exception) for result in results.values())
+print("Converted {} of {} bags in {:.1f}s".format(len(results) - num_failed, len(results), time.time() - start_time))
+for bag_path, result in results.items():
+    if isinstance(result, Exception):
+        print("Failed: {} ({})".format(bag_path, result))
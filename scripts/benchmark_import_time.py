@@ -0,0 +1,81 @@
+import argparse
+import json
+import subprocess
+import sys
+
+# Checks that the headless parts of the package, the particle filter engine, the pipeline and the test evaluation, import
+# quickly and without the heavy dependencies of the app, so evaluation jobs and worker processes start fast. Each module
+# is imported in a fresh interpreter, the best time of the repeats is compared to the budget, and the heavy modules it
+# pulled in are listed. Exits with 1 if any module is over the budget or imports a heavy module, so it can be run in CI.
+
+HEADLESS_MODULES = ["pf_orchard_localization.pf_engine",
+                    "pf_orchard_localization.pipeline",
+                    "pf_orchard_localization.recorded_data_loaders",
+                    "pf_orchard_localization.utils",
+                    "pf_orchard_localization.utils.parallel_pf_evaluation"]
+
+# Modules that are only needed by the app, the bag files, the visual odometry or once a particle filter runs
+HEAVY_MODULES = ["PyQt5", "pyqtgraph", "cv2", "cv_bridge", "rosbags", "rclpy", "scipy.stats", "scipy.ndimage"]
+
+# Run in the fresh interpreter, prints the import time and the heavy modules that were imported as json
+IMPORT_CODE = """
+import json, sys, time
+start_time = time.perf_counter()
+import {module}
+import_time = time.perf_counter() - start_time
+heavy_modules = [name for name in {heavy_modules!r} if name in sys.modules]
+print(json.dumps({{"import_time": import_time, "heavy_modules": heavy_modules}}))
+"""
+
+
+def time_import(module, heavy_modules, num_repeats):
+    """
+    Time importing a module in fresh interpreters
+
+    Args:
+        module (str): The module to import
+        heavy_modules (list): The modules to check whether the import pulled in
+        num_repeats (int): The number of times to import the module
+
+    Returns:
+        tuple: The best import time in seconds and the heavy modules the import pulled in
+    """
+    code = IMPORT_CODE.format(module=module, heavy_modules=heavy_modules)
+    import_times = []
+    imported_heavy_modules = []
+    for _ in range(num_repeats):
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        import_times.append(result["import_time"])
+        imported_heavy_modules = result["heavy_modules"]
+
+    return min(import_times), imported_heavy_modules
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the import time of the headless modules against a budget")
+    parser.add_argument("--modules", nargs="+", default=HEADLESS_MODULES, help="Modules to time the import of")
+    parser.add_argument("--budget", type=float, default=1.0, help="Most time each import can take, in seconds")
+    parser.add_argument("--num_repeats", type=int, default=3, help="Number of times to import each module, the best is used")
+    parser.add_argument("--allow_heavy_modules", action="store_true",
+                        help="Don't fail when a heavy module is imported, only check the time")
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        try:
+            import_time, imported_heavy_modules = time_import(module, HEAVY_MODULES, args.num_repeats)
+        except subprocess.CalledProcessError as e:
+            print("{}: import failed\n{}".format(module, e.stderr))
+            failed = True
+            continue
+
+        over_budget = import_time > args.budget
+        heavy_failure = bool(imported_heavy_modules) and not args.allow_heavy_modules
+        failed = failed or over_budget or heavy_failure
+
+        print("{}: {:.3f} s{}".format(module, import_time, " (over the {:.3f} s budget)".format(args.budget) if over_budget else ""))
+        if imported_heavy_modules:
+            print("    imports {}".format(", ".join(imported_heavy_modules)))
+
+    sys.exit(1 if failed else 0)
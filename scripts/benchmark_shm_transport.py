@@ -0,0 +1,148 @@
+import argparse
+import ast
+import subprocess
+import sys
+import time
+import numpy as np
+from pf_orchard_localization.trunk_data_connection.tcp_transport import TrunkDataClient, LocalTrunkDataConsumer
+from pf_orchard_localization.trunk_data_connection.shm_transport import (SharedMemoryTrunkDataClient,
+                                                                         LocalSharedMemoryTrunkDataConsumer)
+
+# Measures the per-frame latency of moving rgb and depth frames to a trunk data consumer on the same host and getting the
+# trunk data back, through the shared memory ring of shm_transport and over the TCP transport of tcp_transport. The
+# consumer runs in a separate process, started from this script with --serve, and answers with a few trunks and a copy of
+# the rgb image as the segmented image. For the shared memory transport, the time each request took to reach the consumer
+# and each result to come back are reported too, from the write time stamped in the slot headers.
+
+
+def make_frames(num_frames, width, height):
+    """
+    Make random rgb and depth frames of the camera size
+
+    Args:
+        num_frames (int): The number of distinct frames
+        width (int): The width of the frames
+        height (int): The height of the frames
+
+    Returns:
+        list: The rgb and depth frames
+    """
+    rng = np.random.default_rng(0)
+    return [(rng.integers(0, 256, (height, width, 3), dtype=np.uint8),
+             rng.integers(0, 10000, (height, width), dtype=np.uint16)) for _ in range(num_frames)]
+
+
+def process_frames(rgb_image, depth_image):
+    """
+    Stand-in for the segmenter and width analyzer, a few trunks and the rgb image as the segmented image
+    """
+    positions = np.array([[1.0, 0.5], [2.0, -0.5], [3.0, 0.2]])
+    widths = np.array([0.08, 0.1, 0.12])
+    class_estimates = np.array([0, 1, 2])
+    return positions, widths, class_estimates, rgb_image
+
+
+def serve(transport):
+    """
+    Run a consumer stand-in until stdin closes, printing its address first
+    """
+    if transport == "shm":
+        consumer = LocalSharedMemoryTrunkDataConsumer(process_frames)
+    else:
+        consumer = LocalTrunkDataConsumer(process_frames)
+    print(repr(consumer.address), flush=True)
+    sys.stdin.read()
+    consumer.close()
+
+
+def start_consumer(transport):
+    """
+    Start a consumer stand-in in a separate process
+
+    Returns:
+        tuple: The process and the address of the consumer
+    """
+    process = subprocess.Popen([sys.executable, __file__, "--serve", transport], stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, text=True)
+    address = ast.literal_eval(process.stdout.readline())
+    return process, address
+
+
+def benchmark(transport, frames, num_requests, max_in_flight):
+    """
+    Send frames through a transport, waiting for each result before sending the next frame if max_in_flight is 1
+
+    Returns:
+        tuple: The round trip times of the frames in seconds, the total time in seconds and the request and result
+               transfer times of the frames in seconds, or None for the TCP transport
+    """
+    process, address = start_consumer(transport)
+    if transport == "shm":
+        client = SharedMemoryTrunkDataClient(address, num_slots=max_in_flight)
+    else:
+        client = TrunkDataClient(address, max_in_flight=max_in_flight)
+    client.connect()
+
+    # Warm up the connection and the pages of the shared memory
+    for i in range(2 * max_in_flight):
+        client.get_result(client.submit(*frames[i % len(frames)]))
+    if transport == "shm":
+        client.transfer_latencies.clear()
+
+    round_trip_times = []
+    submit_times = {}
+    start_time = time.perf_counter()
+    request_ids = []
+    for i in range(num_requests):
+        if len(request_ids) >= max_in_flight:
+            request_id = request_ids.pop(0)
+            if client.get_result(request_id) is None:
+                raise RuntimeError("Lost the connection to the consumer: {}".format(client.error))
+            round_trip_times.append(time.perf_counter() - submit_times.pop(request_id))
+        request_id = client.submit(*frames[i % len(frames)])
+        submit_times[request_id] = time.perf_counter()
+        request_ids.append(request_id)
+    for request_id in request_ids:
+        if client.get_result(request_id) is None:
+            raise RuntimeError("Lost the connection to the consumer: {}".format(client.error))
+        round_trip_times.append(time.perf_counter() - submit_times.pop(request_id))
+    total_time = time.perf_counter() - start_time
+
+    transfer_latencies = np.array(client.transfer_latencies) if transport == "shm" else None
+
+    client.close()
+    process.stdin.close()
+    process.wait()
+    return np.array(round_trip_times), total_time, transfer_latencies
+
+
+def format_times(times):
+    return "median {:.2f} ms, p90 {:.2f} ms, p99 {:.2f} ms".format(*(1000 * np.percentile(times, [50, 90, 99])))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the shared memory transport against the TCP transport")
+    parser.add_argument("--num_requests", type=int, default=300, help="Number of frames to send")
+    parser.add_argument("--max_in_flight", type=int, default=1,
+                        help="Most requests at the consumer at once, the number of slots of the shared memory ring")
+    parser.add_argument("--width", type=int, default=848, help="Width of the frames")
+    parser.add_argument("--height", type=int, default=480, help="Height of the frames")
+    parser.add_argument("--transports", nargs="+", choices=["shm", "tcp"], default=["shm", "tcp"],
+                        help="Transports to benchmark")
+    parser.add_argument("--serve", choices=["shm", "tcp"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve is not None:
+        serve(args.serve)
+        sys.exit(0)
+
+    frames = make_frames(4, args.width, args.height)
+
+    for transport in args.transports:
+        round_trip_times, total_time, transfer_latencies = benchmark(transport, frames, args.num_requests,
+                                                                     args.max_in_flight)
+        print("{}: {:.1f} frames/s".format(transport, args.num_requests / total_time))
+        print("    round trip: {}".format(format_times(round_trip_times)))
+        if transfer_latencies is not None:
+            print("    request transfer: {}".format(format_times(transfer_latencies[:, 0])))
+            print("    result transfer: {}".format(format_times(transfer_latencies[:, 1])))
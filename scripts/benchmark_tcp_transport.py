@@ -0,0 +1,156 @@
+import argparse
+import pickle
+import socket
+import struct
+import threading
+import time
+import numpy as np
+from pf_orchard_localization.trunk_data_connection.tcp_transport import TrunkDataClient, LocalTrunkDataConsumer
+
+# Measures the throughput of sending rgb and depth frames to a trunk data consumer over TCP and getting the trunk data
+# back. The binary protocol of tcp_transport, with several requests in flight, is compared to the pickled framing the
+# ProducerThread used before, with one request at a time and the response grown a chunk at a time. The consumer is the
+# local stand-in, answering with a few trunks and a copy of the rgb image as the segmented image, so only the transport
+# is timed, plus the time given with --process_time to stand in for the segmenter. With several requests in flight the
+# next frame is sent while the consumer processes the current one.
+
+# Time the consumer stand-in takes for each frame, in seconds
+PROCESS_TIME = 0.0
+
+
+def make_frames(num_frames, width, height):
+    """
+    Make random rgb and depth frames of the camera size
+
+    Args:
+        num_frames (int): The number of distinct frames
+        width (int): The width of the frames
+        height (int): The height of the frames
+
+    Returns:
+        list: The rgb and depth frames
+    """
+    rng = np.random.default_rng(0)
+    return [(rng.integers(0, 256, (height, width, 3), dtype=np.uint8),
+             rng.integers(0, 10000, (height, width), dtype=np.uint16)) for _ in range(num_frames)]
+
+
+def process_frames(rgb_image, depth_image):
+    """
+    Stand-in for the segmenter and width analyzer, a few trunks and the rgb image as the segmented image
+    """
+    if PROCESS_TIME > 0:
+        time.sleep(PROCESS_TIME)
+    positions = np.array([[1.0, 0.5], [2.0, -0.5], [3.0, 0.2]])
+    widths = np.array([0.08, 0.1, 0.12])
+    class_estimates = np.array([0, 1, 2])
+    return positions, widths, class_estimates, rgb_image
+
+
+def serve_legacy(listen_sock):
+    """
+    Consumer side of the legacy framing, a length prefixed pickle of each request and response
+    """
+    sock, _ = listen_sock.accept()
+    with sock:
+        try:
+            while True:
+                data_size = sock.recv(4)
+                if not data_size:
+                    return
+                data_size = struct.unpack("!I", data_size)[0]
+                data = b""
+                while len(data) < data_size:
+                    packet = sock.recv(data_size - len(data))
+                    if not packet:
+                        return
+                    data += packet
+                rgb_image, depth_image = pickle.loads(data)
+                response = pickle.dumps(process_frames(rgb_image, depth_image))
+                sock.sendall(struct.pack("!I", len(response)) + response)
+        except OSError:
+            return
+
+
+def benchmark_legacy(frames, num_requests):
+    """
+    Time the legacy framing, one request at a time
+
+    Returns:
+        float: The total time in seconds
+    """
+    listen_sock = socket.create_server(("localhost", 0))
+    server_thread = threading.Thread(target=serve_legacy, args=(listen_sock,), daemon=True)
+    server_thread.start()
+
+    sock = socket.create_connection(listen_sock.getsockname())
+    start_time = time.perf_counter()
+    for i in range(num_requests):
+        data = pickle.dumps(frames[i % len(frames)])
+        sock.sendall(struct.pack("!I", len(data)) + data)
+
+        ack_size = struct.unpack("!I", sock.recv(4))[0]
+        ack_data = b""
+        while len(ack_data) < ack_size:
+            ack_data += sock.recv(4096)
+        pickle.loads(ack_data)
+    total_time = time.perf_counter() - start_time
+
+    sock.close()
+    server_thread.join()
+    listen_sock.close()
+    return total_time
+
+
+def benchmark_binary(frames, num_requests, max_in_flight):
+    """
+    Time the binary protocol with up to max_in_flight requests at the consumer
+
+    Returns:
+        float: The total time in seconds
+    """
+    consumer = LocalTrunkDataConsumer(process_frames)
+    client = TrunkDataClient(consumer.address, max_in_flight=max_in_flight)
+    client.connect()
+
+    start_time = time.perf_counter()
+    request_ids = [client.submit(*frames[i % len(frames)]) for i in range(num_requests)]
+    for request_id in request_ids:
+        if client.get_result(request_id) is None:
+            raise RuntimeError("Lost the connection to the consumer: {}".format(client.error))
+    total_time = time.perf_counter() - start_time
+
+    client.close()
+    consumer.close()
+    return total_time
+
+
+def print_result(name, total_time, num_requests, frame_bytes):
+    # The segmented image comes back too, so each request moves the frame and an rgb image
+    print("{}: {:.1f} frames/s, {:.2f} ms/frame, {:.0f} MB/s".format(
+        name, num_requests / total_time, 1000 * total_time / num_requests, num_requests * frame_bytes / total_time / 1e6))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the trunk data TCP transport")
+    parser.add_argument("--num_requests", type=int, default=200, help="Number of frames to send")
+    parser.add_argument("--max_in_flight", type=int, nargs="+", default=[1, 4],
+                        help="Most requests at the consumer at once for the binary protocol, one run for each")
+    parser.add_argument("--width", type=int, default=848, help="Width of the frames")
+    parser.add_argument("--height", type=int, default=480, help="Height of the frames")
+    parser.add_argument("--process_time", type=float, default=0.0,
+                        help="Time the consumer takes for each frame, in milliseconds, to stand in for the segmenter")
+    parser.add_argument("--skip_legacy", action="store_true", help="Don't run the legacy pickled framing")
+    args = parser.parse_args()
+
+    PROCESS_TIME = args.process_time / 1000
+
+    frames = make_frames(4, args.width, args.height)
+    frame_bytes = 2 * frames[0][0].nbytes + frames[0][1].nbytes
+
+    if not args.skip_legacy:
+        print_result("pickle, 1 in flight", benchmark_legacy(frames, args.num_requests), args.num_requests, frame_bytes)
+
+    for max_in_flight in args.max_in_flight:
+        print_result("binary, {} in flight".format(max_in_flight),
+                     benchmark_binary(frames, args.num_requests, max_in_flight), args.num_requests, frame_bytes)
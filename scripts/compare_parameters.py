@@ -0,0 +1,43 @@
+import argparse
+from map_data_tools import MapData
+from pf_orchard_localization.utils import ParametersPf
+from pf_orchard_localization.utils.paired_comparison import PairedComparison
+
+# Compares two particle filter parameter files over a test regimen. Both run every trial with the same random numbers, so
+# the difference of each trial is down to the parameters, and the confidence intervals on the mean differences show
+# whether the second parameters are better or worse than the first with far fewer trials than comparing two separate
+# evaluations.
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare two sets of particle filter parameters trial by trial")
+    parser.add_argument("test_starts", help="Csv file with the test start information")
+    parser.add_argument("cached_data_dir", help="Directory of the cached data files")
+    parser.add_argument("map_data", help="Map data json file")
+    parser.add_argument("parameters_a", help="Baseline particle filter parameters yaml file")
+    parser.add_argument("parameters_b", help="Particle filter parameters yaml file to compare to the baseline")
+    parser.add_argument("--save_path", default=None, help="Csv file to save the paired differences to")
+    parser.add_argument("--num_trials", type=int, default=2, help="Number of trials to run for each test")
+    parser.add_argument("--num_workers", type=int, default=None, help="Number of worker processes, defaults to the number of cpus")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for the trials, random if not given")
+    parser.add_argument("--confidence", type=float, default=0.95, help="Confidence level of the intervals")
+    args = parser.parse_args()
+
+    parameters_a = ParametersPf()
+    parameters_a.load_from_yaml(args.parameters_a)
+    parameters_b = ParametersPf()
+    parameters_b.load_from_yaml(args.parameters_b)
+
+    map_data = MapData(map_data_path=args.map_data, move_origin=True, origin_offset=(5, 5))
+
+    comparison = PairedComparison(map_data=map_data,
+                                  parameters_a=parameters_a,
+                                  parameters_b=parameters_b,
+                                  test_info_path=args.test_starts,
+                                  cached_data_files_dir=args.cached_data_dir,
+                                  num_trials=args.num_trials,
+                                  num_workers=args.num_workers,
+                                  seed=args.seed,
+                                  confidence=args.confidence)
+    comparison.run()
+    comparison.process_results(save_path=args.save_path)
@@ -0,0 +1,27 @@
+import argparse
+import os
+import time
+from pf_orchard_localization.recorded_data_loaders import convert_json_cached_data
+
+# Converts json cached data files to the binary cached data format, which opens much faster. Give either a single json
+# file or a directory of them.
+
+parser = argparse.ArgumentParser(description="Convert json cached data files to the binary cached data format")
+parser.add_argument("path", help="A json cached data file or a directory of them")
+parser.add_argument("--output_dir", default=None, help="Directory to write the binary files to, defaults to next to the json files")
+args = parser.parse_args()
+
+if os.path.isdir(args.path):
+    json_file_paths = [os.path.join(args.path, file_name) for file_name in sorted(os.listdir(args.path))
+                       if file_name.endswith(".json") and not file_name.startswith(".")]
+else:
+    json_file_paths = [args.path]
+
+for json_file_path in json_file_paths:
+    output_file_path = None
+    if args.output_dir is not None:
+        output_file_path = os.path.join(args.output_dir, os.path.splitext(os.path.basename(json_file_path))[0] + ".pfc")
+
+    start_time = time.time()
+    output_file_path = convert_json_cached_data(json_file_path, output_file_path)
+    print("Converted {} to {} in {:.2f}s".format(json_file_path, output_file_path, time.time() - start_time))
@@ -0,0 +1,89 @@
+import argparse
+import time
+from pf_orchard_localization.utils import ParametersPf
+from pf_orchard_localization.utils.job_queue import JobBroker, SqliteJobQueue, open_job_queue
+from pf_orchard_localization.utils.distributed_evaluation import DistributedPfTestCoordinator, run_worker
+from pf_orchard_localization.utils.early_stopping import EarlyStopping
+from pf_orchard_localization.pipeline import ExecutionClock, CLOCK_MODES, CLOCK_FAST
+
+# Runs a test regimen on workers on several machines. The queue is either a sqlite file on a file system every machine
+# can reach, or tcp://host:port of a broker started with the broker command. Start the coordinator to put the jobs on the
+# queue and wait for the results, then start any number of workers pointing at the same queue. Workers that stop running
+# have their jobs given to other workers once their lease runs out.
+#
+#   python distributed_evaluation.py broker --port 5600
+#   python distributed_evaluation.py coordinator tcp://127.0.0.1:5600 test_starts.csv cached_data/ map.json --parameters parameters_pf.yaml
+#   python distributed_evaluation.py worker tcp://127.0.0.1:5600
+
+parser = argparse.ArgumentParser(description="Run a particle filter test regimen on workers through a job queue")
+subparsers = parser.add_subparsers(dest="command", required=True)
+
+broker_parser = subparsers.add_parser("broker", help="Serve a job queue over tcp")
+broker_parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+broker_parser.add_argument("--port", type=int, default=5600, help="Port to listen on")
+broker_parser.add_argument("--db", default=":memory:", help="Sqlite file to keep the queue in, in memory if not given")
+broker_parser.add_argument("--max_attempts", type=int, default=3, help="Times a job is tried before it's marked failed")
+
+coordinator_parser = subparsers.add_parser("coordinator", help="Put the tests on the queue and collect the results")
+coordinator_parser.add_argument("queue", help="Sqlite file or tcp://host:port of the job queue")
+coordinator_parser.add_argument("test_starts", help="Csv file with the test start information")
+coordinator_parser.add_argument("cached_data_dir", help="Directory of the cached data files")
+coordinator_parser.add_argument("map_data", help="Map data json file")
+coordinator_parser.add_argument("--parameters", required=True, help="Particle filter parameters yaml file")
+coordinator_parser.add_argument("--save_path", default=None, help="Csv file to save the results to")
+coordinator_parser.add_argument("--num_trials", type=int, default=2, help="Number of trials to run for each test")
+coordinator_parser.add_argument("--seed", type=int, default=None, help="Seed for the trials, random if not given")
+coordinator_parser.add_argument("--max_interval_width", type=float, default=None,
+                                help="Stop counting trials of a test once the confidence interval on its convergence rate is this narrow")
+coordinator_parser.add_argument("--min_trials", type=int, default=5, help="Fewest trials of a test before the confidence interval can stop it")
+coordinator_parser.add_argument("--divergence_distance", type=float, default=None,
+                                help="Stop a trial once no particle is within this distance of the ground truth, in meters")
+coordinator_parser.add_argument("--clock", choices=CLOCK_MODES, default=CLOCK_FAST,
+                                help="How the trials are paced and timed, simulated gives trial times in data time")
+coordinator_parser.add_argument("--speed_factor", type=float, default=1.0,
+                                help="How many times faster than recorded to play the data with the realtime clock")
+
+worker_parser = subparsers.add_parser("worker", help="Run jobs from the queue")
+worker_parser.add_argument("queue", help="Sqlite file or tcp://host:port of the job queue")
+worker_parser.add_argument("--lease_time", type=float, default=300.0, help="Seconds without a lease renewal before a job is requeued")
+worker_parser.add_argument("--idle_timeout", type=float, default=None, help="Stop after this many seconds without a job")
+
+args = parser.parse_args()
+
+if args.command == "broker":
+    broker = JobBroker(SqliteJobQueue(args.db, max_attempts=args.max_attempts), host=args.host, port=args.port)
+    print("Job broker listening on {}:{}".format(*broker.address))
+    try:
+        broker.serve_forever()
+    except KeyboardInterrupt:
+        broker.server_close()
+
+elif args.command == "coordinator":
+    pf_parameters = ParametersPf()
+    pf_parameters.load_from_yaml(args.parameters)
+
+    coordinator = DistributedPfTestCoordinator(job_queue=open_job_queue(args.queue),
+                                               parameters_pf=pf_parameters,
+                                               test_info_path=args.test_starts,
+                                               cached_data_files_dir=args.cached_data_dir,
+                                               map_data_path=args.map_data,
+                                               num_trials=args.num_trials,
+                                               class_mapping=(1, 2, 0),
+                                               save_path=args.save_path,
+                                               seed=args.seed,
+                                               early_stopping=EarlyStopping(max_interval_width=args.max_interval_width,
+                                                                            min_trials=args.min_trials,
+                                                                            divergence_distance=args.divergence_distance),
+                                               clock=ExecutionClock(args.clock, speed_factor=args.speed_factor))
+
+    start_time = time.time()
+    coordinator.run_all_tests(progress_callback=lambda status: print(
+        "{pending} pending, {leased} running, {done} done, {failed} failed".format(**status)))
+    print("Ran all tests in {:.1f}s".format(time.time() - start_time))
+
+    if args.save_path is None:
+        coordinator.process_results(save_path=None)
+
+elif args.command == "worker":
+    num_jobs_run = run_worker(open_job_queue(args.queue), lease_time=args.lease_time, idle_timeout=args.idle_timeout)
+    print("Ran {} jobs".format(num_jobs_run))
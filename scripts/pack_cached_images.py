@@ -0,0 +1,53 @@
+import argparse
+import json
+import os
+import time
+from pf_orchard_localization.recorded_data_loaders import pack_image_directory, PACKED_IMAGES_EXTENSION, BINARY_CACHED_DATA_EXTENSION
+from pf_orchard_localization.recorded_data_loaders.array_file import open_array_file
+from pf_orchard_localization.recorded_data_loaders.packed_image_store import time_stamp_to_key
+
+# Packs a directory of cached segmentation images (one file per time stamp) into packed image files, which the cached
+# data mode reads in place of the image files. If a directory of cached data files is given, one packed file is made for
+# each run with the images of that run, otherwise all the images are packed into one file.
+
+parser = argparse.ArgumentParser(description="Pack a directory of cached images into packed image files")
+parser.add_argument("image_dir", help="Directory of cached images")
+parser.add_argument("--data_dir", default=None, help="Directory of cached data files, to make one packed file per run")
+parser.add_argument("--output_dir", default=None, help="Directory to write the packed files to, defaults to the image directory")
+parser.add_argument("--encoding", default="jpeg", choices=["jpeg", "webp", "png"], help="Encoding of the packed images")
+parser.add_argument("--quality", type=int, default=90, help="JPEG or WebP quality, a WebP quality of 101 is lossless")
+parser.add_argument("--scale", type=float, default=1.0, help="Factor to resize the images by")
+args = parser.parse_args()
+
+output_dir = args.output_dir if args.output_dir is not None else args.image_dir
+
+
+def get_image_keys(data_file_path):
+    """
+    Get the keys of the images in a cached data file
+    """
+    if data_file_path.endswith(BINARY_CACHED_DATA_EXTENSION):
+        arrays, _ = open_array_file(data_file_path, names=('img_t',))
+        return [time_stamp_to_key(time_stamp) for time_stamp in arrays['img_t']]
+
+    with open(data_file_path) as f:
+        loaded_data = json.load(f)
+    return [int(key) for key, data in loaded_data.items() if data is None or 'tree_data' in data]
+
+
+if args.data_dir is None:
+    runs = [("images", None)]
+else:
+    runs = []
+    for file_name in sorted(os.listdir(args.data_dir)):
+        run_name, extension = os.path.splitext(file_name)
+        if extension in (".json", BINARY_CACHED_DATA_EXTENSION) and not file_name.startswith("."):
+            runs.append((run_name, get_image_keys(os.path.join(args.data_dir, file_name))))
+
+for run_name, keys in runs:
+    output_file_path = os.path.join(output_dir, run_name + PACKED_IMAGES_EXTENSION)
+
+    start_time = time.time()
+    num_packed = pack_image_directory(args.image_dir, output_file_path, keys=keys, encoding=args.encoding,
+                                      quality=args.quality, scale=args.scale)
+    print("Packed {} images into {} in {:.2f}s".format(num_packed, output_file_path, time.time() - start_time))
@@ -0,0 +1,23 @@
+import argparse
+import os
+from pf_orchard_localization.recorded_data_loaders import CachedDataStreamWriter, BINARY_CACHED_DATA_EXTENSION
+
+# Recovers a cached data file that was being recorded when the app stopped, keeping everything up to the last chunk that
+# was fully written. The app streams the cache to a hidden .partial file in the save directory while recording.
+
+parser = argparse.ArgumentParser(description="Recover a cached data file that was never saved")
+parser.add_argument("path", help="The .partial cached data file")
+parser.add_argument("--output", default=None, help="Path to write the recovered file to, defaults to the same name with the .pfc extension")
+args = parser.parse_args()
+
+output_file_path = args.output
+if output_file_path is None:
+    file_name = os.path.splitext(os.path.basename(args.path))[0].lstrip(".")
+    output_file_path = os.path.join(os.path.dirname(args.path), file_name + BINARY_CACHED_DATA_EXTENSION)
+
+writer = CachedDataStreamWriter.recover(args.path)
+num_msgs = writer.num_msgs
+writer.finalize()
+os.replace(args.path, output_file_path)
+
+print("Recovered {} messages to {}".format(num_msgs, output_file_path))
@@ -2,6 +2,7 @@ from pf_orchard_localization.pf_engine import PfEngine
 from map_data_tools import MapData
 from pf_orchard_localization.utils import ParametersPf
 from pf_orchard_localization.utils.pf_evaluation import PfTestExecutor
+from pf_orchard_localization.utils.result_cache import ResultCache
 
 
 pf_parameters_path = "/home/jostan/OneDrive/Docs/Grad_school/Research/code_projects/pf_orchard_localization/config/parameters_pf.yaml"
@@ -18,12 +19,17 @@ pf_engine = PfEngine(map_data=map_data)
 
 class_mapping = (1, 2, 0)
 
+# Trials already run with the same inputs are taken from here instead of being run again
+result_cache = ResultCache("/media/jostan/portabits/pf_app_data/pf_result_cache.db")
+
 pf_test_runner = PfTestExecutor(pf_engine=pf_engine,
                                 parameters_pf=pf_parameters,
                                 test_info_path=test_start_info_path,
                                 cached_data_files_dir=cached_data_files_directory,
                                 num_trials=2,
-                                class_mapping=class_mapping)
+                                class_mapping=class_mapping,
+                                seed=0,
+                                result_cache=result_cache)
 
 pf_test_runner.run_all_tests()
 
@@ -0,0 +1,69 @@
+import argparse
+import time
+from map_data_tools import MapData
+from pf_orchard_localization.utils import ParametersPf
+from pf_orchard_localization.utils.parallel_pf_evaluation import ParallelPfTestExecutor
+from pf_orchard_localization.utils.early_stopping import EarlyStopping
+from pf_orchard_localization.utils.result_cache import ResultCache
+from pf_orchard_localization.pipeline import ExecutionClock, CLOCK_MODES, CLOCK_FAST
+
+# Runs a test regimen on a pool of worker processes, the same as run_evaluation.py but with the trials spread over the
+# cpus. The results are saved in the same csv format. Using the same seed gives the same results for any number of
+# workers.
+
+
+def print_progress(test_info, trial_num, num_trials_done, num_trials_total):
+    print("{}/{} trials done, test {} trial {}".format(num_trials_done, num_trials_total, test_info.test_name, trial_num))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a particle filter test regimen on multiple processes")
+    parser.add_argument("test_starts", help="Csv file with the test start information")
+    parser.add_argument("cached_data_dir", help="Directory of the cached data files")
+    parser.add_argument("map_data", help="Map data json file")
+    parser.add_argument("--parameters", required=True, help="Particle filter parameters yaml file")
+    parser.add_argument("--save_path", default=None, help="Csv file to save the results to")
+    parser.add_argument("--num_trials", type=int, default=2, help="Number of trials to run for each test")
+    parser.add_argument("--num_workers", type=int, default=None, help="Number of worker processes, defaults to the number of cpus")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for the trials, random if not given")
+    parser.add_argument("--max_interval_width", type=float, default=None,
+                        help="Stop running trials of a test once the confidence interval on its convergence rate is this narrow")
+    parser.add_argument("--min_trials", type=int, default=5, help="Fewest trials of a test before the confidence interval can stop it")
+    parser.add_argument("--divergence_distance", type=float, default=None,
+                        help="Stop a trial once no particle is within this distance of the ground truth, in meters")
+    parser.add_argument("--result_cache", default=None,
+                        help="Sqlite file to store trial results in, trials already in it aren't run again. Needs a seed")
+    parser.add_argument("--telemetry_dir", default=None, help="Directory to write the time series of each trial to")
+    parser.add_argument("--clock", choices=CLOCK_MODES, default=CLOCK_FAST,
+                        help="How the trials are paced and timed, simulated gives trial times in data time")
+    parser.add_argument("--speed_factor", type=float, default=1.0,
+                        help="How many times faster than recorded to play the data with the realtime clock")
+    args = parser.parse_args()
+
+    pf_parameters = ParametersPf()
+    pf_parameters.load_from_yaml(args.parameters)
+
+    map_data = MapData(map_data_path=args.map_data, move_origin=True, origin_offset=(5, 5))
+
+    pf_test_runner = ParallelPfTestExecutor(map_data=map_data,
+                                            parameters_pf=pf_parameters,
+                                            test_info_path=args.test_starts,
+                                            cached_data_files_dir=args.cached_data_dir,
+                                            num_trials=args.num_trials,
+                                            class_mapping=(1, 2, 0),
+                                            save_path=args.save_path,
+                                            num_workers=args.num_workers,
+                                            seed=args.seed,
+                                            early_stopping=EarlyStopping(max_interval_width=args.max_interval_width,
+                                                                         min_trials=args.min_trials,
+                                                                         divergence_distance=args.divergence_distance),
+                                            result_cache=ResultCache(args.result_cache) if args.result_cache else None,
+                                            telemetry_dir=args.telemetry_dir,
+                                            clock=ExecutionClock(args.clock, speed_factor=args.speed_factor))
+
+    start_time = time.time()
+    pf_test_runner.run_all_tests(progress_callback=print_progress)
+    print("Ran all tests in {:.1f}s".format(time.time() - start_time))
+
+    if args.save_path is None:
+        pf_test_runner.process_results(save_path=None)
@@ -0,0 +1,76 @@
+import argparse
+import time
+from map_data_tools import MapData
+from pf_orchard_localization.utils import ParametersPf
+from pf_orchard_localization.utils.parameter_sweep import ParameterSweep, SweepObjective, load_search_space
+from pf_orchard_localization.utils.early_stopping import EarlyStopping
+
+# Searches for the particle filter parameters that do best over a test regimen. The search space is a yaml file mapping
+# each parameter to search over to either a list of values or a range, see load_search_space. Every other parameter is
+# taken from the base parameters file. The results of every configuration are saved to sweep_results.csv in the output
+# directory, and the parameters of the best configurations to parameters_pf_best_<rank>.yaml.
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search for the best particle filter parameters over a test regimen")
+    parser.add_argument("test_starts", help="Csv file with the test start information")
+    parser.add_argument("cached_data_dir", help="Directory of the cached data files")
+    parser.add_argument("map_data", help="Map data json file")
+    parser.add_argument("search_space", help="Yaml file with the values or range of each parameter to search over")
+    parser.add_argument("--parameters", required=True, help="Base particle filter parameters yaml file")
+    parser.add_argument("--output_dir", default="parameter_sweep", help="Directory to save the results to")
+    parser.add_argument("--method", choices=["grid", "random", "halving", "bayesian"], default="random",
+                        help="How to search the space")
+    parser.add_argument("--num_configs", type=int, default=20,
+                        help="Number of configurations for the random, halving and bayesian searches")
+    parser.add_argument("--grid_points", type=int, default=3, help="Number of values of each range for the grid search")
+    parser.add_argument("--eta", type=int, default=3, help="Factor the configurations are cut by each halving round")
+    parser.add_argument("--num_trials", type=int, default=1, help="Number of trials to run for each test")
+    parser.add_argument("--num_workers", type=int, default=None, help="Number of worker processes, defaults to the number of cpus")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for the trials and the search, random if not given")
+    parser.add_argument("--time_weight", type=float, default=0.01, help="Objective cost per second of average trial time")
+    parser.add_argument("--cost_weight", type=float, default=0.0, help="Objective cost per second of average trial cpu time")
+    parser.add_argument("--divergence_distance", type=float, default=None,
+                        help="Stop a trial once no particle is within this distance of the ground truth, in meters")
+    parser.add_argument("--sweep_min_tests", type=int, default=None,
+                        help="Drop clearly worse configurations after running them on this many tests")
+    parser.add_argument("--num_best", type=int, default=3, help="Number of best configurations to save the parameters of")
+    args = parser.parse_args()
+
+    pf_parameters = ParametersPf()
+    pf_parameters.load_from_yaml(args.parameters)
+
+    map_data = MapData(map_data_path=args.map_data, move_origin=True, origin_offset=(5, 5))
+
+    objective = SweepObjective(time_weight=args.time_weight, cost_weight=args.cost_weight)
+
+    start_time = time.time()
+    with ParameterSweep(map_data=map_data,
+                        base_parameters=pf_parameters,
+                        test_info_path=args.test_starts,
+                        cached_data_files_dir=args.cached_data_dir,
+                        search_space=load_search_space(args.search_space),
+                        num_trials=args.num_trials,
+                        objective=objective,
+                        num_workers=args.num_workers,
+                        seed=args.seed,
+                        early_stopping=EarlyStopping(divergence_distance=args.divergence_distance,
+                                                     sweep_min_tests=args.sweep_min_tests)) as sweep:
+
+        if args.method == "grid":
+            sweep.grid_search(args.grid_points)
+        elif args.method == "random":
+            sweep.random_search(args.num_configs)
+        elif args.method == "halving":
+            sweep.successive_halving(args.num_configs, eta=args.eta)
+        else:
+            sweep.bayesian_search(args.num_configs)
+
+    print("Sweep done in {:.1f}s".format(time.time() - start_time))
+
+    for rank, result in enumerate(sweep.best_results(args.num_best)):
+        print("{}: score {:.3f}, convergence rate {:.2f}, average time {:.2f}s, {}".format(
+            rank + 1, result.score, result.convergence_rate, result.avg_time, result.config))
+
+    for parameter_file_path in sweep.save_results(args.output_dir, args.num_best):
+        print("Saved {}".format(parameter_file_path))
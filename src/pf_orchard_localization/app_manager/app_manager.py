@@ -9,6 +9,7 @@ from ..custom_widgets import (PfMainWindow, PfControlButtons, PfStartLocationCon
                               DataFileControls, ImageNumberLabel, ImageDelaySlider, CachedDataCreator,
                               PfChangeParametersButton, PfTestControls, PfQueueSizeLabel, CalibrationDataControls)
 from ..utils.parameters import ParametersPf, ParametersBagData, ParametersCachedData, ParametersLiveData
+from ..utils.detection_cache import DetectionCache
 from ..pf_engine import PfEngine
 from map_data_tools import MapData
 import logging
@@ -24,6 +25,10 @@ def import_trunk_data_connection(parameters_data):
     if parameters_data.use_ros_service_for_trunk_width:
         from ..trunk_data_connection import TrunkDataConnectionRosService
         return TrunkDataConnectionRosService()
+    elif parameters_data.trunk_data_consumer_host is not None:
+        from ..trunk_data_connection import TrunkDataConnectionJetson
+        return TrunkDataConnectionJetson(server_address=(parameters_data.trunk_data_consumer_host,
+                                                         parameters_data.trunk_data_consumer_port))
     else:
         from ..trunk_data_connection import TrunkDataConnection
         return TrunkDataConnection()
@@ -361,6 +366,16 @@ class PfAppBase(PfMainWindow):
             if mode.mode_active:
                 mode.shutdown_hook()
 
+        # Let the widgets that write files in the background finish writing them
+        for widget in self.widget_list:
+            if hasattr(widget, "shutdown"):
+                widget.shutdown()
+
+        # Close the files the trunk data connection has open, such as the packed cached images
+        trunk_data_connection = getattr(self, "trunk_data_connection", None)
+        if hasattr(trunk_data_connection, "shutdown"):
+            trunk_data_connection.shutdown()
+
         event.accept()
 
 class PfAppBags(PfAppBase):
@@ -397,6 +412,12 @@ class PfAppBags(PfAppBase):
         self.trunk_data_connection = import_trunk_data_connection(self.parameters_data)
         self.trunk_data_connection.start()
         self.image_display_checkbox_changed()
+
+        if self.parameters_data.detection_cache_path is not None:
+            self.detection_cache = DetectionCache(self.parameters_data.detection_cache_path,
+                                                  store_seg_imgs=self.parameters_data.detection_cache_seg_imgs)
+        else:
+            self.detection_cache = None
         
     def init_widgets_unique(self):
         """
@@ -1,3 +1,19 @@
-from .pf_mode import PfRecordedDataMode, PfModeCached, PfModeCachedTests, PfModeSaveCalibrationData
-from .playback_mode import PlaybackMode
-from .pf_live_mode import PfLiveMode
\ No newline at end of file
+import importlib
+
+# Each mode pulls in its Qt widgets, threads and data loaders, so a mode is only imported when it's first used
+LAZY_IMPORTS = {"PfRecordedDataMode": ".pf_mode",
+                "PfModeCached": ".pf_mode",
+                "PfModeCachedTests": ".pf_mode",
+                "PfModeSaveCalibrationData": ".pf_mode",
+                "PlaybackMode": ".playback_mode",
+                "PfLiveMode": ".pf_live_mode"}
+
+
+def __getattr__(name):
+    if name in LAZY_IMPORTS:
+        return getattr(importlib.import_module(LAZY_IMPORTS[name], __name__), name)
+    raise AttributeError("module {} has no attribute {}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + list(LAZY_IMPORTS))
@@ -8,6 +8,12 @@ class PfRecordedDataMode(QObject):
     """
     
     stop_pf_signal = pyqtSignal()
+
+    # Whether to use the stored trunk data of the images instead of segmenting them again, if the app has a detection
+    # cache
+    USE_DETECTION_CACHE = True
+    # Whether to request the trunk data of the upcoming images while the particle filter runs
+    USE_TRUNK_DATA_PREFETCH = True
     
     def __init__(self, main_app_manager):
         """
@@ -42,6 +48,7 @@ class PfRecordedDataMode(QObject):
         self.main_app_manager.change_parameters_button.setEnabled(enable)
         
         self.main_app_manager.data_file_controls.data_file_time_line.setReadOnly(not enable)
+        self.main_app_manager.data_file_controls.img_number_line.setReadOnly(not enable)
         self.main_app_manager.image_delay_slider.setEnabled(enable)
         self.main_app_manager.checkboxes.setEnabled(enable)
         self.main_app_manager.start_location_controls.setReadOnly(not enable)
@@ -84,7 +91,10 @@ class PfRecordedDataMode(QObject):
                                      added_delay=self.main_app_manager.image_delay_slider.get_delay_ms()/1000,
                                      image_fps=self.main_app_manager.parameters_data.image_fps,
                                      use_visual_odom=self.main_app_manager.parameters_data.use_visual_odom,
-                                     cache_data_enabled=self.main_app_manager.cached_data_creator.cache_data_enabled)
+                                     cache_data_enabled=self.main_app_manager.cached_data_creator.cache_data_enabled,
+                                     dataset_catalog=self.main_app_manager.data_file_controls.dataset_catalog,
+                                     prefetch_depth=self.main_app_manager.parameters_data.trunk_data_prefetch_depth if self.USE_TRUNK_DATA_PREFETCH else 0,
+                                     detection_cache=self.main_app_manager.detection_cache if self.USE_DETECTION_CACHE else None)
         
         self.pf_thread.load_next_data_file.connect(self.main_app_manager.data_file_controls.load_next_data_file)
         self.pf_thread.pf_run_message.connect(self.main_app_manager.print_message)
@@ -339,7 +349,9 @@ class PfModeCachedTests(PfModeCached):
                                           save_path=self.main_app_manager.pf_test_controls.get_save_path(),
                                           convergence_threshold=0.5,
                                           test_index=test_index,
-                                          load_data_only=load_data_only,)
+                                          load_data_only=load_data_only,
+                                          map_data=self.main_app_manager.map_data,
+                                          num_workers=self.main_app_manager.pf_test_controls.get_num_workers(),)
         
         self.pf_thread.reset_pf_app.connect(self.main_app_manager.reset_pf)
         self.pf_thread.update_test_number.connect(self.main_app_manager.pf_test_controls.update_test_number)
@@ -486,6 +498,12 @@ class PfModeSaveCalibrationData(PfRecordedDataMode):
     """
     
     signal_save_data = pyqtSignal(dict)
+
+    # The calibration data is saved as the images are segmented, so they all have to be segmented
+    USE_DETECTION_CACHE = False
+    # The best particle is read when the calibration data arrives, so the trunk thread has to stay on the image the
+    # particle filter is on
+    USE_TRUNK_DATA_PREFETCH = False
     
     def __init__(self, main_app_manager):
         """
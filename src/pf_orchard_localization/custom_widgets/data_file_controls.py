@@ -2,7 +2,8 @@ from PyQt5.QtWidgets import QWidget, QComboBox, QHBoxLayout, QVBoxLayout, QLabel
 from PyQt5.QtCore import pyqtSignal, pyqtSlot
 import os
 import logging
-from ..recorded_data_loaders import Bag2DataLoader, CachedDataLoader
+from ..recorded_data_loaders import (Bag2DataLoader, CachedDataLoader, BinaryCachedDataLoader, DatasetCatalog,
+                                     BINARY_CACHED_DATA_EXTENSION, select_data_files)
 
 class DataFileControls(QWidget):
     """
@@ -40,6 +41,7 @@ class DataFileControls(QWidget):
             raise ValueError("Data file directory not given in config file")
 
         self.data_file_names = None
+        self.dataset_catalog = None
         
         self.data_file_time_line = QLineEdit()
         self.data_file_time_line.setFixedWidth(75)
@@ -47,6 +49,22 @@ class DataFileControls(QWidget):
         time_line_label = QLabel("Data Time:")
         time_line_label.setFixedWidth(75)
 
+        self.img_number_line = QLineEdit()
+        self.img_number_line.setToolTip("Enter an image number to jump to that image")
+        self.img_number_line.setFixedWidth(75)
+
+        img_number_label = QLabel("Image:")
+        img_number_label.setToolTip("Enter an image number to jump to that image")
+        img_number_label.setFixedWidth(50)
+
+        self.global_time_line = QLineEdit()
+        self.global_time_line.setToolTip("Enter a time since the start of the first data file to jump to it")
+        self.global_time_line.setFixedWidth(75)
+
+        global_time_label = QLabel("Global Time:")
+        global_time_label.setToolTip("Enter a time since the start of the first data file to jump to it")
+        global_time_label.setFixedWidth(85)
+
         self.data_file_selector_label = QLabel("Data File:")
         self.data_file_selector_label.setToolTip("Select the data file to open")
         self.data_file_selector_label.setFixedWidth(70)
@@ -66,6 +84,12 @@ class DataFileControls(QWidget):
         self.data_file_selector_layout.addWidget(time_line_label)
         self.data_file_selector_layout.addWidget(self.data_file_time_line)
         self.data_file_selector_layout.addSpacing(15)
+        self.data_file_selector_layout.addWidget(img_number_label)
+        self.data_file_selector_layout.addWidget(self.img_number_line)
+        self.data_file_selector_layout.addSpacing(15)
+        self.data_file_selector_layout.addWidget(global_time_label)
+        self.data_file_selector_layout.addWidget(self.global_time_line)
+        self.data_file_selector_layout.addSpacing(15)
         self.data_file_selector_layout.addWidget(self.data_file_selector_label)
         self.data_file_selector_layout.addWidget(self.data_file_selector)
         self.data_file_selector_layout.addWidget(self.data_file_open_button)
@@ -76,6 +100,8 @@ class DataFileControls(QWidget):
         self.data_file_open_button.clicked.connect(self.trigger_open_data_file)
         self.data_file_open_next_button.clicked.connect(self.trigger_open_next_data_file)
         self.data_file_time_line.returnPressed.connect(self.data_file_time_line_edited)
+        self.img_number_line.returnPressed.connect(self.img_number_line_edited)
+        self.global_time_line.returnPressed.connect(self.global_time_line_edited)
 
         self.set_data_file_names()
     
@@ -87,8 +113,13 @@ class DataFileControls(QWidget):
         Args:
             time_stamp (float): The time stamp to set the time line to
         """
-        time_stamp = round(time_stamp, 2)
-        self.data_file_time_line.setText(str(time_stamp))
+        self.data_file_time_line.setText(str(round(time_stamp, 2)))
+
+        if self.data_manager is not None and self.dataset_catalog is not None and self.dataset_catalog.is_indexed:
+            file_idx = self.dataset_catalog.get_file_index(self.data_manager.current_data_file_path)
+            if file_idx is not None:
+                global_time = self.dataset_catalog.to_global_time(file_idx, time_stamp)
+                self.global_time_line.setText(str(round(global_time, 2)))
     
     @pyqtSlot()
     def trigger_open_data_file(self):
@@ -126,10 +157,15 @@ class DataFileControls(QWidget):
         Set the data file names in the data file selector combo box
         """
 
-        self.data_file_names = os.listdir(self.data_file_dir)
+        # Hidden files aren't data files
+        self.data_file_names = [file_name for file_name in os.listdir(self.data_file_dir)
+                                if not file_name.startswith(".")]
 
         if self.using_cached_data:
-            self.data_file_names = [file_name for file_name in self.data_file_names if file_name.endswith(".json")]
+            self.data_file_names = [file_name for file_name in self.data_file_names
+                                    if file_name.endswith(".json") or file_name.endswith(BINARY_CACHED_DATA_EXTENSION)]
+            # A converted run has both files, list it once
+            self.data_file_names = select_data_files(self.data_file_names)
 
         self.data_file_names.sort()
 
@@ -141,6 +177,21 @@ class DataFileControls(QWidget):
 
         logging.debug(f"Found {len(self.data_file_names)} data files in {self.data_file_dir}")
 
+        if self.dataset_catalog is not None:
+            self.dataset_catalog.close()
+
+        topics = None
+        if hasattr(self.data_parameters, 'depth_topic'):
+            topics = (self.data_parameters.depth_topic, self.data_parameters.rgb_topic, self.data_parameters.odom_topic)
+
+        index_dir = None
+        if hasattr(self.data_parameters, 'catalog_index_dir'):
+            index_dir = self.data_parameters.catalog_index_dir
+
+        # The data files that haven't been indexed before are summarized in the background
+        self.dataset_catalog = DatasetCatalog(self.data_file_dir, self.data_file_names, self.create_data_manager,
+                                              topics=topics, index_dir=index_dir)
+
     @property
     def current_data_file_selection(self):
         """
@@ -182,7 +233,70 @@ class DataFileControls(QWidget):
         self.reset_pf.emit(True)
 
         self.set_img_number_label.emit(self.data_manager.current_img_position, self.data_manager.num_img_msgs)
-        
+
+    def img_number_line_edited(self):
+        """
+        Jump to the image number entered in the image number edit box by the user
+        """
+        img_number = self.img_number_line.text()
+
+        # Check if the value entered is an integer
+        try:
+            img_number = int(img_number)
+        except ValueError:
+            self.data_file_controls_message.emit("Invalid image number")
+            return
+
+        # Set the image number in the data manager and get the current message
+        message, current_msg = self.data_manager.set_img_number(img_number)
+
+        self.data_file_controls_message.emit(message)
+
+        if current_msg is None:
+            return
+
+        # Update the app with the image and set the time line to the time stamp of the image
+        self.set_image_display.emit({"current_msg": current_msg, "for_display_only": True})
+        self.set_time_line(self.data_manager.current_data_file_time_stamp)
+
+        self.reset_pf.emit(True)
+
+        self.set_img_number_label.emit(self.data_manager.current_img_position, self.data_manager.num_img_msgs)
+
+    def global_time_line_edited(self):
+        """
+        Jump to the time since the start of the first data file entered in the global time edit box by the user, opening
+        the data file at that time if it isn't the current one
+        """
+        global_time = self.global_time_line.text()
+
+        # Check if the value entered is a number
+        try:
+            global_time = float(global_time)
+        except ValueError:
+            self.data_file_controls_message.emit("Invalid global time")
+            return
+
+        if not self.dataset_catalog.is_indexed:
+            self.data_file_controls_message.emit("Still reading the data files, try again in a moment")
+            return
+
+        file_idx, time_stamp = self.dataset_catalog.locate_global_time(global_time)
+
+        if file_idx is None:
+            self.data_file_controls_message.emit("Global time is outside the data files, which are " +
+                                                 str(round(self.dataset_catalog.total_duration, 2)) + "s long")
+            return
+
+        data_file_name = self.data_file_names[file_idx]
+        if self.data_manager is None or self.data_manager.current_data_file_name != data_file_name:
+            self.open_data_file(data_file_name, load_first_image=False)
+            if self.data_manager is None:
+                return
+
+        self.data_file_time_line.setText(str(round(time_stamp, 2)))
+        self.data_file_time_line_edited()
+
     @pyqtSlot(bool)
     def load_next_data_file(self, load_first_image=True):
         """
@@ -226,10 +340,8 @@ class DataFileControls(QWidget):
             self.dispense_data_manager(success=False, message=message)
             return
         
-        if data_file_path.endswith(".json"):
-            self.data_manager = CachedDataLoader(data_file_path)
-        else:
-            self.data_manager = Bag2DataLoader(data_file_path, self.data_parameters.depth_topic, self.data_parameters.rgb_topic, self.data_parameters.odom_topic)
+        # The catalog may have already opened the file in the background
+        self.data_manager = self.dataset_catalog.get_data_manager(self.data_file_names.index(data_file_name))
 
         if self.data_manager.num_img_msgs == 0:
             self.dispense_data_manager(success=False, message="No images found in data file, check topic names")
@@ -249,6 +361,23 @@ class DataFileControls(QWidget):
             self.set_img_number_label.emit(self.data_manager.current_img_position, self.data_manager.num_img_msgs)
             
     
+    def create_data_manager(self, data_file_path: str):
+        """
+        Create the data manager for a data file, used by the dataset catalog to open the data files
+
+        Args:
+            data_file_path (str): Path to the data file
+
+        Returns:
+            BaseDataLoader: The data manager
+        """
+        if data_file_path.endswith(".json"):
+            return CachedDataLoader(data_file_path)
+        elif data_file_path.endswith(BINARY_CACHED_DATA_EXTENSION):
+            return BinaryCachedDataLoader(data_file_path)
+        else:
+            return Bag2DataLoader(data_file_path, self.data_parameters.depth_topic, self.data_parameters.rgb_topic, self.data_parameters.odom_topic)
+
     def check_data_file_is_valid(self, data_file_path: str):
         """
         Check if a data file is valid
@@ -261,9 +390,9 @@ class DataFileControls(QWidget):
         """
         if not os.path.isfile(data_file_path) and not os.path.isdir(data_file_path):
             return False, "Invalid file path"
-        elif data_file_path.endswith(".json") and not self.using_cached_data:
+        elif self.is_cached_data_file(data_file_path) and not self.using_cached_data:
             return False, "Invalid file type, not using cached data"
-        elif data_file_path.endswith(".json") and self.using_cached_data:
+        elif self.is_cached_data_file(data_file_path) and self.using_cached_data:
             return True, "Valid file"
         elif os.path.isdir(data_file_path):
             files = os.listdir(data_file_path)
@@ -274,6 +403,19 @@ class DataFileControls(QWidget):
         else:
             return False, "Invalid file"
     
+    @staticmethod
+    def is_cached_data_file(data_file_path: str):
+        """
+        Check if a data file is a json or binary cached data file
+
+        Args:
+            data_file_path (str): Path to the data file
+
+        Returns:
+            bool: Whether the data file is a cached data file
+        """
+        return data_file_path.endswith(".json") or data_file_path.endswith(BINARY_CACHED_DATA_EXTENSION)
+
     def dispense_data_manager(self, success: bool, message: str = None):
         """
         Emit the data manager object and a message
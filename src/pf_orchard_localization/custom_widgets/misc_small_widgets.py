@@ -2,16 +2,23 @@ from PyQt5.QtWidgets import (QLabel, QPushButton, QVBoxLayout, QHBoxLayout, QWid
                              QPlainTextEdit, QMainWindow, QComboBox, QFileDialog, QInputDialog, QDialog, QSlider,
                              QListWidget, QMessageBox, QSpinBox)
 from PyQt5.QtGui import QImage, QPixmap, QGuiApplication
-from PyQt5.QtCore import Qt, pyqtSignal, pyqtSlot
+from PyQt5.QtCore import Qt, pyqtSignal, pyqtSlot, QTimer
 import math
 import cv2
 import numpy as np
 from . import PfSettingsDialog
 import time
 import logging
-import json
 import os
 import copy
+import shutil
+import tempfile
+from ..recorded_data_loaders import BINARY_CACHED_DATA_EXTENSION, CachedDataStreamWriter
+from ..recorded_data_loaders.packed_image_store import time_stamp_to_key
+from ..utils.image_writer_pool import ImageWriterPool, ImageEncoder
+
+# The image formats that can be selected for saving images, and the ImageEncoder format of each
+IMAGE_FORMAT_OPTIONS = {"PNG": "png", "WebP (lossless)": "webp", "NPY": "npy"}
 
 
 class PfMainWindow(QMainWindow):
@@ -726,6 +733,54 @@ class PfQueueSizeLabel(QWidget):
         self.queue_size_label.setText("Queue Size: " + str(queue_size))
 
 
+class ImageWriterQueueLabel(QLabel):
+    """
+    Label showing the number of writes waiting in an image writer pool, and how many have been dropped
+    """
+
+    def __init__(self, image_writer_pool, update_interval_ms=250):
+        """
+        Args:
+            image_writer_pool (ImageWriterPool): The image writer pool to show the queue of
+            update_interval_ms (int, optional): How often to update the label in milliseconds. Defaults to 250.
+        """
+        super().__init__()
+
+        self.image_writer_pool = image_writer_pool
+
+        self.setToolTip("Number of images waiting to be written to disk")
+        self.setMinimumWidth(140)
+        self.update_queue_depth()
+
+        # The pool's writer threads aren't Qt threads, so poll it instead of having it emit signals
+        self.update_timer = QTimer(self)
+        self.update_timer.timeout.connect(self.update_queue_depth)
+        self.update_timer.start(update_interval_ms)
+
+    @pyqtSlot()
+    def update_queue_depth(self):
+        """
+        Update the label with the current queue depth of the pool
+        """
+        text = "Write Queue: " + str(self.image_writer_pool.queue_depth)
+        if self.image_writer_pool.num_dropped > 0:
+            text += " (" + str(self.image_writer_pool.num_dropped) + " dropped)"
+        self.setText(text)
+
+
+def make_image_format_combo_box():
+    """
+    Make a combo box for selecting the format images are saved in
+
+    Returns:
+        QComboBox: The combo box
+    """
+    image_format_combo_box = QComboBox()
+    image_format_combo_box.addItems(list(IMAGE_FORMAT_OPTIONS.keys()))
+    image_format_combo_box.setToolTip("Format to save the images in")
+    return image_format_combo_box
+
+
 class CachedDataCreator(QWidget):
     """
     Widget to aid in cacheing data in the app 
@@ -742,7 +797,12 @@ class CachedDataCreator(QWidget):
         self.main_app_manager = main_app_manager
 
         self.cache_data_enabled = False
-        self.cache = {}
+
+        # The data is streamed to a temporary file as it's cached, which is moved to the save location when it's saved
+        self.cache_writer = None
+
+        # Images are written in the background so encoding them doesn't hold up the app
+        self.image_writer_pool = ImageWriterPool()
 
         button_width = 140
 
@@ -769,6 +829,9 @@ class CachedDataCreator(QWidget):
         self.save_images_checkbox.setChecked(True)
         self.save_images_checkbox.setMinimumWidth(button_width)
 
+        self.image_format_combo_box = make_image_format_combo_box()
+        self.write_queue_label = ImageWriterQueueLabel(self.image_writer_pool)
+
         self.cache_size_label = QLabel("Cache Size: 0 messages")
         self.cache_size_label.setToolTip("Number of messages currently in the cache")
         self.cache_size_label.setMinimumWidth(180)
@@ -800,6 +863,8 @@ class CachedDataCreator(QWidget):
         self.top_layout.addWidget(self.save_directory_input)
         self.top_layout.addWidget(self.change_save_directory_button)
         self.top_layout.addWidget(self.save_images_checkbox)
+        self.top_layout.addWidget(self.image_format_combo_box)
+        self.top_layout.addWidget(self.write_queue_label)
 
         self.bottom_layout.addWidget(self.cache_size_label)
         self.bottom_layout.addWidget(self.file_name_label)
@@ -816,6 +881,7 @@ class CachedDataCreator(QWidget):
         self.change_save_directory_button.clicked.connect(self.change_save_directory)
         self.save_button.clicked.connect(self.save_cache)
         self.reset_cache_button.clicked.connect(self.reset_cache)
+        self.image_format_combo_box.currentTextChanged.connect(self.image_format_changed)
 
         self.cache_data_checkbox_changed()
 
@@ -833,9 +899,39 @@ class CachedDataCreator(QWidget):
         """
         Slot for resetting the cache when the button is clicked
         """
-        self.cache = {}
+        if self.cache_writer is not None:
+            self.cache_writer.close()
+            if os.path.exists(self.cache_writer.file_path):
+                os.remove(self.cache_writer.file_path)
+            self.cache_writer = None
+
         self.cache_size_label.setText("Cache Size: 0 messages")
 
+    def get_cache_writer(self):
+        """
+        Get the writer the cached data is streamed to, starting a new cache file if there isn't one yet. The file is put
+        in the save directory if it's set, so saving it only needs to rename it.
+
+        Returns:
+            CachedDataStreamWriter: The writer
+        """
+        if self.cache_writer is None:
+            save_directory = self.save_directory_input.text()
+            if not os.path.isdir(save_directory):
+                save_directory = tempfile.gettempdir()
+
+            file_descriptor, file_path = tempfile.mkstemp(prefix=".pf_cache_", suffix=".partial", dir=save_directory)
+            os.close(file_descriptor)
+            self.cache_writer = CachedDataStreamWriter(file_path)
+
+        return self.cache_writer
+
+    def update_cache_size_label(self):
+        """
+        Update the label showing the number of messages in the cache
+        """
+        self.cache_size_label.setText("Cache Size: " + str(self.cache_writer.num_msgs) + " messages")
+
     def get_timestamp_str(self, time_stamp):
         """
         Get the timestamp as a string
@@ -846,7 +942,7 @@ class CachedDataCreator(QWidget):
         Returns:
             str: The time stamp as a string
         """
-        return str(time_stamp*1000).split(".")[0]
+        return str(time_stamp_to_key(time_stamp))
     
     @pyqtSlot(dict)
     def cache_data(self, msg):
@@ -875,8 +971,8 @@ class CachedDataCreator(QWidget):
             theta_odom (float): Theta position of the odometry
             time_stamp_odom (float): Time stamp of the odometry
         """
-        self.cache[self.get_timestamp_str(time_stamp_odom)] = {"x_odom": x_odom, "theta_odom": theta_odom, "time_stamp": time_stamp_odom}
-        self.cache_size_label.setText("Cache Size: " + str(len(self.cache)) + " messages")
+        self.get_cache_writer().append_odom(x_odom, theta_odom, time_stamp_odom)
+        self.update_cache_size_label()
 
     def cache_tree_data(self, positions, widths, class_estimates, location_estimate, time_stamp):
         """
@@ -889,19 +985,15 @@ class CachedDataCreator(QWidget):
             location_estimate (np.array): Location estimate of the trees
             time_stamp (float): Time stamp of the tree data
         """
-        if positions is None:
-            self.cache[self.get_timestamp_str(time_stamp)] = None
-            return
-        tree_data = {"positions": positions.tolist(), "widths": widths.tolist(), "classes": class_estimates.tolist()}
-        location_estimate = {"x": location_estimate[0], "y": location_estimate[1], "theta": location_estimate[2]}
-        self.cache[self.get_timestamp_str(time_stamp)] = {"tree_data": tree_data, "location_estimate": location_estimate}
+        self.get_cache_writer().append_tree_data(positions, widths, class_estimates, location_estimate, time_stamp)
+        self.update_cache_size_label()
 
     @pyqtSlot()
     def save_cache(self):
         """
         Slot for saving the cache when the button is clicked. Does some check to ensure the save location is valid
         """
-        if len(self.cache) == 0:
+        if self.cache_writer is None or self.cache_writer.num_msgs == 0:
             self.main_app_manager.print_message("No data to save")
             return
 
@@ -913,7 +1005,7 @@ class CachedDataCreator(QWidget):
             self.main_app_manager.print_message("Please enter a file name")
             return
 
-        save_location = self.save_directory_input.text() + self.file_name_input.text() + ".json"
+        save_location = self.save_directory_input.text() + self.file_name_input.text() + BINARY_CACHED_DATA_EXTENSION
 
         # check if file already exists, if so, have popup to ask if they want to overwrite
         if os.path.exists(save_location):
@@ -932,8 +1024,14 @@ class CachedDataCreator(QWidget):
             if ret == QMessageBox.No:
                 return
 
-        with open(save_location, 'w') as f:
-            json.dump(self.cache, f)
+        # Make sure all the images from the run are on disk before reporting it's saved
+        self.image_writer_pool.flush()
+
+        # The data is already on disk, so saving only writes the footer and moves the file
+        self.cache_writer.finalize()
+        shutil.move(self.cache_writer.file_path, save_location)
+        self.cache_writer = None
+        self.cache_size_label.setText("Cache Size: 0 messages")
 
         self.main_app_manager.print_message("Cache saved to: " + save_location)
 
@@ -960,9 +1058,26 @@ class CachedDataCreator(QWidget):
         if not os.path.exists(save_directory):
             os.makedirs(save_directory)
 
-        save_location = save_directory + self.get_timestamp_str(time_stamp) + ".png"
+        save_location = save_directory + self.get_timestamp_str(time_stamp)
+
+        if not self.image_writer_pool.submit_image(save_location, img):
+            logging.warning("Image writer queue is full, dropped image " + save_location)
+
+    @pyqtSlot(str)
+    def image_format_changed(self, image_format_text):
+        """
+        Slot for when the image format is changed
+
+        Args:
+            image_format_text (str): The text of the selected image format
+        """
+        self.image_writer_pool.set_encoder(ImageEncoder(IMAGE_FORMAT_OPTIONS[image_format_text]))
 
-        cv2.imwrite(save_location, img)
+    def shutdown(self):
+        """
+        Write the images still in the queue and stop the image writer pool, called when the app closes
+        """
+        self.image_writer_pool.stop()
 
     @pyqtSlot()
     def cache_data_checkbox_changed(self):
@@ -985,6 +1100,7 @@ class CachedDataCreator(QWidget):
             disabled (bool): True to disable input, False to enable
         """
         self.save_images_checkbox.setDisabled(disabled)
+        self.image_format_combo_box.setDisabled(disabled)
         self.save_directory_input.setDisabled(disabled)
         self.change_save_directory_button.setDisabled(disabled)
         self.file_name_input.setDisabled(disabled)
@@ -1038,6 +1154,10 @@ class CalibrationDataControls(QWidget):
         self.date_edit.setToolTip("Ground truth date of the data")
         self.date_edit.setFixedWidth(150)
 
+        # The images and data are written in the background so encoding them doesn't hold up the app
+        self.image_writer_pool = ImageWriterPool()
+        self.image_format_combo_box = make_image_format_combo_box()
+        self.write_queue_label = ImageWriterQueueLabel(self.image_writer_pool)
 
         self.layout_1 = QHBoxLayout()
         self.layout_2 = QHBoxLayout()
@@ -1052,6 +1172,8 @@ class CalibrationDataControls(QWidget):
 
         self.layout_2.addWidget(self.ground_truth_date_label)
         self.layout_2.addWidget(self.date_edit)
+        self.layout_2.addWidget(self.image_format_combo_box)
+        self.layout_2.addWidget(self.write_queue_label)
 
         self.main_layout = QVBoxLayout()
 
@@ -1062,6 +1184,7 @@ class CalibrationDataControls(QWidget):
 
         self.change_save_location_button.clicked.connect(self.change_save_location)
         self.save_data_checkbox.stateChanged.connect(self.save_data_checkbox_changed)
+        self.image_format_combo_box.currentTextChanged.connect(self.image_format_changed)
         
         self.previous_x_position_in_image = None
         
@@ -1096,7 +1219,7 @@ class CalibrationDataControls(QWidget):
             self.main_app_manager.print_message("Data not being saved")
             return
 
-        closest_objects, kept_idx = self.find_closest_tree()
+        closest_objects, kept_idx = self.find_closest_tree(current_msg["positions"], current_msg["class_estimates"])
 
         if len(closest_objects) == 0:
             self.main_app_manager.print_message("No tree detected")
@@ -1133,7 +1256,7 @@ class CalibrationDataControls(QWidget):
 
         timestamp_secs = int(time_stamp)
         timestamp_ns = int((time_stamp - timestamp_secs) * 1e9)
-        file_name = str(timestamp_secs) + "_" + str(timestamp_ns).zfill(9) + ".png"
+        file_name = str(timestamp_secs) + "_" + str(timestamp_ns).zfill(9)
 
         data_note = self.data_note_input.text()
 
@@ -1141,7 +1264,7 @@ class CalibrationDataControls(QWidget):
         tree_data.convert_to_lat_lon()
 
         x_position_in_image = x_positions_in_image[kept_idx]
-        measured_width = self.main_app_manager.trunk_data_connection.widths[kept_idx]
+        measured_width = current_msg["widths"][kept_idx]
 
         data_to_save = {"tree_number": tree_data.object_number,
                         "tree_position": tree_data.position_estimate,
@@ -1155,25 +1278,30 @@ class CalibrationDataControls(QWidget):
 
         rgb_save_location = rgb_dir + file_name
         depth_save_location = depth_dir + file_name
-        data_save_location = data_dir + file_name.replace(".png", ".json")
+        data_save_location = data_dir + file_name + ".json"
 
-        cv2.imwrite(rgb_save_location, rgb_image)
-        cv2.imwrite(depth_save_location, depth_image)
-        with open(data_save_location, 'w') as f:
-            json.dump(data_to_save, f, indent=4)
+        queued = self.image_writer_pool.submit_images_with_json([(rgb_save_location, rgb_image),
+                                                                 (depth_save_location, depth_image)],
+                                                                data_save_location, data_to_save)
+
+        if not queued:
+            self.main_app_manager.print_message("Image writer queue is full, data not saved: " + data_save_location)
+            return
 
         self.main_app_manager.print_message("Data saved to: " + data_save_location)
 
-    def find_closest_tree(self):
+    def find_closest_tree(self, tree_positions, class_estimates):
         """
         Find the closest tree to the best particle and return the tree data and the index of the tree in the trunk data
 
+        Args:
+            tree_positions (np.ndarray): The positions of the trunks in the image
+            class_estimates (np.ndarray): The class estimates of the trunks
+
         Returns:
             list: List of the closest tree data
             list: List of the index of the tree in the trunk data
         """
-        tree_positions = self.main_app_manager.trunk_data_connection.positions
-        class_estimates = self.main_app_manager.trunk_data_connection.class_estimates
         best_particle = self.main_app_manager.pf_engine.best_particle
 
         # make the 3, array a 1,3 array
@@ -1249,9 +1377,18 @@ class CalibrationDataControls(QWidget):
         else:
             self.main_app_manager.trunk_data_connection.set_emitting_save_calibration_data(False)
 
+    @pyqtSlot(str)
+    def image_format_changed(self, image_format_text):
+        """
+        Slot for when the image format is changed
 
+        Args:
+            image_format_text (str): The text of the selected image format
+        """
+        self.image_writer_pool.set_encoder(ImageEncoder(IMAGE_FORMAT_OPTIONS[image_format_text]))
 
-
-
-
-
+    def shutdown(self):
+        """
+        Write the data still in the queue and stop the image writer pool, called when the app closes
+        """
+        self.image_writer_pool.stop()
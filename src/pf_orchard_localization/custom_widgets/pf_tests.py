@@ -64,6 +64,16 @@ class PfTestControls(QWidget):
         self.tests_per_location_spinbox.setValue(1)
         self.tests_per_location_spinbox.setFixedWidth(50)
 
+        self.num_workers_label = QLabel("Workers:")
+        self.num_workers_label.setToolTip("Number of processes to run the trials on, the particles aren't shown when more than 1")
+
+        self.num_workers_spinbox = QSpinBox()
+        self.num_workers_spinbox.setToolTip("Number of processes to run the trials on, the particles aren't shown when more than 1")
+        self.num_workers_spinbox.setMinimum(1)
+        self.num_workers_spinbox.setMaximum(max(os.cpu_count() or 1, 1))
+        self.num_workers_spinbox.setValue(1)
+        self.num_workers_spinbox.setFixedWidth(50)
+
         self.test_number_label = QLabel("Test:")
         self.test_number_label.setToolTip("Current test number")
         self.test_number_label.setFixedWidth(80)
@@ -100,6 +110,8 @@ class PfTestControls(QWidget):
         self.layer_2_layout.addWidget(self.load_tests_button)
         self.layer_2_layout.addWidget(self.tests_per_location_label)
         self.layer_2_layout.addWidget(self.tests_per_location_spinbox)
+        self.layer_2_layout.addWidget(self.num_workers_label)
+        self.layer_2_layout.addWidget(self.num_workers_spinbox)
 
         self.layer_3_layout = QHBoxLayout()
         self.layer_3_layout.addWidget(self.test_number_label)
@@ -208,6 +220,12 @@ class PfTestControls(QWidget):
         """
         return self.tests_per_location_spinbox.value()
 
+    def get_num_workers(self):
+        """
+        Get the number of worker processes to run the trials on
+        """
+        return self.num_workers_spinbox.value()
+
     @pyqtSlot()
     def load_tests_button_clicked(self):
         """
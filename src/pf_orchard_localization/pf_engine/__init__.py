@@ -1 +1 @@
-from .pf_engine import PfEngine
\ No newline at end of file
+from .pf_engine import PfEngine, PF_ENGINE_VERSION
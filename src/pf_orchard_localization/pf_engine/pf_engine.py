@@ -1,11 +1,14 @@
 #!/usr/bin/env python3
 
+import time
 import numpy as np
 from scipy.spatial import KDTree
 from scipy.stats import norm
 from scipy.ndimage import label
 from map_data_tools import MapData
 
+# Bump when a change to the particle filter changes its results, so stored trial results aren't used for the new version
+PF_ENGINE_VERSION = 2
 
 class PfEngine:
 
@@ -13,6 +16,12 @@ class PfEngine:
         
         np.random.seed(random_seed)
 
+        # The random number sources for initializing the particles, the motion noise and resampling. They're the global
+        # numpy random state unless set_random_streams gives each its own stream.
+        self.init_rng = np.random
+        self.motion_rng = np.random
+        self.resample_rng = np.random
+
         # Save the tree positions and widths
         self.map_positions = map_data.all_position_estimates
         self.map_widths = map_data.all_width_estimates
@@ -20,6 +29,27 @@ class PfEngine:
         # Create a KDTree for fast nearest-neighbor lookup of the trees
         self.kd_tree = KDTree(self.map_positions)
 
+    def set_random_streams(self, seed=None) -> None:
+        """
+        Give the particle initialization, the motion noise and the resampling each their own random number stream. With
+        separate streams, two runs with the same seed draw the same numbers for each part even if one part draws more
+        numbers in one of the runs, which makes runs with different parameters comparable trial by trial.
+
+        Args:
+            seed (int, optional): The seed the streams are spawned from. Defaults to None, which goes back to using the
+                                  global numpy random state.
+        """
+        if seed is None:
+            self.init_rng = np.random
+            self.motion_rng = np.random
+            self.resample_rng = np.random
+            return
+
+        init_seed, motion_seed, resample_seed = np.random.SeedSequence(seed).spawn(3)
+        self.init_rng = np.random.default_rng(init_seed)
+        self.motion_rng = np.random.default_rng(motion_seed)
+        self.resample_rng = np.random.default_rng(resample_seed)
+
     def reset_pf(self, setup_data) -> None:
         """
         Reset the particle filter with the given setup data.
@@ -63,6 +93,12 @@ class PfEngine:
 
         self.histogram = None
 
+        # Diagnostics of the last scan update and convergence check
+        self.effective_sample_size = float(self.particles.shape[0])
+        self.weight_time = 0.0
+        self.resample_time = 0.0
+        self.num_clusters = 0
+
     def initialize_particles(self, num_particles: int):
         """
         Initialize the particle poses
@@ -87,20 +123,20 @@ class PfEngine:
         particles = np.zeros((num_particles, 3))
 
         # Set the x and y coordinates of the particles to be uniformly distributed around the start pose center
-        particles[:, 0] = np.random.uniform(start_pose_center_x - start_pose_width_by_2,
+        particles[:, 0] = self.init_rng.uniform(start_pose_center_x - start_pose_width_by_2,
                                             start_pose_center_x + start_pose_width_by_2,
                                             num_particles)
-        particles[:, 1] = np.random.uniform(start_pose_center_y - start_pose_height_by_2,
+        particles[:, 1] = self.init_rng.uniform(start_pose_center_y - start_pose_height_by_2,
                                             start_pose_center_y + start_pose_height_by_2,
                                             num_particles)
 
         # Set the orientation of the particles to be uniformly distributed around the orientation center, or put half facing the oposite direction if spawn_in_both_directions is True
         if self.spawn_in_both_directions:
             half_particle_num = int(num_particles / 2)
-            particles[:half_particle_num, 2] = np.random.uniform(orientation_min, orientation_max, half_particle_num) + self.orientation_center
-            particles[half_particle_num:, 2] = np.random.uniform(orientation_min, orientation_max, half_particle_num) + self.orientation_center - np.pi
+            particles[:half_particle_num, 2] = self.init_rng.uniform(orientation_min, orientation_max, half_particle_num) + self.orientation_center
+            particles[half_particle_num:, 2] = self.init_rng.uniform(orientation_min, orientation_max, half_particle_num) + self.orientation_center - np.pi
         else:
-            particles[:, 2] = np.random.uniform(orientation_min, orientation_max, num_particles) + self.orientation_center
+            particles[:, 2] = self.init_rng.uniform(orientation_min, orientation_max, num_particles) + self.orientation_center
 
         # Rotate the particles around the start pose center by the given rotation
         particles = self.rotate_around_point(particles, self.rotation, self.start_pose_center)
@@ -145,6 +181,8 @@ class PfEngine:
         Handle the tree message. This will be called every time a tree message is received.
         """
 
+        start_time = time.perf_counter()
+
         if tree_msg['positions'] is not None:
 
             postions_sense = np.array(tree_msg['positions'])
@@ -162,8 +200,15 @@ class PfEngine:
             # Calculate the 'best' particle as the one with the highest weight
             self.best_particle = self.particles[np.argmax(self.particle_weights)]
 
+            self.effective_sample_size = float(1.0 / np.sum(self.particle_weights ** 2))
+
+        resample_start_time = time.perf_counter()
+        self.weight_time = resample_start_time - start_time
+
         # Resample the particles
         self.resample_particles()
+
+        self.resample_time = time.perf_counter() - resample_start_time
         
     def motion_update(self, u: np.ndarray, dt: float, num_readings: int):
         """
@@ -179,7 +224,7 @@ class PfEngine:
         num_particles = self.particles.shape[0]
 
         # Make array of noise. Noise is averaged over multiple readings if num_readings > 1
-        noise = np.random.randn(num_particles, 2) @ (self.R / np.sqrt(num_readings))
+        noise = self.motion_rng.standard_normal((num_particles, 2)) @ (self.R / np.sqrt(num_readings))
 
         # Add noise to control/odometry velocities
         ud = u + noise.T
@@ -209,7 +254,7 @@ class PfEngine:
         num_particles = self.calculate_num_particles(self.particles)
 
         # Calculate the step size for resampling
-        step_size = np.random.uniform(0, 1 / num_particles)
+        step_size = self.resample_rng.uniform(0, 1 / num_particles)
 
         # Set a starting position for the resampling
         cur_weight = self.particle_weights[0]
@@ -480,6 +525,7 @@ class PfEngine:
 
         # Label connected components. The structure defines what is considered "connected".
         labeled_array, num_features = label(binary_mask, structure=structure)
+        self.num_clusters = num_features
 
         # If there is only one feature, then the particles have converged
         if num_features == 1:
@@ -1,15 +1,13 @@
-from PyQt5.QtCore import QThread, pyqtSignal, pyqtSlot, QMutex, QWaitCondition
+from PyQt5.QtCore import QThread, pyqtSignal, pyqtSlot
 import numpy as np
-import time
-from ..utils.parameters import ParametersPf
 from ..pf_engine import PfEngine
-import inspect
-from ..visual_odom import OpticalFlowOdometerThread
+from ..pipeline import PfPipeline, PipelineObserver, LiveMessageSource, CachedTrunkSource, FrameOdomSource, run_blocking
 import os
 
-class PfLiveThread(QThread):
+class PfLiveThread(QThread, PipelineObserver):
     """
-    Runs the particle filter algorithm in real-time using live data from the camera
+    Runs the particle filter algorithm in real-time using live data from the camera. The odometry and trunk data received
+    from the ros thread are matched up by a LiveMessageSource and processed by a PfPipeline.
     """
     
     pf_run_message = pyqtSignal(str)
@@ -35,25 +33,19 @@ class PfLiveThread(QThread):
         
         self.pf_engine = pf_engine
         self.trunk_data_thread = trunk_data_thread
-        self.stop_when_converged = stop_when_converged
 
         self.fps = int(os.environ.get("IMAGE_FPS"))
         
-        self.dt = 1 / self.fps
-        
-        self.pf_active = False
-        self.converged = False
-        
         self.segmented_image_display_num = 1
         
-        self.tree_image_data_queue = []
-        self.odom_data_list = []
-        
-        self.odom_mutex = QMutex()
-        self.odom_wait_condition = QWaitCondition()
-        
-        self.tree_image_data_mutex = QMutex()
-        self.tree_image_data_condition = QWaitCondition()
+        self.message_source = LiveMessageSource()
+        self.pipeline = PfPipeline(pf_engine=pf_engine,
+                                   message_source=self.message_source,
+                                   trunk_source=CachedTrunkSource(),
+                                   odom_source=FrameOdomSource(self.fps),
+                                   observers=[self],
+                                   stop_when_converged=stop_when_converged,
+                                   check_convergence_every_msg=True)
         
         self.trunk_data_thread.trunk_data_signal.connect(self.trunk_data_reciever)
         self.trunk_data_thread.odom_data_signal.connect(self.odom_data_reciever)
@@ -61,132 +53,65 @@ class PfLiveThread(QThread):
         
     
     def run(self):
-            """
-            The main loop of the thread, stopped by calling stop_pf()
-            """
-                        
-            self.pf_active = True
-            
-            # As long as the thread is active, keep processing the data
-            while self.pf_active:
-                
-                # Wait for odom data
-                self.odom_mutex.lock()
-                if len(self.odom_data_list) == 0:
-                    self.odom_wait_condition.wait(self.odom_mutex)
-                if not self.pf_active:
-                    self.odom_mutex.unlock()
-                    break
-                odom_data = self.odom_data_list.pop(0)
-                self.odom_mutex.unlock()
-                
-                # Wait for trunk data
-                self.tree_image_data_mutex.lock()
-                if len(self.tree_image_data_queue) == 0:
-                    self.tree_image_data_condition.wait(self.tree_image_data_mutex)
-                if not self.pf_active:
-                    self.tree_image_data_mutex.unlock()
-                    break
-                tree_image_data = self.tree_image_data_queue.pop(0)
-                self.tree_image_data_mutex.unlock()
-                
-                # TODO check if the odom or trunk data is None and act accordingly
-                
-                # TODO I'm not sure this queue size is working right
-                self.set_queue_size.emit(len(self.tree_image_data_queue))
-                
-                # Check if the timestamps are the same, they should be since they are from the same image
-                timestamp_odom = odom_data["timestamp"]
-                timestamp_tree_data = tree_image_data["timestamp"]
-                timestamp_diff = timestamp_odom - timestamp_tree_data
-                
-                # Odom is newer, so ignore the trunk data and put the odom data back in the queue
-                if timestamp_diff > 0.0001:
-                    self.odom_mutex.lock()
-                    self.odom_data_list.insert(0, odom_data)
-                    self.odom_mutex.unlock()
-                
-                # Trunk data is newer, so handle the odom data and put the trunk data back in the queue
-                elif timestamp_diff < -0.0001:
-                    self.handle_odom_data(odom_data)
-                    self.tree_image_data_mutex.lock()
-                    self.tree_image_data_queue.insert(0, tree_image_data)
-                    self.tree_image_data_mutex.unlock()
-                    
-                # The timestamps are the same so we can process the data
-                else:
-                    seg_img = tree_image_data["seg_img"]
-                    
-                    self.signal_segmented_image.emit(seg_img, self.segmented_image_display_num)
-                    
-                    self.handle_odom_data(odom_data)
-                    self.handle_tree_image_data(tree_image_data)
-                    
-                    self.plot_best_guess.emit(self.pf_engine.best_particle)
-                    self.plot_particles.emit(self.pf_engine.downsample_particles())
-                
-                
-                self.converged_signal.emit(self.pf_engine.check_convergence())
-                
-    
-    def handle_odom_data(self, odom_data):
         """
-        Processes the odometry dat
-        
+        The main loop of the thread, stopped by calling stop_pf()
+        """
+        run_blocking(self.pipeline)
+
+    def on_message(self, msg):
+        """
+        Update the queue size, and show the segmented image of each image message
+
         Args:
-            odom_data (dict): The odometry data
+            msg (dict): The message
         """
-        x_odom = odom_data["x_odom"]
-        u = np.array([[x_odom/self.dt], [0]])
-        num_readings = int(self.dt * 60)
-        self.pf_engine.motion_update(u, self.dt, num_readings=num_readings)
-    
-    def handle_tree_image_data(self, tree_image_data):
+        # TODO I'm not sure this queue size is working right
+        self.set_queue_size.emit(self.message_source.queue_size())
+
+        if msg['topic'] == 'image':
+            self.signal_segmented_image.emit(msg['data']['seg_img'], self.segmented_image_display_num)
+
+    def on_image(self, msg, tree_data):
         """
-        Processes the tree image data
+        Plot the particles after a scan update
 
         Args:
-            tree_image_data (dict): The tree image data
+            msg (dict): The image message
+            tree_data (dict): The trunk data of the scan update, or None if there was none
         """
-        trunk_data = tree_image_data["trunk_data"]
-        self.pf_engine.scan_update(trunk_data)            
-        
-    def check_convergence(self):
+        if tree_data is None:
+            return
+
+        self.plot_best_guess.emit(self.pf_engine.best_particle)
+        self.plot_particles.emit(self.pf_engine.downsample_particles())
+
+    def on_convergence_check(self, converged):
         """
-        Checks if the particle filter has converged, and sets the converged flag
+        Publish whether the particle filter has converged
+
+        Args:
+            converged (bool): Whether the particle filter has converged
         """
-        self.converged = self.pf_engine.check_convergence()
-        
-        if self.converged and self.stop_when_converged:
-            self.pf_active = False
+        self.converged_signal.emit(converged)
             
     @pyqtSlot(dict)
     def trunk_data_reciever(self, tree_image_data):
         """
         Slot for receiving the trunk data from the ros thread
         """
-        self.tree_image_data_mutex.lock()
-        self.tree_image_data_queue.append(tree_image_data)
-        self.tree_image_data_condition.wakeAll()
-        self.tree_image_data_mutex.unlock()
+        self.message_source.push_trunk_data(tree_image_data)
     
     @pyqtSlot(dict)
     def odom_data_reciever(self, odom_data):
         """
         Slot for receiving the odometry data from the ros thread
         """
-        self.odom_mutex.lock()
-        self.odom_data_list.append(odom_data)
-        self.odom_wait_condition.wakeAll()
-        self.odom_mutex.unlock()
+        self.message_source.push_odom(odom_data)
     
     @pyqtSlot()
     def stop_pf(self):
         """
         Stops the thread and stops any waiting
         """
-        self.pf_active = False
-    
-        self.odom_wait_condition.wakeAll()
-        self.tree_image_data_condition.wakeAll()
-        
\ No newline at end of file
+        self.pipeline.stop()
+        self.message_source.close()
@@ -1,16 +1,21 @@
 from ..utils.pf_evaluation import PfTestExecutor
+from ..utils.parallel_pf_evaluation import ParallelPfTestExecutor
+from ..pipeline import (PfPipeline, PipelineObserver, RecordedMessageSource, RosOdomSource, CachedOdomSource,
+                        DetectionCacheTrunkSource, ExecutionClock, CLOCK_FAST, run_blocking)
+from ..utils.detection_cache import hash_config
+from .qt_sources import QtTrunkDataSource, QtVisualOdomSource
 from PyQt5.QtCore import QThread, pyqtSignal, pyqtSlot, QMutex, QWaitCondition
 import numpy as np
 import time
 from ..utils.parameters import ParametersPf
 from ..pf_engine import PfEngine
 import inspect
-from ..visual_odom import OpticalFlowOdometerThread
 import os
 
-class PfBagThread(QThread):
+class PfBagThread(QThread, PipelineObserver):
     """
-    Thread to run the particle filter algorithm using data from a bag file
+    Thread to run the particle filter algorithm using data from a bag file. The messages are processed by a PfPipeline,
+    this thread gets the trunk data and odometry from the app's worker threads and updates the app through its signals.
     """
     
     load_next_data_file = pyqtSignal(bool)
@@ -31,7 +36,11 @@ class PfBagThread(QThread):
                  added_delay, 
                  image_fps,
                  use_visual_odom=False,
-                 cache_data_enabled=False):
+                 cache_data_enabled=False,
+                 dataset_catalog=None,
+                 clock=None,
+                 prefetch_depth=0,
+                 detection_cache=None):
         """
         Args:
             pf_engine (PfEngine): The particle filter engine
@@ -39,10 +48,20 @@ class PfBagThread(QThread):
             trunk_data_thread (TrunkDataConnection or TrunkDataConnectionRosService): The thread that handles getting the trunk data
             stop_when_converged (bool): If True, the thread will stop when the particle filter converges
             only_single_image (bool): If True, the thread will only process a single image then exit
-            added_delay (float): The amount of added time to wait between processing images
+            added_delay (float): The amount of added time to wait between processing messages, used if no clock is given
             image_fps (int): The frames per second of the images
             use_visual_odom (bool, optional): If True, the thread will use visual odometry. Defaults to False.
             cache_data_enabled (bool, optional): If True, the thread will cache the data. Defaults to False.
+            dataset_catalog (DatasetCatalog, optional): The catalog of the data files, used to open the next data file in
+                                                        the background before the current one ends. Defaults to None.
+            clock (ExecutionClock, optional): Paces the messages and times the particle filter engine. Defaults to None,
+                                              which sends the messages as fast as possible with the added delay.
+            prefetch_depth (int, optional): How many images ahead to request the trunk data of, so the next images are
+                                            segmented while the particle filter processes the current one. Defaults to 0,
+                                            which segments each image when it's reached.
+            detection_cache (DetectionCache, optional): The stored trunk data of the bag images, used instead of the
+                                                        trunk data thread for the images in it and added to for the
+                                                        others. Defaults to None.
         """
         
         super().__init__()
@@ -50,40 +69,70 @@ class PfBagThread(QThread):
         self.pf_engine = pf_engine
         self.data_manager = data_manager
         self.cache_data_enabled = cache_data_enabled
-        self.trunk_data_thread = trunk_data_thread
-        self.stop_when_converged = stop_when_converged
         self.only_single_image = only_single_image
         self.added_delay = added_delay
         self.use_visual_odom = use_visual_odom
+        self.detection_cache = detection_cache
+        self.clock = clock if clock is not None else ExecutionClock(CLOCK_FAST, added_delay=added_delay)
 
         self.fps = image_fps
         
-        self.dt = 1 / self.fps
-        
-        self.trunk_data_thread.signal_request_processed.connect(self.on_trunk_request_processed)
-        
-        self.trunk_data = None
+        # Only the one image is segmented when running a single image
+        self.trunk_source = QtTrunkDataSource(trunk_data_thread, prefetch_depth=0 if only_single_image else prefetch_depth)
+        if detection_cache is not None:
+            self.trunk_source = DetectionCacheTrunkSource(self.trunk_source, detection_cache,
+                                                          hash_config(trunk_data_thread.get_detection_config()),
+                                                          self.get_bag_key)
         
         if self.use_visual_odom:
+            # Only imported when used, it needs cv2 and scipy
+            from ..visual_odom import OpticalFlowOdometerThread
             self.visual_odom_thread = OpticalFlowOdometerThread()
             self.visual_odom_thread.start()
-            self.visual_odom_thread.signal_request_processed.connect(self.on_visual_odom_request_processed)
-            self.odom_mutex = QMutex()
-            self.odom_condition = QWaitCondition()
-        
-        self.trunk_mutex = QMutex()
-        self.trunk_condition = QWaitCondition()
+            odom_source = QtVisualOdomSource(self.visual_odom_thread, self.fps)
+        else:
+            odom_source = self.make_wheel_odom_source()
         
         self.data_manager_mutex = QMutex()
         self.data_manager_condition = QWaitCondition()
         
-        self.pf_active = False
-        self.converged = False
         self.load_data_success = False
+
+        self.message_source = RecordedMessageSource(data_manager,
+                                                    next_data_manager_func=self.get_new_data_manager,
+                                                    dataset_catalog=dataset_catalog)
+        self.pipeline = PfPipeline(pf_engine=pf_engine,
+                                   message_source=self.message_source,
+                                   trunk_source=self.trunk_source,
+                                   odom_source=odom_source,
+                                   clock=self.clock,
+                                   observers=[self],
+                                   stop_when_converged=stop_when_converged)
+
+    def get_bag_key(self):
+        """
+        Get the identity of the bag the messages are currently from, for the detection cache
+
+        Returns:
+            str: The identity of the bag
+        """
+        return self.detection_cache.get_bag_key(self.message_source.data_manager.current_data_file_path)
+
+    def make_wheel_odom_source(self):
+        """
+        Make the source of the wheel odometry, from the odometry messages of the bag file
+
+        Returns:
+            OdomSource: The odometry source
+        """
+        return RosOdomSource()
         
     def get_new_data_manager(self):
         """
         Get a new data manager from the main thread. Tells the main thread to load the next data file then waits for the data manager to be received.
+
+        Returns:
+            Bag2DataLoader: The data manager of the next data file, or None if it couldn't be loaded
         """
         load_first_image = False
         self.load_next_data_file.emit(load_first_image)
@@ -92,15 +141,16 @@ class PfBagThread(QThread):
         timeout = 120 * 1000  # Timeout in milliseconds # TODO: Maybe make this a parameter
         if not self.data_manager_condition.wait(self.data_manager_mutex, timeout):
             self.pf_run_message.emit("Timeout waiting for data manager. Stopping particle filter.")
-            self.pf_active = False
             self.data_manager_mutex.unlock()
-            return
+            return None
 
+        data_manager = self.data_manager
         if not self.load_data_success:
             self.pf_run_message.emit("Failed to load next data file. Stopping particle filter.")
-            self.pf_active = False
+            data_manager = None
         
         self.data_manager_mutex.unlock()
+        return data_manager
         
     @pyqtSlot(bool, object)
     def data_manager_receiver(self, success, data_manager):
@@ -118,178 +168,74 @@ class PfBagThread(QThread):
         """
         The main loop of the thread, stopped by calling stop_pf(). 
         """
-        
-        self.pf_active = True
-        
-        while self.pf_active:
-            self.send_next_msg()
-            self.msleep(int(self.added_delay * 1000))
-            
-            if self.pf_active and self.data_manager.at_img_msg and self.only_single_image:
-                self.pf_active = False
-    
-    def send_next_msg(self):
-        """
-        Get the next message from the data manager and process it
-        """
-        current_msg = self.data_manager.get_next_msg()
-        
-        # The data manager returns None if it is at the end of the data
-        if current_msg is None:
-            self.get_new_data_manager()
-            if not self.pf_active:
-                return
-            current_msg = self.data_manager.get_next_msg()
-        
-        self.set_time_line.emit(self.data_manager.current_data_file_time_stamp)
-
-        # Using visual odom so this is commented out, TODO: make visual odom a setting somewhere, also, cacheing for visual odom currently doesn't work
-        if current_msg['topic'] == 'odom' and not self.use_visual_odom:
-            x_odom, theta_odom, time_stamp_odom = self.get_wheel_odom_data(current_msg)
-            self.pf_engine.handle_odom(x_odom, theta_odom, time_stamp_odom)
-            
-        elif current_msg['topic'] == 'image':
-            
-            self.get_data_from_image_msg(current_msg)
+        run_blocking(self.pipeline)
 
-    def get_data_from_image_msg(self, current_msg): 
+    def on_message(self, current_msg):
         """
-        Get the trunk data and odom data from the image message
+        Update the time line, and cache the odometry if caching is enabled
 
         Args:
             current_msg (dict): The current message from the data manager
         """
-        
-        # Send off the request for processing the trunk data and odom data then wait for the response
-        request = {"current_msg": current_msg}
+        self.set_time_line.emit(self.message_source.data_manager.current_data_file_time_stamp)
 
-        self.trunk_data_thread.handle_request(request)
-        
-        if self.use_visual_odom:
-            self.visual_odom_thread.handle_request(request)
-        
-        self.trunk_data = None
-        self.x_odom = None
-        
-        self.wait_for_response()
-        
-        if self.use_visual_odom:
-            # If the odom data is None, the visual odometer failed to process the image
-            if self.x_odom != "returned_none":
-                u = np.array([[self.x_odom/self.dt], [0]])
-                num_readings = int(self.dt * 60)
-                self.pf_engine.motion_update(u, self.dt, num_readings=num_readings)
-            else:
-                return
-        
+        if self.cache_data_enabled and current_msg['topic'] == 'odom' and not self.use_visual_odom:
+            x_odom, theta_odom, time_stamp_odom = self.pipeline.odom_source.get_odom(current_msg)
+            data = {'topic': 'odom', 'x_odom': x_odom, 'theta_odom': theta_odom, 'time_stamp': time_stamp_odom}
+            self.cache_msg.emit(data)
 
-        positions, widths, class_estimates, seg_img = self.trunk_data
+    def on_image(self, current_msg, tree_data):
+        """
+        Update the app after the scan update of an image, and cache the trunk data if caching is enabled
 
-       # Exit if there is no trunk data
-        if positions is None:
+        Args:
+            current_msg (dict): The image message
+            tree_data (dict): The trunk data of the scan update, or None if there was none
+        """
+        if tree_data is None:
             if self.cache_data_enabled:
                 data = {'topic': 'image', 'positions': None, 'widths': None, 'class_estimates': None, 'location_estimate': None,
                         'time_stamp': current_msg['timestamp'], 'image': None}
                 self.cache_msg.emit(data)
             return
 
-        self.set_img_number_label.emit(self.data_manager.current_img_position, self.data_manager.num_img_msgs)
-
-        tree_data = {'positions': positions, 'widths': widths, 'classes': class_estimates}
-        self.pf_engine.scan_update(tree_data)
+        data_manager = self.message_source.data_manager
+        self.set_img_number_label.emit(data_manager.current_img_position, data_manager.num_img_msgs)
 
         self.plot_best_guess.emit(self.pf_engine.best_particle)
         self.plot_particles.emit(self.pf_engine.downsample_particles())
 
         if self.cache_data_enabled:
-            data = {'topic': 'image', 'positions': positions, 'widths': widths, 'class_estimates': class_estimates, 'location_estimate': self.pf_engine.best_particle,
-                    'time_stamp': current_msg['timestamp'], 'image': seg_img}
+            data = {'topic': 'image', 'positions': tree_data['positions'], 'widths': tree_data['widths'],
+                    'class_estimates': tree_data['classes'], 'location_estimate': self.pf_engine.best_particle,
+                    'time_stamp': current_msg['timestamp'], 'image': self.trunk_source.seg_img}
             self.cache_msg.emit(data)
-                    
-        self.check_convergence()
-        
-    def wait_for_response(self):
-        """
-        Wait for trunk data and odom data to be received
-        """ 
-        self.trunk_mutex.lock()
-        if self.trunk_data is None:
-            self.trunk_condition.wait(self.trunk_mutex)
-        self.trunk_mutex.unlock()
-        
-        if self.use_visual_odom:
-            # Trunk data is in, now wait for odom data if it is not already in
-            self.odom_mutex.lock()
-            if self.x_odom is None:
-                self.odom_condition.wait(self.odom_mutex)
-            self.odom_mutex.unlock()
-        
-    
-    @pyqtSlot(object)
-    def on_trunk_request_processed(self, trunk_data):
-        """
-        Slot to receive the trunk data from the trunk data thread
-        
-        Args:
-            trunk_data (tuple): The trunk data
-        """
-        self.trunk_mutex.lock()
-        self.trunk_data = trunk_data
-        self.trunk_condition.wakeAll()
-        self.trunk_mutex.unlock()
-    
-    @pyqtSlot(object)
-    def on_visual_odom_request_processed(self, x_odom):
-        """
-        Slot to receive the odom data from the visual odometer thread
 
-        Args:
-            x_odom (float): The estimated x movement in mm from the visual odometer
+    def on_message_processed(self, current_msg):
         """
-        self.odom_mutex.lock()
-        if x_odom is None:
-            self.x_odom = "returned_none"
-        else:
-            self.x_odom = x_odom
-        self.odom_condition.wakeAll()
-        self.odom_mutex.unlock()
-        
-    def get_wheel_odom_data(self, current_msg):
-        """
-        Get the odometry data from the current message
+        Stop after the first image if only a single image is to be processed
 
         Args:
-            current_msg (dict): The current message
-        
-        Returns:
-            tuple: The x movement, theta movement, and time stamp of the odometry data
+            current_msg (dict): The current message from the data manager
         """
-        odom_data = current_msg['data']
-        x_odom = odom_data.twist.twist.linear.x
-        theta_odom = odom_data.twist.twist.angular.z
-        time_stamp_odom = odom_data.header.stamp.sec + odom_data.header.stamp.nanosec * 1e-9
-
-        if self.cache_data_enabled:
-            data = {'topic': 'odom', 'x_odom': x_odom, 'theta_odom': theta_odom, 'time_stamp': time_stamp_odom}
-            self.cache_msg.emit(data)
+        if self.only_single_image and self.message_source.data_manager.at_img_msg:
+            self.pipeline.stop()
 
-        return x_odom, theta_odom, time_stamp_odom
-    
-    def check_convergence(self):
+    def on_stop(self, stop_reason):
         """
-        Check if the particle filter has converged, and set the converged flag
+        Drop the trunk data requests of the images that were requested ahead but won't be processed
+
+        Args:
+            stop_reason (str): Why the pipeline stopped
         """
-        self.converged = self.pf_engine.check_convergence()
-        
-        if self.converged and self.stop_when_converged:
-            self.pf_active = False
+        self.trunk_source.cancel()
             
     @pyqtSlot()
     def stop_pf(self):
         """
         Stop the particle filter
         """
-        self.pf_active = False
+        self.pipeline.stop()
     
 class PfCachedThread(PfBagThread):
     """
@@ -299,52 +245,28 @@ class PfCachedThread(PfBagThread):
         """
         Override the base class method to just exit if the end of a data file is reached, as cached data does not have multiple files
         """
-        self.pf_active = False       
+        return None
     
-    def get_wheel_odom_data(self, current_msg):
+    def make_wheel_odom_source(self):
         """
         Override the base class method to get the odometry data from the cached data manager
 
-        Args:
-            current_msg (dict): The current message
-
         Returns:
-            tuple: The x movement, theta movement, and time stamp of the odometry data
+            OdomSource: The odometry source
         """
-        odom_data = current_msg['data']
-        x_odom = odom_data['x_odom']
-        theta_odom = odom_data['theta_odom']
-        time_stamp_odom = current_msg['timestamp']
-
-        return x_odom, theta_odom, time_stamp_odom 
+        return CachedOdomSource()
     
-    def get_data_from_image_msg(self, current_msg):
+    def on_image(self, current_msg, tree_data):
         """
-        Override the base class method to get the trunk data and odom data from the cached data manager
+        Override the base class method to plot the ground truth position from the cached data
 
         Args:
-            current_msg (dict): The current message from the data manager
+            current_msg (dict): The image message
+            tree_data (dict): The trunk data of the scan update, or None if there was none
         """
-        
-        request = {"current_msg": current_msg}
-        
-        self.trunk_data_thread.handle_request(request)
-
-        if self.use_visual_odom:
-            self.visual_odom_thread.handle_request(request)
-        
-        self.trunk_data = None
-        
-        self.wait_for_response()
-
-        positions, widths, class_estimates = self.trunk_data
-
-        if positions is None:
+        if tree_data is None:
             return
 
-        tree_data = {'positions': positions, 'widths': widths, 'classes': class_estimates}
-        self.pf_engine.scan_update(tree_data)
-
         actual_position = (current_msg['data']['location_estimate'])
         self.position_gt = np.array([actual_position['x'], actual_position['y']])
         self.plot_best_guess.emit(self.position_gt)
@@ -352,9 +274,8 @@ class PfCachedThread(PfBagThread):
         self.position_estimate = self.pf_engine.best_particle
         self.plot_particles.emit(self.pf_engine.downsample_particles())
 
-        self.set_img_number_label.emit(self.data_manager.current_img_position, self.data_manager.num_img_msgs)
-
-        self.check_convergence()
+        data_manager = self.message_source.data_manager
+        self.set_img_number_label.emit(data_manager.current_img_position, data_manager.num_img_msgs)
 
 
 class PfTestExecutorQt(PfTestExecutor, QThread):
@@ -371,7 +292,9 @@ class PfTestExecutorQt(PfTestExecutor, QThread):
     update_ui_with_trial_results = pyqtSignal(float, float, float)
     reset_pf_app = pyqtSignal(bool)
     print_message = pyqtSignal(str)
-    
+
+    # The trunk data connection remaps the classes when it gets the trunk data
+    CACHE_REMAPPED_CLASSES = False
     
     def __init__(self,
                  pf_engine: PfEngine,
@@ -383,7 +306,10 @@ class PfTestExecutorQt(PfTestExecutor, QThread):
                  save_path=None,
                  convergence_threshold=0.5,
                  test_index=None,
-                 load_data_only=False
+                 load_data_only=False,
+                 map_data=None,
+                 num_workers=1,
+                 clock=None
                  ):
         """
         Args:
@@ -397,6 +323,12 @@ class PfTestExecutorQt(PfTestExecutor, QThread):
             convergence_threshold (float, optional): The distance error threshold to be considered a correct convergence. Defaults to 0.5.
             test_index (int, optional): The index of the test to run. If None, all tests will be run. Defaults to None.
             load_data_only (bool, optional): If True, the data will be loaded but the tests will not be run. Defaults to False.
+            map_data (MapData, optional): The map data, needed to run the tests on worker processes. Defaults to None.
+            num_workers (int, optional): The number of worker processes to run the trials on. The particles and images
+                                         aren't shown while the trials run on workers. Defaults to 1, which runs the
+                                         trials on this thread.
+            clock (ExecutionClock, optional): Paces the messages of the trials and times them. Defaults to None, which
+                                              runs the trials as fast as possible.
         """
         
         # Initialize the PfTestExecutor class, which contains the main logic for running the tests
@@ -408,11 +340,17 @@ class PfTestExecutorQt(PfTestExecutor, QThread):
                                 num_trials=num_trials,
                                 save_path=save_path,
                                 print_message_func=self.signal_print_message, 
-                                convergence_threshold=convergence_threshold)
+                                convergence_threshold=convergence_threshold,
+                                clock=clock)
         
         self.get_trunk_data_func = get_trunk_data_func
         self.test_index = test_index
         self.load_data_only = load_data_only
+
+        self.test_info_path = test_info_path
+        self.map_data = map_data
+        self.num_workers = num_workers
+        self.parallel_executor = None
         
         QThread.__init__(self)
     
@@ -428,13 +366,70 @@ class PfTestExecutorQt(PfTestExecutor, QThread):
         """
 
         
+        run_parallel = self.num_workers > 1 and self.map_data is not None
+
         if self.test_index is not None:
             if self.load_data_only:
                 self.reset_for_test(self.test_regimen.pf_tests[self.test_index])
+            elif run_parallel:
+                self.run_tests_parallel([self.test_index])
             else:
                 self.run_selected_test(self.test_index)
         elif self.test_index is None:
-            self.run_all_tests()
+            if run_parallel:
+                self.run_tests_parallel(range(self.test_regimen.num_tests))
+                if self.save_path is not None and not self.tests_aborted:
+                    self.process_results(self.save_path)
+            else:
+                self.run_all_tests()
+
+    def run_tests_parallel(self, test_indices):
+        """
+        Run the trials of the tests on worker processes, adding the results to this executor's test regimen and updating
+        the app as each trial finishes
+
+        Args:
+            test_indices (list): The indices of the tests to run
+        """
+        self.parallel_executor = ParallelPfTestExecutor(map_data=self.map_data,
+                                                        parameters_pf=self.parameters_pf,
+                                                        test_info_path=self.test_info_path,
+                                                        cached_data_files_dir=self.cached_data_files_dir,
+                                                        num_trials=self.num_trials,
+                                                        class_mapping=self.class_mapping,
+                                                        convergence_threshold=self.convergence_threshold,
+                                                        print_message_func=self.signal_print_message,
+                                                        num_workers=self.num_workers,
+                                                        data_time_window=self.data_time_window,
+                                                        early_stopping=self.early_stopping)
+        self.parallel_executor.test_regimen = self.test_regimen
+
+        self.parallel_executor.run_tests(test_indices, progress_callback=self.signal_parallel_progress)
+        self.tests_aborted = self.parallel_executor.tests_aborted
+
+    def signal_parallel_progress(self, test_info, trial_num, num_trials_done, num_trials_total):
+        """
+        Update the app with the progress of the tests running on worker processes
+
+        Args:
+            test_info (PfTest): The test the trial result was added to
+            trial_num (int): The number of trial results the test has
+            num_trials_done (int): The number of trials done across all the tests
+            num_trials_total (int): The total number of trials to run
+        """
+        self.signal_update_test_number(test_info.test_name)
+        self.signal_update_trial_number(trial_num)
+        self.signal_update_ui_with_trial_results(test_info)
+        self.signal_print_message("Finished {} of {} trials".format(num_trials_done, num_trials_total))
+
+    @pyqtSlot()
+    def stop_pf(self):
+        """
+        Stop the tests, including the ones running on worker processes
+        """
+        PfTestExecutor.stop_pf(self)
+        if self.parallel_executor is not None:
+            self.parallel_executor.stop()
             
     # def signal_running_all_tests(self):
     #     self.running_all_tests.emit()
@@ -509,7 +504,7 @@ class PfTestExecutorQt(PfTestExecutor, QThread):
         Send signal to update the trial info in the app
         """
         particle_count = self.pf_engine.particles.shape[0]
-        current_time = time.time() - self.trial_start_time
+        current_time = self.clock.elapsed()
         self.update_trial_info.emit(current_time, particle_count)
     
     def signal_update_ui_with_trial_results(self, test_info):
@@ -540,12 +535,4 @@ class PfTestExecutorQt(PfTestExecutor, QThread):
         # TODO, probably would be best to have a response signal setup instead of waiting
         time.sleep(0.4)
         
-        # self.pf_engine.reset_pf(self.parameters_pf)
-    
-    @pyqtSlot()
-    def stop_pf(self):
-        """
-        Stop the particle filter
-        """
-        self.pf_active = False
-        self.tests_aborted = True
\ No newline at end of file
+        # self.pf_engine.reset_pf(self.parameters_pf)
\ No newline at end of file
@@ -0,0 +1,158 @@
+import itertools
+from PyQt5.QtCore import QMutex, QWaitCondition
+from ..pipeline import TrunkSource, FrameOdomSource
+
+# Pipeline sources that get their data from the Qt worker threads of the app. Each request is sent to the worker thread,
+# and the result comes back through the worker's signal_request_processed signal.
+
+# The IDs of the trunk data requests, shared by all the sources since they can share a trunk data thread
+TRUNK_REQUEST_IDS = itertools.count()
+
+
+class QtTrunkDataSource(TrunkSource):
+    """
+    Trunk data from a trunk data connection thread. With a prefetch depth the trunk data of the next few images is
+    requested ahead of time, so the thread segments them while the particle filter processes the current image. The
+    thread processes the requests in order and sends each result back with its request ID, and each image waits for its
+    own result, so the trunk data is still given in the order of the images.
+    """
+
+    def __init__(self, trunk_data_thread, prefetch_depth=0):
+        """
+        Args:
+            trunk_data_thread (TrunkDataConnection): The thread that gets the trunk data
+            prefetch_depth (int, optional): How many images ahead of the current one to request the trunk data of.
+                                            Defaults to 0, which requests each image when it's processed.
+        """
+        self.trunk_data_thread = trunk_data_thread
+        self.prefetch_depth = prefetch_depth
+
+        self.seg_img = None
+
+        # The request ID of each requested image by its time stamp, in the order they were requested, and the results
+        # received for the requests still wanted
+        self.request_ids = {}
+        self.wanted_request_ids = set()
+        self.results = {}
+
+        self.trunk_mutex = QMutex()
+        self.trunk_condition = QWaitCondition()
+
+        self.trunk_data_thread.signal_request_result.connect(self.on_request_processed)
+
+    def request(self, msg):
+        self.trunk_mutex.lock()
+        if msg['timestamp'] in self.request_ids:
+            self.trunk_mutex.unlock()
+            return
+        request_id = next(TRUNK_REQUEST_IDS)
+        self.request_ids[msg['timestamp']] = request_id
+        self.wanted_request_ids.add(request_id)
+        self.trunk_mutex.unlock()
+
+        self.trunk_data_thread.handle_request({"current_msg": msg, "request_id": request_id})
+
+    def get_trunk_data(self, msg):
+        self.trunk_mutex.lock()
+        request_id = self.request_ids.pop(msg['timestamp'])
+
+        # Images requested before this one that weren't processed, like those before a seek, aren't needed anymore
+        for time_stamp, earlier_request_id in list(self.request_ids.items()):
+            if earlier_request_id > request_id:
+                break
+            del self.request_ids[time_stamp]
+            self.wanted_request_ids.discard(earlier_request_id)
+            self.results.pop(earlier_request_id, None)
+
+        while request_id not in self.results:
+            self.trunk_condition.wait(self.trunk_mutex)
+        trunk_data = self.results.pop(request_id)
+        self.wanted_request_ids.discard(request_id)
+        self.trunk_mutex.unlock()
+
+        # Trunk data connections that segment the images also give the segmented image
+        self.seg_img = trunk_data[3] if len(trunk_data) > 3 else None
+
+        return trunk_data[:3]
+
+    def cancel(self):
+        """
+        Drop the requests that are still waiting, so the trunk data thread doesn't process images that won't be used
+        """
+        self.trunk_mutex.lock()
+        self.request_ids.clear()
+        self.wanted_request_ids.clear()
+        self.results.clear()
+        self.trunk_mutex.unlock()
+
+        self.trunk_data_thread.clear_requests()
+
+    def on_request_processed(self, request_id, trunk_data):
+        """
+        Receive the trunk data of a request from the trunk data thread
+
+        Args:
+            request_id (int): The ID of the request
+            trunk_data (tuple): The trunk data
+        """
+        self.trunk_mutex.lock()
+        if request_id in self.wanted_request_ids:
+            self.results[request_id] = trunk_data
+            self.trunk_condition.wakeAll()
+        self.trunk_mutex.unlock()
+
+
+class QtVisualOdomSource(FrameOdomSource):
+    """
+    Motion of each image from a visual odometry thread
+    """
+
+    IMAGE_MOTION = True
+
+    def __init__(self, visual_odom_thread, image_fps):
+        """
+        Args:
+            visual_odom_thread (OpticalFlowOdometerThread): The thread that estimates the motion of each image
+            image_fps (int): The frames per second of the images
+        """
+        super().__init__(image_fps)
+
+        self.visual_odom_thread = visual_odom_thread
+
+        # The estimated motion, False until it is received since None means the odometer failed
+        self.x_odom = False
+
+        self.odom_mutex = QMutex()
+        self.odom_condition = QWaitCondition()
+
+        self.visual_odom_thread.signal_request_processed.connect(self.on_request_processed)
+
+    def request(self, msg):
+        self.odom_mutex.lock()
+        self.x_odom = False
+        self.odom_mutex.unlock()
+
+        self.visual_odom_thread.handle_request({"current_msg": msg})
+
+    def get_motion(self, msg):
+        self.odom_mutex.lock()
+        while self.x_odom is False:
+            self.odom_condition.wait(self.odom_mutex)
+        x_odom = self.x_odom
+        self.odom_mutex.unlock()
+
+        if x_odom is None:
+            return None
+        return self.get_frame_motion(x_odom)
+
+    def on_request_processed(self, x_odom):
+        """
+        Receive the motion from the visual odometry thread
+
+        Args:
+            x_odom (float): The estimated x movement in mm, or None if the odometer failed to process the image
+        """
+        self.odom_mutex.lock()
+        self.x_odom = x_odom
+        self.odom_condition.wakeAll()
+        self.odom_mutex.unlock()
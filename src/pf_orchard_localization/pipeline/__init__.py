@@ -0,0 +1,6 @@
+from .pf_pipeline import PfPipeline, PipelineObserver, STOP_CONVERGED, STOP_END_OF_DATA, STOP_REQUESTED
+from .sources import (MessageSource, RecordedMessageSource, LiveMessageSource, TrunkSource, CachedTrunkSource,
+                      FunctionTrunkSource, DetectionCacheTrunkSource, OdomSource, CachedOdomSource, RosOdomSource,
+                      FrameOdomSource, remap_classes)
+from .runners import run_blocking, run_async
+from .execution_clock import ExecutionClock, CLOCK_REALTIME, CLOCK_FAST, CLOCK_SIMULATED, CLOCK_MODES
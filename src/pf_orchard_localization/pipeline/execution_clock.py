@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+import asyncio
+import time
+from contextlib import contextmanager
+
+# Paces a run of the particle filter through recorded data and accounts for where its time goes. The clock has three
+# modes:
+#   realtime:  each message is sent when its time stamp comes up, with the data played back speed_factor times faster than
+#              it was recorded
+#   fast:      messages are sent as fast as possible, with an optional fixed delay after each one for watching the run
+#   simulated: messages are sent as fast as possible and the clock reads the time of the data, so the time of a run is the
+#              data time it took and doesn't depend on the machine or the load on it
+# The time spent in the particle filter engine is timed separately from the rest of the run, so the cost of the filter can
+# be told apart from the overhead of loading data, updating a UI and waiting for the pace of the data.
+
+CLOCK_REALTIME = "realtime"
+CLOCK_FAST = "fast"
+CLOCK_SIMULATED = "simulated"
+CLOCK_MODES = (CLOCK_REALTIME, CLOCK_FAST, CLOCK_SIMULATED)
+
+
+class ExecutionClock:
+    """
+    Clock that paces the messages of a particle filter run and times the particle filter engine
+    """
+
+    def __init__(self, mode=CLOCK_FAST, speed_factor=1.0, added_delay=0.0):
+        """
+        Args:
+            mode (str, optional): One of CLOCK_MODES. Defaults to CLOCK_FAST.
+            speed_factor (float, optional): How many times faster than recorded to play the data in realtime mode.
+                                            Defaults to 1.0.
+            added_delay (float, optional): The delay after each message in fast mode, in seconds. Defaults to 0.0.
+        """
+        if mode not in CLOCK_MODES:
+            raise ValueError("Unknown clock mode: {}, must be one of {}".format(mode, CLOCK_MODES))
+        if speed_factor <= 0:
+            raise ValueError("The speed factor must be positive")
+
+        self.mode = mode
+        self.speed_factor = speed_factor
+        self.added_delay = added_delay
+
+        self.start()
+
+    def start(self):
+        """
+        Start timing a new run, the data time starts at the time stamp of the first message
+        """
+        self.start_wall_time = time.perf_counter()
+        self.start_data_time = None
+        self.data_time = None
+
+        self.wait_time = 0.0
+        self.engine_time = 0.0
+        self.engine_cpu_time = 0.0
+
+    def advance(self, data_time):
+        """
+        Move the clock to a message, without waiting for it
+
+        Args:
+            data_time (float): The time stamp of the message, in seconds
+
+        Returns:
+            float: How long to wait before sending the message, in seconds
+        """
+        if self.start_data_time is None:
+            self.start_data_time = data_time
+        self.data_time = data_time
+
+        if self.mode == CLOCK_REALTIME:
+            return self.start_wall_time + (data_time - self.start_data_time) / self.speed_factor - time.perf_counter()
+        elif self.mode == CLOCK_FAST:
+            return self.added_delay
+        return 0.0
+
+    def wait_for(self, data_time):
+        """
+        Wait until a message is due to be sent
+
+        Args:
+            data_time (float): The time stamp of the message, in seconds
+        """
+        delay = self.advance(data_time)
+        if delay > 0:
+            wait_start_time = time.perf_counter()
+            time.sleep(delay)
+            self.wait_time += time.perf_counter() - wait_start_time
+
+    async def wait_for_async(self, data_time):
+        """
+        Wait until a message is due to be sent, without blocking the event loop
+
+        Args:
+            data_time (float): The time stamp of the message, in seconds
+        """
+        delay = self.advance(data_time)
+        if delay > 0:
+            wait_start_time = time.perf_counter()
+            await asyncio.sleep(delay)
+            self.wait_time += time.perf_counter() - wait_start_time
+
+    @contextmanager
+    def engine(self):
+        """
+        Context manager that adds the time of the block to the time spent in the particle filter engine. The cpu time is
+        the time of the calling thread only, so other threads like a UI aren't counted.
+        """
+        start_time = time.perf_counter()
+        start_cpu_time = time.thread_time()
+        try:
+            yield
+        finally:
+            self.engine_cpu_time += time.thread_time() - start_cpu_time
+            self.engine_time += time.perf_counter() - start_time
+
+    def get_data_time(self):
+        """
+        Returns:
+            float: The data time from the first message of the run to the last one, in seconds
+        """
+        if self.start_data_time is None:
+            return 0.0
+        return self.data_time - self.start_data_time
+
+    def get_wall_time(self):
+        """
+        Returns:
+            float: The wall time since the start of the run, in seconds
+        """
+        return time.perf_counter() - self.start_wall_time
+
+    def elapsed(self):
+        """
+        Returns:
+            float: The time since the start of the run by this clock, the data time in simulated mode and the wall time
+                   otherwise, in seconds
+        """
+        if self.mode == CLOCK_SIMULATED:
+            return self.get_data_time()
+        return self.get_wall_time()
+
+    def get_timing(self):
+        """
+        Get where the time of the run so far went
+
+        Returns:
+            dict: The data time of the run, its wall time, the time spent waiting to pace the messages, the wall and cpu
+                  time spent in the particle filter engine, and the overhead, which is the rest of the wall time
+        """
+        wall_time = self.get_wall_time()
+        return {"data_time": self.get_data_time(),
+                "wall_time": wall_time,
+                "wait_time": self.wait_time,
+                "engine_time": self.engine_time,
+                "engine_cpu_time": self.engine_cpu_time,
+                "overhead_time": wall_time - self.wait_time - self.engine_time}
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+import time
+from ..pf_engine import PfEngine
+from .execution_clock import ExecutionClock
+
+# The message processing of a particle filter run, shared by the app, the live app and the test evaluation. A message
+# source gives the messages in order, a trunk source gets the trunk data of the image messages and an odometry source the
+# motion of the robot, and the pipeline feeds them to the particle filter engine. Observers are told about each step,
+# which is how the app updates its UI and the evaluation records its results. Nothing here imports Qt, the Qt threads only
+# adapt the sources and observers to their signals, so headless runs don't need a display stack.
+
+# Why the pipeline stopped
+STOP_CONVERGED = "converged"
+STOP_END_OF_DATA = "end_of_data"
+STOP_REQUESTED = "requested"
+
+
+class PipelineObserver:
+    """
+    Receives the events of a pipeline run, override the methods of the events of interest
+    """
+
+    def on_message(self, msg):
+        """
+        Called before a message is processed
+
+        Args:
+            msg (dict): The message
+        """
+        pass
+
+    def on_image(self, msg, tree_data):
+        """
+        Called after an image message is processed
+
+        Args:
+            msg (dict): The image message
+            tree_data (dict): The trunk data the scan update was done with, or None if the image had no trunk data
+        """
+        pass
+
+    def on_convergence_check(self, converged):
+        """
+        Called after each convergence check
+
+        Args:
+            converged (bool): Whether the particle filter has converged
+        """
+        pass
+
+    def on_message_processed(self, msg):
+        """
+        Called after a message is processed, unless the pipeline was stopped while processing it
+
+        Args:
+            msg (dict): The message
+        """
+        pass
+
+    def on_stop(self, stop_reason):
+        """
+        Called once the pipeline stops
+
+        Args:
+            stop_reason (str): Why the pipeline stopped
+        """
+        pass
+
+
+class PfPipeline:
+    """
+    Feeds the messages of a message source to a particle filter engine
+    """
+
+    def __init__(self,
+                 pf_engine: PfEngine,
+                 message_source,
+                 trunk_source,
+                 odom_source=None,
+                 clock=None,
+                 observers=None,
+                 stop_when_converged=True,
+                 check_convergence_every_msg=False):
+        """
+        Args:
+            pf_engine (PfEngine): The particle filter engine
+            message_source (MessageSource): Gives the messages to process, see sources
+            trunk_source (TrunkSource): Gets the trunk data of the image messages
+            odom_source (OdomSource, optional): Gets the motion of the robot. Defaults to None, which ignores odometry.
+            clock (ExecutionClock, optional): Paces the messages and times the engine. Defaults to None, which processes
+                                              the messages as fast as possible.
+            observers (list, optional): The PipelineObservers to tell about each step. Defaults to None.
+            stop_when_converged (bool, optional): Whether to stop once the particle filter converges. Defaults to True.
+            check_convergence_every_msg (bool, optional): Whether to check for convergence after every message, instead of
+                                                          only after scan updates. Defaults to False.
+        """
+        self.pf_engine = pf_engine
+        self.message_source = message_source
+        self.trunk_source = trunk_source
+        self.odom_source = odom_source
+        self.clock = clock if clock is not None else ExecutionClock()
+        self.observers = list(observers) if observers is not None else []
+        self.stop_when_converged = stop_when_converged
+        self.check_convergence_every_msg = check_convergence_every_msg
+
+        self.active = False
+        self.stop_reason = None
+        self.converged = False
+
+        # The time of the last scan update and convergence check, in seconds
+        self.scan_time = 0.0
+        self.convergence_time = 0.0
+
+    def add_observer(self, observer):
+        """
+        Add an observer to tell about each step
+
+        Args:
+            observer (PipelineObserver): The observer
+        """
+        self.observers.append(observer)
+
+    def start(self):
+        """
+        Get ready to process messages, the runners call this
+        """
+        self.active = True
+        self.stop_reason = None
+        self.converged = False
+        self.clock.start()
+
+    def stop(self, stop_reason=STOP_REQUESTED):
+        """
+        Stop processing messages, can be called from any thread or by an observer
+
+        Args:
+            stop_reason (str, optional): Why the pipeline stopped, only the first reason is kept. Defaults to
+                                         STOP_REQUESTED.
+        """
+        if self.stop_reason is None:
+            self.stop_reason = stop_reason
+        self.active = False
+
+    def finish(self):
+        """
+        Tell the observers the pipeline stopped, the runners call this
+        """
+        for observer in self.observers:
+            observer.on_stop(self.stop_reason)
+
+    def next_message(self):
+        """
+        Get the next message from the message source, stopping the pipeline at the end of the data
+
+        Returns:
+            dict: The message, or None at the end of the data
+        """
+        msg = self.message_source.next_message()
+        if msg is None:
+            self.stop(STOP_END_OF_DATA)
+        return msg
+
+    def step(self):
+        """
+        Get, pace and process the next message
+
+        Returns:
+            bool: Whether the pipeline is still active
+        """
+        msg = self.next_message()
+        if msg is None:
+            return False
+
+        self.clock.wait_for(msg['timestamp'])
+        self.process_message(msg)
+        return self.active
+
+    def process_message(self, msg):
+        """
+        Process a message
+
+        Args:
+            msg (dict): The message
+        """
+        for observer in self.observers:
+            observer.on_message(msg)
+
+        check_convergence = self.check_convergence_every_msg
+        if msg['topic'] == 'odom':
+            self.handle_odom_msg(msg)
+        elif msg['topic'] == 'image':
+            if self.handle_image_msg(msg):
+                check_convergence = True
+
+        # An observer or another thread stopped the pipeline
+        if not self.active:
+            return
+
+        if check_convergence:
+            self.check_convergence()
+
+        for observer in self.observers:
+            observer.on_message_processed(msg)
+
+    def handle_odom_msg(self, msg):
+        """
+        Update the particle filter with the motion from an odometry message
+
+        Args:
+            msg (dict): The odometry message
+        """
+        if self.odom_source is None or self.odom_source.IMAGE_MOTION:
+            return
+
+        odom = self.odom_source.get_odom(msg)
+        if odom is not None:
+            with self.clock.engine():
+                self.pf_engine.handle_odom(*odom)
+            return
+
+        motion = self.odom_source.get_motion(msg)
+        if motion is not None:
+            with self.clock.engine():
+                self.pf_engine.motion_update(*motion)
+
+    def handle_image_msg(self, msg):
+        """
+        Update the particle filter with the trunk data, and the motion if the odometry comes from the images, of an image
+        message
+
+        Args:
+            msg (dict): The image message
+
+        Returns:
+            bool: Whether a scan update was done
+        """
+        # Start getting the trunk data and the odometry together, for sources that work in the background, along with
+        # the trunk data of the next few images so it's found while this one is processed
+        self.trunk_source.request(msg)
+        if self.trunk_source.prefetch_depth > 0:
+            for upcoming_msg in self.message_source.peek_image_msgs(self.trunk_source.prefetch_depth):
+                self.trunk_source.request(upcoming_msg)
+        image_motion = self.odom_source is not None and self.odom_source.IMAGE_MOTION
+        if image_motion:
+            self.odom_source.request(msg)
+
+            # The image is skipped if its motion couldn't be found
+            motion = self.odom_source.get_motion(msg)
+            if motion is None:
+                return False
+            with self.clock.engine():
+                self.pf_engine.motion_update(*motion)
+
+        positions, widths, class_estimates = self.trunk_source.get_trunk_data(msg)
+
+        if positions is None:
+            for observer in self.observers:
+                observer.on_image(msg, None)
+            return False
+
+        tree_data = {'positions': positions, 'widths': widths, 'classes': class_estimates}
+        scan_start_time = time.perf_counter()
+        with self.clock.engine():
+            self.pf_engine.scan_update(tree_data)
+        self.scan_time = time.perf_counter() - scan_start_time
+
+        for observer in self.observers:
+            observer.on_image(msg, tree_data)
+        return True
+
+    def check_convergence(self):
+        """
+        Check whether the particle filter has converged, stopping the pipeline if it has and stop_when_converged is set
+        """
+        convergence_start_time = time.perf_counter()
+        with self.clock.engine():
+            self.converged = self.pf_engine.check_convergence()
+        self.convergence_time = time.perf_counter() - convergence_start_time
+
+        for observer in self.observers:
+            observer.on_convergence_check(self.converged)
+
+        if self.converged and self.stop_when_converged:
+            self.stop(STOP_CONVERGED)
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+import asyncio
+
+# Runners that drive a PfPipeline until it stops. The blocking runner processes the messages on the calling thread, which
+# is what the Qt threads and the evaluation use. The asyncio runner waits out the pacing of the clock on the event loop
+# and runs the message source and the processing on an executor, since they block, so a pipeline can run alongside other
+# coroutines such as a server feeding it live data.
+
+
+def run_blocking(pipeline):
+    """
+    Run a pipeline on the calling thread until it stops
+
+    Args:
+        pipeline (PfPipeline): The pipeline to run
+
+    Returns:
+        str: Why the pipeline stopped
+    """
+    pipeline.start()
+    while pipeline.active:
+        pipeline.step()
+    pipeline.finish()
+
+    return pipeline.stop_reason
+
+
+async def run_async(pipeline, executor=None):
+    """
+    Run a pipeline until it stops without blocking the event loop
+
+    Args:
+        pipeline (PfPipeline): The pipeline to run
+        executor (concurrent.futures.Executor, optional): The executor to get and process the messages on. Defaults to
+                                                          None, which uses the default executor of the event loop.
+
+    Returns:
+        str: Why the pipeline stopped
+    """
+    loop = asyncio.get_running_loop()
+
+    pipeline.start()
+    while pipeline.active:
+        msg = await loop.run_in_executor(executor, pipeline.next_message)
+        if msg is None:
+            break
+
+        await pipeline.clock.wait_for_async(msg['timestamp'])
+        if not pipeline.active:
+            break
+
+        await loop.run_in_executor(executor, pipeline.process_message, msg)
+    pipeline.finish()
+
+    return pipeline.stop_reason
@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+import collections
+import threading
+import numpy as np
+
+# The sources a PfPipeline gets its data from. Messages are dicts with a 'topic' of 'odom' or 'image', a 'timestamp' in
+# seconds and the 'data' of the message, the format the recorded data loaders give. The base classes are the interfaces,
+# the Qt threads subclass them to get the trunk data and visual odometry from their worker threads.
+
+
+class MessageSource:
+    """
+    Gives the messages of a particle filter run in order
+    """
+
+    def next_message(self):
+        """
+        Get the next message, waiting for it if it isn't in yet
+
+        Returns:
+            dict: The message, or None at the end of the data
+        """
+        raise NotImplementedError
+
+    def peek_image_msgs(self, num_msgs):
+        """
+        Get the image messages coming up after the current message without moving past them, so trunk sources can start
+        getting their trunk data ahead of time. Sources that can't look ahead give none.
+
+        Args:
+            num_msgs (int): The most image messages to get
+
+        Returns:
+            list: The upcoming image messages, in order
+        """
+        return []
+
+
+class RecordedMessageSource(MessageSource):
+    """
+    Messages from a recorded data loader, optionally carrying on to the next data file at the end of each one
+    """
+
+    def __init__(self, data_manager, next_data_manager_func=None, dataset_catalog=None):
+        """
+        Args:
+            data_manager (BaseDataLoader): The data loader to get the messages from
+            next_data_manager_func (function, optional): Called at the end of the data file, returns the data loader of
+                                                         the next one or None to end the run. Defaults to None, which
+                                                         ends the run at the end of the data file.
+            dataset_catalog (DatasetCatalog, optional): The catalog of the data files, used to open the next data file in
+                                                        the background before the current one ends. Defaults to None.
+        """
+        self.data_manager = data_manager
+        self.next_data_manager_func = next_data_manager_func
+        self.dataset_catalog = dataset_catalog
+
+    def next_message(self):
+        msg = self.data_manager.get_next_msg()
+
+        # Start opening the next data file once partway through this one, so it's ready when this one ends
+        if self.dataset_catalog is not None:
+            self.dataset_catalog.prefetch_next(self.data_manager)
+
+        if msg is None and self.next_data_manager_func is not None:
+            data_manager = self.next_data_manager_func()
+            if data_manager is None:
+                return None
+            self.data_manager = data_manager
+            msg = self.data_manager.get_next_msg()
+
+        return msg
+
+    def peek_image_msgs(self, num_msgs):
+        # Only looks ahead through the part of the data file that's loaded, the rest is requested once it's loaded
+        data_manager = self.data_manager
+        next_img_idx = np.searchsorted(data_manager.img_msg_positions, data_manager.cur_data_pos, side='right')
+        positions = data_manager.img_msg_positions[next_img_idx:next_img_idx + num_msgs]
+        return [data_manager.get_msg(int(position)) for position in positions]
+
+
+class LiveMessageSource(MessageSource):
+    """
+    Messages from live odometry and trunk data, pushed in from other threads. The trunk data of an image comes with the
+    odometry of the same image, the two are matched up by their time stamps, giving the odometry message then the image
+    message. Trunk data older than the oldest odometry waiting is dropped.
+    """
+
+    def __init__(self, time_stamp_tolerance=0.0001):
+        """
+        Args:
+            time_stamp_tolerance (float, optional): How close the time stamps of the odometry and trunk data of an image
+                                                    have to be, in seconds. Defaults to 0.0001.
+        """
+        self.time_stamp_tolerance = time_stamp_tolerance
+
+        self.condition = threading.Condition()
+        self.odom_queue = collections.deque()
+        self.trunk_data_queue = collections.deque()
+        self.image_msg = None
+        self.closed = False
+
+    def push_odom(self, odom_data):
+        """
+        Add odometry data
+
+        Args:
+            odom_data (dict): The odometry data, with its 'timestamp' and 'x_odom'
+        """
+        with self.condition:
+            self.odom_queue.append(odom_data)
+            self.condition.notify_all()
+
+    def push_trunk_data(self, tree_image_data):
+        """
+        Add the trunk data of an image
+
+        Args:
+            tree_image_data (dict): The trunk data, with its 'timestamp', the 'trunk_data' with the positions, widths and
+                                    classes of the trunks, and the segmented image 'seg_img'
+        """
+        with self.condition:
+            self.trunk_data_queue.append(tree_image_data)
+            self.condition.notify_all()
+
+    def close(self):
+        """
+        End the messages, waking up any wait for them
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def queue_size(self):
+        """
+        Returns:
+            int: The number of images waiting to be processed
+        """
+        return len(self.trunk_data_queue)
+
+    def next_message(self):
+        with self.condition:
+            while True:
+                if self.image_msg is not None:
+                    msg, self.image_msg = self.image_msg, None
+                    return msg
+
+                while not self.closed and (not self.odom_queue or not self.trunk_data_queue):
+                    self.condition.wait()
+                if self.closed:
+                    return None
+
+                odom_data = self.odom_queue[0]
+                tree_image_data = self.trunk_data_queue[0]
+                time_stamp_diff = odom_data["timestamp"] - tree_image_data["timestamp"]
+
+                # The odometry is newer, so the trunk data has no odometry to go with it
+                if time_stamp_diff > self.time_stamp_tolerance:
+                    self.trunk_data_queue.popleft()
+                    continue
+
+                self.odom_queue.popleft()
+
+                # The time stamps match, so the image message goes after the odometry
+                if time_stamp_diff >= -self.time_stamp_tolerance:
+                    self.trunk_data_queue.popleft()
+                    self.image_msg = {'topic': 'image', 'timestamp': tree_image_data["timestamp"],
+                                      'data': {'tree_data': tree_image_data["trunk_data"],
+                                               'seg_img': tree_image_data["seg_img"]}}
+
+                return {'topic': 'odom', 'timestamp': odom_data["timestamp"], 'data': odom_data}
+
+
+class TrunkSource:
+    """
+    Gets the trunk data of image messages
+    """
+
+    # How many of the upcoming image messages to request ahead of the current one, for sources that work in the
+    # background, so their trunk data is being found while the particle filter processes the current image
+    prefetch_depth = 0
+
+    def request(self, msg):
+        """
+        Start getting the trunk data of an image message, for sources that work in the background. Requesting a message
+        that was already requested does nothing.
+
+        Args:
+            msg (dict): The image message
+        """
+        pass
+
+    def get_trunk_data(self, msg):
+        """
+        Get the trunk data of an image message
+
+        Args:
+            msg (dict): The image message
+
+        Returns:
+            tuple: The positions, widths and class estimates of the trunks, all None if there are no trunks
+        """
+        raise NotImplementedError
+
+
+class CachedTrunkSource(TrunkSource):
+    """
+    Trunk data stored in the messages, like those of the cached data files
+    """
+
+    def __init__(self, class_mapping=None):
+        """
+        Args:
+            class_mapping (tuple, optional): The mapping of classes from the trunk width estimation package to this one.
+                                             Defaults to None, for classes that are already mapped.
+        """
+        self.class_mapping = class_mapping
+
+    def get_trunk_data(self, msg):
+        if msg['data'] is None:
+            return None, None, None
+
+        msg_data = msg['data']['tree_data']
+        if msg_data['positions'] is None:
+            return None, None, None
+
+        positions = np.asarray(msg_data['positions'])
+        widths = np.asarray(msg_data['widths'])
+        class_estimates = np.asarray(msg_data['classes'], dtype=np.int32)
+
+        if self.class_mapping is not None:
+            class_estimates = remap_classes(class_estimates, self.class_mapping)
+
+        return positions, widths, class_estimates
+
+
+class FunctionTrunkSource(TrunkSource):
+    """
+    Trunk data from a function, like the get_trunk_data of a trunk data connection
+    """
+
+    def __init__(self, get_trunk_data_func):
+        """
+        Args:
+            get_trunk_data_func (function): Takes an image message and returns the positions, widths and class estimates
+                                            of its trunks
+        """
+        self.get_trunk_data_func = get_trunk_data_func
+
+    def get_trunk_data(self, msg):
+        return self.get_trunk_data_func(msg)[:3]
+
+
+class DetectionCacheTrunkSource(TrunkSource):
+    """
+    Trunk data from a detection cache, falling back to another trunk source for the images that aren't in it and storing
+    what that source finds, so replaying a bag only finds the trunk data of each image once
+    """
+
+    def __init__(self, trunk_source, detection_cache, config_key, get_bag_key_func):
+        """
+        Args:
+            trunk_source (TrunkSource): The trunk source of the images that aren't in the cache
+            detection_cache (DetectionCache): The cache
+            config_key (str): The hash of the configuration the trunk source finds the trunk data with
+            get_bag_key_func (function): Returns the identity of the bag the messages are currently from
+        """
+        self.trunk_source = trunk_source
+        self.detection_cache = detection_cache
+        self.config_key = config_key
+        self.get_bag_key_func = get_bag_key_func
+
+        self.prefetch_depth = trunk_source.prefetch_depth
+        self.seg_img = None
+
+        # The cached trunk data of the requested images that were in the cache, and the time stamps of those that weren't
+        # and were requested from the trunk source
+        self.cached_trunk_data = {}
+        self.source_requests = set()
+
+    def request(self, msg):
+        if msg['timestamp'] in self.cached_trunk_data or msg['timestamp'] in self.source_requests:
+            return
+
+        cached = self.detection_cache.get(self.get_bag_key_func(), self.config_key, msg['timestamp'])
+        if cached is not None:
+            self.cached_trunk_data[msg['timestamp']] = cached
+        else:
+            self.source_requests.add(msg['timestamp'])
+            self.trunk_source.request(msg)
+
+    def get_trunk_data(self, msg):
+        self.source_requests.discard(msg['timestamp'])
+        cached = self.cached_trunk_data.pop(msg['timestamp'], None)
+        if cached is not None:
+            self.seg_img = cached[3]
+            return cached[:3]
+
+        positions, widths, class_estimates = self.trunk_source.get_trunk_data(msg)
+        self.seg_img = getattr(self.trunk_source, "seg_img", None)
+        self.detection_cache.put(self.get_bag_key_func(), self.config_key, msg['timestamp'], positions, widths,
+                                 class_estimates, self.seg_img)
+        return positions, widths, class_estimates
+
+    def cancel(self):
+        """
+        Drop the requests that are still waiting
+        """
+        self.cached_trunk_data.clear()
+        self.source_requests.clear()
+        if hasattr(self.trunk_source, "cancel"):
+            self.trunk_source.cancel()
+
+
+class OdomSource:
+    """
+    Gets the motion of the robot, either from odometry messages or from the image messages
+    """
+
+    # Whether the motion comes from the image messages, like visual odometry, in which case odometry messages are ignored
+    IMAGE_MOTION = False
+
+    def request(self, msg):
+        """
+        Start getting the motion of an image message, for sources that work in the background
+
+        Args:
+            msg (dict): The image message
+        """
+        pass
+
+    def get_odom(self, msg):
+        """
+        Get the velocities of an odometry message, for PfEngine.handle_odom
+
+        Args:
+            msg (dict): The odometry message
+
+        Returns:
+            tuple: The linear and angular velocity and the time stamp, or None if the message is given as a motion, see
+                   get_motion
+        """
+        return None
+
+    def get_motion(self, msg):
+        """
+        Get the motion over a message, for PfEngine.motion_update
+
+        Args:
+            msg (dict): The odometry message, or the image message if IMAGE_MOTION is set
+
+        Returns:
+            tuple: The control input, the time step and the number of readings, or None if there is no motion
+        """
+        return None
+
+
+class CachedOdomSource(OdomSource):
+    """
+    Odometry stored in the messages as dicts, like those of the cached data files
+    """
+
+    def get_odom(self, msg):
+        odom_data = msg['data']
+        return odom_data['x_odom'], odom_data['theta_odom'], msg['timestamp']
+
+
+class RosOdomSource(OdomSource):
+    """
+    Odometry from the nav_msgs/Odometry messages of a bag file
+    """
+
+    def get_odom(self, msg):
+        odom_data = msg['data']
+        x_odom = odom_data.twist.twist.linear.x
+        theta_odom = odom_data.twist.twist.angular.z
+        time_stamp_odom = odom_data.header.stamp.sec + odom_data.header.stamp.nanosec * 1e-9
+        return x_odom, theta_odom, time_stamp_odom
+
+
+class FrameOdomSource(OdomSource):
+    """
+    Odometry given as the distance moved between frames, like the live odometry, applied as a velocity over one frame
+    """
+
+    def __init__(self, image_fps):
+        """
+        Args:
+            image_fps (int): The frames per second of the images
+        """
+        self.dt = 1 / image_fps
+
+    def get_frame_motion(self, x_odom):
+        """
+        Get the motion over one frame
+
+        Args:
+            x_odom (float): The distance moved forward over the frame
+
+        Returns:
+            tuple: The control input, the time step and the number of readings
+        """
+        u = np.array([[x_odom / self.dt], [0]])
+        num_readings = int(self.dt * 60)
+        return u, self.dt, num_readings
+
+    def get_motion(self, msg):
+        return self.get_frame_motion(msg['data']['x_odom'])
+
+
+def remap_classes(class_estimates, class_mapping):
+    """
+    Remap the classes from the trunk width estimation package to this one
+
+    Args:
+        class_estimates (np.ndarray): The class estimates
+        class_mapping (tuple): The class each class of the trunk width estimation package maps to
+
+    Returns:
+        np.ndarray: The remapped class estimates
+    """
+    class_estimates_copy = class_estimates.copy()
+    for i, class_num in enumerate(class_mapping):
+        class_estimates_copy[class_estimates == i] = class_num
+
+    return class_estimates_copy
@@ -1,3 +1,27 @@
+import importlib
 from .base_data_loader import BaseDataLoader
-from .bag_data_loader import BagDataLoader, Bag2DataLoader
 from .cached_data_loader import CachedDataLoader
+from .binary_cached_data_loader import (BinaryCachedDataLoader, convert_json_cached_data, select_data_files,
+                                        BINARY_CACHED_DATA_EXTENSION)
+from .cached_data_stream_writer import CachedDataStreamWriter
+from .dataset_catalog import DatasetCatalog
+
+# The bag loaders need rosbags and the packed image store needs cv2, so they're only imported when first used, which keeps
+# them out of headless runs on the cached data
+LAZY_IMPORTS = {"BagDataLoader": ".bag_data_loader",
+                "Bag2DataLoader": ".bag_data_loader",
+                "PackedImageWriter": ".packed_image_store",
+                "PackedImageReader": ".packed_image_store",
+                "CachedImageSource": ".packed_image_store",
+                "pack_image_directory": ".packed_image_store",
+                "PACKED_IMAGES_EXTENSION": ".packed_image_store"}
+
+
+def __getattr__(name):
+    if name in LAZY_IMPORTS:
+        return getattr(importlib.import_module(LAZY_IMPORTS[name], __name__), name)
+    raise AttributeError("module {} has no attribute {}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + list(LAZY_IMPORTS))
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+import json
+import os
+import struct
+import numpy as np
+
+# File layout:
+#   FILE_MAGIC, padded to ALIGNMENT
+#   segment 0: SEGMENT_MAGIC, header length (uint32), json header, padding, raw array data
+#   segment 1: ...
+#   footer: json index of all the segments of each array
+#   trailer: footer length (uint64), FOOTER_MAGIC
+#
+# Each array can be stored in several segments, so a file can be written a piece at a time and the footer is only
+# written once at the end. Every segment carries its own small header, so if the footer was never written the index can
+# be rebuilt by scanning the segments.
+
+FILE_MAGIC = b"PFARRAY1"
+SEGMENT_MAGIC = b"PFSEGMT1"
+FOOTER_MAGIC = b"PFFOOTR1"
+ALIGNMENT = 64
+
+SEGMENT_HEADER_STRUCT = struct.Struct("<8sI")
+TRAILER_STRUCT = struct.Struct("<Q8s")
+
+
+def padding_for(position):
+    """
+    Get the number of bytes needed to pad a position in the file to the alignment
+
+    Args:
+        position (int): The position in the file
+
+    Returns:
+        int: The number of padding bytes
+    """
+    return (-position) % ALIGNMENT
+
+
+class ArrayFileWriter:
+    """
+    Writes named numpy arrays to an array file. Arrays are written as segments along their first axis, so the rows of an
+    array can be appended over several calls, and the footer index is written when the file is finalized.
+    """
+
+    def __init__(self, file_path, metadata=None):
+        """
+        Args:
+            file_path (str): The path to write the file to
+            metadata (dict, optional): Json serializable metadata to store in the footer. Defaults to None.
+        """
+        self.file_path = file_path
+        self.metadata = metadata if metadata is not None else {}
+        self.arrays_index = {}
+
+        self.file = open(file_path, 'wb')
+        self.position = 0
+        self.write_bytes(FILE_MAGIC)
+        self.write_padding()
+
+        self.finalized = False
+
+    @classmethod
+    def reopen(cls, file_path, arrays_index, position, metadata=None):
+        """
+        Reopen an array file that was never finalized to keep writing to it. Everything in the file after the given
+        position is discarded.
+
+        Args:
+            file_path (str): The path to the array file
+            arrays_index (dict): The index of the segments to keep, as returned by scan_segments
+            position (int): The position in the file to continue writing from
+            metadata (dict, optional): Json serializable metadata to store in the footer. Defaults to None.
+
+        Returns:
+            ArrayFileWriter: The writer
+        """
+        writer = cls.__new__(cls)
+        writer.file_path = file_path
+        writer.metadata = metadata if metadata is not None else {}
+        writer.arrays_index = arrays_index
+
+        writer.file = open(file_path, 'r+b')
+        writer.file.truncate(position)
+        writer.file.seek(position)
+        writer.position = position
+
+        writer.finalized = False
+        return writer
+
+    def write_bytes(self, data):
+        """
+        Write bytes to the file and keep track of the position in the file
+
+        Args:
+            data (bytes or memoryview): The data to write
+        """
+        self.file.write(data)
+        self.position += len(data)
+
+    def write_padding(self):
+        """
+        Pad the file to the alignment
+        """
+        self.write_bytes(b"\0" * padding_for(self.position))
+
+    def append(self, name, array):
+        """
+        Append rows to an array in the file, creating the array if it isn't in the file yet
+
+        Args:
+            name (str): The name of the array
+            array (np.ndarray): The rows to append, the dtype and the shape of each row must match previous appends
+        """
+        array = np.ascontiguousarray(array)
+        if array.ndim == 0:
+            array = array.reshape(1)
+
+        dtype_str = array.dtype.str
+        row_shape = list(array.shape[1:])
+
+        if name in self.arrays_index:
+            array_index = self.arrays_index[name]
+            if array_index['dtype'] != dtype_str or array_index['shape'] != row_shape:
+                raise ValueError(f"Array {name} was written with dtype {array_index['dtype']} and row shape "
+                                 f"{array_index['shape']}, can't append dtype {dtype_str} and row shape {row_shape}")
+        else:
+            array_index = {'dtype': dtype_str, 'shape': row_shape, 'segments': []}
+            self.arrays_index[name] = array_index
+
+        header = json.dumps({'name': name, 'dtype': dtype_str, 'shape': row_shape, 'rows': array.shape[0]}).encode()
+        self.write_bytes(SEGMENT_HEADER_STRUCT.pack(SEGMENT_MAGIC, len(header)))
+        self.write_bytes(header)
+        self.write_padding()
+
+        array_index['segments'].append([self.position, array.shape[0]])
+        self.write_bytes(memoryview(array.reshape(-1).view(np.uint8)))
+
+    def flush(self, fsync=False):
+        """
+        Flush the written data to the operating system, and optionally to the disk
+
+        Args:
+            fsync (bool, optional): If True, also sync the file to the disk. Defaults to False.
+        """
+        self.file.flush()
+        if fsync:
+            os.fsync(self.file.fileno())
+
+    def finalize(self):
+        """
+        Write the footer index and close the file
+        """
+        if self.finalized:
+            return
+
+        footer = json.dumps({'metadata': self.metadata, 'arrays': self.arrays_index}).encode()
+        self.write_bytes(footer)
+        self.write_bytes(TRAILER_STRUCT.pack(len(footer), FOOTER_MAGIC))
+        self.flush(fsync=True)
+        self.file.close()
+
+        self.finalized = True
+
+
+def read_footer(file_path):
+    """
+    Read the footer index of an array file
+
+    Args:
+        file_path (str): The path to the array file
+
+    Returns:
+        dict: The footer, with the metadata and the index of the arrays
+    """
+    with open(file_path, 'rb') as f:
+        if f.read(len(FILE_MAGIC)) != FILE_MAGIC:
+            raise ValueError(f"{file_path} is not an array file")
+
+        f.seek(-TRAILER_STRUCT.size, 2)
+        footer_length, footer_magic = TRAILER_STRUCT.unpack(f.read(TRAILER_STRUCT.size))
+        if footer_magic != FOOTER_MAGIC:
+            raise ValueError(f"{file_path} has no footer, the file was not finalized")
+
+        f.seek(-TRAILER_STRUCT.size - footer_length, 2)
+        return json.loads(f.read(footer_length))
+
+
+def scan_segments(file_path):
+    """
+    Scan through the segments of an array file without using the footer, used to recover files that were never
+    finalized. A segment cut short at the end of the file is left out.
+
+    Args:
+        file_path (str): The path to the array file
+
+    Returns:
+        list: The segments in the order they were written, as dictionaries with the name, dtype, shape, rows, offset of
+              the data and end position of the segment
+    """
+    segments = []
+    file_size = os.path.getsize(file_path)
+
+    with open(file_path, 'rb') as f:
+        if f.read(len(FILE_MAGIC)) != FILE_MAGIC:
+            raise ValueError(f"{file_path} is not an array file")
+        position = len(FILE_MAGIC) + padding_for(len(FILE_MAGIC))
+
+        while position + SEGMENT_HEADER_STRUCT.size <= file_size:
+            f.seek(position)
+            segment_magic, header_length = SEGMENT_HEADER_STRUCT.unpack(f.read(SEGMENT_HEADER_STRUCT.size))
+            if segment_magic != SEGMENT_MAGIC:
+                break
+
+            try:
+                header = json.loads(f.read(header_length))
+            except ValueError:
+                break
+
+            offset = position + SEGMENT_HEADER_STRUCT.size + header_length
+            offset += padding_for(offset)
+            num_bytes = header['rows'] * int(np.prod(header['shape'], dtype=np.int64)) * np.dtype(header['dtype']).itemsize
+            if offset + num_bytes > file_size:
+                break
+
+            header['offset'] = offset
+            header['end'] = offset + num_bytes
+            segments.append(header)
+            position = header['end']
+
+    return segments
+
+
+def index_segments(segments):
+    """
+    Build the footer index of the arrays from a list of segments
+
+    Args:
+        segments (list): The segments, as returned by scan_segments
+
+    Returns:
+        dict: The index of the arrays, as used in the footer
+    """
+    arrays_index = {}
+    for segment in segments:
+        if segment['name'] not in arrays_index:
+            arrays_index[segment['name']] = {'dtype': segment['dtype'], 'shape': segment['shape'], 'segments': []}
+        arrays_index[segment['name']]['segments'].append([segment['offset'], segment['rows']])
+    return arrays_index
+
+
+def open_array_file(file_path, names=None):
+    """
+    Open an array file. The arrays are memory mapped views into the file, so opening a file doesn't read the array data.
+    Arrays stored in more than one segment are joined together, which copies them.
+
+    Args:
+        file_path (str): The path to the array file
+        names (list, optional): The names of the arrays to open. Defaults to all the arrays in the file.
+
+    Returns:
+        tuple: A dictionary of the arrays by name, and the metadata stored in the file
+    """
+    footer = read_footer(file_path)
+
+    file_map = np.memmap(file_path, dtype=np.uint8, mode='r')
+
+    arrays = {}
+    for name, array_index in footer['arrays'].items():
+        if names is not None and name not in names:
+            continue
+
+        dtype = np.dtype(array_index['dtype'])
+        row_shape = tuple(array_index['shape'])
+        row_size = int(np.prod(row_shape, dtype=np.int64))
+
+        segments = []
+        for offset, rows in array_index['segments']:
+            segment = np.frombuffer(file_map, dtype=dtype, count=rows * row_size, offset=offset)
+            segments.append(segment.reshape((rows,) + row_shape))
+
+        if len(segments) == 0:
+            arrays[name] = np.zeros((0,) + row_shape, dtype=dtype)
+        elif len(segments) == 1:
+            arrays[name] = segments[0]
+        else:
+            arrays[name] = np.concatenate(segments)
+
+    return arrays, footer['metadata']
@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
-from cv_bridge import CvBridge, CvBridgeError
-
 from pf_orchard_localization.recorded_data_loaders import BaseDataLoader
+from pf_orchard_localization.recorded_data_loaders.image_msg_decoding import decode_image_msg
 
 from pathlib import Path
 from rosbags.highlevel import AnyReader
@@ -14,19 +13,21 @@ class BagDataLoader(BaseDataLoader):
     specific time stamp in the data.
     """
     
-    def __init__(self, file_path, depth_topic, rgb_topic, odom_topic):
+    def __init__(self, file_path, depth_topic, rgb_topic, odom_topic, time_window=None):
         """
         Args:
             file_path (str): The path to the rosbag file
             depth_topic (str): The topic name for the depth image messages
             rgb_topic (str): The topic name for the rgb image messages
             odom_topic (str): The topic name for the odometry messages
+            time_window (tuple, optional): The start and end time of the data to load, relative to the first message in
+                                           the bag. The window is extended if the playback goes past the end of it.
+                                           Defaults to None, which loads the whole bag.
         """
 
         super().__init__()
        
         self.rosbag_import()
-        self.bridge = CvBridge()
         self.depth_topic = depth_topic
         self.rgb_topic = rgb_topic
         self.odom_topic = odom_topic
@@ -35,14 +36,20 @@ class BagDataLoader(BaseDataLoader):
         self.color_msg = None
         self.t_start = None
 
-        self.open_file(file_path)
+        self.open_file(file_path, time_window)
     
     def rosbag_import(self):
         """
-        Import the rosbag module, separate from the rest of the code to allow for running the code without the rosbag module
+        Import the rosbag and cv_bridge modules, separate from the rest of the code to allow for running the code without
+        ROS 1
         """
+        import genpy
         import rosbag
+        from cv_bridge import CvBridge, CvBridgeError
+        self.genpy = genpy
         self.rosbag = rosbag
+        self.bridge = CvBridge()
+        self.cv_bridge_error = CvBridgeError
 
     @staticmethod
     def bag_timestamp_to_sec(time):
@@ -83,29 +90,73 @@ class BagDataLoader(BaseDataLoader):
                 time_stamp_img = self.header_timestamp_to_sec(d_msg.header.stamp)
 
                 return depth_image, color_img, time_stamp_img
-            except CvBridgeError as e:
+            except self.cv_bridge_error as e:
                 print(e)
 
         return None, None, None
 
-    def open_file(self, file_path):
+    @property
+    def topics(self):
+        """
+        Returns the topics loaded from the bag
+        """
+        return [self.rgb_topic, self.depth_topic, self.odom_topic]
+
+    def open_file(self, file_path, time_window=None):
         """
-        Open the rosbag file and load the data
+        Open the rosbag file and load the data in the time window
 
         Args:
             file_path (str): The path to the rosbag file
+            time_window (tuple, optional): The start and end time of the data to load. Defaults to None.
         """
 
         self.current_data_file_path = file_path
 
-        bag_data = self.rosbag.Bag(file_path)
+        self.bag_data = self.rosbag.Bag(file_path)
 
         self.depth_msg = None
         self.color_msg = None
 
+        # The time stamps are relative to the first message on the topics, even if the time window starts later
         self.t_start = None
-        for topic, msg, t in bag_data.read_messages(topics=[self.rgb_topic, self.depth_topic, self.odom_topic]):
-            self.handle_message(topic, msg, t)
+        for _, _, t in self.bag_data.read_messages(topics=self.topics):
+            self.t_start = self.bag_timestamp_to_sec(t)
+            break
+        self.t_end = self.bag_data.get_end_time()
+
+        self.open_time_window(time_window)
+
+    def load_time_window(self, start_time, end_time):
+        """
+        Load the messages from start_time up to end_time, after the messages already loaded
+
+        Args:
+            start_time (float): The start of the time window, relative to the first message in the bag
+            end_time (float): The end of the time window, or None for the end of the bag
+
+        Returns:
+            float: The end of the loaded time window, or None if there are no messages in the bag after it
+        """
+        self.time_stamps = list(self.time_stamps)
+
+        if self.t_start is not None:
+            window_start = self.genpy.Time.from_sec(self.t_start + start_time)
+            window_end = None if end_time is None else self.genpy.Time.from_sec(self.t_start + end_time)
+
+            for topic, msg, t in self.bag_data.read_messages(topics=self.topics, start_time=window_start,
+                                                             end_time=window_end):
+                # The end time of read_messages is inclusive
+                if window_end is not None and t >= window_end:
+                    break
+                self.handle_message(topic, msg, t)
+
+        self.build_index()
+
+        if self.t_start is None or end_time is None or self.t_start + end_time > self.t_end:
+            self.bag_data.close()
+            return None
+        return end_time
 
 
     def handle_message(self, topic, msg, t):
@@ -141,7 +192,7 @@ class BagDataLoader(BaseDataLoader):
 
         elif topic == self.odom_topic:
             self.time_stamps.append(self.bag_timestamp_to_sec(t) - self.t_start)
-            msg = {'topic': 'odom', 'data': msg}
+            msg = {'topic': 'odom', 'data': msg, 'timestamp': self.header_timestamp_to_sec(msg.header.stamp)}
             self.msg_list.append(msg)
             self.msg_order.append(0)
 
@@ -153,7 +204,7 @@ class Bag2DataLoader(BagDataLoader):
     specific time stamp in the data.
     """
 
-    def __init__(self, file_path, depth_topic, rgb_topic, odom_topic):
+    def __init__(self, file_path, depth_topic, rgb_topic, odom_topic, time_window=None):
         """
         Extend the contructor of the BagDataLoader class to handle ros2 bag files
 
@@ -162,13 +213,39 @@ class Bag2DataLoader(BagDataLoader):
             depth_topic (str): The topic name for the depth image messages
             rgb_topic (str): The topic name for the rgb image messages
             odom_topic (str): The topic name for the odometry messages
+            time_window (tuple, optional): The start and end time of the data to load, relative to the first message in
+                                           the bag. Defaults to None, which loads the whole bag.
         """
         self.typestore = get_typestore(Stores.ROS2_HUMBLE)
 
-        super().__init__(file_path, depth_topic, rgb_topic, odom_topic)
+        super().__init__(file_path, depth_topic, rgb_topic, odom_topic, time_window)
         
     def rosbag_import(self):
         pass
+
+    def pair_messages(self, d_msg, img_msg):
+        """
+        Override the pair_messages method to decode the images without cv_bridge. The raw images are views into the
+        serialized messages rather than copies, and compressed image topics are decoded.
+
+        Args:
+            d_msg (sensor_msgs.msg.Image or sensor_msgs.msg.CompressedImage): The depth image message
+            img_msg (sensor_msgs.msg.Image or sensor_msgs.msg.CompressedImage): The image message
+
+        Returns:
+            tuple: The depth image, color image, and timestamp
+        """
+        if d_msg is not None and img_msg is not None and d_msg.header.stamp == img_msg.header.stamp:
+            try:
+                depth_image = decode_image_msg(d_msg, "passthrough")
+                color_img = decode_image_msg(img_msg, "bgr8")
+                time_stamp_img = self.header_timestamp_to_sec(d_msg.header.stamp)
+
+                return depth_image, color_img, time_stamp_img
+            except ValueError as e:
+                print(e)
+
+        return None, None, None
         
     @staticmethod
     def bag_timestamp_to_sec(time):
@@ -190,27 +267,65 @@ class Bag2DataLoader(BagDataLoader):
         """
         return time.sec + time.nanosec * 1e-9
 
-    def open_file(self, file_path):
+    def open_file(self, file_path, time_window=None):
         """
         Override the open_file method to handle ros2 bag files
 
         Args:
             file_path: The path to the rosbag file
+            time_window (tuple, optional): The start and end time of the data to load. Defaults to None.
         """
         self.current_data_file_path = file_path
-        bagpath = Path(file_path)
 
         self.depth_msg = None
         self.color_msg = None
         self.t_start = None
 
-        with AnyReader([bagpath], default_typestore=self.typestore) as reader:
-            topics = [self.rgb_topic, self.depth_topic, self.odom_topic]
-            connections = [x for x in reader.connections if x.topic in topics]
-            for connection, t, rawdata in reader.messages(connections=connections):
-                msg = reader.deserialize(rawdata, connection.msgtype)
-                topic = connection.topic
-                self.handle_message(topic, msg, t)
+        # The time stamps are relative to the first message on the topics, even if the time window starts later, so
+        # find it first. Kept in nanoseconds so the window bounds are exact.
+        self.t_start_ns = None
+        with AnyReader([Path(file_path)], default_typestore=self.typestore) as reader:
+            connections = [x for x in reader.connections if x.topic in self.topics]
+            for _, t, _ in reader.messages(connections=connections):
+                self.t_start_ns = t
+                self.t_start = self.bag_timestamp_to_sec(t)
+                break
+            self.t_end_ns = reader.end_time
+
+        self.open_time_window(time_window)
+
+    def load_time_window(self, start_time, end_time):
+        """
+        Override the load_time_window method to read only the messages in the time window from the ros2 bag
+
+        Args:
+            start_time (float): The start of the time window, relative to the first message in the bag
+            end_time (float): The end of the time window, or None for the end of the bag
+
+        Returns:
+            float: The end of the loaded time window, or None if there are no messages in the bag after it
+        """
+        self.time_stamps = list(self.time_stamps)
+
+        window_end_ns = None
+        if self.t_start_ns is not None:
+            window_start_ns = self.t_start_ns + int(round(start_time * 1e9))
+            if end_time is not None:
+                window_end_ns = self.t_start_ns + int(round(end_time * 1e9))
+
+            with AnyReader([Path(self.current_data_file_path)], default_typestore=self.typestore) as reader:
+                connections = [x for x in reader.connections if x.topic in self.topics]
+                for connection, t, rawdata in reader.messages(connections=connections, start=window_start_ns,
+                                                              stop=window_end_ns):
+                    msg = reader.deserialize(rawdata, connection.msgtype)
+                    topic = connection.topic
+                    self.handle_message(topic, msg, t)
+
+        self.build_index()
+
+        if window_end_ns is None or window_end_ns > self.t_end_ns:
+            return None
+        return end_time
 
 if __name__ == '__main__':
     bag_path = "/media/jostan/portabits/pcl_mod_ros2/envy-trunks-02_6_converted_synced_pcl-mod"
@@ -1,13 +1,29 @@
 #!/usr/bin/env python3
-import bisect
+import numpy as np
 
 class BaseDataLoader:
     """
     Base class for data loaders. The data loader is responsible for loading the data from the recorded data files and
     providing the data to the rest of the system. The data loader should be able to provide the data in the order it was
     recorded, and be able to skip to a specific time stamp in the data.
+
+    While a file is being opened the subclasses append to the time_stamps, msg_list and msg_order lists, then call
+    build_index() which packs them into numpy arrays. The arrays hold the message type of each message, a prefix count of
+    the image messages and the positions of the image messages, so that position queries are O(1) and image seeks are
+    O(log n) no matter how long the data file is.
+
+    Subclasses can also load only a time window of the data file, through load_time_window(). The window is extended
+    automatically when the playback or a seek goes past the end of it, so a test that starts at some time in a long data
+    file only loads the part of the file it plays through.
     """
 
+    # Values used in msg_order/msg_types to mark the type of each message
+    ODOM_MSG = 0
+    IMG_MSG = 1
+
+    # How much further the time window is extended each time the playback reaches the end of it, in seconds
+    TIME_WINDOW_EXTENSION = 30.0
+
     def __init__(self):
 
         self.time_stamps = []
@@ -21,26 +37,151 @@ class BaseDataLoader:
         self.reached_end_of_data = False
         self.reached_start_of_data = True
 
+        # The end of the loaded time window, relative to the start of the data file, None once the rest of the file is
+        # loaded
+        self.time_window_end = None
+
+        self.init_index()
+
+    def init_index(self):
+        """
+        Initialize the message index arrays to be empty
+        """
+        self.msg_types = np.zeros(0, dtype=np.int8)
+        self.img_prefix_counts = np.zeros(1, dtype=np.int64)
+        self.img_msg_positions = np.zeros(0, dtype=np.int64)
+
+    def build_index(self):
+        """
+        Build the index arrays from the lists filled in while opening the data file. Should be called by the subclasses
+        once they are done adding messages.
+        """
+        self.set_index_arrays(np.asarray(self.time_stamps, dtype=np.float64),
+                              np.asarray(self.msg_order, dtype=np.int8))
+
+    def set_index_arrays(self, time_stamps, msg_types):
+        """
+        Set the time stamps and message types of the data and build the rest of the index from them
+
+        Args:
+            time_stamps (np.ndarray): The time stamp of each message, relative to the start of the data file
+            msg_types (np.ndarray): The type of each message, ODOM_MSG or IMG_MSG
+        """
+        self.time_stamps = time_stamps
+        self.msg_types = msg_types
+
+        # img_prefix_counts[i] is the number of image messages before message i
+        self.img_prefix_counts = np.zeros(len(self.msg_types) + 1, dtype=np.int64)
+        np.cumsum(self.msg_types, out=self.img_prefix_counts[1:])
+
+        self.img_msg_positions = np.flatnonzero(self.msg_types == self.IMG_MSG)
+
+    def load_time_window(self, start_time, end_time):
+        """
+        Load the messages with time stamps from start_time up to end_time, after the messages already loaded, and update
+        the index. Only needed by the subclasses that support time windows.
+
+        Args:
+            start_time (float): The start of the time window, relative to the start of the data file
+            end_time (float): The end of the time window, relative to the start of the data file, or None for the end of
+                              the data file
+
+        Returns:
+            float: The end of the loaded time window, or None if there are no messages in the data file after it
+        """
+        raise NotImplementedError("This data loader doesn't support time windows")
+
+    def open_time_window(self, time_window):
+        """
+        Load the first time window of the data file, should be called by the subclasses that support time windows once the
+        data file is open
+
+        Args:
+            time_window (tuple): The start and end time of the window to load, relative to the start of the data file, or
+                                 None to load the whole data file
+        """
+        if time_window is None:
+            time_window = (0.0, None)
+        self.time_window_end = self.load_time_window(*time_window)
+
+    def extend_time_window(self, end_time=None):
+        """
+        Load more of the data file after the end of the loaded time window
+
+        Args:
+            end_time (float, optional): The time to load the data file up to. Defaults to TIME_WINDOW_EXTENSION seconds
+                                        after the end of the loaded time window.
+
+        Returns:
+            bool: True if any more of the data file was loaded, False if the whole data file was already loaded
+        """
+        if self.time_window_end is None:
+            return False
+
+        if end_time is None or end_time <= self.time_window_end:
+            end_time = self.time_window_end + self.TIME_WINDOW_EXTENSION
+
+        self.time_window_end = self.load_time_window(self.time_window_end, end_time)
+        return True
+
+    def load_past_position(self, data_pos):
+        """
+        Extend the time window until there is a message at a position in the data, or the whole data file is loaded
+
+        Args:
+            data_pos (int): The position of the message in the data
+
+        Returns:
+            bool: True if there is a message at the position
+        """
+        while data_pos >= self.num_msgs:
+            if not self.extend_time_window():
+                return False
+        return True
+
+    def load_past_img_number(self, img_number):
+        """
+        Extend the time window until there is an image message with a position relative to the other image messages, or
+        the whole data file is loaded
+
+        Args:
+            img_number (int): The position of the image message relative to the other image messages
+
+        Returns:
+            bool: True if there is an image message with the position
+        """
+        while img_number >= self.num_img_msgs:
+            if not self.extend_time_window():
+                return False
+        return True
+
+    @property
+    def num_msgs(self):
+        """
+        Returns the total number of messages in the data
+        """
+        return len(self.msg_types)
+
     @property
     def num_odom_msgs(self):
         """
         Returns the number of odometry messages in the data
         """
-        return len(self.msg_list) - sum(self.msg_order)
+        return self.num_msgs - self.num_img_msgs
 
     @property
     def num_img_msgs(self):
         """
         Returns the number of image messages in the data
         """
-        return sum(self.msg_order)
+        return len(self.img_msg_positions)
 
     @property
     def at_end_of_data(self):
         """
         Returns True if the data loader is at the last message in the data
         """
-        return self.cur_data_pos >= len(self.msg_list)
+        return self.cur_data_pos >= self.num_msgs
 
     @property
     def at_start_of_data(self):
@@ -54,14 +195,14 @@ class BaseDataLoader:
         """
         Returns True if the current message is an image message
         """
-        return self.current_msg['topic'] == 'image'
+        return self.msg_types[self.cur_data_pos] == self.IMG_MSG
 
     @property
     def at_odom_msg(self):
         """
         Returns True if the current message is an odometry message
         """
-        return self.current_msg['topic'] == 'odom'
+        return self.msg_types[self.cur_data_pos] == self.ODOM_MSG
 
     @property
     def current_data_file_time_stamp(self):
@@ -75,21 +216,21 @@ class BaseDataLoader:
         """
         Returns the position of the current image message relative to the other image messages
         """
-        return self.msg_order[:self.cur_data_pos].count(1)
+        return int(self.img_prefix_counts[self.cur_data_pos])
 
     @property
     def current_odom_position(self):
         """
         Returns the position of the current odometry message relative to the other odometry messages
         """
-        return self.msg_order[:self.cur_data_pos].count(0)
+        return self.cur_data_pos - self.current_img_position
 
     @property
     def current_msg(self):
         """
         Returns the current message
         """
-        return self.msg_list[self.cur_data_pos]
+        return self.get_msg(self.cur_data_pos)
 
     @property
     def current_data_file_name(self):
@@ -98,6 +239,19 @@ class BaseDataLoader:
         """
         return self.current_data_file_path.split('/')[-1]
 
+    def get_msg(self, data_pos):
+        """
+        Get the message at a position in the data. Subclasses that don't keep a list of messages can override this to
+        create the message when it is requested.
+
+        Args:
+            data_pos (int): The position of the message in the data
+
+        Returns:
+            dict: The message
+        """
+        return self.msg_list[data_pos]
+
     def close(self):
         """
         Close a data file
@@ -113,16 +267,20 @@ class BaseDataLoader:
         self.reached_end_of_data = False
         self.reached_start_of_data = True
 
+        self.time_window_end = None
+
+        self.init_index()
+
     def get_next_msg(self):
         """
         Get the next message in the data
-        
+
         Returns:
             The next message in the data
         """
         self.cur_data_pos += 1
-        if self.at_end_of_data:
-            self.cur_data_pos = len(self.msg_list) - 1
+        if not self.load_past_position(self.cur_data_pos):
+            self.cur_data_pos = self.num_msgs - 1
             self.reached_end_of_data = True
             return None
         else:
@@ -136,18 +294,17 @@ class BaseDataLoader:
         Returns:
             The next image message in the data
         """
-        self.cur_data_pos += 1
+        # Index of the first image message after the current position
+        next_img_idx = np.searchsorted(self.img_msg_positions, self.cur_data_pos, side='right')
+
+        if not self.load_past_img_number(next_img_idx):
+            self.reached_end_of_data = True
+            self.cur_data_pos = self.num_msgs - 1
+            return None
 
-        while True:
-            if self.at_end_of_data:
-                self.reached_end_of_data = True
-                self.cur_data_pos = len(self.msg_list) - 1
-                return None
-            if self.at_img_msg:
-                self.reached_start_of_data = False
-                return self.current_msg
-            else:
-                self.cur_data_pos += 1
+        self.cur_data_pos = int(self.img_msg_positions[next_img_idx])
+        self.reached_start_of_data = False
+        return self.current_msg
 
     def get_prev_img_msg(self):
         """
@@ -156,18 +313,38 @@ class BaseDataLoader:
         Returns:
             The previous image message in the data
         """
-        self.cur_data_pos -= 1
+        # Index of the last image message before the current position
+        prev_img_idx = np.searchsorted(self.img_msg_positions, self.cur_data_pos, side='left') - 1
 
-        while True:
-            if self.at_start_of_data:
-                self.reached_start_of_data = True
-                self.cur_data_pos = 0
-                return None
-            if self.at_img_msg:
-                self.reached_end_of_data = False
-                return self.current_msg
-            else:
-                self.cur_data_pos -= 1
+        # The first message in the data counts as the start of the data, even if it is an image
+        if prev_img_idx < 0 or self.img_msg_positions[prev_img_idx] <= 0:
+            self.reached_start_of_data = True
+            self.cur_data_pos = 0
+            return None
+
+        self.cur_data_pos = int(self.img_msg_positions[prev_img_idx])
+        self.reached_end_of_data = False
+        return self.current_msg
+
+    def set_img_number(self, img_number):
+        """
+        Set the current position in the data to a specific image message
+
+        Args:
+            img_number (int): The position of the image message relative to the other image messages, matching
+                              current_img_position
+
+        Returns:
+            tuple: A message indicating if the image number was set successfully, and the image message
+        """
+        if img_number < 0 or not self.load_past_img_number(img_number):
+            return "Image number must be between 0 and " + str(self.num_img_msgs - 1), None
+
+        self.cur_data_pos = int(self.img_msg_positions[img_number])
+
+        self.reached_start_of_data = False
+        self.reached_end_of_data = False
+        return "Image number set", self.current_msg
 
     def set_time_stamp(self, time_stamp):
         """
@@ -181,8 +358,12 @@ class BaseDataLoader:
         """
         previous_pos = self.cur_data_pos
 
+        # Load the data file past the time stamp if it's after the loaded time window
+        if self.time_window_end is not None and time_stamp >= self.time_window_end:
+            self.extend_time_window(time_stamp + self.TIME_WINDOW_EXTENSION)
+
         # Find the position of the time stamp in the list of time stamps
-        time_stamp_pos = bisect.bisect_left(self.time_stamps, time_stamp)
+        time_stamp_pos = int(np.searchsorted(self.time_stamps, time_stamp, side='left'))
 
         # Check if the position is valid
         if time_stamp_pos >= len(self.time_stamps):
@@ -199,4 +380,3 @@ class BaseDataLoader:
         else:
             self.reached_end_of_data = False
             return "Time stamp set", img_msg
-
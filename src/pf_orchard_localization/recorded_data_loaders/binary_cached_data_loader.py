@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+import json
+import os
+import numpy as np
+from pf_orchard_localization.recorded_data_loaders import BaseDataLoader
+from pf_orchard_localization.recorded_data_loaders.array_file import ArrayFileWriter, open_array_file
+
+BINARY_CACHED_DATA_EXTENSION = ".pfc"
+BINARY_CACHED_DATA_VERSION = 1
+
+# The columns of the binary cached data format. The msg_* columns have one row per message in time order, with msg_rows
+# giving the row of each message in the odom_* or img_* columns. The trunks seen in image i are rows
+# trunk_offsets[i]:trunk_offsets[i + 1] of the trunk_* columns.
+CACHED_DATA_COLUMNS = {
+    'msg_t': np.float64,
+    'msg_types': np.int8,
+    'msg_rows': np.int64,
+    'odom_t': np.float64,
+    'odom_x': np.float64,
+    'odom_theta': np.float64,
+    'img_t': np.float64,
+    'img_has_data': np.uint8,
+    'trunk_offsets': np.int64,
+    'trunk_positions': np.float64,
+    'trunk_widths': np.float64,
+    'trunk_classes': np.int32,
+    'gt_x': np.float64,
+    'gt_y': np.float64,
+    'gt_theta': np.float64,
+}
+
+
+def json_cached_data_to_arrays(loaded_data):
+    """
+    Convert the data from a json cached data file to the columns of the binary cached data format. Like the
+    CachedDataLoader, all the data after the last image with tree data is dropped.
+
+    Args:
+        loaded_data (dict): The loaded json cached data, keyed by the time stamps in milliseconds
+
+    Returns:
+        dict: The columns of the binary cached data format
+    """
+    time_stamps_keys = sorted(loaded_data.keys(), key=int)
+
+    last_img = 0
+    for i, time_stamp_key in enumerate(time_stamps_keys):
+        if loaded_data[time_stamp_key] is not None and 'tree_data' in loaded_data[time_stamp_key]:
+            last_img = i
+    time_stamps_keys = time_stamps_keys[:last_img + 1]
+
+    columns = {name: [] for name in CACHED_DATA_COLUMNS}
+    columns['trunk_offsets'].append(0)
+    num_trunks = 0
+
+    for time_stamp_key in time_stamps_keys:
+        data = loaded_data[time_stamp_key]
+        columns['msg_t'].append(int(time_stamp_key) / 1000.0)
+
+        if data is not None and 'x_odom' in data:
+            columns['msg_types'].append(BaseDataLoader.ODOM_MSG)
+            columns['msg_rows'].append(len(columns['odom_t']))
+            columns['odom_t'].append(data.get('time_stamp', int(time_stamp_key) / 1000.0))
+            columns['odom_x'].append(data['x_odom'])
+            columns['odom_theta'].append(data['theta_odom'])
+            continue
+
+        columns['msg_types'].append(BaseDataLoader.IMG_MSG)
+        columns['msg_rows'].append(len(columns['img_t']))
+        columns['img_t'].append(int(time_stamp_key) / 1000.0)
+
+        if data is None or 'tree_data' not in data:
+            columns['img_has_data'].append(0)
+            columns['trunk_offsets'].append(num_trunks)
+            for name in ('gt_x', 'gt_y', 'gt_theta'):
+                columns[name].append(np.nan)
+            continue
+
+        tree_data = data['tree_data']
+        columns['img_has_data'].append(1)
+        columns['trunk_positions'].extend(tree_data['positions'])
+        columns['trunk_widths'].extend(tree_data['widths'])
+        columns['trunk_classes'].extend(tree_data['classes'])
+        num_trunks += len(tree_data['widths'])
+        columns['trunk_offsets'].append(num_trunks)
+
+        location_estimate = data.get('location_estimate')
+        if location_estimate is None:
+            location_estimate = {'x': np.nan, 'y': np.nan, 'theta': np.nan}
+        columns['gt_x'].append(location_estimate['x'])
+        columns['gt_y'].append(location_estimate['y'])
+        columns['gt_theta'].append(location_estimate['theta'])
+
+    arrays = {name: np.array(columns[name], dtype=dtype) for name, dtype in CACHED_DATA_COLUMNS.items()}
+    arrays['trunk_positions'] = arrays['trunk_positions'].reshape(-1, 2)
+
+    return arrays
+
+
+def write_binary_cached_data(file_path, arrays, metadata=None):
+    """
+    Write the columns of the binary cached data format to a file
+
+    Args:
+        file_path (str): The path to write the file to
+        arrays (dict): The columns of the binary cached data format
+        metadata (dict, optional): Extra metadata to store in the file. Defaults to None.
+    """
+    file_metadata = {'format': 'pf_cached_data', 'version': BINARY_CACHED_DATA_VERSION}
+    if metadata is not None:
+        file_metadata.update(metadata)
+
+    writer = ArrayFileWriter(file_path, metadata=file_metadata)
+    for name, dtype in CACHED_DATA_COLUMNS.items():
+        writer.append(name, np.asarray(arrays[name], dtype=dtype))
+    writer.finalize()
+
+
+def convert_json_cached_data(json_file_path, output_file_path=None):
+    """
+    Convert a json cached data file to the binary cached data format
+
+    Args:
+        json_file_path (str): The path to the json cached data file
+        output_file_path (str, optional): The path to write the binary file to. Defaults to the json file path with the
+                                          binary cached data extension.
+
+    Returns:
+        str: The path to the binary cached data file
+    """
+    if output_file_path is None:
+        output_file_path = os.path.splitext(json_file_path)[0] + BINARY_CACHED_DATA_EXTENSION
+
+    with open(json_file_path) as f:
+        loaded_data = json.load(f)
+
+    arrays = json_cached_data_to_arrays(loaded_data)
+    write_binary_cached_data(output_file_path, arrays, metadata={'source': os.path.basename(json_file_path)})
+
+    return output_file_path
+
+
+def select_data_files(data_file_names):
+    """
+    Keep one data file of each run, since converting a json cached data file leaves the binary file next to it. The
+    binary file is kept when a run has both, other names are kept as they are.
+
+    Args:
+        data_file_names (list): The names of the data files
+
+    Returns:
+        list: The names of the data files to use, in the same order
+    """
+    binary_stems = {os.path.splitext(data_file_name)[0] for data_file_name in data_file_names
+                    if data_file_name.endswith(BINARY_CACHED_DATA_EXTENSION)}
+    return [data_file_name for data_file_name in data_file_names
+            if not (data_file_name.endswith(".json") and os.path.splitext(data_file_name)[0] in binary_stems)]
+
+
+class BinaryCachedDataLoader(BaseDataLoader):
+    """
+    Data loader for binary cached data files. The columns of the file are memory mapped and the messages are only created
+    when they are requested, so opening a file doesn't depend on the number of messages in it. Provides the same messages
+    as the CachedDataLoader, except the tree data is given as numpy arrays instead of lists. With a time window only the
+    messages in the window are indexed.
+    """
+
+    def __init__(self, file_path, time_window=None):
+        """
+        Args:
+            file_path (str): The path to the binary cached data file
+            time_window (tuple, optional): The start and end time of the data to load, relative to the start of the data
+                                           file. The window is extended if the playback goes past the end of it. Defaults
+                                           to None, which loads the whole data file.
+        """
+        super().__init__()
+
+        self.open_file(file_path, time_window)
+
+    @classmethod
+    def from_arrays(cls, arrays, file_path, time_window=None):
+        """
+        Create a data loader from columns of the binary cached data format that are already loaded
+
+        Args:
+            arrays (dict): The columns of the binary cached data format
+            file_path (str): The path of the data file the columns came from
+            time_window (tuple, optional): The start and end time of the data to load. Defaults to None.
+
+        Returns:
+            BinaryCachedDataLoader: The data loader
+        """
+        data_loader = cls.__new__(cls)
+        BaseDataLoader.__init__(data_loader)
+        data_loader.set_arrays(arrays, file_path, time_window)
+        return data_loader
+
+    def open_file(self, file_path, time_window=None):
+        """
+        Open the binary cached data file
+
+        Args:
+            file_path (str): The path to the binary cached data file
+            time_window (tuple, optional): The start and end time of the data to load. Defaults to None.
+        """
+        arrays, metadata = open_array_file(file_path)
+
+        if metadata.get('format') != 'pf_cached_data':
+            raise ValueError(f"{file_path} is not a cached data file")
+
+        self.set_arrays(arrays, file_path, time_window)
+
+    def set_arrays(self, arrays, file_path, time_window=None):
+        """
+        Set the columns the data loader provides the messages from
+
+        Args:
+            arrays (dict): The columns of the binary cached data format
+            file_path (str): The path of the data file the columns came from
+            time_window (tuple, optional): The start and end time of the data to load. Defaults to None.
+        """
+        self.current_data_file_path = file_path
+        self.arrays = arrays
+
+        msg_t = arrays['msg_t']
+        msg_types = arrays['msg_types']
+        msg_rows = arrays['msg_rows']
+
+        # Data written as it was recorded may be slightly out of order
+        if len(msg_t) > 1 and np.any(msg_t[1:] < msg_t[:-1]):
+            order = np.argsort(msg_t, kind='stable')
+            msg_t, msg_types, msg_rows = msg_t[order], msg_types[order], msg_rows[order]
+
+        # Drop the data after the last image with tree data
+        img_msgs_with_data = np.flatnonzero(msg_types == self.IMG_MSG)
+        img_msgs_with_data = img_msgs_with_data[arrays['img_has_data'][msg_rows[img_msgs_with_data]] != 0]
+        if len(img_msgs_with_data) > 0:
+            num_msgs = img_msgs_with_data[-1] + 1
+        else:
+            num_msgs = min(1, len(msg_t))
+
+        self.file_msg_t = msg_t[:num_msgs]
+        self.file_msg_types = msg_types[:num_msgs]
+        self.file_msg_rows = msg_rows[:num_msgs]
+
+        t_start = self.file_msg_t[0] if num_msgs > 0 else 0.0
+        self.file_time_stamps = self.file_msg_t - t_start
+
+        self.window_start_pos = 0
+        self.init_index()
+        self.open_time_window(time_window)
+
+    def load_time_window(self, start_time, end_time):
+        """
+        Index the messages from start_time up to end_time, after the messages already indexed
+
+        Args:
+            start_time (float): The start of the time window, relative to the start of the data file
+            end_time (float): The end of the time window, or None for the end of the data file
+
+        Returns:
+            float: The end of the loaded time window, or None if there are no messages in the data file after it
+        """
+        if self.num_msgs == 0:
+            self.window_start_pos = int(np.searchsorted(self.file_time_stamps, start_time, side='left'))
+
+        if end_time is None:
+            window_end_pos = len(self.file_time_stamps)
+        else:
+            window_end_pos = int(np.searchsorted(self.file_time_stamps, end_time, side='left'))
+
+        window = slice(self.window_start_pos, window_end_pos)
+        self.msg_t = self.file_msg_t[window]
+        self.msg_rows = self.file_msg_rows[window]
+        self.set_index_arrays(self.file_time_stamps[window], self.file_msg_types[window])
+
+        if window_end_pos >= len(self.file_time_stamps):
+            return None
+        return end_time
+
+    def get_msg(self, data_pos):
+        """
+        Create the message at a position in the data
+
+        Args:
+            data_pos (int): The position of the message in the data
+
+        Returns:
+            dict: The message
+        """
+        row = int(self.msg_rows[data_pos])
+        time_stamp = float(self.msg_t[data_pos])
+
+        if self.msg_types[data_pos] == self.ODOM_MSG:
+            data = {'x_odom': float(self.arrays['odom_x'][row]),
+                    'theta_odom': float(self.arrays['odom_theta'][row]),
+                    'time_stamp': float(self.arrays['odom_t'][row])}
+            return {'topic': 'odom', 'data': data, 'timestamp': time_stamp}
+
+        if not self.arrays['img_has_data'][row]:
+            return {'topic': 'image', 'data': None, 'timestamp': time_stamp}
+
+        trunk_start = self.arrays['trunk_offsets'][row]
+        trunk_end = self.arrays['trunk_offsets'][row + 1]
+
+        tree_data = {'positions': self.arrays['trunk_positions'][trunk_start:trunk_end],
+                     'widths': self.arrays['trunk_widths'][trunk_start:trunk_end],
+                     'classes': self.arrays['trunk_classes'][trunk_start:trunk_end]}
+        location_estimate = {'x': float(self.arrays['gt_x'][row]),
+                             'y': float(self.arrays['gt_y'][row]),
+                             'theta': float(self.arrays['gt_theta'][row])}
+
+        return {'topic': 'image', 'data': {'tree_data': tree_data, 'location_estimate': location_estimate},
+                'timestamp': time_stamp}
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import json
+import numpy as np
 from pf_orchard_localization.recorded_data_loaders import BaseDataLoader
 
 class CachedDataLoader(BaseDataLoader):
@@ -9,59 +10,97 @@ class CachedDataLoader(BaseDataLoader):
     specific time stamp in the data.
     """
 
-    def __init__(self, file_path):
+    def __init__(self, file_path, time_window=None):
         """
         Args:
             file_path (str): The path to the cached data file
+            time_window (tuple, optional): The start and end time of the data to load, relative to the start of the data
+                                           file. The window is extended if the playback goes past the end of it. Defaults
+                                           to None, which loads the whole data file.
         """
         super().__init__()
         # self.time_stamps_keys = []
 
-        self.open_file(file_path)
+        self.open_file(file_path, time_window)
 
-    def open_file(self, file_path):
+    def open_file(self, file_path, time_window=None):
         """
-        Open the cached data file and load the data into the data loader
+        Open the cached data file and load the data in the time window into the data loader
 
         Args:
             file_path (str): The path to the cached data file
+            time_window (tuple, optional): The start and end time of the data to load. Defaults to None.
         """
         self.current_data_file_path = file_path
 
-        t_start = None
-
-        loaded_data = json.load(open(file_path))
+        self.loaded_data = json.load(open(file_path))
         # get all the time stamps from the data, which are the keys
-        time_stamps_keys = list(loaded_data.keys())
+        time_stamps_keys = list(self.loaded_data.keys())
         time_stamps_keys.sort()
 
         # Find the last None value in loaded_data and remove it, all data after it, and all odom data between it and
         # the previous image
         last_img = 0
         for i, time_stamp_key in enumerate(time_stamps_keys):
-            if loaded_data[time_stamp_key] is None:
+            if self.loaded_data[time_stamp_key] is None:
                 continue
-            data_keys = list(loaded_data[time_stamp_key].keys())
+            data_keys = list(self.loaded_data[time_stamp_key].keys())
             if 'tree_data' in data_keys:
                 last_img = i
 
-        for i, time_stamp_key in enumerate(time_stamps_keys):
-            if i > last_img:
-                break
-            if t_start is None:
-                t_start = float(time_stamp_key)/1000.0
-            self.time_stamps.append(float(time_stamp_key)/1000.0 - t_start)
-            if loaded_data[time_stamp_key] is None:
+        self.time_stamps_keys = time_stamps_keys[:last_img + 1]
+
+        file_time_stamps = np.array([float(time_stamp_key)/1000.0 for time_stamp_key in self.time_stamps_keys])
+        t_start = file_time_stamps[0] if len(file_time_stamps) > 0 else 0.0
+        self.file_time_stamps = file_time_stamps - t_start
+
+        self.window_end_pos = 0
+        self.open_time_window(time_window)
+
+    def load_time_window(self, start_time, end_time):
+        """
+        Load the messages from start_time up to end_time, after the messages already loaded
+
+        Args:
+            start_time (float): The start of the time window, relative to the start of the data file
+            end_time (float): The end of the time window, or None for the end of the data file
+
+        Returns:
+            float: The end of the loaded time window, or None if there are no messages in the data file after it
+        """
+        if self.num_msgs == 0:
+            self.window_end_pos = int(np.searchsorted(self.file_time_stamps, start_time, side='left'))
+
+        if end_time is None:
+            window_end_pos = len(self.file_time_stamps)
+        else:
+            window_end_pos = int(np.searchsorted(self.file_time_stamps, end_time, side='left'))
+
+        self.time_stamps = list(self.time_stamps)
+
+        for i in range(self.window_end_pos, window_end_pos):
+            time_stamp_key = self.time_stamps_keys[i]
+            self.time_stamps.append(self.file_time_stamps[i])
+            if self.loaded_data[time_stamp_key] is None:
                 self.msg_order.append(1)
-                msg = {'topic': 'image', 'data': loaded_data[time_stamp_key], 'timestamp': float(time_stamp_key)/1000.0}
+                msg = {'topic': 'image', 'data': self.loaded_data[time_stamp_key], 'timestamp': float(time_stamp_key)/1000.0}
                 self.msg_list.append(msg)
                 continue
-            data_keys = list(loaded_data[time_stamp_key].keys())
+            data_keys = list(self.loaded_data[time_stamp_key].keys())
             if 'x_odom' in data_keys:
-                msg = {'topic': 'odom', 'data': loaded_data[time_stamp_key], 'timestamp': float(time_stamp_key)/1000.0}
+                msg = {'topic': 'odom', 'data': self.loaded_data[time_stamp_key], 'timestamp': float(time_stamp_key)/1000.0}
                 self.msg_list.append(msg)
                 self.msg_order.append(0)
             else:
                 self.msg_order.append(1)
-                msg = {'topic': 'image', 'data': loaded_data[time_stamp_key], 'timestamp': float(time_stamp_key)/1000.0}
-                self.msg_list.append(msg)
\ No newline at end of file
+                msg = {'topic': 'image', 'data': self.loaded_data[time_stamp_key], 'timestamp': float(time_stamp_key)/1000.0}
+                self.msg_list.append(msg)
+
+        self.window_end_pos = window_end_pos
+        self.build_index()
+
+        if window_end_pos >= len(self.file_time_stamps):
+            # Everything is loaded, so the parsed file isn't needed anymore
+            self.loaded_data = None
+            return None
+        return end_time
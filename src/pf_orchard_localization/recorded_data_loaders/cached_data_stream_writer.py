@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+import time
+import numpy as np
+from pf_orchard_localization.recorded_data_loaders import BaseDataLoader
+from pf_orchard_localization.recorded_data_loaders.array_file import (ArrayFileWriter, scan_segments, index_segments)
+from pf_orchard_localization.recorded_data_loaders.binary_cached_data_loader import (CACHED_DATA_COLUMNS,
+                                                                                     BINARY_CACHED_DATA_VERSION)
+
+# Written as the last segment of every chunk, with the running message, odom, image and trunk counts. A chunk is only
+# complete once this has been written, which is used to recover a file that was never finalized.
+CHUNK_END_COLUMN = 'chunk_ends'
+
+
+class CachedDataStreamWriter:
+    """
+    Writes cached data to a binary cached data file as it's recorded. Records are buffered in memory in chunks, each
+    full chunk is appended to the file and the file is synced to the disk periodically, so the memory used stays the
+    same no matter how long the run is and a crash only loses the last chunk. Finalizing writes the footer index from
+    the index of the chunks kept in memory, without reading the file back.
+    """
+
+    def __init__(self, file_path, chunk_size=500, fsync_interval=5.0, metadata=None):
+        """
+        Args:
+            file_path (str): The path to write the cached data file to
+            chunk_size (int, optional): The number of messages to buffer before writing them to the file. Defaults to 500.
+            fsync_interval (float, optional): The minimum time in seconds between syncs of the file to the disk.
+                                              Defaults to 5.0.
+            metadata (dict, optional): Extra metadata to store in the file. Defaults to None.
+        """
+        self.file_path = file_path
+        self.chunk_size = chunk_size
+        self.fsync_interval = fsync_interval
+
+        file_metadata = {'format': 'pf_cached_data', 'version': BINARY_CACHED_DATA_VERSION}
+        if metadata is not None:
+            file_metadata.update(metadata)
+
+        self.array_file_writer = ArrayFileWriter(file_path, metadata=file_metadata)
+
+        self.num_msgs = 0
+        self.num_odom_msgs = 0
+        self.num_img_msgs = 0
+        self.num_trunks = 0
+
+        self.last_fsync_time = time.time()
+
+        self.reset_buffers()
+
+    @classmethod
+    def recover(cls, file_path, chunk_size=500, fsync_interval=5.0):
+        """
+        Reopen a cached data file that was being streamed when the app stopped, keeping all the complete chunks. The
+        returned writer can keep appending to the file or be finalized.
+
+        Args:
+            file_path (str): The path to the cached data file
+            chunk_size (int, optional): The number of messages to buffer before writing them to the file. Defaults to 500.
+            fsync_interval (float, optional): The minimum time in seconds between syncs of the file to the disk.
+                                              Defaults to 5.0.
+
+        Returns:
+            CachedDataStreamWriter: The writer
+        """
+        segments = scan_segments(file_path)
+
+        # Only keep up to the end of the last complete chunk
+        chunk_end_idxs = [i for i, segment in enumerate(segments) if segment['name'] == CHUNK_END_COLUMN]
+        if chunk_end_idxs:
+            segments = segments[:chunk_end_idxs[-1] + 1]
+            position = segments[-1]['end']
+        else:
+            segments = []
+            position = None
+
+        writer = cls.__new__(cls)
+        writer.file_path = file_path
+        writer.chunk_size = chunk_size
+        writer.fsync_interval = fsync_interval
+
+        metadata = {'format': 'pf_cached_data', 'version': BINARY_CACHED_DATA_VERSION, 'recovered': True}
+        if position is None:
+            writer.array_file_writer = ArrayFileWriter(file_path, metadata=metadata)
+            counts = np.zeros(4, dtype=np.int64)
+        else:
+            writer.array_file_writer = ArrayFileWriter.reopen(file_path, index_segments(segments), position, metadata)
+            with open(file_path, 'rb') as f:
+                f.seek(segments[-1]['offset'])
+                counts = np.frombuffer(f.read(4 * 8), dtype=np.int64)
+
+        writer.num_msgs, writer.num_odom_msgs, writer.num_img_msgs, writer.num_trunks = (int(count) for count in counts)
+        writer.last_fsync_time = time.time()
+        writer.reset_buffers()
+
+        return writer
+
+    def reset_buffers(self):
+        """
+        Empty the buffers of the current chunk
+        """
+        self.buffers = {name: [] for name in CACHED_DATA_COLUMNS}
+        self.num_buffered_msgs = 0
+
+    def append_odom(self, x_odom, theta_odom, time_stamp):
+        """
+        Append an odometry message
+
+        Args:
+            x_odom (float): The linear velocity of the odometry
+            theta_odom (float): The angular velocity of the odometry
+            time_stamp (float): The time stamp of the odometry message in seconds
+        """
+        self.buffers['msg_t'].append(time_stamp)
+        self.buffers['msg_types'].append(BaseDataLoader.ODOM_MSG)
+        self.buffers['msg_rows'].append(self.num_odom_msgs)
+        self.buffers['odom_t'].append(time_stamp)
+        self.buffers['odom_x'].append(x_odom)
+        self.buffers['odom_theta'].append(theta_odom)
+
+        self.num_odom_msgs += 1
+        self.msg_appended()
+
+    def append_tree_data(self, positions, widths, class_estimates, location_estimate, time_stamp):
+        """
+        Append an image message with the tree data found in it
+
+        Args:
+            positions (np.ndarray): The positions of the trees, or None if no trees were found
+            widths (np.ndarray): The widths of the trees
+            class_estimates (np.ndarray): The class estimates of the trees
+            location_estimate (np.ndarray): The location estimate (x, y, theta) at the time of the image
+            time_stamp (float): The time stamp of the image message in seconds
+        """
+        self.buffers['msg_t'].append(time_stamp)
+        self.buffers['msg_types'].append(BaseDataLoader.IMG_MSG)
+        self.buffers['msg_rows'].append(self.num_img_msgs)
+        self.buffers['img_t'].append(time_stamp)
+        self.buffers['trunk_offsets'].append(self.num_trunks)
+
+        if positions is None:
+            self.buffers['img_has_data'].append(0)
+            location_estimate = (np.nan, np.nan, np.nan)
+        else:
+            self.buffers['img_has_data'].append(1)
+            self.buffers['trunk_positions'].append(np.asarray(positions, dtype=np.float64).reshape(-1, 2))
+            self.buffers['trunk_widths'].append(np.asarray(widths, dtype=np.float64).reshape(-1))
+            self.buffers['trunk_classes'].append(np.asarray(class_estimates, dtype=np.int32).reshape(-1))
+            self.num_trunks += len(self.buffers['trunk_widths'][-1])
+
+        self.buffers['gt_x'].append(location_estimate[0])
+        self.buffers['gt_y'].append(location_estimate[1])
+        self.buffers['gt_theta'].append(location_estimate[2])
+
+        self.num_img_msgs += 1
+        self.msg_appended()
+
+    def msg_appended(self):
+        """
+        Update the message counts after a message is appended and write the chunk if it's full
+        """
+        self.num_msgs += 1
+        self.num_buffered_msgs += 1
+
+        if self.num_buffered_msgs >= self.chunk_size:
+            self.write_chunk()
+
+    def write_chunk(self):
+        """
+        Write the buffered messages to the file as a chunk
+        """
+        if self.num_buffered_msgs == 0:
+            return
+
+        writer = self.array_file_writer
+        for name, dtype in CACHED_DATA_COLUMNS.items():
+            if name in ('trunk_positions', 'trunk_widths', 'trunk_classes') or not self.buffers[name]:
+                continue
+            writer.append(name, np.array(self.buffers[name], dtype=dtype))
+
+        if self.buffers['trunk_widths']:
+            writer.append('trunk_positions', np.concatenate(self.buffers['trunk_positions']))
+            writer.append('trunk_widths', np.concatenate(self.buffers['trunk_widths']))
+            writer.append('trunk_classes', np.concatenate(self.buffers['trunk_classes']))
+
+        counts = np.array([self.num_msgs, self.num_odom_msgs, self.num_img_msgs, self.num_trunks], dtype=np.int64)
+        writer.append(CHUNK_END_COLUMN, counts.reshape(1, 4))
+
+        fsync = time.time() - self.last_fsync_time >= self.fsync_interval
+        writer.flush(fsync=fsync)
+        if fsync:
+            self.last_fsync_time = time.time()
+
+        self.reset_buffers()
+
+    def finalize(self):
+        """
+        Write the last chunk and the footer index, after which the file can be opened by the BinaryCachedDataLoader
+        """
+        self.write_chunk()
+
+        writer = self.array_file_writer
+
+        # Close off the trunk offsets, and make sure the arrays with no rows written are still in the file
+        writer.append('trunk_offsets', np.array([self.num_trunks], dtype=np.int64))
+        for name, dtype in CACHED_DATA_COLUMNS.items():
+            if name not in writer.arrays_index:
+                row_shape = (0, 2) if name == 'trunk_positions' else (0,)
+                writer.append(name, np.zeros(row_shape, dtype=dtype))
+
+        writer.finalize()
+
+    def close(self):
+        """
+        Close the file without finalizing it, the complete chunks can still be recovered later
+        """
+        if not self.array_file_writer.finalized:
+            self.array_file_writer.flush(fsync=True)
+            self.array_file_writer.file.close()
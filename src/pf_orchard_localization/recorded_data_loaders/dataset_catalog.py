@@ -0,0 +1,552 @@
+#!/usr/bin/env python3
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+import numpy as np
+import yaml
+from pf_orchard_localization.recorded_data_loaders.array_file import open_array_file
+from pf_orchard_localization.recorded_data_loaders.binary_cached_data_loader import (BINARY_CACHED_DATA_EXTENSION,
+                                                                                     select_data_files)
+
+CATALOG_INDEX_VERSION = 1
+
+# Matches the strings, with the colon after them if they're keys, and the brackets of a json file
+JSON_TOKEN_PATTERN = re.compile(r'"(?:[^"\\]|\\.)*"\s*:?|[{}\[\]]')
+
+
+def get_default_index_dir():
+    """
+    Get the directory the dataset catalog indexes are saved in when none is given, in the user's cache directory
+
+    Returns:
+        str: The path to the directory
+    """
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_dir, "pf_orchard_localization", "dataset_catalogs")
+
+
+def get_file_signature(file_path):
+    """
+    Get a signature of a data file that changes when the file does, used to tell if the saved index of a file is still
+    valid. Bag directories use the signature of their metadata file.
+
+    Args:
+        file_path (str): The path to the data file or bag directory
+
+    Returns:
+        list: The size and modification time of the file
+    """
+    if os.path.isdir(file_path):
+        file_path = os.path.join(file_path, "metadata.yaml")
+    stat = os.stat(file_path)
+    return [stat.st_size, stat.st_mtime]
+
+
+def summarize_bag(bag_path, topics):
+    """
+    Summarize a ros2 bag from its metadata file, without reading any messages. The number of messages is an estimate,
+    since the data loader only keeps the rgb and depth images it can pair.
+
+    Args:
+        bag_path (str): The path to the bag directory
+        topics (tuple): The depth, rgb and odom topics
+
+    Returns:
+        dict: The start time, duration and number of messages of the bag
+    """
+    with open(os.path.join(bag_path, "metadata.yaml")) as f:
+        bag_info = yaml.safe_load(f)["rosbag2_bagfile_information"]
+
+    depth_topic, rgb_topic, odom_topic = topics
+    message_counts = {topic_info["topic_metadata"]["name"]: topic_info["message_count"]
+                      for topic_info in bag_info.get("topics_with_message_count", [])}
+    num_img_msgs = min(message_counts.get(depth_topic, 0), message_counts.get(rgb_topic, 0))
+
+    return {"start_time": bag_info["starting_time"]["nanoseconds_since_epoch"] * 1e-9,
+            "duration": bag_info["duration"]["nanoseconds"] * 1e-9,
+            "num_msgs": num_img_msgs + message_counts.get(odom_topic, 0)}
+
+
+def read_json_keys(file_path):
+    """
+    Read the keys of the top level object of a json file, without decoding the values
+
+    Args:
+        file_path (str): The path to the json file
+
+    Returns:
+        list: The keys
+    """
+    with open(file_path) as f:
+        text = f.read()
+
+    keys = []
+    depth = 0
+    for match in JSON_TOKEN_PATTERN.finditer(text):
+        token = match.group()
+        if token in ("{", "["):
+            depth += 1
+        elif token in ("}", "]"):
+            depth -= 1
+        elif depth == 1 and token.endswith(":"):
+            keys.append(json.loads(token[:-1].rstrip()))
+    return keys
+
+
+def summarize_cached_data(file_path):
+    """
+    Summarize a json or binary cached data file
+
+    Args:
+        file_path (str): The path to the cached data file
+
+    Returns:
+        dict: The start time, duration and number of messages of the file
+    """
+    if file_path.endswith(BINARY_CACHED_DATA_EXTENSION):
+        arrays, _ = open_array_file(file_path, names=("msg_t",))
+        time_stamps = np.sort(arrays["msg_t"])
+    else:
+        time_stamps = np.sort(np.array([int(key) for key in read_json_keys(file_path)], dtype=np.int64)) / 1000.0
+
+    if len(time_stamps) == 0:
+        return {"start_time": 0.0, "duration": 0.0, "num_msgs": 0}
+
+    return {"start_time": float(time_stamps[0]), "duration": float(time_stamps[-1] - time_stamps[0]),
+            "num_msgs": len(time_stamps)}
+
+
+class DatasetCatalog:
+    """
+    Catalog of all the data files in a directory, which puts them on one global timeline in the order of their names.
+    Global times are the time since the start of the first file, with each file starting where the previous one ended,
+    and global positions count the messages the same way, so any point in the dataset can be found without opening the
+    files before it.
+
+    The start, duration and number of messages of each file are read from the bag metadata or the cached data file and
+    saved in an index file, so later catalogs of the same directory don't read the files again. The files that aren't in
+    the index are read on a background thread, and the global times aren't known until they have been, see is_indexed.
+    Once a file is opened its entry is updated from the data loader, which makes it exact.
+
+    Data files are opened on a background thread, so the next file can be opened while the current one is being used.
+    """
+
+    def __init__(self, data_file_dir, data_file_names, open_data_file, topics=None, max_open_files=2, index_dir=None):
+        """
+        Args:
+            data_file_dir (str): The directory with the data files
+            data_file_names (list): The names of the data files in the order they're played, a run with both a json and
+                                    a binary cached data file is only played from the binary one
+            open_data_file (Callable): Function that opens a data file path and returns a data loader
+            topics (tuple, optional): The depth, rgb and odom topics used in bag files. Defaults to None.
+            max_open_files (int, optional): The maximum number of data files kept open, including the one being
+                                            prefetched. Defaults to 2.
+            index_dir (str, optional): The directory to save the index file in, which is named by the data file
+                                       directory. Defaults to None, which uses the user's cache directory.
+        """
+        self.data_file_dir = data_file_dir
+        self.data_file_names = select_data_files(data_file_names)
+        self.open_data_file = open_data_file
+        self.topics = topics
+        self.max_open_files = max_open_files
+        self.index_dir = index_dir if index_dir is not None else get_default_index_dir()
+        self.closed = False
+
+        # Guards the entries and offsets, which are updated on the background threads when a file is summarized or opened
+        self.entries_lock = threading.RLock()
+        self.entries = [None] * len(self.data_file_names)
+        self.summary_executor = ThreadPoolExecutor(max_workers=1)
+        self.summaries_future = None
+        self.load_index()
+
+        # Futures of the opened data loaders by file index, in the order they were used
+        self.open_files = {}
+        self.lock = threading.Lock()
+        self.open_executor = ThreadPoolExecutor(max_workers=1)
+
+    @property
+    def num_files(self):
+        """
+        Returns the number of data files in the catalog
+        """
+        return len(self.data_file_names)
+
+    @property
+    def index_file_path(self):
+        """
+        Returns the path of the saved index file, named by a hash of the data file directory
+        """
+        dir_hash = hashlib.sha256(os.path.abspath(self.data_file_dir).encode()).hexdigest()[:16]
+        return os.path.join(self.index_dir, dir_hash + ".json")
+
+    @property
+    def is_indexed(self):
+        """
+        Returns whether all the data files have been summarized, so the global times and positions are known
+        """
+        return self.summaries_future is None or self.summaries_future.done()
+
+    def wait_until_indexed(self, timeout=None):
+        """
+        Wait for the data files to be summarized
+
+        Args:
+            timeout (float, optional): The most time to wait in seconds. Defaults to None, which waits until they are.
+
+        Returns:
+            bool: Whether all the data files have been summarized
+        """
+        if self.summaries_future is None:
+            return True
+        done, _ = wait([self.summaries_future], timeout=timeout)
+        return bool(done)
+
+    def get_data_file_path(self, file_idx):
+        """
+        Get the path of a data file
+
+        Args:
+            file_idx (int): The index of the data file
+
+        Returns:
+            str: The path of the data file
+        """
+        return os.path.join(self.data_file_dir, self.data_file_names[file_idx])
+
+    def get_file_index(self, data_file_name):
+        """
+        Get the index of a data file by its name or path
+
+        Args:
+            data_file_name (str): The name or path of the data file
+
+        Returns:
+            int: The index of the data file, or None if it's not in the catalog
+        """
+        data_file_name = os.path.basename(os.path.normpath(data_file_name))
+        if data_file_name not in self.data_file_names:
+            return None
+        return self.data_file_names.index(data_file_name)
+
+    def load_index(self):
+        """
+        Load the entries of the data files from the saved index file if they're in it and the files haven't changed, the
+        other files are summarized on the background thread
+        """
+        saved_entries = {}
+        if os.path.exists(self.index_file_path):
+            try:
+                with open(self.index_file_path) as f:
+                    saved_index = json.load(f)
+                if saved_index.get("version") == CATALOG_INDEX_VERSION:
+                    saved_entries = saved_index["entries"]
+            except (OSError, ValueError):
+                logging.warning(f"Could not read the dataset catalog index {self.index_file_path}")
+
+        unsummarized_files = []
+        for file_idx, data_file_name in enumerate(self.data_file_names):
+            try:
+                signature = get_file_signature(self.get_data_file_path(file_idx))
+            except OSError:
+                signature = None
+
+            saved_entry = saved_entries.get(data_file_name)
+            if saved_entry is not None and saved_entry["signature"] == signature:
+                self.entries[file_idx] = saved_entry
+                continue
+
+            # Counts as empty until it's summarized, and isn't saved until then
+            self.entries[file_idx] = {"start_time": 0.0, "duration": 0.0, "num_msgs": 0, "exact": False,
+                                      "signature": signature, "pending": True}
+            unsummarized_files.append(file_idx)
+
+        self.update_offsets()
+
+        if unsummarized_files:
+            self.summaries_future = self.summary_executor.submit(self.summarize_files, unsummarized_files)
+
+    def summarize_files(self, file_indices):
+        """
+        Summarize data files and save them to the index, called on the background thread
+
+        Args:
+            file_indices (list): The indices of the data files
+        """
+        for file_idx in file_indices:
+            if self.closed:
+                return
+            summary = self.summarize_file(self.get_data_file_path(file_idx))
+
+            with self.entries_lock:
+                entry = self.entries[file_idx]
+                # The file may have been opened in the meantime, which makes the rest of its entry exact
+                if not entry["exact"]:
+                    entry.update(summary)
+                entry["start_time"] = summary["start_time"]
+                entry.pop("pending")
+                self.update_offsets()
+
+        with self.entries_lock:
+            self.save_index()
+
+    def summarize_file(self, data_file_path):
+        """
+        Summarize a data file without opening it with a data loader
+
+        Args:
+            data_file_path (str): The path to the data file
+
+        Returns:
+            dict: The start time, duration and number of messages of the data file
+        """
+        try:
+            if os.path.isdir(data_file_path):
+                summary = summarize_bag(data_file_path, self.topics)
+            else:
+                summary = summarize_cached_data(data_file_path)
+            summary["exact"] = False
+        except (OSError, ValueError, KeyError, TypeError, yaml.YAMLError):
+            logging.warning(f"Could not summarize data file {data_file_path}")
+            summary = {"start_time": 0.0, "duration": 0.0, "num_msgs": 0, "exact": False}
+        return summary
+
+    def save_index(self):
+        """
+        Save the entries of the data files that have been summarized to the index file, so they don't have to be
+        summarized again
+        """
+        saved_entries = {data_file_name: entry for data_file_name, entry in zip(self.data_file_names, self.entries)
+                         if not entry.get("pending", False)}
+        try:
+            os.makedirs(self.index_dir, exist_ok=True)
+            with open(self.index_file_path, "w") as f:
+                json.dump({"version": CATALOG_INDEX_VERSION, "data_file_dir": os.path.abspath(self.data_file_dir),
+                           "entries": saved_entries}, f)
+        except OSError:
+            logging.warning(f"Could not save the dataset catalog index {self.index_file_path}")
+
+    def update_offsets(self):
+        """
+        Update the global time and message offsets of the data files from their entries
+        """
+        durations = np.array([entry["duration"] for entry in self.entries], dtype=np.float64)
+        num_msgs = np.array([entry["num_msgs"] for entry in self.entries], dtype=np.int64)
+
+        self.time_offsets = np.zeros(self.num_files + 1, dtype=np.float64)
+        np.cumsum(durations, out=self.time_offsets[1:])
+        self.msg_offsets = np.zeros(self.num_files + 1, dtype=np.int64)
+        np.cumsum(num_msgs, out=self.msg_offsets[1:])
+
+    def update_entry(self, file_idx, data_manager):
+        """
+        Update the entry of a data file from its opened data loader, which makes it exact
+
+        Args:
+            file_idx (int): The index of the data file
+            data_manager (BaseDataLoader): The data loader of the file
+        """
+        with self.entries_lock:
+            entry = self.entries[file_idx]
+            if entry["exact"] or data_manager.num_msgs == 0:
+                return
+
+            entry["duration"] = float(data_manager.time_stamps[-1])
+            entry["num_msgs"] = int(data_manager.num_msgs)
+            entry["exact"] = True
+
+            self.update_offsets()
+            self.save_index()
+
+    @property
+    def total_duration(self):
+        """
+        Returns the total duration of all the data files
+        """
+        with self.entries_lock:
+            return float(self.time_offsets[-1])
+
+    @property
+    def total_num_msgs(self):
+        """
+        Returns the total number of messages in all the data files
+        """
+        with self.entries_lock:
+            return int(self.msg_offsets[-1])
+
+    def to_global_time(self, file_idx, time_stamp):
+        """
+        Convert a time stamp in a data file to a global time
+
+        Args:
+            file_idx (int): The index of the data file
+            time_stamp (float): The time stamp relative to the start of the data file
+
+        Returns:
+            float: The global time
+        """
+        with self.entries_lock:
+            return float(self.time_offsets[file_idx] + time_stamp)
+
+    def locate_global_time(self, global_time):
+        """
+        Find the data file and the time in it of a global time
+
+        Args:
+            global_time (float): The global time
+
+        Returns:
+            tuple: The index of the data file and the time stamp relative to the start of it, or (None, None) if the
+                   global time is outside the dataset
+        """
+        with self.entries_lock:
+            if global_time < 0 or global_time > self.total_duration or self.num_files == 0:
+                return None, None
+
+            file_idx = int(np.searchsorted(self.time_offsets, global_time, side='right')) - 1
+            file_idx = min(file_idx, self.num_files - 1)
+            return file_idx, float(global_time - self.time_offsets[file_idx])
+
+    def to_global_position(self, file_idx, data_pos):
+        """
+        Convert a message position in a data file to a global position
+
+        Args:
+            file_idx (int): The index of the data file
+            data_pos (int): The position of the message in the data file
+
+        Returns:
+            int: The global position
+        """
+        with self.entries_lock:
+            return int(self.msg_offsets[file_idx] + data_pos)
+
+    def locate_global_position(self, global_pos):
+        """
+        Find the data file and the position in it of a global message position
+
+        Args:
+            global_pos (int): The global position
+
+        Returns:
+            tuple: The index of the data file and the position of the message in it, or (None, None) if the position is
+                   outside the dataset
+        """
+        with self.entries_lock:
+            if global_pos < 0 or global_pos >= self.total_num_msgs:
+                return None, None
+
+            file_idx = int(np.searchsorted(self.msg_offsets, global_pos, side='right')) - 1
+            return file_idx, int(global_pos - self.msg_offsets[file_idx])
+
+    def open_file(self, file_idx):
+        """
+        Open a data file with the data loader, called on the background thread
+
+        Args:
+            file_idx (int): The index of the data file
+
+        Returns:
+            BaseDataLoader: The data loader
+        """
+        data_manager = self.open_data_file(self.get_data_file_path(file_idx))
+        self.update_entry(file_idx, data_manager)
+        return data_manager
+
+    def prefetch(self, file_idx):
+        """
+        Start opening a data file in the background, if it isn't already open
+
+        Args:
+            file_idx (int): The index of the data file
+        """
+        if file_idx is None or file_idx < 0 or file_idx >= self.num_files:
+            return
+
+        with self.lock:
+            if file_idx in self.open_files:
+                return
+            self.open_files[file_idx] = self.open_executor.submit(self.open_file, file_idx)
+
+    def prefetch_next(self, data_manager, fraction=0.5):
+        """
+        Start opening the data file after the one a data loader has open once it's past a fraction of its messages, so
+        the next file is ready when it reaches the end
+
+        Args:
+            data_manager (BaseDataLoader): The data loader of the current data file
+            fraction (float, optional): How far through the current file to start opening the next one. Defaults to 0.5.
+        """
+        if data_manager.cur_data_pos < fraction * data_manager.num_msgs:
+            return
+
+        file_idx = self.get_file_index(data_manager.current_data_file_path)
+        if file_idx is not None:
+            self.prefetch(file_idx + 1)
+
+    def get_data_manager(self, file_idx):
+        """
+        Get the data loader of a data file, opening it if it isn't already open or being opened. Only waits for the
+        file to open if it wasn't prefetched.
+
+        Args:
+            file_idx (int): The index of the data file
+
+        Returns:
+            BaseDataLoader: The data loader
+        """
+        self.prefetch(file_idx)
+
+        with self.lock:
+            future = self.open_files.pop(file_idx)
+            # Move it to the end as the most recently used, and close the least recently used files
+            self.open_files[file_idx] = future
+            while len(self.open_files) > self.max_open_files:
+                oldest_file_idx = next(iter(self.open_files))
+                self.open_files.pop(oldest_file_idx).cancel()
+
+        try:
+            data_manager = future.result()
+        except Exception:
+            # Don't keep the failed file open, so it's tried again the next time it's requested
+            with self.lock:
+                if self.open_files.get(file_idx) is future:
+                    self.open_files.pop(file_idx)
+            raise
+
+        # A data loader that was used before starts from the beginning again
+        data_manager.cur_data_pos = 0
+        data_manager.reached_start_of_data = True
+        data_manager.reached_end_of_data = False
+
+        return data_manager
+
+    def seek_global_time(self, global_time):
+        """
+        Get the data loader of the data file at a global time, set to the time. Only the data file at the time is opened.
+
+        Args:
+            global_time (float): The global time
+
+        Returns:
+            tuple: The data loader, a message indicating if the time was set successfully, and the image message at the
+                   time
+        """
+        file_idx, time_stamp = self.locate_global_time(global_time)
+        if file_idx is None:
+            return None, "Time is outside the dataset, which is " + str(round(self.total_duration, 2)) + "s long", None
+
+        data_manager = self.get_data_manager(file_idx)
+        message, img_msg = data_manager.set_time_stamp(time_stamp)
+        return data_manager, message, img_msg
+
+    def close(self):
+        """
+        Stop summarizing and opening data files in the background
+        """
+        self.closed = True
+        self.summary_executor.shutdown(wait=False, cancel_futures=True)
+        self.open_executor.shutdown(wait=False, cancel_futures=True)
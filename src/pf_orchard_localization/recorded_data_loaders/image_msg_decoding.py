@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+import struct
+import numpy as np
+
+# Decodes sensor_msgs/Image and sensor_msgs/CompressedImage messages from rosbags into numpy arrays without cv_bridge.
+# rosbags deserializes the data of an image message as a read only numpy view into the serialized message, so raw images
+# are returned as views of that buffer with the row stride of the message, and are only copied when the channels need
+# to be reordered. The returned arrays are read only, copy them before changing them.
+
+# The numpy dtype and number of channels of each raw image encoding
+IMAGE_ENCODINGS = {
+    "rgb8": (np.uint8, 3),
+    "bgr8": (np.uint8, 3),
+    "rgba8": (np.uint8, 4),
+    "bgra8": (np.uint8, 4),
+    "mono8": (np.uint8, 1),
+    "mono16": (np.uint16, 1),
+    "8UC1": (np.uint8, 1),
+    "8UC3": (np.uint8, 3),
+    "16UC1": (np.uint16, 1),
+    "32FC1": (np.float32, 1),
+}
+
+# The encodings that can be converted to each other by reordering the channels
+CHANNEL_ORDERS = {"rgb8": (0, 1, 2), "bgr8": (2, 1, 0), "rgba8": (0, 1, 2, 3), "bgra8": (2, 1, 0, 3)}
+
+# Header at the start of the data of a compressedDepth image: the depth format, and the two quantization parameters
+COMPRESSED_DEPTH_HEADER_STRUCT = struct.Struct("<iff")
+
+
+def image_msg_to_array(msg, desired_encoding="passthrough"):
+    """
+    View the data of a sensor_msgs/Image message as a numpy array
+
+    Args:
+        msg (sensor_msgs.msg.Image): The image message
+        desired_encoding (str, optional): The encoding to convert the image to, "passthrough" keeps the encoding of the
+                                          message. Only conversions between rgb8/bgr8 and rgba8/bgra8 are supported.
+                                          Defaults to "passthrough".
+
+    Returns:
+        np.ndarray: The image, with shape (height, width) for single channel images and (height, width, channels)
+                    otherwise
+    """
+    if msg.encoding not in IMAGE_ENCODINGS:
+        raise ValueError(f"Unsupported image encoding {msg.encoding}")
+
+    dtype, channels = IMAGE_ENCODINGS[msg.encoding]
+    dtype = np.dtype(dtype).newbyteorder(">" if msg.is_bigendian else "<")
+
+    # View the rows with the stride of the message, which can be padded past width * channels * itemsize
+    data = np.frombuffer(msg.data, dtype=np.uint8)
+    shape = (msg.height, msg.width, channels)
+    strides = (msg.step, channels * dtype.itemsize, dtype.itemsize)
+    image = np.ndarray(shape=shape, dtype=dtype, buffer=data, strides=strides)
+
+    if not dtype.isnative:
+        image = image.astype(dtype.newbyteorder("="))
+
+    if channels == 1:
+        image = image[:, :, 0]
+
+    if desired_encoding in ("passthrough", msg.encoding):
+        return image
+
+    if msg.encoding in CHANNEL_ORDERS and desired_encoding in CHANNEL_ORDERS:
+        channel_order = [CHANNEL_ORDERS[msg.encoding].index(i) for i in CHANNEL_ORDERS[desired_encoding]]
+        if len(channel_order) == channels:
+            return np.ascontiguousarray(image[:, :, channel_order])
+
+    raise ValueError(f"Can't convert image encoding {msg.encoding} to {desired_encoding}")
+
+
+def compressed_image_msg_to_array(msg, desired_encoding="passthrough"):
+    """
+    Decode a sensor_msgs/CompressedImage message, including compressedDepth images from image_transport
+
+    Args:
+        msg (sensor_msgs.msg.CompressedImage): The compressed image message
+        desired_encoding (str, optional): "bgr8" or "rgb8" to get a three channel color image, "passthrough" to keep the
+                                          decoded image as is. Defaults to "passthrough".
+
+    Returns:
+        np.ndarray: The image
+    """
+    import cv2
+
+    data = np.frombuffer(msg.data, dtype=np.uint8)
+
+    if "compressedDepth" in msg.format:
+        _, depth_quant_a, depth_quant_b = COMPRESSED_DEPTH_HEADER_STRUCT.unpack_from(data)
+        image = cv2.imdecode(data[COMPRESSED_DEPTH_HEADER_STRUCT.size:], cv2.IMREAD_UNCHANGED)
+
+        # 32 bit float depth is stored as inverse depth quantized to 16 bits, with 0 for no depth
+        if msg.format.split(";")[0].strip() == "32FC1":
+            inverse_depth = image.astype(np.float32)
+            with np.errstate(divide="ignore"):
+                image = np.where(image > 0, depth_quant_a / (inverse_depth - depth_quant_b), 0).astype(np.float32)
+        return image
+
+    if desired_encoding in ("bgr8", "rgb8"):
+        image = cv2.imdecode(data, cv2.IMREAD_COLOR)
+        if desired_encoding == "rgb8":
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        return image
+
+    return cv2.imdecode(data, cv2.IMREAD_UNCHANGED)
+
+
+def decode_image_msg(msg, desired_encoding="passthrough"):
+    """
+    Decode a sensor_msgs/Image or sensor_msgs/CompressedImage message
+
+    Args:
+        msg (sensor_msgs.msg.Image or sensor_msgs.msg.CompressedImage): The image message
+        desired_encoding (str, optional): The encoding to convert the image to. Defaults to "passthrough".
+
+    Returns:
+        np.ndarray: The image
+    """
+    # Compressed images have a format instead of an encoding
+    if hasattr(msg, "format"):
+        return compressed_image_msg_to_array(msg, desired_encoding)
+    return image_msg_to_array(msg, desired_encoding)
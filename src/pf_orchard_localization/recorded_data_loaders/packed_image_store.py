@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+import collections
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from pf_orchard_localization.recorded_data_loaders.array_file import ArrayFileWriter, open_array_file
+
+PACKED_IMAGES_EXTENSION = ".pfi"
+PACKED_IMAGES_VERSION = 1
+
+# The extensions of the loose image files that can be packed
+IMAGE_FILE_EXTENSIONS = (".png", ".webp", ".jpg", ".jpeg", ".npy")
+
+
+def time_stamp_to_key(time_stamp):
+    """
+    Get the key images are stored under for a time stamp, the time stamp in milliseconds, which is also the name of the
+    loose image files. Rounded rather than truncated, since the time stamps of cached data are the keys divided by 1000
+    and multiplying them back isn't always exact.
+
+    Args:
+        time_stamp (float): The time stamp in seconds
+
+    Returns:
+        int: The key
+    """
+    return int(round(1000 * time_stamp))
+
+
+class PackedImageWriter:
+    """
+    Writes images to a packed image file, an array file holding the encoded images back to back along with an index of
+    the key, offset and size of each image. The encoded images are buffered and written in chunks, so the whole run
+    doesn't have to be kept in memory.
+    """
+
+    ENCODINGS = ("jpeg", "webp", "png")
+
+    def __init__(self, file_path, encoding="jpeg", quality=90, scale=1.0, chunk_bytes=32 * 1024 * 1024, metadata=None):
+        """
+        Args:
+            file_path (str): The path to write the packed image file to
+            encoding (str, optional): The encoding of the images, one of ENCODINGS. Defaults to "jpeg".
+            quality (int, optional): The JPEG or WebP quality, a WebP quality above 100 is lossless. Defaults to 90.
+            scale (float, optional): The factor to resize the images by before encoding them. Defaults to 1.0.
+            chunk_bytes (int, optional): The number of bytes of encoded images to buffer before writing them.
+                                         Defaults to 32MB.
+            metadata (dict, optional): Extra metadata to store in the file. Defaults to None.
+        """
+        if encoding not in self.ENCODINGS:
+            raise ValueError(f"Encoding must be one of {self.ENCODINGS}, got {encoding}")
+
+        self.encoding = encoding
+        self.quality = quality
+        self.scale = scale
+        self.chunk_bytes = chunk_bytes
+
+        file_metadata = {'format': 'pf_packed_images', 'version': PACKED_IMAGES_VERSION, 'encoding': encoding,
+                         'quality': quality, 'scale': scale}
+        if metadata is not None:
+            file_metadata.update(metadata)
+
+        self.array_file_writer = ArrayFileWriter(file_path, metadata=file_metadata)
+
+        self.keys = []
+        self.offsets = []
+        self.sizes = []
+
+        self.chunk = []
+        self.chunk_size = 0
+
+    def encode(self, image):
+        """
+        Resize and encode an image
+
+        Args:
+            image (np.ndarray): The image
+
+        Returns:
+            np.ndarray: The encoded image bytes
+        """
+        if self.scale != 1.0:
+            image = cv2.resize(image, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+
+        if self.encoding == "jpeg":
+            success, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        elif self.encoding == "webp":
+            success, encoded = cv2.imencode(".webp", image, [cv2.IMWRITE_WEBP_QUALITY, self.quality])
+        else:
+            success, encoded = cv2.imencode(".png", image)
+
+        if not success:
+            raise ValueError(f"Failed to encode image as {self.encoding}")
+
+        return encoded.reshape(-1)
+
+    def add_image(self, key, image):
+        """
+        Add an image to the file
+
+        Args:
+            key (int): The key of the image, the time stamp in milliseconds
+            image (np.ndarray): The image
+        """
+        encoded = self.encode(image)
+
+        self.keys.append(key)
+        self.sizes.append(len(encoded))
+        self.chunk.append(encoded)
+        self.chunk_size += len(encoded)
+
+        if self.chunk_size >= self.chunk_bytes:
+            self.write_chunk()
+
+    def write_chunk(self):
+        """
+        Write the buffered images to the file
+        """
+        if not self.chunk:
+            return
+
+        self.array_file_writer.append('image_data', np.concatenate(self.chunk))
+
+        # Offsets are stored as positions in the file, so the reader doesn't need to join the chunks together
+        chunk_offset = self.array_file_writer.arrays_index['image_data']['segments'][-1][0]
+        for encoded in self.chunk:
+            self.offsets.append(chunk_offset)
+            chunk_offset += len(encoded)
+
+        self.chunk = []
+        self.chunk_size = 0
+
+    def finalize(self):
+        """
+        Write the rest of the images and the index, and close the file
+        """
+        self.write_chunk()
+
+        keys = np.array(self.keys, dtype=np.int64)
+        order = np.argsort(keys, kind='stable')
+
+        self.array_file_writer.append('image_keys', keys[order])
+        self.array_file_writer.append('image_offsets', np.array(self.offsets, dtype=np.int64)[order])
+        self.array_file_writer.append('image_sizes', np.array(self.sizes, dtype=np.int64)[order])
+        self.array_file_writer.finalize()
+
+
+class PackedImageReader:
+    """
+    Reads images from a packed image file. The file is memory mapped, images are decoded by a pool of threads, and the
+    decoded images are kept in an LRU cache. Images can be prefetched so they're already decoded when they're needed.
+    """
+
+    def __init__(self, file_path, num_decode_threads=2, cache_size=32):
+        """
+        Args:
+            file_path (str): The path to the packed image file
+            num_decode_threads (int, optional): The number of threads decoding images. Defaults to 2.
+            cache_size (int, optional): The number of decoded images to keep. Defaults to 32.
+        """
+        self.file_path = file_path
+
+        arrays, self.metadata = open_array_file(file_path, names=('image_keys', 'image_offsets', 'image_sizes'))
+        if self.metadata.get('format') != 'pf_packed_images':
+            raise ValueError(f"{file_path} is not a packed image file")
+
+        self.keys = arrays['image_keys']
+        self.offsets = arrays['image_offsets']
+        self.sizes = arrays['image_sizes']
+
+        self.file_map = np.memmap(file_path, dtype=np.uint8, mode='r')
+
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()
+        self.cache_lock = threading.Lock()
+        self.decode_executor = ThreadPoolExecutor(max_workers=num_decode_threads)
+
+    @property
+    def num_images(self):
+        """
+        Returns the number of images in the file
+        """
+        return len(self.keys)
+
+    def find_image(self, key):
+        """
+        Find the position of an image in the index
+
+        Args:
+            key (int): The key of the image
+
+        Returns:
+            int: The position of the image, or None if it isn't in the file
+        """
+        idx = int(np.searchsorted(self.keys, key))
+        if idx < len(self.keys) and self.keys[idx] == key:
+            return idx
+        return None
+
+    def has_image(self, key):
+        """
+        Check if an image is in the file
+
+        Args:
+            key (int): The key of the image
+
+        Returns:
+            bool: True if the image is in the file
+        """
+        return self.find_image(key) is not None
+
+    def decode(self, idx):
+        """
+        Decode an image
+
+        Args:
+            idx (int): The position of the image in the index
+
+        Returns:
+            np.ndarray: The image
+        """
+        offset = int(self.offsets[idx])
+        encoded = self.file_map[offset:offset + int(self.sizes[idx])]
+        return cv2.imdecode(np.asarray(encoded), cv2.IMREAD_UNCHANGED)
+
+    def get_future(self, idx):
+        """
+        Get the future of the decoded image from the cache, starting to decode it if it isn't in the cache
+
+        Args:
+            idx (int): The position of the image in the index
+
+        Returns:
+            Future: The future of the decoded image
+        """
+        with self.cache_lock:
+            future = self.cache.get(idx)
+            if future is not None:
+                self.cache.move_to_end(idx)
+                return future
+
+            future = self.decode_executor.submit(self.decode, idx)
+            self.cache[idx] = future
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            return future
+
+    def get_image(self, key):
+        """
+        Get an image
+
+        Args:
+            key (int): The key of the image
+
+        Returns:
+            np.ndarray: The image, or None if it isn't in the file
+        """
+        idx = self.find_image(key)
+        if idx is None:
+            return None
+        return self.get_future(idx).result()
+
+    def prefetch_after(self, key, num_images):
+        """
+        Start decoding the images after an image in the background
+
+        Args:
+            key (int): The key of the image
+            num_images (int): The number of images after it to decode
+        """
+        start_idx = int(np.searchsorted(self.keys, key, side='right'))
+        for idx in range(start_idx, min(start_idx + num_images, len(self.keys))):
+            self.get_future(idx)
+
+    def close(self):
+        """
+        Stop the decode threads and unmap the file, waiting for the images being decoded
+        """
+        self.decode_executor.shutdown(wait=True, cancel_futures=True)
+        with self.cache_lock:
+            self.cache.clear()
+        self.file_map = None
+
+
+class CachedImageSource:
+    """
+    Provides the cached segmentation images of the cached data mode from a directory, which can hold loose image files
+    named by their time stamp in milliseconds, packed image files, or both. Packed images are used when there's one for
+    the time stamp, and the images after it are prefetched.
+    """
+
+    def __init__(self, image_directory, num_prefetch=4, num_decode_threads=2, cache_size=32):
+        """
+        Args:
+            image_directory (str): The directory with the cached images
+            num_prefetch (int, optional): The number of images to decode ahead of the requested one. Defaults to 4.
+            num_decode_threads (int, optional): The number of threads decoding images in each packed file. Defaults to 2.
+            cache_size (int, optional): The number of decoded images to keep for each packed file. Defaults to 32.
+        """
+        self.image_directory = image_directory
+        self.num_prefetch = num_prefetch
+
+        self.packed_readers = []
+        if image_directory is not None and os.path.isdir(image_directory):
+            for file_name in sorted(os.listdir(image_directory)):
+                if file_name.endswith(PACKED_IMAGES_EXTENSION):
+                    self.packed_readers.append(PackedImageReader(os.path.join(image_directory, file_name),
+                                                                 num_decode_threads=num_decode_threads,
+                                                                 cache_size=cache_size))
+
+    def get_image(self, time_stamp):
+        """
+        Get the cached image for a time stamp
+
+        Args:
+            time_stamp (float): The time stamp of the image in seconds
+
+        Returns:
+            np.ndarray: The image, or None if there's no image for the time stamp
+        """
+        key = time_stamp_to_key(time_stamp)
+
+        for packed_reader in self.packed_readers:
+            if packed_reader.has_image(key):
+                image = packed_reader.get_image(key)
+                if self.num_prefetch > 0:
+                    packed_reader.prefetch_after(key, self.num_prefetch)
+                return image
+
+        return read_image_file(os.path.join(self.image_directory, str(key)))
+
+    def close(self):
+        """
+        Close the packed image files
+        """
+        for packed_reader in self.packed_readers:
+            packed_reader.close()
+        self.packed_readers = []
+
+
+def read_image_file(file_path_base):
+    """
+    Read a loose image file, trying each of the possible extensions
+
+    Args:
+        file_path_base (str): The path of the image, without the extension
+
+    Returns:
+        np.ndarray: The image, or None if there is no image at the path
+    """
+    for extension in IMAGE_FILE_EXTENSIONS:
+        file_path = file_path_base + extension
+        if not os.path.exists(file_path):
+            continue
+        if extension == ".npy":
+            return np.load(file_path)
+        return cv2.imread(file_path, cv2.IMREAD_UNCHANGED)
+    return None
+
+
+def list_image_files(image_directory):
+    """
+    List the loose image files in a directory by their key
+
+    Args:
+        image_directory (str): The directory
+
+    Returns:
+        dict: The file paths by key
+    """
+    image_files = {}
+    for file_name in os.listdir(image_directory):
+        name, extension = os.path.splitext(file_name)
+        if extension in IMAGE_FILE_EXTENSIONS and name.isdigit():
+            image_files[int(name)] = os.path.join(image_directory, file_name)
+    return image_files
+
+
+def pack_image_directory(image_directory, output_file_path, keys=None, encoding="jpeg", quality=90, scale=1.0):
+    """
+    Pack the loose image files in a directory into a packed image file
+
+    Args:
+        image_directory (str): The directory with the image files, named by their time stamp in milliseconds
+        output_file_path (str): The path to write the packed image file to
+        keys (list, optional): The keys of the images to pack. Defaults to all the images in the directory.
+        encoding (str, optional): The encoding of the images. Defaults to "jpeg".
+        quality (int, optional): The JPEG or WebP quality. Defaults to 90.
+        scale (float, optional): The factor to resize the images by. Defaults to 1.0.
+
+    Returns:
+        int: The number of images packed
+    """
+    image_files = list_image_files(image_directory)
+    if keys is None:
+        keys = image_files.keys()
+
+    writer = PackedImageWriter(output_file_path, encoding=encoding, quality=quality, scale=scale)
+    num_packed = 0
+    for key in sorted(keys):
+        if key not in image_files:
+            continue
+        file_path = image_files[key]
+        if file_path.endswith(".npy"):
+            image = np.load(file_path)
+        else:
+            image = cv2.imread(file_path, cv2.IMREAD_UNCHANGED)
+        writer.add_image(key, image)
+        num_packed += 1
+    writer.finalize()
+
+    return num_packed
@@ -1,8 +1,24 @@
-from .trunk_data_connection import TrunkDataConnection, TrunkDataConnectionCachedData
-
-# only import the ROS2 classes if ROS2 is available
-try:
-    from .trunk_data_connection_ros import TrunkDataConnectionRosService, TrunkDataConnectionRosSub
-except ImportError:
-    print("Unable to import TrunkDataConnectionRosService, ROS2 is likely not installed or pf_orchard_interfaces package is missing")
-    pass
\ No newline at end of file
+import importlib
+
+# Everything is only imported when first used. The connections pull in Qt and cv2, and the ROS2 ones rclpy, which is slow
+# to import, and ROS2 or the pf_orchard_interfaces package may not be installed. The transports only need numpy, so the
+# producer and consumer stand-ins can import them without the rest.
+LAZY_IMPORTS = {"TrunkDataConnection": ".trunk_data_connection",
+                "TrunkDataConnectionCachedData": ".trunk_data_connection",
+                "TrunkDataConnectionRosService": ".trunk_data_connection_ros",
+                "TrunkDataConnectionRosSub": ".trunk_data_connection_ros",
+                "TrunkDataConnectionJetson": ".trunk_data_connection_tcp-ip",
+                "TrunkDataClient": ".tcp_transport",
+                "LocalTrunkDataConsumer": ".tcp_transport",
+                "SharedMemoryTrunkDataClient": ".shm_transport",
+                "LocalSharedMemoryTrunkDataConsumer": ".shm_transport"}
+
+
+def __getattr__(name):
+    if name in LAZY_IMPORTS:
+        return getattr(importlib.import_module(LAZY_IMPORTS[name], __name__), name)
+    raise AttributeError("module {} has no attribute {}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + list(LAZY_IMPORTS))
@@ -0,0 +1,605 @@
+#!/usr/bin/env python3
+import collections
+import os
+import socket
+import struct
+import tempfile
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.connection import Listener, Client
+import numpy as np
+from .tcp_transport import ARRAY_HEADER
+
+# Moves the images to a trunk data consumer on the same host through shared memory, rather than a socket, so each frame
+# is only copied once, into the shared memory, and the consumer reads it where it is. The producer makes two rings of
+# slots, one for the requests and one for the results, and a request and its result use the slot of the same index, so a
+# slot is free again once its result is read. Each slot starts with a header with the sequence number of the frame in it,
+# the request ID, the time it was written and a descriptor of each array, like the frames of tcp_transport, and the
+# arrays follow at a fixed offset. The sequence number is written last, so a reader can tell a slot holds the frame it was
+# told about. Only a few bytes, the slot index and sequence number, go over the notification channel, a unix socket.
+
+# message type, slot index, sequence number
+NOTIFICATION = struct.Struct("<BIQ")
+MSG_REQUEST = 0
+MSG_RESPONSE = 1
+
+# sequence number, request ID, time written in ns, latency of the request in ns, number of arrays, descriptors length
+SLOT_HEADER = struct.Struct("<QQQQHI")
+# Room for the slot header and the array descriptors, the arrays start after it
+SLOT_HEADER_SIZE = 4096
+
+# A slot fits an 848x480 rgb image with its depth image, and the segmented image with the trunk data
+DEFAULT_SLOT_SIZE = SLOT_HEADER_SIZE + 848 * 480 * 5 + 4096
+DEFAULT_NUM_SLOTS = 4
+
+# Where a consumer on this host listens for clients of the shared memory transport
+DEFAULT_SHM_ADDRESS = os.path.join(tempfile.gettempdir(), "pf_trunk_data_consumer.sock")
+
+# Hosts that are always this host
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1", "")
+
+
+def is_local_host(host):
+    """
+    Check whether a host is this host, so the producer and consumer can share memory
+
+    Args:
+        host (str): The host name or address
+
+    Returns:
+        bool: Whether the host is this host
+    """
+    if host in LOCAL_HOSTS or host == socket.gethostname():
+        return True
+    try:
+        return socket.gethostbyname(host).startswith("127.")
+    except OSError:
+        return False
+
+
+def is_consumer_listening(address):
+    """
+    Check whether a consumer is listening on a unix socket, since the socket file is left behind when a consumer crashes
+
+    Args:
+        address (str): The path of the unix socket
+
+    Returns:
+        bool: Whether a connection to the socket was accepted
+    """
+    if not os.path.exists(address):
+        return False
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(1.0)
+            sock.connect(address)
+        return True
+    except OSError:
+        return False
+
+
+def shutdown_connection(connection):
+    """
+    Shut down the socket of a connection, which wakes up a thread waiting on it where closing it wouldn't
+
+    Args:
+        connection (multiprocessing.connection.Connection): The connection
+    """
+    try:
+        with socket.socket(fileno=os.dup(connection.fileno())) as sock:
+            sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+def attach_shared_memory(name, owner_pid):
+    """
+    Attach to shared memory made by another process, without the resource tracker unlinking it when this process exits
+
+    Args:
+        name (str): The name of the shared memory
+        owner_pid (int): The ID of the process that made it
+
+    Returns:
+        shared_memory.SharedMemory: The shared memory
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python before 3.13 always tracks it. Within the process that made it, the tracker has it once for both.
+        shm = shared_memory.SharedMemory(name=name)
+        if owner_pid != os.getpid():
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+def layout_frame(arrays):
+    """
+    Lay out the arrays of a frame in a slot, each array is written in C order after the slot header and aligned to 64 bytes
+
+    Args:
+        arrays (list): The arrays, None for a missing array
+
+    Returns:
+        tuple: The arrays as numpy arrays, the array descriptors, the offset of each array in the slot and the size the
+               frame needs
+    """
+    np_arrays = []
+    descriptors = []
+    offsets = []
+    data_offset = SLOT_HEADER_SIZE
+    for array in arrays:
+        if array is None:
+            np_arrays.append(None)
+            descriptors.append(ARRAY_HEADER.pack(0, b"", 0))
+            offsets.append(None)
+            continue
+
+        array = np.asarray(array)
+        if array.dtype.hasobject:
+            raise ValueError("Arrays of objects can't be sent")
+
+        np_arrays.append(array)
+        descriptors.append(ARRAY_HEADER.pack(1, array.dtype.str.encode(), array.ndim))
+        descriptors.append(struct.pack("<{}q".format(array.ndim), *array.shape))
+        offsets.append(data_offset)
+        data_offset += -(-array.nbytes // 64) * 64
+
+    descriptors = b"".join(descriptors)
+    if SLOT_HEADER.size + len(descriptors) > SLOT_HEADER_SIZE:
+        raise ValueError("The frame has too many arrays or dimensions for the slot header")
+    return np_arrays, descriptors, offsets, data_offset
+
+
+class FrameRing:
+    """
+    Ring of fixed size slots in shared memory, each holding the arrays of one frame
+    """
+
+    def __init__(self, num_slots=DEFAULT_NUM_SLOTS, slot_size=DEFAULT_SLOT_SIZE, name=None, owner_pid=None):
+        """
+        Args:
+            num_slots (int, optional): The number of slots. Defaults to DEFAULT_NUM_SLOTS.
+            slot_size (int, optional): The size of each slot in bytes, with the header. Defaults to DEFAULT_SLOT_SIZE.
+            name (str, optional): The name of shared memory made by another process to attach to. Defaults to None, which
+                                  makes new shared memory owned by this ring.
+            owner_pid (int, optional): The ID of the process that made the shared memory that's attached to. Defaults
+                                       to None.
+        """
+        self.num_slots = num_slots
+        self.slot_size = slot_size
+        self.owner = name is None
+
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=num_slots * slot_size)
+        else:
+            self.shm = attach_shared_memory(name, owner_pid)
+        self.name = self.shm.name
+
+    def get_slot(self, slot):
+        """
+        Get the memory of a slot
+
+        Args:
+            slot (int): The slot index
+
+        Returns:
+            memoryview: The memory of the slot
+        """
+        return self.shm.buf[slot * self.slot_size:(slot + 1) * self.slot_size]
+
+    def write(self, slot, sequence, request_id, arrays, latency_ns=0):
+        """
+        Write the arrays of a frame to a slot
+
+        Args:
+            slot (int): The slot index
+            sequence (int): The sequence number of the frame, not 0
+            request_id (int): The ID of the request
+            arrays (list): The arrays, None for a missing array
+            latency_ns (int, optional): The latency of the request, sent back with its result. Defaults to 0.
+        """
+        # The transfer time counts from here, so it includes the copy into the slot
+        write_time_ns = time.monotonic_ns()
+
+        arrays, descriptors, offsets, frame_size = layout_frame(arrays)
+        if frame_size > self.slot_size:
+            raise ValueError("The frame needs {} bytes but the slots are {} bytes".format(frame_size, self.slot_size))
+
+        buffer = self.get_slot(slot)
+        # Clear the sequence number first so the slot isn't read while it's being written
+        SLOT_HEADER.pack_into(buffer, 0, 0, 0, 0, 0, 0, 0)
+        buffer[SLOT_HEADER.size:SLOT_HEADER.size + len(descriptors)] = descriptors
+
+        for array, offset in zip(arrays, offsets):
+            if array is None or array.size == 0:
+                continue
+            np.copyto(np.ndarray(array.shape, dtype=array.dtype, buffer=buffer, offset=offset), array)
+
+        SLOT_HEADER.pack_into(buffer, 0, sequence, request_id, write_time_ns, latency_ns, len(arrays),
+                              len(descriptors))
+
+    def read(self, slot, sequence, copy=True):
+        """
+        Read the arrays of a frame from a slot
+
+        Args:
+            slot (int): The slot index
+            sequence (int): The sequence number of the frame, to check the slot still holds it
+            copy (bool, optional): Whether to copy the arrays out of the slot. If False they're views of the shared
+                                   memory that are only valid until the slot is reused. Defaults to True.
+
+        Returns:
+            tuple: The request ID, the list of arrays, the time the frame took to get here in ns and the latency sent
+                   with it in ns
+        """
+        buffer = self.get_slot(slot)
+        slot_sequence, request_id, write_time_ns, latency_ns, num_arrays, descriptors_length = \
+            SLOT_HEADER.unpack_from(buffer, 0)
+        transfer_time_ns = time.monotonic_ns() - write_time_ns
+        if slot_sequence != sequence:
+            raise ValueError("Slot {} holds frame {}, not frame {}".format(slot, slot_sequence, sequence))
+
+        arrays = []
+        offset = SLOT_HEADER.size
+        data_offset = SLOT_HEADER_SIZE
+        for _ in range(num_arrays):
+            present, dtype_str, ndim = ARRAY_HEADER.unpack_from(buffer, offset)
+            offset += ARRAY_HEADER.size
+            if not present:
+                arrays.append(None)
+                continue
+
+            shape = struct.unpack_from("<{}q".format(ndim), buffer, offset)
+            offset += 8 * ndim
+            dtype = np.dtype(dtype_str.rstrip(b"\0").decode())
+
+            array = np.ndarray(shape, dtype=dtype, buffer=buffer, offset=data_offset)
+            arrays.append(array.copy() if copy else array)
+            data_offset += -(-array.nbytes // 64) * 64
+
+        return request_id, arrays, transfer_time_ns, latency_ns
+
+    def close(self):
+        """
+        Close the shared memory, removing it if this ring made it
+        """
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                # The resource tracker of a consumer that attached to it removed it already
+                pass
+
+
+class SharedMemoryTrunkDataClient:
+    """
+    Sends images to a trunk data consumer on the same host through shared memory and receives their trunk data, with the
+    same interface as TrunkDataClient. The images are written straight into a free slot by submit, or queued until a slot
+    frees up, and a receiver thread collects the results by request ID and writes the queued images to the freed slots.
+    """
+
+    def __init__(self, address, num_slots=DEFAULT_NUM_SLOTS, slot_size=DEFAULT_SLOT_SIZE, result_callback=None):
+        """
+        Args:
+            address (str): The path of the unix socket of the consumer
+            num_slots (int, optional): The number of slots, the most requests in flight. Defaults to DEFAULT_NUM_SLOTS.
+            slot_size (int, optional): The size of each slot in bytes. Defaults to DEFAULT_SLOT_SIZE.
+            result_callback (function, optional): Called on the receiver thread with the request ID and the result of
+                                                  each request. Defaults to None.
+        """
+        self.address = address
+        self.num_slots = num_slots
+        self.slot_size = slot_size
+        self.result_callback = result_callback
+
+        self.request_ring = None
+        self.response_ring = None
+        self.connection = None
+        self.send_lock = threading.Lock()
+
+        self.condition = threading.Condition()
+        self.free_slots = collections.deque()
+        self.queue = collections.deque()
+        self.results = {}
+        # The requests whose results are dropped when they come, see discard
+        self.discarded_ids = set()
+        # The requests waiting for their results, and the slots they're in
+        self.pending_ids = set()
+        self.slot_requests = {}
+        self.next_request_id = 0
+        self.next_sequence = 1
+        self.running = False
+        self.error = None
+
+        # The time the requests took to get to the consumer and their results to get back, in seconds
+        self.transfer_latencies = collections.deque(maxlen=1000)
+
+        self.receiver_thread = None
+
+    def connect(self):
+        """
+        Make the rings, hand them to the consumer and start the receiver thread
+        """
+        self.connection = Client(self.address, family="AF_UNIX")
+        self.request_ring = FrameRing(self.num_slots, self.slot_size)
+        self.response_ring = FrameRing(self.num_slots, self.slot_size)
+        try:
+            self.connection.send({"request_ring": self.request_ring.name,
+                                  "response_ring": self.response_ring.name,
+                                  "num_slots": self.num_slots,
+                                  "slot_size": self.slot_size,
+                                  "pid": os.getpid()})
+        except OSError:
+            self.close()
+            raise
+
+        with self.condition:
+            self.free_slots = collections.deque(range(self.num_slots))
+            self.running = True
+            self.error = None
+
+        self.receiver_thread = threading.Thread(target=self.receiver_loop, daemon=True)
+        self.receiver_thread.start()
+
+        self.send_queued()
+
+    def submit(self, rgb_image, depth_image):
+        """
+        Queue images to be sent to the consumer, they're written to a slot right away if one is free
+
+        Args:
+            rgb_image (np.ndarray): The rgb image
+            depth_image (np.ndarray): The depth image
+
+        Returns:
+            int: The request ID, to get the result with
+        """
+        # Check the images fit here, rather than when they're written on the receiver thread
+        frame_size = layout_frame([rgb_image, depth_image])[3]
+        if frame_size > self.slot_size:
+            raise ValueError("The frame needs {} bytes but the slots are {} bytes".format(frame_size, self.slot_size))
+
+        with self.condition:
+            request_id = self.next_request_id
+            self.next_request_id += 1
+            self.queue.append((request_id, rgb_image, depth_image))
+            self.pending_ids.add(request_id)
+
+        self.send_queued()
+        return request_id
+
+    def send_queued(self):
+        """
+        Write the queued images to the free slots and tell the consumer about them
+        """
+        while True:
+            with self.condition:
+                if not (self.running and self.queue and self.free_slots):
+                    return
+                slot = self.free_slots.popleft()
+                request_id, rgb_image, depth_image = self.queue.popleft()
+                sequence = self.next_sequence
+                self.next_sequence += 1
+                self.slot_requests[slot] = request_id
+
+            try:
+                # Under the lock so the rings aren't closed while they're written
+                with self.send_lock:
+                    if self.request_ring is None:
+                        return
+                    self.request_ring.write(slot, sequence, request_id, [rgb_image, depth_image])
+                    self.connection.send_bytes(NOTIFICATION.pack(MSG_REQUEST, slot, sequence))
+            except (OSError, ValueError) as e:
+                self.stop_with_error(e)
+                return
+
+    def get_result(self, request_id, timeout=None):
+        """
+        Wait for the result of a request
+
+        Args:
+            request_id (int): The request ID from submit
+            timeout (float, optional): The most time to wait, in seconds. Defaults to None, which waits until the result
+                                       comes or the request is lost.
+
+        Returns:
+            tuple: The positions, widths, class estimates and segmented image, or None if the wait timed out or the
+                   request was lost with the connection
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: request_id in self.results or request_id not in self.pending_ids, timeout)
+            return self.results.pop(request_id, None)
+
+    def discard(self, request_id):
+        """
+        Drop the result of a request that's no longer wanted, for example after waiting for it timed out, now if it's
+        in or when it comes
+
+        Args:
+            request_id (int): The request ID from submit
+        """
+        with self.condition:
+            if self.results.pop(request_id, None) is None and request_id in self.pending_ids:
+                self.discarded_ids.add(request_id)
+
+    def receiver_loop(self):
+        """
+        Read the results from the response ring and free their slots
+        """
+        try:
+            while self.running:
+                _, slot, sequence = NOTIFICATION.unpack(self.connection.recv_bytes())
+                request_id, arrays, transfer_time_ns, request_latency_ns = self.response_ring.read(slot, sequence)
+                result = tuple(arrays)
+                self.transfer_latencies.append((request_latency_ns / 1e9, transfer_time_ns / 1e9))
+
+                with self.condition:
+                    discarded = request_id in self.discarded_ids
+                    if discarded:
+                        self.discarded_ids.discard(request_id)
+                    else:
+                        self.results[request_id] = result
+                    self.pending_ids.discard(request_id)
+                    self.slot_requests.pop(slot, None)
+                    self.free_slots.append(slot)
+                    self.condition.notify_all()
+
+                self.send_queued()
+
+                if self.result_callback is not None and not discarded:
+                    self.result_callback(request_id, result)
+        except (OSError, EOFError, ValueError) as e:
+            self.stop_with_error(e)
+
+    def stop_with_error(self, error):
+        """
+        Stop the client after a connection error, waking up anything waiting on it
+
+        Args:
+            error (Exception): The error
+        """
+        with self.condition:
+            if self.running:
+                self.error = error
+            self.stop()
+
+    def stop(self):
+        """
+        Stop the client, the requests in the slots are lost. Call with the condition held.
+        """
+        self.running = False
+        self.pending_ids -= set(self.slot_requests.values())
+        self.discarded_ids &= self.pending_ids
+        self.slot_requests.clear()
+        self.condition.notify_all()
+
+    def close(self, drop_queued=True):
+        """
+        Stop the receiver thread, close the connection and remove the rings
+
+        Args:
+            drop_queued (bool, optional): Whether to drop the requests that weren't written to a slot yet, rather than
+                                          keep them to send after connecting again. Defaults to True.
+        """
+        with self.condition:
+            self.stop()
+            if drop_queued:
+                self.queue.clear()
+                self.pending_ids.clear()
+                self.discarded_ids.clear()
+
+        if self.connection is not None:
+            shutdown_connection(self.connection)
+        if self.receiver_thread is not None and self.receiver_thread is not threading.current_thread():
+            self.receiver_thread.join()
+
+        with self.send_lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+            for ring in (self.request_ring, self.response_ring):
+                if ring is not None:
+                    ring.close()
+            self.request_ring = None
+            self.response_ring = None
+
+
+class LocalSharedMemoryTrunkDataConsumer:
+    """
+    Local stand-in for the trunk data consumer on the shared memory transport, for testing and benchmarking it without the
+    segmenter. Serves one client at a time, answering each request with the result of a processing function, which gets
+    the images as views of the shared memory so they aren't copied.
+    """
+
+    def __init__(self, process_func, address=None):
+        """
+        Args:
+            process_func (function): Takes the rgb and depth images and returns the positions, widths, class estimates and
+                                     segmented image, any of which can be None. It mustn't keep the images, their memory
+                                     is reused.
+            address (str, optional): The path of the unix socket to listen on. Defaults to None, which makes one in the
+                                     temporary directory, see the address attribute.
+        """
+        self.process_func = process_func
+
+        if address is None:
+            address = os.path.join(tempfile.mkdtemp(prefix="pf_trunk_data_"), "consumer.sock")
+        self.listener = Listener(address, family="AF_UNIX")
+        self.address = self.listener.address
+        self.running = True
+        self.connection = None
+        self.num_requests = 0
+
+        # The time the requests took to get here, in seconds
+        self.transfer_latencies = collections.deque(maxlen=1000)
+
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        """
+        Accept clients and answer their requests until closed
+        """
+        while self.running:
+            try:
+                self.connection = self.listener.accept()
+            except OSError:
+                return
+
+            request_ring = None
+            response_ring = None
+            try:
+                rings = self.connection.recv()
+                request_ring = FrameRing(rings["num_slots"], rings["slot_size"], rings["request_ring"], rings["pid"])
+                response_ring = FrameRing(rings["num_slots"], rings["slot_size"], rings["response_ring"], rings["pid"])
+
+                while self.running:
+                    _, slot, sequence = NOTIFICATION.unpack(self.connection.recv_bytes())
+                    self.answer_request(request_ring, response_ring, slot, sequence)
+            except (OSError, EOFError, ValueError):
+                pass
+            finally:
+                self.connection.close()
+                for ring in (request_ring, response_ring):
+                    if ring is not None:
+                        ring.close()
+
+    def answer_request(self, request_ring, response_ring, slot, sequence):
+        """
+        Process the images in a slot and write the result to the same slot of the response ring. The images are views of
+        the shared memory, which go away when this returns so the rings can be closed.
+
+        Args:
+            request_ring (FrameRing): The ring of the requests
+            response_ring (FrameRing): The ring of the results
+            slot (int): The slot index
+            sequence (int): The sequence number of the request
+        """
+        request_id, (rgb_image, depth_image), transfer_time_ns, _ = request_ring.read(slot, sequence, copy=False)
+        self.transfer_latencies.append(transfer_time_ns / 1e9)
+
+        result = self.process_func(rgb_image, depth_image)
+
+        response_ring.write(slot, sequence, request_id, list(result), latency_ns=transfer_time_ns)
+        self.connection.send_bytes(NOTIFICATION.pack(MSG_RESPONSE, slot, sequence))
+        self.num_requests += 1
+
+    def close(self):
+        """
+        Stop serving
+        """
+        self.running = False
+
+        # Wake up the serving thread, by shutting down the connection if it's serving a client, and by connecting to it if
+        # it's waiting for one
+        if self.connection is not None:
+            shutdown_connection(self.connection)
+        try:
+            Client(self.address, family="AF_UNIX").close()
+        except OSError:
+            pass
+        self.thread.join()
+        self.listener.close()
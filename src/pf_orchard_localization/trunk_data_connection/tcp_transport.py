@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+import collections
+import socket
+import struct
+import threading
+import numpy as np
+
+# A binary protocol for sending images to a trunk data consumer over TCP and getting the trunk data back. Each frame is a
+# fixed header with the message type, the request ID and the number of arrays, then a descriptor of each array with its
+# dtype, shape and strides, then the raw bytes of the arrays. The arrays are sent straight from their memory with sendmsg
+# and received with recv_into into arrays allocated for them, so nothing is pickled or copied along the way. Several
+# requests can be in flight at once, the responses carry the ID of their request.
+
+MSG_REQUEST = 0
+MSG_RESPONSE = 1
+
+FRAME_MAGIC = b"PFTD"
+FRAME_VERSION = 1
+
+# magic, version, message type, request ID, number of arrays, length of the array descriptors
+FRAME_HEADER = struct.Struct("<4sBBQHI")
+# whether the array is there, its dtype string and its number of dimensions, followed by the shape and strides
+ARRAY_HEADER = struct.Struct("<B8sB")
+
+# The most buffers given to one sendmsg call, below the IOV_MAX of the common platforms
+MAX_SEND_BUFFERS = 512
+
+
+class ConnectionClosedError(ConnectionError):
+    """
+    The other end closed the connection
+    """
+    pass
+
+
+def pack_frame(msg_type, request_id, arrays):
+    """
+    Make the header of a frame and the buffers of its arrays. Arrays that are contiguous in C or Fortran order are sent as
+    they are in memory, others are copied to C order first.
+
+    Args:
+        msg_type (int): MSG_REQUEST or MSG_RESPONSE
+        request_id (int): The ID of the request
+        arrays (list): The arrays to send, None for a missing array
+
+    Returns:
+        tuple: The header bytes and the list of array buffers
+    """
+    descriptors = []
+    buffers = []
+    for array in arrays:
+        if array is None:
+            descriptors.append(ARRAY_HEADER.pack(0, b"", 0))
+            continue
+
+        array = np.asarray(array)
+        if array.dtype.hasobject:
+            raise ValueError("Arrays of objects can't be sent")
+        if not (array.flags.c_contiguous or array.flags.f_contiguous):
+            array = np.ascontiguousarray(array)
+
+        descriptors.append(ARRAY_HEADER.pack(1, array.dtype.str.encode(), array.ndim))
+        descriptors.append(struct.pack("<{}q".format(2 * array.ndim), *array.shape, *array.strides))
+
+        if array.nbytes > 0:
+            # A Fortran ordered array is C ordered when transposed, with the same bytes
+            buffers.append(memoryview(array if array.flags.c_contiguous else array.T).cast("B"))
+
+    descriptors = b"".join(descriptors)
+    header = FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, msg_type, request_id, len(arrays), len(descriptors))
+    return header + descriptors, buffers
+
+
+def send_buffers(sock, buffers):
+    """
+    Send buffers in order without joining them, resuming after partial sends
+
+    Args:
+        sock (socket.socket): The socket
+        buffers (list): The buffers to send
+    """
+    views = collections.deque(memoryview(buffer).cast("B") for buffer in buffers if len(buffer) > 0)
+
+    if not hasattr(sock, "sendmsg"):
+        for view in views:
+            sock.sendall(view)
+        return
+
+    while views:
+        num_sent = sock.sendmsg(list(views)[:MAX_SEND_BUFFERS])
+        while num_sent > 0:
+            if num_sent >= len(views[0]):
+                num_sent -= len(views.popleft())
+            else:
+                views[0] = views[0][num_sent:]
+                num_sent = 0
+
+
+def recv_into_exactly(sock, buffer):
+    """
+    Fill a buffer from a socket
+
+    Args:
+        sock (socket.socket): The socket
+        buffer (memoryview or np.ndarray or bytearray): The buffer to fill
+    """
+    view = memoryview(buffer).cast("B")
+    while len(view) > 0:
+        num_received = sock.recv_into(view)
+        if num_received == 0:
+            raise ConnectionClosedError("The connection was closed")
+        view = view[num_received:]
+
+
+def send_frame(sock, msg_type, request_id, arrays):
+    """
+    Send a frame
+
+    Args:
+        sock (socket.socket): The socket
+        msg_type (int): MSG_REQUEST or MSG_RESPONSE
+        request_id (int): The ID of the request
+        arrays (list): The arrays to send, None for a missing array
+    """
+    header, buffers = pack_frame(msg_type, request_id, arrays)
+    send_buffers(sock, [header] + buffers)
+
+
+def recv_frame(sock):
+    """
+    Receive a frame, each array is received straight into a new array of its size
+
+    Args:
+        sock (socket.socket): The socket
+
+    Returns:
+        tuple: The message type, the request ID and the list of arrays, None for a missing array
+    """
+    header = bytearray(FRAME_HEADER.size)
+    recv_into_exactly(sock, header)
+    magic, version, msg_type, request_id, num_arrays, descriptors_length = FRAME_HEADER.unpack(header)
+    if magic != FRAME_MAGIC or version != FRAME_VERSION:
+        raise ValueError("Not a trunk data frame, or a frame of another version")
+
+    descriptors = bytearray(descriptors_length)
+    recv_into_exactly(sock, descriptors)
+
+    arrays = []
+    offset = 0
+    for _ in range(num_arrays):
+        present, dtype_str, ndim = ARRAY_HEADER.unpack_from(descriptors, offset)
+        offset += ARRAY_HEADER.size
+        if not present:
+            arrays.append(None)
+            continue
+
+        shape_strides = struct.unpack_from("<{}q".format(2 * ndim), descriptors, offset)
+        offset += 16 * ndim
+        dtype = np.dtype(dtype_str.rstrip(b"\0").decode())
+        shape, strides = shape_strides[:ndim], shape_strides[ndim:]
+
+        num_bytes = int(np.prod(shape)) * dtype.itemsize
+        buffer = np.empty(num_bytes, dtype=np.uint8)
+        if num_bytes > 0:
+            recv_into_exactly(sock, buffer)
+        arrays.append(np.ndarray(shape, dtype=dtype, buffer=buffer, strides=strides if num_bytes > 0 else None))
+
+    return msg_type, request_id, arrays
+
+
+class TrunkDataClient:
+    """
+    Sends images to a trunk data consumer and receives their trunk data. Images are queued with submit and sent by a
+    sender thread, with up to max_in_flight of them at the consumer at once, and a receiver thread collects the results by
+    request ID. The queue is a condition variable, so neither thread polls.
+    """
+
+    def __init__(self, server_address=('localhost', 65432), max_in_flight=4, result_callback=None):
+        """
+        Args:
+            server_address (tuple, optional): The host and port of the consumer. Defaults to ('localhost', 65432).
+            max_in_flight (int, optional): The most requests sent to the consumer without their results back. Defaults
+                                           to 4.
+            result_callback (function, optional): Called on the receiver thread with the request ID and the result of
+                                                  each request. Defaults to None.
+        """
+        self.server_address = server_address
+        self.max_in_flight = max_in_flight
+        self.result_callback = result_callback
+
+        self.sock = None
+        self.condition = threading.Condition()
+        self.queue = collections.deque()
+        self.results = {}
+        # The requests whose results are dropped when they come, see discard
+        self.discarded_ids = set()
+        # The requests waiting for their results, queued or sent, and the ones of them that were sent
+        self.pending_ids = set()
+        self.in_flight_ids = set()
+        self.next_request_id = 0
+        self.running = False
+        self.error = None
+
+        self.sender_thread = None
+        self.receiver_thread = None
+
+    def connect(self):
+        """
+        Connect to the consumer and start the sender and receiver threads
+        """
+        self.sock = socket.create_connection(self.server_address)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.running = True
+        self.error = None
+
+        self.sender_thread = threading.Thread(target=self.sender_loop, daemon=True)
+        self.receiver_thread = threading.Thread(target=self.receiver_loop, daemon=True)
+        self.sender_thread.start()
+        self.receiver_thread.start()
+
+    def submit(self, rgb_image, depth_image):
+        """
+        Queue images to be sent to the consumer
+
+        Args:
+            rgb_image (np.ndarray): The rgb image
+            depth_image (np.ndarray): The depth image
+
+        Returns:
+            int: The request ID, to get the result with
+        """
+        with self.condition:
+            request_id = self.next_request_id
+            self.next_request_id += 1
+            self.queue.append((request_id, rgb_image, depth_image))
+            self.pending_ids.add(request_id)
+            self.condition.notify_all()
+        return request_id
+
+    def get_result(self, request_id, timeout=None):
+        """
+        Wait for the result of a request. Requests queued before the client connects are sent once it does.
+
+        Args:
+            request_id (int): The request ID from submit
+            timeout (float, optional): The most time to wait, in seconds. Defaults to None, which waits until the result
+                                       comes or the request is lost.
+
+        Returns:
+            tuple: The positions, widths, class estimates and segmented image, or None if the wait timed out or the
+                   request was lost with the connection
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: request_id in self.results or request_id not in self.pending_ids, timeout)
+            return self.results.pop(request_id, None)
+
+    def sender_loop(self):
+        """
+        Send the queued requests, keeping at most max_in_flight at the consumer
+        """
+        try:
+            while True:
+                with self.condition:
+                    self.condition.wait_for(lambda: not self.running or
+                                            (self.queue and len(self.in_flight_ids) < self.max_in_flight))
+                    if not self.running:
+                        return
+                    request_id, rgb_image, depth_image = self.queue.popleft()
+                    self.in_flight_ids.add(request_id)
+
+                send_frame(self.sock, MSG_REQUEST, request_id, [rgb_image, depth_image])
+        except OSError as e:
+            self.stop_with_error(e)
+
+    def discard(self, request_id):
+        """
+        Drop the result of a request that's no longer wanted, for example after waiting for it timed out, now if it's
+        in or when it comes
+
+        Args:
+            request_id (int): The request ID from submit
+        """
+        with self.condition:
+            if self.results.pop(request_id, None) is None and request_id in self.pending_ids:
+                self.discarded_ids.add(request_id)
+
+    def receiver_loop(self):
+        """
+        Receive the results and hand them to the waiting requests
+        """
+        try:
+            while self.running:
+                _, request_id, arrays = recv_frame(self.sock)
+                result = tuple(arrays)
+
+                with self.condition:
+                    discarded = request_id in self.discarded_ids
+                    if discarded:
+                        self.discarded_ids.discard(request_id)
+                    else:
+                        self.results[request_id] = result
+                    self.in_flight_ids.discard(request_id)
+                    self.pending_ids.discard(request_id)
+                    self.condition.notify_all()
+
+                if self.result_callback is not None and not discarded:
+                    self.result_callback(request_id, result)
+        except (OSError, ValueError) as e:
+            self.stop_with_error(e)
+
+    def stop_with_error(self, error):
+        """
+        Stop the client after a connection error, waking up anything waiting on it
+
+        Args:
+            error (Exception): The error
+        """
+        with self.condition:
+            if self.running:
+                self.error = error
+            self.stop()
+
+    def stop(self):
+        """
+        Stop the threads, the requests that were sent are lost. Call with the condition held.
+        """
+        self.running = False
+        self.pending_ids -= self.in_flight_ids
+        self.discarded_ids &= self.pending_ids
+        self.in_flight_ids.clear()
+        self.condition.notify_all()
+
+    def close(self, drop_queued=True):
+        """
+        Stop the threads and close the connection
+
+        Args:
+            drop_queued (bool, optional): Whether to drop the requests that weren't sent yet, rather than keep them to
+                                          send after connecting again. Defaults to True.
+        """
+        with self.condition:
+            self.stop()
+            if drop_queued:
+                self.queue.clear()
+                self.pending_ids.clear()
+                self.discarded_ids.clear()
+
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.sock.close()
+
+        for thread in (self.sender_thread, self.receiver_thread):
+            if thread is not None and thread is not threading.current_thread():
+                thread.join()
+
+
+class LocalTrunkDataConsumer:
+    """
+    Local stand-in for the trunk data consumer, for testing and benchmarking the transport without the segmenter. Serves
+    one client at a time, answering each request with the result of a processing function.
+    """
+
+    def __init__(self, process_func, server_address=('localhost', 0)):
+        """
+        Args:
+            process_func (function): Takes the rgb and depth images and returns the positions, widths, class estimates and
+                                     segmented image, any of which can be None
+            server_address (tuple, optional): The host and port to listen on. Defaults to ('localhost', 0), which picks a
+                                              free port, see the address attribute.
+        """
+        self.process_func = process_func
+
+        self.listen_sock = socket.create_server(server_address)
+        self.address = self.listen_sock.getsockname()
+        self.running = True
+        self.client_sock = None
+        self.num_requests = 0
+
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        """
+        Accept clients and answer their requests until closed
+        """
+        while self.running:
+            try:
+                sock, _ = self.listen_sock.accept()
+            except OSError:
+                return
+
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.client_sock = sock
+            try:
+                while self.running:
+                    _, request_id, (rgb_image, depth_image) = recv_frame(sock)
+                    result = self.process_func(rgb_image, depth_image)
+                    send_frame(sock, MSG_RESPONSE, request_id, list(result))
+                    self.num_requests += 1
+            except (OSError, ValueError):
+                pass
+            finally:
+                sock.close()
+
+    def close(self):
+        """
+        Stop serving
+        """
+        self.running = False
+
+        # Shutting the sockets down wakes up the serving thread if it's waiting on them
+        for sock in (self.listen_sock, self.client_sock):
+            if sock is None:
+                continue
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.listen_sock.close()
+        self.thread.join()
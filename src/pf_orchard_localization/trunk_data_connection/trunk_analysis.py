@@ -0,0 +1,66 @@
+from ..pipeline.sources import remap_classes
+
+# The config file of the trunk width estimation package that's used
+WIDTH_ESTIMATION_CONFIG_FILE = "width_estimation_config_apple.yaml"
+
+# Function to only import these if they're needed
+def import_trunk_analyzer(width_estimation_config_file_path):
+    from trunk_width_estimation import TrunkAnalyzer, TrunkSegmenter, PackagePaths
+    # TODO: make the config file path an argument that works
+    config_file = WIDTH_ESTIMATION_CONFIG_FILE
+    return TrunkAnalyzer(PackagePaths(config_file), combine_segmenter=False), TrunkSegmenter(PackagePaths(config_file))
+
+
+class TrunkDataAnalyzer:
+    """
+    Gets the trunk data of images with the trunk segmenter and analyzer of the trunk width estimation package. It doesn't
+    use Qt, so it's shared by the TrunkDataConnection of the app and the worker processes that convert bags to cached
+    data files.
+    """
+
+    def __init__(self, width_estimation_config_file_path=None, class_mapping=(1, 2, 0)):
+        """
+        Args:
+            width_estimation_config_file_path (str, optional): The path to the width estimation config file. Defaults to None.
+            class_mapping (tuple, optional): The mapping of classes for the trunk data. Defaults to (1, 2, 0).
+        """
+        self.trunk_analyzer, self.trunk_segmenter = import_trunk_analyzer(width_estimation_config_file_path)
+        self.class_mapping = class_mapping
+
+    def segment(self, rgb_image):
+        """
+        Segment an image
+
+        Args:
+            rgb_image (np.ndarray): The rgb image
+
+        Returns:
+            tuple: The results dictionary and results of the segmenter
+        """
+        return self.trunk_segmenter.get_results(rgb_image)
+
+    def analyze(self, depth_image, results_dict, results):
+        """
+        Get the trunk data of an image from its segmentation, with the classes remapped
+
+        Args:
+            depth_image (np.ndarray): The depth image
+            results_dict (dict): The results dictionary from the trunk segmenter
+            results (list): The results from the trunk segmenter
+
+        Returns:
+            tuple: The positions, widths, class estimates, x positions in the image, indices of the segmenter results
+                   kept, and segmented image, which is None if no results were kept
+        """
+        positions, widths, class_estimates, x_positions_in_image, results_kept = (
+            self.trunk_analyzer.get_width_estimation_pf(depth_image, results_dict=results_dict))
+
+        if results_kept is not None:
+            seg_img = results[results_kept].plot()
+        else:
+            seg_img = None
+
+        if class_estimates is not None:
+            class_estimates = remap_classes(class_estimates, self.class_mapping)
+
+        return positions, widths, class_estimates, x_positions_in_image, results_kept, seg_img
@@ -1,28 +1,23 @@
+import collections
+import hashlib
+import os
+from importlib.metadata import version, PackageNotFoundError
 import numpy as np
-import cv2
-from typing import Callable, Optional, List
-import time
-from PyQt5.QtCore import QThread, pyqtSignal, pyqtSlot, QObject, QMutex, QWaitCondition
-from PyQt5.QtWidgets import QApplication
-import socket
-import struct
-import pickle
-import copy
-
-# Function to only import these if they're needed
-def import_trunk_analyzer(width_estimation_config_file_path):
-    from trunk_width_estimation import TrunkAnalyzer, TrunkSegmenter, PackagePaths
-    # TODO: make the config file path an argument that works
-    config_file = "width_estimation_config_apple.yaml"
-    return TrunkAnalyzer(PackagePaths(config_file), combine_segmenter=False), TrunkSegmenter(PackagePaths(config_file))
+from PyQt5.QtCore import QThread, pyqtSignal, pyqtSlot, QMutex, QWaitCondition
+from ..recorded_data_loaders.packed_image_store import CachedImageSource
+from ..pipeline.sources import remap_classes
+from .trunk_analysis import TrunkDataAnalyzer, WIDTH_ESTIMATION_CONFIG_FILE
+
 
 class TrunkDataConnection(QThread):
     """
-    Thread to get the trunk data from the trunk width estimation package
+    Thread to get the trunk data from the trunk width estimation package. Requests are queued and processed in the order
+    they were received, so a requester can have several images in flight and match up the results by their request IDs.
     """
     
     signal_save_calibration_data = pyqtSignal(dict)
     signal_request_processed = pyqtSignal(object)
+    signal_request_result = pyqtSignal(int, object)
     signal_segmented_image = pyqtSignal(object, int)
     signal_unfiltered_image = pyqtSignal(object, int)
     signal_original_image = pyqtSignal(object, int)
@@ -44,10 +39,11 @@ class TrunkDataConnection(QThread):
         self.wait_condition = QWaitCondition()
         self.mutex = QMutex()
 
-        self.init_trunk_analyzer(width_estimation_config_file_path)
-
         self.class_mapping = class_mapping
         self.offset = offset
+
+        self.width_estimation_config_file_path = width_estimation_config_file_path
+        self.init_trunk_analyzer(width_estimation_config_file_path)
         
         # Start as -1 so they don't display, they are set externally in the main thread using a signal
         self.original_image_display_num = -1
@@ -63,7 +59,8 @@ class TrunkDataConnection(QThread):
         self.x_positions_in_image = None
         self.results_kept = None
         
-        self.current_msg = None        
+        # The requests waiting to be processed, oldest first
+        self.requests = collections.deque()
 
     def init_trunk_analyzer(self, width_estimation_config_file_path):
         """
@@ -72,7 +69,7 @@ class TrunkDataConnection(QThread):
         Args:
             width_estimation_config_file_path (str): The path to the width estimation config file"""
         self.mutex.lock()
-        self.trunk_analyzer, self.trunk_segmenter = import_trunk_analyzer(width_estimation_config_file_path)
+        self.trunk_data_analyzer = TrunkDataAnalyzer(width_estimation_config_file_path, self.class_mapping)
         self.mutex.unlock()
 
     def run(self):
@@ -81,32 +78,71 @@ class TrunkDataConnection(QThread):
         """
         while True:
             self.mutex.lock()
-            self.wait_condition.wait(self.mutex)
-            if self.current_msg is not None:
-                result = self.get_trunk_data(self.current_msg, return_seg_img=True)
-                
-                if not self.for_display_only:
-                    self.signal_request_processed.emit(result)
-                    
-                self.current_msg = None
+            while not self.requests:
+                self.wait_condition.wait(self.mutex)
+            request_data = self.requests.popleft()
             self.mutex.unlock()
+
+            # The mutex isn't held while processing, so more requests can be queued in the meantime
+            result = self.get_trunk_data(request_data["current_msg"], return_seg_img=True)
+
+            if not request_data.get("for_display_only", False):
+                self.signal_request_processed.emit(result)
+                if request_data.get("request_id") is not None:
+                    self.signal_request_result.emit(request_data["request_id"], result)
     
     @pyqtSlot(dict)
     def handle_request(self, request_data):
         """ 
-        Receive a request for trunk data and saves the request data
+        Receive a request for trunk data and queue it
+
+        Args:
+            request_data (dict): The request, with the 'current_msg' to get the trunk data of, optionally 'for_display_only'
+                                 if the result is only to be displayed and a 'request_id' to send the result back with on
+                                 signal_request_result
         """
         self.mutex.lock()
-        self.current_msg = request_data["current_msg"]
-        
-        if "for_display_only" in request_data:
-            self.for_display_only = request_data["for_display_only"]
-        else:
-            self.for_display_only = False
-        
+        # Only the latest image to display is kept, so browsing through the images doesn't queue up every one of them
+        if request_data.get("for_display_only", False):
+            self.requests = collections.deque(request for request in self.requests
+                                              if not request.get("for_display_only", False))
+        self.requests.append(request_data)
         self.wait_condition.wakeAll()
         self.mutex.unlock()
 
+    def get_detection_config(self):
+        """
+        Get the configuration the trunk data is found with, for keying the stored trunk data of a detection cache
+
+        Returns:
+            dict: The configuration
+        """
+        config = {"connection": type(self).__name__,
+                  "config_file": WIDTH_ESTIMATION_CONFIG_FILE,
+                  "class_mapping": list(self.class_mapping),
+                  "offset": list(self.offset)}
+
+        # The contents of the config file if there is one, so changing it changes the configuration
+        config_file_path = self.width_estimation_config_file_path
+        if config_file_path is not None and os.path.isfile(config_file_path):
+            with open(config_file_path, "rb") as f:
+                config["config_file_digest"] = hashlib.sha256(f.read()).hexdigest()
+
+        try:
+            config["package_version"] = version("trunk_width_estimation")
+        except PackageNotFoundError:
+            config["package_version"] = None
+
+        return config
+
+    def clear_requests(self):
+        """
+        Drop the requests that haven't been processed yet, the one being processed still finishes
+        """
+        self.mutex.lock()
+        self.requests.clear()
+        self.mutex.unlock()
+
     def get_trunk_data(self, current_msg, return_seg_img=False):
         """
         Get the trunk data from the trunk width estimation package
@@ -119,7 +155,7 @@ class TrunkDataConnection(QThread):
             tuple: The positions, widths, class estimates, and segmented image if return_seg_img is True
         """
 
-        results_dict, results = self.trunk_segmenter.get_results(current_msg['rgb_image'])
+        results_dict, results = self.trunk_data_analyzer.segment(current_msg['rgb_image'])
 
         if self.unfiltered_image_display_num != -1:
             seg_img_og = results.plot()
@@ -155,37 +191,21 @@ class TrunkDataConnection(QThread):
             results (list): The results from the trunk segmenter
         """
 
-        self.positions, self.widths, self.class_estimates, self.x_positions_in_image, self.results_kept = (
-            self.trunk_analyzer.get_width_estimation_pf(current_msg['depth_image'], results_dict=results_dict))
+        (self.positions, self.widths, self.class_estimates, self.x_positions_in_image, self.results_kept,
+         self.seg_img) = self.trunk_data_analyzer.analyze(current_msg['depth_image'], results_dict, results)
 
-        if self.emitting_save_calibration_data:
-            calibration_data = copy.deepcopy(current_msg)
-            calibration_data['x_positions_in_image'] = copy.deepcopy(self.x_positions_in_image)
-            self.signal_save_calibration_data.emit(calibration_data)
-                                            
-        if self.results_kept is not None:
-            self.seg_img = results[self.results_kept].plot()
-        else:
+        if self.seg_img is None:
             self.seg_img = current_msg['rgb_image']
 
-        if self.class_estimates is not None:
-            self.class_estimates = self.remap_classes(self.class_estimates)
-    
-    def remap_classes(self, class_estimates):
-        """
-        Remap the classes from the trunk segmenter to the classes used in the localization package
-
-        Args:
-            class_estimates (np.array): The class estimates from the trunk segmenter
-
-        Returns:
-            np.array: The class estimates with the classes remapped
-        """
-        class_estimates_copy = class_estimates.copy()
-        for i, class_num in enumerate(self.class_mapping):
-            class_estimates_copy[class_estimates == i] = class_num
-
-        return class_estimates_copy
+        if self.emitting_save_calibration_data:
+            # The trunk data goes with the images, since by the time the receiver gets it this thread may be on a later
+            # image. None of it is changed after this, so the receiver can share it instead of copying.
+            calibration_data = dict(current_msg)
+            calibration_data['x_positions_in_image'] = self.x_positions_in_image
+            calibration_data['positions'] = self.positions
+            calibration_data['widths'] = self.widths
+            calibration_data['class_estimates'] = self.class_estimates
+            self.signal_save_calibration_data.emit(calibration_data)
 
     def print_messages(self, positions, widths):
         """
@@ -272,7 +292,31 @@ class TrunkDataConnectionCachedData(TrunkDataConnection):
         """
         super().__init__(class_mapping=class_mapping, offset=offset)
 
+        self.cached_image_source = None
+        self.set_cached_img_directory(cached_img_directory)
+
+    def set_cached_img_directory(self, cached_img_directory):
+        """
+        Set the directory the cached images are read from, closing the packed image files of the previous one
+
+        Args:
+            cached_img_directory (str): The directory containing the cached images
+        """
+        if self.cached_image_source is not None:
+            self.cached_image_source.close()
+
         self.cached_img_directory = cached_img_directory
+
+        # Reads the images from packed image files in the directory if there are any, otherwise from the image files
+        self.cached_image_source = CachedImageSource(cached_img_directory)
+
+    def shutdown(self):
+        """
+        Close the packed image files of the cached images
+        """
+        if self.cached_image_source is not None:
+            self.cached_image_source.close()
+            self.cached_image_source = None
     
     def init_trunk_analyzer(self, width_estimation_config_file_path):
         """
@@ -295,16 +339,16 @@ class TrunkDataConnectionCachedData(TrunkDataConnection):
             return None, None, None
 
         msg_data = current_msg['data']['tree_data']
-        self.positions = np.array(msg_data['positions'])
-        self.widths = np.array(msg_data['widths'])
-        self.class_estimates = np.array(msg_data['classes'], dtype=np.int32)
+        self.positions = np.asarray(msg_data['positions'])
+        self.widths = np.asarray(msg_data['widths'])
+        self.class_estimates = np.asarray(msg_data['classes'], dtype=np.int32)
 
         self.seg_img = self.load_cached_img(current_msg['timestamp'])
 
         if self.segmented_image_display_num != -1:
             self.signal_segmented_image.emit(self.seg_img, self.segmented_image_display_num)
 
-        self.class_estimates = self.remap_classes(self.class_estimates)
+        self.class_estimates = remap_classes(self.class_estimates, self.class_mapping)
         self.print_messages(self.positions, self.widths)
 
         return self.positions, self.widths, self.class_estimates
@@ -317,11 +361,10 @@ class TrunkDataConnectionCachedData(TrunkDataConnection):
             time_stamp (int): The time stamp of the image
 
         Returns:
-            np.ndarray: The image
+            np.ndarray: The image, or None if the connection has been shut down
         """
-        time_stamp = str(int(1000*time_stamp))
-        file_path = self.cached_img_directory + "/" + time_stamp + ".png"
-        img = cv2.imread(file_path)
-        return img
+        if self.cached_image_source is None:
+            return None
+        return self.cached_image_source.get_image(time_stamp)
 
 
@@ -7,6 +7,7 @@ from cv_bridge import CvBridge
 from pf_orchard_interfaces.msg import TreeImageData, TreeInfo, TreePosition, StampedFloat
 from pf_orchard_interfaces.srv import TreeImageProcessing
 from .trunk_data_connection import TrunkDataConnection
+from ..pipeline.sources import remap_classes
 import numpy as np
 import time 
 from std_srvs.srv import Trigger
@@ -88,7 +89,7 @@ class TrunkDataConnectionRosService(TrunkDataConnection):
             self.signal_segmented_image.emit(self.seg_img, self.segmented_image_display_num)
         
         if self.class_estimates is not None:
-            self.class_estimates = self.remap_classes(self.class_estimates)
+            self.class_estimates = remap_classes(self.class_estimates, self.class_mapping)
 
         if not return_seg_img:
             return self.positions, self.widths, self.class_estimates
@@ -280,7 +281,7 @@ class TrunkDataConnectionRosSub(TrunkDataConnectionRosService):
         tree_positions, widths, class_estimates, seg_img = self.tree_image_msg_2_trunk_data(tree_image_data)
                 
         if self.class_estimates is not None:
-            self.class_estimates = self.remap_classes(self.class_estimates)
+            self.class_estimates = remap_classes(self.class_estimates, self.class_mapping)
         
         trunk_data = {"positions": tree_positions, "widths": widths, "classes": class_estimates}
         timestamp = tree_image_data.header.stamp.sec + tree_image_data.header.stamp.nanosec * 1e-9
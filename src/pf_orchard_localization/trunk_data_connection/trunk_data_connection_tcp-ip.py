@@ -1,84 +1,141 @@
-import socket
-import struct
-import pickle
+import collections
 import time
-import numpy as np
-from typing import List, Callable, Optional
-from PyQt5.QtCore import QThread, pyqtSignal, pyqtSlot, QApplication
+from typing import Optional
+from PyQt5.QtCore import QThread, pyqtSignal
 from .trunk_data_connection import TrunkDataConnection
+from ..pipeline.sources import remap_classes
+from .tcp_transport import TrunkDataClient
+from .shm_transport import SharedMemoryTrunkDataClient, DEFAULT_SHM_ADDRESS, is_local_host, is_consumer_listening
 
 class TrunkDataConnectionJetson(TrunkDataConnection):
     """
-    Class for connecting to the trunk data producer from the trunk_width_estimation package. This isn't currenltly used
-    in the system, but is left here in case it is needed in the future.
+    Class for getting the trunk data from a trunk data consumer running the trunk_width_estimation package in another
+    process, such as on a Jetson, instead of segmenting the images in this one. The images are sent over TCP, or through
+    shared memory when the consumer is on this host, see ProducerThread. Requests are sent as soon as they're queued, so
+    up to max_in_flight images are at the consumer at once, and their results are sent back in the order they were
+    requested.
     """
 
     def __init__(self,
-                 width_estimation_config_file_path: str = None,
-                 seg_image_display_func: Callable[[Optional[np.ndarray]], None] = None,
-                 pre_filtered_segmentation_display_func: Callable[[Optional[np.ndarray]], None] = None,
-                 original_image_display_func: Callable[[Optional[np.ndarray]], None] = None,
                  class_mapping=(1, 2, 0),
                  offset=(0, 0),
-                 message_printer: Callable[[List[str]], None] = None):
+                 server_address=('localhost', 65432),
+                 shm_address: Optional[str] = DEFAULT_SHM_ADDRESS,
+                 response_timeout=2.0,
+                 max_in_flight=4):
         """
         Args:
-            width_estimation_config_file_path (str, optional): The path to the width estimation config file. Defaults to None.
-            seg_image_display_func (Callable[[Optional[np.ndarray]], None], optional): The function to display the segmented image. Defaults to None.
-            pre_filtered_segmentation_display_func (Callable[[Optional[np.ndarray]], None], optional): The function to display the pre-filtered segmentation image. Defaults to None.
-            original_image_display_func (Callable[[Optional[np.ndarray]], None], optional): The function to display the original image. Defaults to None.
             class_mapping (tuple, optional): The mapping of classes from the trunk width estimation package to this one. Defaults to (1, 2, 0).
             offset (tuple, optional): The offset to apply to the positions. Defaults to (0, 0).
-            message_printer (Callable[[List[str]], None], optional): The function to print messages. Defaults to None.
+            server_address (tuple, optional): The host and port of the consumer. Defaults to ('localhost', 65432).
+            shm_address (str, optional): The unix socket of the shared memory transport of the consumer, used instead of
+                                         TCP when it's on this host. Defaults to DEFAULT_SHM_ADDRESS, None to always use
+                                         TCP.
+            response_timeout (float, optional): The most time to wait for the trunk data of an image, in seconds.
+                                                Defaults to 2.0.
+            max_in_flight (int, optional): The most requests at the consumer at once. Defaults to 4.
         """
-        super().__init__(width_estimation_config_file_path=None,
-                         seg_image_display_func=seg_image_display_func,
-                         pre_filtered_segmentation_display_func=pre_filtered_segmentation_display_func,
-                         original_image_display_func=original_image_display_func,
-                         class_mapping=class_mapping,
-                         offset=offset,
-                         message_printer=message_printer)
-
-        self.producer_thread = ProducerThread()
-        self.producer_thread.image_completed.connect(self.image_data_received)
+        super().__init__(class_mapping=class_mapping, offset=offset)
+
+        self.response_timeout = response_timeout
+
+        self.producer_thread = ProducerThread(server_address=server_address, max_in_flight=max_in_flight,
+                                              shm_address=shm_address)
+        self.producer_thread.signal_print_message.connect(self.signal_print_message.emit)
         self.producer_thread.start()
 
-        self.waiting_for_response = False
+    def init_trunk_analyzer(self, width_estimation_config_file_path):
+        """
+        The trunk data comes from the consumer, so there's no trunk analyzer or segmenter to initialize
+        """
+        pass
 
-        self.positions = None
-        self.widths = None
-        self.class_estimates = None
-        self.seg_img = None
+    def run(self):
+        """
+        The main loop of the thread, sends each queued request to the consumer right away and handles the results in
+        the order they were requested, picking up the requests queued in the meantime after each one
+        """
+        in_flight = collections.deque()
+        while True:
+            self.mutex.lock()
+            while not self.requests and not in_flight:
+                self.wait_condition.wait(self.mutex)
+            new_requests = list(self.requests)
+            self.requests.clear()
+            self.mutex.unlock()
+
+            for request_data in new_requests:
+                # Only the latest image to display is kept, the same as for the queued requests
+                if request_data.get("for_display_only", False):
+                    for old_request in [old_request for old_request in in_flight
+                                        if old_request[0].get("for_display_only", False)]:
+                        in_flight.remove(old_request)
+                        self.producer_thread.client.discard(old_request[1])
+
+                current_msg = request_data["current_msg"]
+                request_id = self.producer_thread.send_images(current_msg['rgb_image'], current_msg['depth_image'])
+                in_flight.append((request_data, request_id, time.time()))
+
+            request_data, request_id, send_time = in_flight.popleft()
+            result = self.wait_for_trunk_data(request_data["current_msg"], request_id, send_time, return_seg_img=True)
+
+            if not request_data.get("for_display_only", False):
+                self.signal_request_processed.emit(result)
+                if request_data.get("request_id") is not None:
+                    self.signal_request_result.emit(request_data["request_id"], result)
 
     def get_trunk_data(self, current_msg, return_seg_img=False):
+        """
+        Get the trunk data of a message from the consumer
 
-        self.waiting_for_response = True
-        self.producer_thread.send_images(current_msg['rgb_image'], current_msg['depth_image'])
+        Args:
+            current_msg (dict): The current message
+            return_seg_img (bool, optional): Whether to return the segmented image. Defaults to False.
 
-        start_time = time.time()
+        Returns:
+            tuple: The positions, widths, class estimates, and segmented image if return_seg_img is True, all None if
+                   the consumer didn't respond in time
+        """
+        request_id = self.producer_thread.send_images(current_msg['rgb_image'], current_msg['depth_image'])
+        return self.wait_for_trunk_data(current_msg, request_id, time.time(), return_seg_img)
 
-        while self.waiting_for_response:
-            time.sleep(0.005)
-            QApplication.processEvents()
-            if time.time() - start_time > 2:
-                print("Timeout waiting for response")
-                if return_seg_img:
-                    return None, None, None, None
-                else:
-                    return None, None, None
+    def wait_for_trunk_data(self, current_msg, request_id, send_time, return_seg_img=False):
+        """
+        Wait for the trunk data of a message sent to the consumer, its result is dropped if it doesn't come in time
 
-        print("Time to get response: ", time.time() - start_time)
+        Args:
+            current_msg (dict): The message
+            request_id (int): The request ID the images were sent with
+            send_time (float): The time the images were sent
+            return_seg_img (bool, optional): Whether to return the segmented image. Defaults to False.
+
+        Returns:
+            tuple: The positions, widths, class estimates, and segmented image if return_seg_img is True, all None if
+                   the consumer didn't respond in time
+        """
+        result = self.producer_thread.client.get_result(request_id, timeout=self.response_timeout)
+        if result is None:
+            self.producer_thread.client.discard(request_id)
+            self.signal_print_message.emit("Timeout waiting for the trunk data consumer")
+            if return_seg_img:
+                return None, None, None, None
+            else:
+                return None, None, None
+
+        self.image_data_received(*result)
+
+        self.signal_print_message.emit("Time to get response: {:.3f}s".format(time.time() - send_time))
         if self.positions is not None:
             self.print_messages(self.positions, self.widths)
 
         if self.seg_img is None:
             self.seg_img = current_msg['rgb_image']
 
-        if self.original_image_display_func is not None:
-            self.original_image_display_func(current_msg['rgb_image'])
+        if self.original_image_display_num != -1:
+            self.signal_original_image.emit(current_msg['rgb_image'], self.original_image_display_num)
 
-        if self.seg_image_display_func is not None:
-            self.seg_image_display_func(self.seg_img)
+        if self.segmented_image_display_num != -1:
+            self.signal_segmented_image.emit(self.seg_img, self.segmented_image_display_num)
 
         if return_seg_img:
             return self.positions, self.widths, self.class_estimates, self.seg_img
@@ -92,83 +149,75 @@ class TrunkDataConnectionJetson(TrunkDataConnection):
         self.seg_img = seg_img
 
         if self.class_estimates is not None:
-            self.class_estimates = self.remap_classes(self.class_estimates)
-
-        # print("Received data from producer thread")
-
-        self.waiting_for_response = False
+            self.class_estimates = remap_classes(self.class_estimates, self.class_mapping)
 
 
 class ProducerThread(QThread):
-    image_completed = pyqtSignal(object, object, object, object)
+    """
+    Keeps a connection to the trunk data consumer, reconnecting when it drops. The images are sent and the results
+    received by a TrunkDataClient, see tcp_transport, or by a
+    SharedMemoryTrunkDataClient when the consumer is on this host and listening for one, see shm_transport.
+    """
+    signal_print_message = pyqtSignal(str)
 
-    def __init__(self, server_address=('localhost', 65432), parent=None):
+    def __init__(self, server_address=('localhost', 65432), max_in_flight=4, shm_address=None, parent=None):
+        """
+        Args:
+            server_address (tuple, optional): The host and port of the consumer. Defaults to ('localhost', 65432).
+            max_in_flight (int, optional): The most requests at the consumer at once. Defaults to 4.
+            shm_address (str, optional): The unix socket of the shared memory transport of the consumer. Defaults to
+                                         None, which always uses TCP.
+            parent (QObject, optional): The parent of the thread. Defaults to None.
+        """
         super(ProducerThread, self).__init__(parent)
         self.server_address = server_address
         self.running = True
-        self.sock = None
-        self.queue = []
         self.connected_to_consumer = False
 
+        # A socket file can be left by a consumer that crashed, so the shared memory transport is only used if a
+        # consumer accepts a connection on it, otherwise this falls back to TCP
+        if shm_address is not None and is_local_host(server_address[0]) and is_consumer_listening(shm_address):
+            self.client = SharedMemoryTrunkDataClient(shm_address, num_slots=max_in_flight)
+        else:
+            self.client = TrunkDataClient(server_address, max_in_flight=max_in_flight)
+
     def run(self):
         while self.running:
             try:
-                # Create a socket object
-                self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                self.sock.connect(self.server_address)
-
-                self.connected_to_consumer = True
-
-                while self.running:
-                    if self.queue:
-                        rgb_image, depth_image = self.queue.pop(0)
-
-                        # Prepare data for sending
-                        data = {
-                            'rgb_image': rgb_image,
-                            'depth_image': depth_image
-                        }
-                        serialized_data = pickle.dumps(data)
-                        data_length = len(serialized_data)
-
-                        # Send the length of the serialized data first
-                        self.sock.sendall(struct.pack("I", data_length))
-                        # Send the serialized data
-                        self.sock.sendall(serialized_data)
-
-                        # Receive data from the consumer
-                        ack_length = struct.unpack("I", self.sock.recv(4))[0]
-                        ack_data = b''
-                        while len(ack_data) < ack_length:
-                            ack_data += self.sock.recv(ack_length - len(ack_data))
-
-                        if ack_data:
-                            response = pickle.loads(ack_data)
-                            positions = response["positions"]
-                            widths = response["widths"]
-                            class_estimates = response["class_estimates"]
-                            seg_img = response["seg_img"]
-
-                            if positions is not None:
-                                self.image_completed.emit(positions, widths, class_estimates, seg_img)
-                            else:
-                                self.image_completed.emit(None, None, None, None)
-                    else:
-                        self.msleep(5)  # Sleep for a short period to avoid busy waiting
-            except (ConnectionRefusedError, BrokenPipeError):
-                print("Connection error, retrying in 5 seconds...")
+                self.client.connect()
+            except OSError:
+                self.signal_print_message.emit("Connection error, retrying in 5 seconds...")
                 self.msleep(5000)
-            finally:
-                self.connected_to_consumer = False
-                if self.sock:
-                    self.sock.close()
+                continue
+
+            self.connected_to_consumer = True
+
+            # Wait for the connection to drop or the thread to be stopped
+            with self.client.condition:
+                self.client.condition.wait_for(lambda: not self.client.running)
+
+            self.connected_to_consumer = False
+            self.client.close(drop_queued=not self.running)
+            if self.running:
+                self.signal_print_message.emit("Connection to the consumer lost: {}, reconnecting...".format(
+                    self.client.error))
 
-    @pyqtSlot(np.ndarray, np.ndarray)
     def send_images(self, rgb_image, depth_image):
-        self.queue.append((rgb_image, depth_image))
+        """
+        Queue images to be sent to the consumer
+
+        Args:
+            rgb_image (np.ndarray): The rgb image
+            depth_image (np.ndarray): The depth image
+
+        Returns:
+            int: The request ID
+        """
+        return self.client.submit(rgb_image, depth_image)
 
     def stop(self):
         self.connected_to_consumer = False
         self.running = False
+        self.client.close()
         self.quit()
-        self.wait()
\ No newline at end of file
+        self.wait()
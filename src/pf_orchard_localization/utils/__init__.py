@@ -1,3 +1,9 @@
 from .get_map_data import get_map_data
 from .parameters import ParametersPf, ParametersCachedData, ParametersBagData
-from .pf_evaluation import PfTestExecutor
\ No newline at end of file
+from .pf_evaluation import PfTestExecutor
+from .dataset_cache import DatasetCache
+from .parallel_pf_evaluation import ParallelPfTestExecutor
+from .result_cache import ResultCache
+from .detection_cache import DetectionCache
+from .image_writer_pool import ImageWriterPool, ImageEncoder
+from .parameter_sweep import ParameterSweep
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+import multiprocessing
+import numpy as np
+from ..recorded_data_loaders import Bag2DataLoader, CachedDataStreamWriter, BINARY_CACHED_DATA_EXTENSION
+from ..recorded_data_loaders.array_file import open_array_file
+from ..recorded_data_loaders.binary_cached_data_loader import json_cached_data_to_arrays
+from ..recorded_data_loaders.packed_image_store import time_stamp_to_key
+from ..trunk_data_connection.trunk_analysis import TrunkDataAnalyzer
+from .image_writer_pool import ImageEncoder
+
+# Converts ros2 bags to cached data files without the app. Each bag is converted by its own worker process, which
+# converts the images in batches and streams the results to a .partial file that's renamed once the bag is done, so an
+# interrupted conversion picks up from the last chunk written.
+
+PARTIAL_EXTENSION = ".partial"
+
+
+@dataclass
+class BagToCacheSettings:
+    """
+    Settings for converting bags to cached data files
+    """
+    depth_topic: str
+    rgb_topic: str
+    odom_topic: str
+    output_dir: str
+
+    image_dir: str = None
+    image_format: str = "png"
+    batch_size: int = 8
+    class_mapping: tuple = (1, 2, 0)
+    ground_truth_dir: str = None
+    overwrite: bool = False
+
+
+class TrunkBatchProcessor:
+    """
+    Runs the trunk segmenter and analyzer on batches of images, one image at a time since the segmenter only takes one,
+    with the same TrunkDataAnalyzer as the TrunkDataConnection
+    """
+
+    def __init__(self, class_mapping=(1, 2, 0)):
+        """
+        Args:
+            class_mapping (tuple, optional): The mapping of classes for the trunk data. Defaults to (1, 2, 0).
+        """
+        self.trunk_data_analyzer = TrunkDataAnalyzer(class_mapping=class_mapping)
+
+    def process_batch(self, img_msgs):
+        """
+        Get the trunk data of a batch of image messages
+
+        Args:
+            img_msgs (list): The image messages from the bag data loader
+
+        Returns:
+            list: The positions, widths, class estimates, and segmented image of each message
+        """
+        trunk_data = []
+        for img_msg in img_msgs:
+            results_dict, results = self.trunk_data_analyzer.segment(img_msg['rgb_image'])
+            positions, widths, class_estimates, _, _, seg_img = self.trunk_data_analyzer.analyze(
+                img_msg['depth_image'], results_dict, results)
+            trunk_data.append((positions, widths, class_estimates, seg_img))
+
+        return trunk_data
+
+
+def load_ground_truth(ground_truth_dir, run_name):
+    """
+    Load the location estimates of the images from an existing cached data file of the same run, to carry them over to
+    the new cached data file
+
+    Args:
+        ground_truth_dir (str): The directory with the existing cached data files
+        run_name (str): The name of the run, the cached data file name without the extension
+
+    Returns:
+        dict: The x, y, theta location estimate by image key, or None if there's no cached data file for the run
+    """
+    if ground_truth_dir is None:
+        return None
+
+    binary_file_path = os.path.join(ground_truth_dir, run_name + BINARY_CACHED_DATA_EXTENSION)
+    json_file_path = os.path.join(ground_truth_dir, run_name + ".json")
+
+    if os.path.exists(binary_file_path):
+        arrays, _ = open_array_file(binary_file_path)
+    elif os.path.exists(json_file_path):
+        with open(json_file_path) as f:
+            arrays = json_cached_data_to_arrays(json.load(f))
+    else:
+        return None
+
+    has_ground_truth = ~np.isnan(arrays['gt_x'])
+    return {time_stamp_to_key(time_stamp): (x, y, theta) for time_stamp, x, y, theta in
+            zip(arrays['img_t'][has_ground_truth], arrays['gt_x'][has_ground_truth], arrays['gt_y'][has_ground_truth],
+                arrays['gt_theta'][has_ground_truth])}
+
+
+def get_odom_data(odom_msg):
+    """
+    Get the odometry data from a bag odometry message, the same as PfBagThread does
+
+    Args:
+        odom_msg (nav_msgs.msg.Odometry): The odometry message
+
+    Returns:
+        tuple: The x movement, theta movement, and time stamp of the odometry data
+    """
+    x_odom = odom_msg.twist.twist.linear.x
+    theta_odom = odom_msg.twist.twist.angular.z
+    time_stamp_odom = odom_msg.header.stamp.sec + odom_msg.header.stamp.nanosec * 1e-9
+    return x_odom, theta_odom, time_stamp_odom
+
+
+# The trunk processor of each worker process, made once when the worker starts since loading the models is slow
+worker_trunk_processor = None
+
+
+def init_worker(class_mapping):
+    """
+    Initialize a worker process
+
+    Args:
+        class_mapping (tuple): The mapping of classes for the trunk data
+    """
+    global worker_trunk_processor
+    worker_trunk_processor = TrunkBatchProcessor(class_mapping)
+
+
+def convert_bag(bag_path, settings, progress_queue=None, trunk_processor=None):
+    """
+    Convert a bag to a cached data file. If a .partial file from an interrupted conversion of the bag exists, the
+    conversion continues from the end of it.
+
+    Args:
+        bag_path (str): The path to the bag
+        settings (BagToCacheSettings): The conversion settings
+        progress_queue (Queue, optional): Queue to put (run name, images done, total images) progress updates on.
+                                          Defaults to None.
+        trunk_processor (TrunkBatchProcessor, optional): The trunk processor to use. Defaults to the worker's.
+
+    Returns:
+        tuple: The path to the cached data file, and the number of images converted
+    """
+    if trunk_processor is None:
+        trunk_processor = worker_trunk_processor
+
+    run_name = os.path.basename(os.path.normpath(bag_path))
+    output_file_path = os.path.join(settings.output_dir, run_name + BINARY_CACHED_DATA_EXTENSION)
+    partial_file_path = output_file_path + PARTIAL_EXTENSION
+
+    if os.path.exists(output_file_path) and not settings.overwrite:
+        return output_file_path, 0
+
+    data_manager = Bag2DataLoader(bag_path, settings.depth_topic, settings.rgb_topic, settings.odom_topic)
+    ground_truth = load_ground_truth(settings.ground_truth_dir, run_name)
+    if ground_truth is None:
+        # The location estimates are NaN then, and the tests can't be evaluated on the cached data file
+        logging.warning(f"No ground truth for {run_name}, the cached data file can't be used to evaluate tests")
+
+    # The messages are written in the same order every time, so the messages already in the partial file are skipped
+    if os.path.exists(partial_file_path) and not settings.overwrite:
+        writer = CachedDataStreamWriter.recover(partial_file_path)
+    else:
+        writer = CachedDataStreamWriter(partial_file_path, metadata={'source': run_name})
+    start_pos = writer.num_msgs
+
+    image_encoder = ImageEncoder(settings.image_format)
+    if settings.image_dir is not None:
+        os.makedirs(settings.image_dir, exist_ok=True)
+
+    num_img_msgs = data_manager.num_img_msgs
+    num_imgs_done = int(data_manager.img_prefix_counts[min(start_pos, data_manager.num_msgs)])
+
+    def write_batch(batch_msgs):
+        """
+        Process the images in a batch of messages and write all the messages in order
+        """
+        img_msgs = [msg for msg in batch_msgs if msg['topic'] == 'image']
+        trunk_data = iter(trunk_processor.process_batch(img_msgs)) if img_msgs else iter(())
+
+        for msg in batch_msgs:
+            if msg['topic'] == 'odom':
+                writer.append_odom(*get_odom_data(msg['data']))
+                continue
+
+            positions, widths, class_estimates, seg_img = next(trunk_data)
+            time_stamp = msg['timestamp']
+
+            if positions is None:
+                writer.append_tree_data(None, None, None, None, time_stamp)
+                continue
+
+            location_estimate = (np.nan, np.nan, np.nan)
+            if ground_truth is not None:
+                location_estimate = ground_truth.get(time_stamp_to_key(time_stamp), location_estimate)
+            writer.append_tree_data(positions, widths, class_estimates, location_estimate, time_stamp)
+
+            if settings.image_dir is not None and seg_img is not None:
+                image_encoder.write(os.path.join(settings.image_dir, str(time_stamp_to_key(time_stamp))), seg_img)
+
+    batch_msgs = []
+    num_batch_imgs = 0
+    for data_pos in range(start_pos, data_manager.num_msgs):
+        msg = data_manager.get_msg(data_pos)
+        batch_msgs.append(msg)
+
+        if msg['topic'] != 'image':
+            continue
+
+        num_batch_imgs += 1
+        if num_batch_imgs >= settings.batch_size:
+            write_batch(batch_msgs)
+            num_imgs_done += num_batch_imgs
+            batch_msgs = []
+            num_batch_imgs = 0
+
+            if progress_queue is not None:
+                progress_queue.put((run_name, num_imgs_done, num_img_msgs))
+
+    write_batch(batch_msgs)
+    num_imgs_done += num_batch_imgs
+
+    writer.finalize()
+    os.replace(partial_file_path, output_file_path)
+
+    if progress_queue is not None:
+        progress_queue.put((run_name, num_imgs_done, num_img_msgs))
+
+    return output_file_path, num_img_msgs
+
+
+def convert_bags(bag_paths, settings, num_workers=2, progress_callback=None):
+    """
+    Convert bags to cached data files, with a pool of worker processes each converting one bag at a time
+
+    Args:
+        bag_paths (list): The paths to the bags
+        settings (BagToCacheSettings): The conversion settings
+        num_workers (int, optional): The number of worker processes. Defaults to 2.
+        progress_callback (Callable, optional): Called with the progress of each bag as it changes, with the run name,
+                                                images done and total images. Defaults to None.
+
+    Returns:
+        dict: The path to the cached data file of each bag, or the exception raised converting it
+    """
+    os.makedirs(settings.output_dir, exist_ok=True)
+
+    results = {}
+    with multiprocessing.Manager() as manager:
+        progress_queue = manager.Queue()
+
+        with ProcessPoolExecutor(max_workers=num_workers, initializer=init_worker,
+                                 initargs=(settings.class_mapping,)) as executor:
+            futures = {executor.submit(convert_bag, bag_path, settings, progress_queue): bag_path
+                       for bag_path in bag_paths}
+
+            pending = set(futures)
+            while pending:
+                report_progress(progress_queue, progress_callback)
+
+                done = [future for future in pending if future.done()]
+                for future in done:
+                    pending.remove(future)
+                    bag_path = futures[future]
+                    try:
+                        results[bag_path] = future.result()[0]
+                    except Exception as e:
+                        logging.exception(f"Failed to convert {bag_path}")
+                        results[bag_path] = e
+
+                time.sleep(0.1)
+
+            report_progress(progress_queue, progress_callback)
+
+    return results
+
+
+def report_progress(progress_queue, progress_callback):
+    """
+    Pass the progress updates waiting in the queue to the progress callback
+
+    Args:
+        progress_queue (Queue): The queue of progress updates
+        progress_callback (Callable): The progress callback, or None
+    """
+    while not progress_queue.empty():
+        progress_update = progress_queue.get()
+        if progress_callback is not None:
+            progress_callback(*progress_update)
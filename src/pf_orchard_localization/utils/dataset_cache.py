@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+import json
+import os
+from collections import OrderedDict
+import numpy as np
+from ..pipeline.sources import remap_classes
+from ..recorded_data_loaders import BinaryCachedDataLoader, BINARY_CACHED_DATA_EXTENSION
+from ..recorded_data_loaders.array_file import open_array_file
+from ..recorded_data_loaders.binary_cached_data_loader import json_cached_data_to_arrays, CACHED_DATA_COLUMNS
+
+
+class DatasetCache:
+    """
+    In memory cache of cached data files for running tests. Each data file is parsed once into the columns of the binary
+    cached data format, with the trunk classes remapped up front, and the columns are shared read only by the data loaders
+    of every test and trial that uses the file. The least recently used files are dropped when the cache grows past its
+    memory budget.
+    """
+
+    def __init__(self, max_bytes=2 * 1024 ** 3, class_mapping=(1, 2, 0)):
+        """
+        Args:
+            max_bytes (int, optional): The memory budget of the cache in bytes. The most recently used file is always
+                                       kept, even if it's larger than the budget. Defaults to 2 GiB.
+            class_mapping (tuple, optional): The mapping of classes from the trunk width estimation package to this one,
+                                             or None to keep the classes as they are in the files. Defaults to (1, 2, 0).
+        """
+        self.max_bytes = max_bytes
+        self.class_mapping = tuple(class_mapping) if class_mapping is not None else None
+
+        # The columns of each file and their size in bytes, keyed by the file path and modification time, in order of
+        # use with the most recent last
+        self.entries = OrderedDict()
+        self.num_bytes = 0
+
+        self.num_hits = 0
+        self.num_misses = 0
+
+    @staticmethod
+    def find_data_file(cached_data_files_dir, data_file_name):
+        """
+        Find the path of a cached data file, preferring the binary version if the file has been converted
+
+        Args:
+            cached_data_files_dir (str): The directory containing the cached data files
+            data_file_name (str): The name of the data file, without the extension
+
+        Returns:
+            str: The path to the data file
+        """
+        data_file_path = os.path.join(cached_data_files_dir, data_file_name + BINARY_CACHED_DATA_EXTENSION)
+        if os.path.isfile(data_file_path):
+            return data_file_path
+        return os.path.join(cached_data_files_dir, data_file_name + ".json")
+
+    def get_arrays(self, data_file_path):
+        """
+        Get the columns of a cached data file, parsing the file if it isn't in the cache
+
+        Args:
+            data_file_path (str): The path to the json or binary cached data file
+
+        Returns:
+            dict: The read only columns of the binary cached data format, with the trunk classes remapped
+        """
+        key = (os.path.abspath(data_file_path), os.stat(data_file_path).st_mtime_ns)
+
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.num_hits += 1
+            return self.entries[key][0]
+
+        self.num_misses += 1
+        arrays = self.load_arrays(data_file_path)
+        num_bytes = sum(array.nbytes for array in arrays.values())
+
+        self.entries[key] = (arrays, num_bytes)
+        self.num_bytes += num_bytes
+        self.evict()
+
+        return arrays
+
+    def get_data_loader(self, data_file_path, time_window=None):
+        """
+        Get a data loader for a cached data file that provides the messages from the cached columns. Making the data
+        loader doesn't copy the columns, so it's cheap to make one per test.
+
+        Args:
+            data_file_path (str): The path to the json or binary cached data file
+            time_window (tuple, optional): The start and end time of the data to index. Defaults to None.
+
+        Returns:
+            BinaryCachedDataLoader: The data loader
+        """
+        return BinaryCachedDataLoader.from_arrays(self.get_arrays(data_file_path), data_file_path, time_window)
+
+    def load_arrays(self, data_file_path):
+        """
+        Parse a cached data file into in memory columns, with the messages sorted by time and the trunk classes remapped
+
+        Args:
+            data_file_path (str): The path to the json or binary cached data file
+
+        Returns:
+            dict: The read only columns of the binary cached data format
+        """
+        if data_file_path.endswith(BINARY_CACHED_DATA_EXTENSION):
+            file_arrays, _ = open_array_file(data_file_path, names=tuple(CACHED_DATA_COLUMNS))
+            # Copy the columns out of the memory map so they don't depend on the file staying the same
+            arrays = {name: np.array(array) for name, array in file_arrays.items()}
+        else:
+            with open(data_file_path) as f:
+                arrays = json_cached_data_to_arrays(json.load(f))
+
+        # Sort the messages once here rather than in every data loader
+        msg_t = arrays['msg_t']
+        if len(msg_t) > 1 and np.any(msg_t[1:] < msg_t[:-1]):
+            order = np.argsort(msg_t, kind='stable')
+            for name in ('msg_t', 'msg_types', 'msg_rows'):
+                arrays[name] = arrays[name][order]
+
+        if self.class_mapping is not None:
+            arrays['trunk_classes'] = remap_classes(np.asarray(arrays['trunk_classes'], dtype=np.int32),
+                                                    self.class_mapping)
+
+        for array in arrays.values():
+            array.flags.writeable = False
+
+        return arrays
+
+    def evict(self):
+        """
+        Drop the least recently used files until the cache is within its memory budget
+        """
+        while self.num_bytes > self.max_bytes and len(self.entries) > 1:
+            _, (_, num_bytes) = self.entries.popitem(last=False)
+            self.num_bytes -= num_bytes
+
+    def clear(self):
+        """
+        Drop all the files from the cache
+        """
+        self.entries.clear()
+        self.num_bytes = 0
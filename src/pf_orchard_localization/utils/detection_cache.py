@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import threading
+import numpy as np
+
+# Stores the trunk data found in the images of the bag files, so replaying a bag doesn't run the segmenter and width
+# analyzer on the same images again. The trunk data of an image is keyed by the identity of its bag, the time stamp of the
+# image and a hash of the configuration of the trunk data connection, so changing the configuration or the bag gives new
+# keys and old trunk data is never served for them. Bump DETECTION_CACHE_VERSION when a change here or to how the trunk
+# data is found changes the trunk data.
+
+DETECTION_CACHE_VERSION = 1
+
+# How much of the start of each bag file is hashed for its identity, hashing all of a bag would take as long as
+# segmenting it
+BAG_HASH_BYTES = 1 << 20
+
+
+def hash_bag(bag_path):
+    """
+    Hash the identity of a bag, the names and sizes of its files and the start of each one, so a copy of a bag has the same
+    identity but a different bag with the same name doesn't
+
+    Args:
+        bag_path (str): The path to the bag file, or the directory of a ros2 bag
+
+    Returns:
+        str: The hex digest of the bag
+    """
+    if os.path.isdir(bag_path):
+        file_paths = sorted(os.path.join(bag_path, file_name) for file_name in os.listdir(bag_path))
+        file_paths = [file_path for file_path in file_paths if os.path.isfile(file_path)]
+    else:
+        file_paths = [bag_path]
+
+    bag_hash = hashlib.sha256()
+    for file_path in file_paths:
+        bag_hash.update(os.path.basename(file_path).encode())
+        bag_hash.update(str(os.path.getsize(file_path)).encode())
+        with open(file_path, "rb") as f:
+            bag_hash.update(f.read(BAG_HASH_BYTES))
+    return bag_hash.hexdigest()
+
+
+def hash_config(config):
+    """
+    Hash the configuration of a trunk data connection
+
+    Args:
+        config (dict): The configuration, see TrunkDataConnection.get_detection_config
+
+    Returns:
+        str: The hex digest of the configuration
+    """
+    inputs = {"cache_version": DETECTION_CACHE_VERSION, "config": config}
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def array_to_bytes(array):
+    """
+    Serialize an array, keeping its dtype and shape
+
+    Args:
+        array (np.ndarray): The array
+
+    Returns:
+        bytes: The serialized array
+    """
+    buffer = io.BytesIO()
+    np.save(buffer, np.asarray(array), allow_pickle=False)
+    return buffer.getvalue()
+
+
+def bytes_to_array(data):
+    """
+    Deserialize an array serialized with array_to_bytes
+
+    Args:
+        data (bytes): The serialized array
+
+    Returns:
+        np.ndarray: The array
+    """
+    return np.load(io.BytesIO(data), allow_pickle=False)
+
+
+class DetectionCache:
+    """
+    Persistent store of the trunk data of bag images, in a sqlite database file
+    """
+
+    def __init__(self, db_path, store_seg_imgs=False, seg_img_quality=90, timeout=60.0):
+        """
+        Args:
+            db_path (str): The path to the database file, made if it doesn't exist
+            store_seg_imgs (bool, optional): Whether to store the segmented images with the trunk data, as jpegs. Defaults
+                                             to False.
+            seg_img_quality (int, optional): The jpeg quality of the stored segmented images. Defaults to 90.
+            timeout (float, optional): How long to wait for other processes to release the database, in seconds.
+                                       Defaults to 60.0.
+        """
+        self.db_path = db_path
+        self.store_seg_imgs = store_seg_imgs
+        self.seg_img_quality = seg_img_quality
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, timeout=timeout, check_same_thread=False)
+
+        with self.lock:
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS detections (
+                    bag_key TEXT,
+                    config_key TEXT,
+                    image_key INTEGER,
+                    positions BLOB,
+                    widths BLOB,
+                    classes BLOB,
+                    seg_img BLOB,
+                    PRIMARY KEY (bag_key, config_key, image_key)
+                );
+            """)
+
+        # The identities of the bags hashed so far, by path, with the size and modification time they were hashed at
+        self.bag_keys = {}
+
+        self.num_hits = 0
+        self.num_misses = 0
+
+    def get_bag_key(self, bag_path):
+        """
+        Get the identity of a bag, only hashing it again once it changes
+
+        Args:
+            bag_path (str): The path to the bag
+
+        Returns:
+            str: The identity of the bag, see hash_bag
+        """
+        bag_path = os.path.abspath(bag_path)
+        bag_stat = os.stat(bag_path)
+        stamp = (bag_stat.st_size, bag_stat.st_mtime_ns)
+
+        if bag_path not in self.bag_keys or self.bag_keys[bag_path][0] != stamp:
+            self.bag_keys[bag_path] = (stamp, hash_bag(bag_path))
+        return self.bag_keys[bag_path][1]
+
+    @staticmethod
+    def get_image_key(time_stamp):
+        """
+        Get the key of an image from its time stamp, in microseconds so the float time stamps match exactly
+
+        Args:
+            time_stamp (float): The time stamp of the image in seconds
+
+        Returns:
+            int: The key
+        """
+        return int(round(time_stamp * 1e6))
+
+    def get(self, bag_key, config_key, time_stamp):
+        """
+        Get the trunk data of an image
+
+        Args:
+            bag_key (str): The identity of the bag, see get_bag_key
+            config_key (str): The hash of the trunk data connection configuration, see hash_config
+            time_stamp (float): The time stamp of the image
+
+        Returns:
+            tuple: The positions, widths and class estimates of the trunks, all None if there were no trunks, and the
+                   segmented image or None if it wasn't stored. None if the image isn't in the cache.
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT positions, widths, classes, seg_img FROM detections "
+                                          "WHERE bag_key = ? AND config_key = ? AND image_key = ?",
+                                          (bag_key, config_key, self.get_image_key(time_stamp))).fetchone()
+        if row is None:
+            self.num_misses += 1
+            return None
+
+        self.num_hits += 1
+        positions, widths, classes, seg_img = row
+        if positions is None:
+            trunk_data = (None, None, None)
+        else:
+            trunk_data = (bytes_to_array(positions), bytes_to_array(widths), bytes_to_array(classes))
+
+        if seg_img is not None:
+            import cv2
+            seg_img = cv2.imdecode(np.frombuffer(seg_img, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+
+        return trunk_data + (seg_img,)
+
+    def put(self, bag_key, config_key, time_stamp, positions, widths, class_estimates, seg_img=None):
+        """
+        Store the trunk data of an image
+
+        Args:
+            bag_key (str): The identity of the bag, see get_bag_key
+            config_key (str): The hash of the trunk data connection configuration, see hash_config
+            time_stamp (float): The time stamp of the image
+            positions (np.ndarray): The positions of the trunks, or None if there were no trunks
+            widths (np.ndarray): The widths of the trunks
+            class_estimates (np.ndarray): The class estimates of the trunks
+            seg_img (np.ndarray, optional): The segmented image, only stored if store_seg_imgs is set. Defaults to None.
+        """
+        if positions is None:
+            arrays = (None, None, None)
+        else:
+            arrays = (array_to_bytes(positions), array_to_bytes(widths), array_to_bytes(class_estimates))
+
+        encoded_seg_img = None
+        if self.store_seg_imgs and seg_img is not None:
+            import cv2
+            success, encoded = cv2.imencode(".jpg", seg_img, [cv2.IMWRITE_JPEG_QUALITY, self.seg_img_quality])
+            if success:
+                encoded_seg_img = encoded.tobytes()
+
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO detections (bag_key, config_key, image_key, positions, "
+                                    "widths, classes, seg_img) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                    (bag_key, config_key, self.get_image_key(time_stamp)) + arrays + (encoded_seg_img,))
+
+    def clear(self):
+        """
+        Remove all the stored trunk data
+        """
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM detections")
+
+    def close(self):
+        """
+        Close the database
+        """
+        with self.lock:
+            self.connection.close()
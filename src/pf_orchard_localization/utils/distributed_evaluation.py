@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+from dataclasses import asdict
+from ..pipeline import ExecutionClock
+from .parameters import ParametersPf
+from .pf_evaluation import PfTestRegimen
+from .early_stopping import EarlyStopping, TEST_MAX_TRIALS, TEST_CONFIDENCE_INTERVAL
+from . import parallel_pf_evaluation
+from .parallel_pf_evaluation import get_trial_seeds
+
+# Runs a test regimen on workers on any number of machines through a job queue. The coordinator puts one job per trial
+# of each test on the queue, along with the configuration the workers need, and the workers lease jobs, run them and post
+# the results. The trial seeds are made the same way as the ParallelPfTestExecutor makes them, so for the same seed the
+# results are the same as running the regimen on one machine. The paths in the configuration need to be valid on every
+# worker, for example on a shared file system. A queue holds the jobs of one configuration, so submitting to a queue with
+# a different configuration or seed is refused rather than mixing the results of the two. Every trial of a test is put on
+# the queue, and a test stopped early by the confidence interval only keeps the results up to where the
+# ParallelPfTestExecutor would have stopped it.
+
+
+def make_job_id(test_index, trial_num):
+    """
+    Make the id of the job that runs a trial of a test
+
+    Args:
+        test_index (int): The index of the test in the test regimen
+        trial_num (int): The number of the trial
+
+    Returns:
+        str: The job id
+    """
+    return f"{test_index}:{trial_num}"
+
+
+class DistributedPfTestCoordinator:
+    """
+    Puts the trials of a test regimen on a job queue and collects the results into the test regimen
+    """
+
+    def __init__(self,
+                 job_queue,
+                 parameters_pf: ParametersPf,
+                 test_info_path: str,
+                 cached_data_files_dir: str,
+                 map_data_path: str,
+                 num_trials,
+                 class_mapping=(1, 2, 0),
+                 save_path=None,
+                 convergence_threshold=0.5,
+                 print_message_func=print,
+                 seed=None,
+                 data_time_window=60.0,
+                 early_stopping=None,
+                 clock=None):
+        """
+        Args:
+            job_queue (SqliteJobQueue or BrokerJobQueue): The job queue
+            parameters_pf (ParametersPf): The parameters for the particle filter
+            test_info_path (str): The path to the csv file containing the test information
+            cached_data_files_dir (str): The directory containing the cached data files
+            map_data_path (str): The path to the map data file
+            num_trials (int): The number of trials to run for each test
+            class_mapping (tuple, optional): The mapping of classes from the trunk width estimation package to this one. Defaults to (1, 2, 0).
+            save_path (str, optional): The path to save the results to. Defaults to None.
+            convergence_threshold (float, optional): The distance at which the particle filter is considered to have converged. Defaults to 0.5.
+            print_message_func (function, optional): The function to use for printing messages. Defaults to print.
+            seed (int, optional): The seed the trial seeds are spawned from. Defaults to None, which uses a random one.
+            data_time_window (float, optional): How much of the data file after the start time of a test to load at first,
+                                                in seconds. Defaults to 60.0.
+            early_stopping (EarlyStopping, optional): When to stop tests and trials early. Defaults to None.
+            clock (ExecutionClock, optional): Paces and times the trials on the workers. Defaults to None, which runs
+                                              them as fast as possible.
+        """
+        self.job_queue = job_queue
+        self.parameters_pf = parameters_pf
+        self.test_info_path = test_info_path
+        self.cached_data_files_dir = cached_data_files_dir
+        self.map_data_path = map_data_path
+        self.num_trials = num_trials
+        self.class_mapping = class_mapping
+        self.save_path = save_path
+        self.convergence_threshold = convergence_threshold
+        self.print_message_func = print_message_func
+        self.seed = seed
+        self.data_time_window = data_time_window
+        self.early_stopping = early_stopping if early_stopping is not None else EarlyStopping()
+        self.clock = clock if clock is not None else ExecutionClock()
+
+        self.test_regimen = PfTestRegimen(test_info_path, print_message_func)
+
+    def get_config(self):
+        """
+        Get the configuration the workers need to run the jobs
+
+        Returns:
+            dict: The configuration
+        """
+        return {"parameters_pf": asdict(self.parameters_pf),
+                "test_info_path": os.path.abspath(self.test_info_path),
+                "cached_data_files_dir": os.path.abspath(self.cached_data_files_dir),
+                "map_data_path": os.path.abspath(self.map_data_path),
+                "class_mapping": list(self.class_mapping),
+                "convergence_threshold": self.convergence_threshold,
+                "data_time_window": self.data_time_window,
+                "early_stopping": asdict(self.early_stopping),
+                "clock": {"mode": self.clock.mode,
+                          "speed_factor": self.clock.speed_factor,
+                          "added_delay": self.clock.added_delay}}
+
+    def submit_jobs(self, test_indices=None):
+        """
+        Put the trials of the tests on the job queue. Submitting again, for example after restarting the coordinator,
+        doesn't add the jobs already on the queue again.
+
+        Args:
+            test_indices (list, optional): The indices of the tests to run. Defaults to all the tests.
+
+        Returns:
+            int: The number of jobs added to the queue
+        """
+        if test_indices is None:
+            test_indices = range(self.test_regimen.num_tests)
+
+        # The seed has to be the same every time the jobs are submitted, so a random one is stored with the queue
+        stored_config = self.job_queue.get_config()
+        if self.seed is None:
+            self.seed = stored_config["seed"] if stored_config is not None and "seed" in stored_config else time.time_ns()
+
+        config = self.get_config()
+        config["seed"] = self.seed
+
+        # The job ids don't say which configuration they're for, so jobs of another one would be taken as these
+        config = json.loads(json.dumps(config))
+        if stored_config is not None and stored_config != config:
+            changed = sorted(key for key in set(config) | set(stored_config) if config.get(key) != stored_config.get(key))
+            raise ValueError("The job queue has the jobs of a different configuration, changed: {}. Use a new queue to "
+                             "run this configuration.".format(", ".join(changed)))
+        self.job_queue.set_config(config)
+
+        trial_seeds = get_trial_seeds(self.seed, self.test_regimen.num_tests, self.num_trials)
+        jobs = [(make_job_id(test_index, trial_num), test_index, trial_num, int(trial_seeds[test_index, trial_num]))
+                for test_index in test_indices for trial_num in range(self.num_trials)]
+
+        num_added = self.job_queue.add_jobs(jobs)
+        self.print_message_func("Added {} of {} jobs to the queue".format(num_added, len(jobs)))
+        return num_added
+
+    def wait_for_results(self, progress_callback=None, poll_interval=2.0):
+        """
+        Wait until all the jobs on the queue are done
+
+        Args:
+            progress_callback (Callable, optional): Called with the job queue status whenever it changes. Defaults to
+                                                    None.
+            poll_interval (float, optional): How often to check the queue, in seconds. Defaults to 2.0.
+        """
+        last_status = None
+        while True:
+            status = self.job_queue.status()
+            if status != last_status:
+                if progress_callback is not None:
+                    progress_callback(status)
+                last_status = status
+
+            if status["pending"] == 0 and status["leased"] == 0:
+                return
+            time.sleep(poll_interval)
+
+    def collect_results(self):
+        """
+        Add the results from the job queue to the tests in the test regimen, in trial order, and set the tests with all
+        their trials done, or stopped early by the confidence interval, as completed
+        """
+        results = {}
+        for _, test_index, trial_num, *result in self.job_queue.get_results():
+            results[(test_index, trial_num)] = result
+
+        # The tests with failed trials aren't completed
+        for job_id, _, _, attempts, error in self.job_queue.get_failures():
+            self.print_message_func("Job {} failed after {} attempts: {}".format(job_id, attempts, error))
+
+        for test_index, test_info in enumerate(self.test_regimen.pf_tests):
+            test_info.reset_results()
+
+            for trial_num in range(self.num_trials):
+                if (test_index, trial_num) not in results:
+                    break
+                test_info.add_results(*results[(test_index, trial_num)])
+
+                if trial_num + 1 == self.num_trials:
+                    test_info.set_completed(TEST_MAX_TRIALS)
+                elif self.early_stopping.test_done(test_info.results_convergence_accuracy):
+                    test_info.set_completed(TEST_CONFIDENCE_INTERVAL)
+                    break
+
+    def run_all_tests(self, progress_callback=None, poll_interval=2.0):
+        """
+        Put all the tests on the job queue, wait for the workers to run them and collect the results
+
+        Args:
+            progress_callback (Callable, optional): Called with the job queue status whenever it changes. Defaults to
+                                                    None.
+            poll_interval (float, optional): How often to check the queue, in seconds. Defaults to 2.0.
+        """
+        self.submit_jobs()
+        self.wait_for_results(progress_callback, poll_interval)
+        self.collect_results()
+
+        if self.save_path is not None:
+            self.process_results(self.save_path)
+
+    def process_results(self, save_path):
+        """
+        Process the results of the tests and save them to a csv file
+
+        Args:
+            save_path (str): The path to save the results to
+        """
+        self.test_regimen.process_results(save_path=save_path)
+
+
+class LeaseRenewer(threading.Thread):
+    """
+    Keeps renewing the lease of a job while a worker runs it
+    """
+
+    def __init__(self, job_queue, job_id, worker_id, lease_time):
+        """
+        Args:
+            job_queue (SqliteJobQueue or BrokerJobQueue): The job queue
+            job_id (str): The id of the job
+            worker_id (str): The id of the worker
+            lease_time (float): How long each lease lasts, the lease is renewed three times per lease time
+        """
+        super().__init__(daemon=True)
+        self.job_queue = job_queue
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.lease_time = lease_time
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.wait(self.lease_time / 3):
+            try:
+                self.job_queue.renew_lease(self.job_id, self.worker_id, self.lease_time)
+            except Exception:
+                # Try again next time, if the queue stays unreachable the lease expires and the job is requeued
+                pass
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+
+def init_worker_from_config(config):
+    """
+    Set up the test executor of this worker from the configuration stored with the job queue
+
+    Args:
+        config (dict): The configuration
+    """
+    from map_data_tools import MapData
+
+    parameters_pf = ParametersPf(**config["parameters_pf"])
+    map_data = MapData(map_data_path=config["map_data_path"], move_origin=True, origin_offset=(5, 5))
+
+    parallel_pf_evaluation.init_worker(map_data, parameters_pf, config["test_info_path"],
+                                       config["cached_data_files_dir"], tuple(config["class_mapping"]),
+                                       config["convergence_threshold"], config["data_time_window"],
+                                       early_stopping=EarlyStopping(**config["early_stopping"]),
+                                       clock=ExecutionClock(**config["clock"]))
+
+
+def run_worker(job_queue, worker_id=None, lease_time=300.0, poll_interval=2.0, idle_timeout=None,
+               print_message_func=print):
+    """
+    Run jobs from a job queue until there are none left
+
+    Args:
+        job_queue (SqliteJobQueue or BrokerJobQueue): The job queue
+        worker_id (str, optional): The id of the worker. Defaults to the host name and process id.
+        lease_time (float, optional): How long a job can go without its lease being renewed before it's given to another
+                                      worker, in seconds. Defaults to 300.0.
+        poll_interval (float, optional): How long to wait before checking for jobs again when there are none to lease but
+                                         other workers are still running jobs, in seconds. Defaults to 2.0.
+        idle_timeout (float, optional): Stop after going this long without a job, in seconds. Defaults to None, which
+                                        waits until all the jobs are done.
+        print_message_func (function, optional): The function to use for printing messages. Defaults to print.
+
+    Returns:
+        int: The number of jobs run
+    """
+    if worker_id is None:
+        worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+    config = job_queue.get_config()
+    while config is None:
+        time.sleep(poll_interval)
+        config = job_queue.get_config()
+
+    init_worker_from_config(config)
+
+    num_jobs_run = 0
+    idle_start_time = time.time()
+
+    while True:
+        job = job_queue.lease_job(worker_id, lease_time)
+
+        if job is None:
+            status = job_queue.status()
+            if status["pending"] == 0 and status["leased"] == 0:
+                break
+            if idle_timeout is not None and time.time() - idle_start_time > idle_timeout:
+                break
+            time.sleep(poll_interval)
+            continue
+
+        job_id, test_index, trial_num, seed = job
+
+        lease_renewer = LeaseRenewer(job_queue, job_id, worker_id, lease_time)
+        lease_renewer.start()
+        try:
+            _, _, *result = parallel_pf_evaluation.run_trial_job(test_index, trial_num, seed)
+        except Exception as e:
+            # Hand the job back rather than stopping the worker, the queue marks it failed after too many attempts
+            print_message_func("{} failed job {}:\n{}".format(worker_id, job_id, traceback.format_exc()))
+            job_queue.post_failure(job_id, worker_id, "{}: {}".format(type(e).__name__, e))
+            idle_start_time = time.time()
+            continue
+        finally:
+            lease_renewer.stop()
+
+        # The whole result of the trial is kept, so the aggregated results are the same as from one machine
+        job_queue.post_result(job_id, worker_id, *result)
+        num_jobs_run += 1
+        idle_start_time = time.time()
+
+        print_message_func("{} finished job {}".format(worker_id, job_id))
+
+    return num_jobs_run
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+from dataclasses import dataclass
+import numpy as np
+from ..pipeline import STOP_CONVERGED, STOP_END_OF_DATA
+
+# Rules for stopping the evaluation of the particle filter early. A test stops running trials once the confidence
+# interval on its convergence rate is narrow enough, a trial stops once the particles have all moved away from the ground
+# truth, since the filter can't recover from that, and a sweep drops configurations whose convergence rate is clearly
+# worse than the best configuration's after a few tests.
+
+# Why a trial stopped, the pipeline stops the trial itself when it converges or the data ends
+TRIAL_CONVERGED = STOP_CONVERGED
+TRIAL_END_OF_DATA = STOP_END_OF_DATA
+TRIAL_DIVERGED = "diverged"
+
+# Why a test stopped running trials
+TEST_MAX_TRIALS = "max_trials"
+TEST_CONFIDENCE_INTERVAL = "confidence_interval"
+
+# Why a sweep stopped evaluating a configuration
+CONFIG_COMPLETED = "completed"
+CONFIG_DOMINATED = "dominated"
+
+
+def wilson_interval(num_successes, num_trials, confidence=0.95):
+    """
+    Get the Wilson score interval of a success rate, which unlike the normal approximation stays in 0 to 1 and is usable
+    with few trials or rates near 0 or 1
+
+    Args:
+        num_successes (int): The number of successes
+        num_trials (int): The number of trials
+        confidence (float, optional): The confidence level of the interval. Defaults to 0.95.
+
+    Returns:
+        tuple: The lower and upper bounds of the interval, (0, 1) if there are no trials
+    """
+    if num_trials == 0:
+        return 0.0, 1.0
+
+    from scipy.stats import norm
+    z = norm.ppf(0.5 + confidence / 2)
+    rate = num_successes / num_trials
+    denominator = 1 + z ** 2 / num_trials
+    center = (rate + z ** 2 / (2 * num_trials)) / denominator
+    half_width = z * np.sqrt(rate * (1 - rate) / num_trials + z ** 2 / (4 * num_trials ** 2)) / denominator
+
+    return max(0.0, float(center - half_width)), min(1.0, float(center + half_width))
+
+
+@dataclass
+class EarlyStopping:
+    """
+    Settings for stopping trials, tests and sweep configurations early, each rule is off when its setting is None
+    """
+    # Stop running trials of a test once the confidence interval on its convergence rate is at most this wide
+    max_interval_width: float = None
+    # The fewest trials to run of a test before the confidence interval can stop it
+    min_trials: int = 5
+    confidence: float = 0.95
+    # Stop a trial once no particle is within this distance of the ground truth position, in meters
+    divergence_distance: float = None
+    # The number of tests to run all the configurations of a sweep on before dropping the dominated ones
+    sweep_min_tests: int = None
+
+    def test_done(self, convergences):
+        """
+        Check if a test has run enough trials for the confidence interval on its convergence rate to be narrow enough
+
+        Args:
+            convergences (list): Whether each trial so far converged to the correct location
+
+        Returns:
+            bool: True if the test can stop running trials
+        """
+        if self.max_interval_width is None or len(convergences) < self.min_trials:
+            return False
+
+        lower, upper = wilson_interval(int(np.sum(convergences)), len(convergences), self.confidence)
+        return upper - lower <= self.max_interval_width
+
+    def trial_diverged(self, particles, position_gt):
+        """
+        Check if all the particles are too far from the ground truth position for the trial to converge correctly
+
+        Args:
+            particles (np.ndarray): The particles, with the x and y positions in the first two columns
+            position_gt (np.ndarray): The ground truth x and y position
+
+        Returns:
+            bool: True if the trial should be stopped
+        """
+        if self.divergence_distance is None or position_gt is None:
+            return False
+
+        squared_distances = np.sum((particles[:, :2] - position_gt[:2]) ** 2, axis=1)
+        return bool(np.min(squared_distances) > self.divergence_distance ** 2)
+
+    def dominated(self, num_converged, num_trials, best_num_converged, best_num_trials):
+        """
+        Check if a configuration is clearly worse than the best one, with the upper bound of the confidence interval on its
+        convergence rate below the lower bound of the best one's, over the same trials
+
+        Args:
+            num_converged (int): The number of trials of the configuration that converged to the correct location
+            num_trials (int): The number of trials of the configuration
+            best_num_converged (int): The number of trials of the best configuration that converged to the correct location
+            best_num_trials (int): The number of trials of the best configuration
+
+        Returns:
+            bool: True if the configuration can be dropped
+        """
+        _, upper = wilson_interval(num_converged, num_trials, self.confidence)
+        best_lower, _ = wilson_interval(best_num_converged, best_num_trials, self.confidence)
+        return upper < best_lower
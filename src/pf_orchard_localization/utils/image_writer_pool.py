@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+import collections
+import json
+import logging
+import threading
+import numpy as np
+
+
+class ImageEncoder:
+    """
+    Writes images to files in one of the supported formats:
+    - png: PNG with a configurable compression level (0-9), works for 8 bit color and 16 bit depth images
+    - webp: Lossless WebP, usually smaller than PNG for color images. WebP only supports 8 bit images, so other images
+      are written as PNG
+    - npy: The raw array, the fastest to write and read but the largest on disk
+    """
+
+    FORMATS = ("png", "webp", "npy")
+
+    def __init__(self, image_format="png", png_compression=3):
+        """
+        Args:
+            image_format (str, optional): The format to write the images in, one of FORMATS. Defaults to "png".
+            png_compression (int, optional): The PNG compression level, from 0 (fastest) to 9 (smallest). Defaults to 3.
+        """
+        if image_format not in self.FORMATS:
+            raise ValueError(f"Image format must be one of {self.FORMATS}, got {image_format}")
+
+        self.image_format = image_format
+        self.png_compression = png_compression
+
+    def get_extension(self, image):
+        """
+        Get the file extension an image will be written with
+
+        Args:
+            image (np.ndarray): The image
+
+        Returns:
+            str: The file extension, including the dot
+        """
+        if self.image_format == "webp" and image.dtype != np.uint8:
+            return ".png"
+        return "." + self.image_format
+
+    def write(self, file_path_base, image):
+        """
+        Write an image to a file, raises an OSError if it can't be written
+
+        Args:
+            file_path_base (str): The path to write the image to, without the extension
+            image (np.ndarray): The image
+
+        Returns:
+            str: The path the image was written to
+        """
+        # Imported here so importing the pool, and writing npy images, doesn't need cv2
+        import cv2
+
+        extension = self.get_extension(image)
+        file_path = file_path_base + extension
+
+        if extension == ".npy":
+            np.save(file_path, image)
+            return file_path
+
+        if extension == ".webp":
+            # A quality above 100 makes the WebP encoder lossless
+            written = cv2.imwrite(file_path, image, [cv2.IMWRITE_WEBP_QUALITY, 101])
+        else:
+            written = cv2.imwrite(file_path, image, [cv2.IMWRITE_PNG_COMPRESSION, self.png_compression])
+
+        # cv2 returns False rather than raising when it can't write the file, such as when the directory doesn't exist
+        if not written:
+            raise OSError(f"Could not write image {file_path}")
+
+        return file_path
+
+
+class ImageWriterPool:
+    """
+    A pool of background threads that write images and json files, so encoding them doesn't block the thread they were
+    captured on. The queue of writes is bounded, and when it's full new writes are handled by the drop policy:
+    - block: wait up to block_timeout seconds for space in the queue, then drop the new write
+    - drop_newest: drop the new write
+    - drop_oldest: drop the oldest write in the queue to make space
+
+    The images are written from the arrays that are passed in, so they must not be changed after they're submitted.
+    Stopping the pool writes everything still in the queue first.
+    """
+
+    DROP_POLICIES = ("block", "drop_newest", "drop_oldest")
+
+    def __init__(self, num_workers=2, max_queue_size=32, drop_policy="block", block_timeout=1.0, encoder=None):
+        """
+        Args:
+            num_workers (int, optional): The number of writer threads. Defaults to 2.
+            max_queue_size (int, optional): The maximum number of writes waiting in the queue. Defaults to 32.
+            drop_policy (str, optional): What to do when the queue is full, one of DROP_POLICIES. Defaults to "block".
+            block_timeout (float, optional): How long the block policy waits for space in seconds. Defaults to 1.0.
+            encoder (ImageEncoder, optional): The encoder to write images with. Defaults to PNG.
+        """
+        if drop_policy not in self.DROP_POLICIES:
+            raise ValueError(f"Drop policy must be one of {self.DROP_POLICIES}, got {drop_policy}")
+
+        self.max_queue_size = max_queue_size
+        self.drop_policy = drop_policy
+        self.block_timeout = block_timeout
+        self.encoder = encoder if encoder is not None else ImageEncoder()
+
+        self.queue = collections.deque()
+        self.condition = threading.Condition()
+        self.num_in_progress = 0
+        self.num_written = 0
+        self.num_dropped = 0
+        self.num_errors = 0
+        self.stopping = False
+
+        self.workers = [threading.Thread(target=self.worker_loop, name=f"image_writer_{i}", daemon=True)
+                        for i in range(num_workers)]
+        for worker in self.workers:
+            worker.start()
+
+    @property
+    def queue_depth(self):
+        """
+        Returns the number of writes that are queued or being written
+        """
+        with self.condition:
+            return len(self.queue) + self.num_in_progress
+
+    def set_encoder(self, encoder):
+        """
+        Set the encoder used for the images submitted after this
+
+        Args:
+            encoder (ImageEncoder): The encoder
+        """
+        self.encoder = encoder
+
+    def submit_image(self, file_path_base, image, encoder=None):
+        """
+        Queue an image to be written
+
+        Args:
+            file_path_base (str): The path to write the image to, without the extension
+            image (np.ndarray): The image
+            encoder (ImageEncoder, optional): The encoder to use for this image. Defaults to the pool's encoder.
+
+        Returns:
+            bool: True if the image was queued, False if it was dropped
+        """
+        encoder = encoder if encoder is not None else self.encoder
+        return self.submit(encoder.write, file_path_base, image)
+
+    def submit_json(self, file_path, data):
+        """
+        Queue json data to be written
+
+        Args:
+            file_path (str): The path to write the json file to
+            data (dict): The data to write
+
+        Returns:
+            bool: True if the data was queued, False if it was dropped
+        """
+        return self.submit(write_json, file_path, data)
+
+    def submit_images_with_json(self, images, file_path, data, encoder=None):
+        """
+        Queue images and json data to be written as one write, the json file after the images. The json file is only
+        written if all the images were, and if the write is dropped none of them are, so there are images for every json
+        file.
+
+        Args:
+            images (list): The path to write each image to, without the extension, and the image
+            file_path (str): The path to write the json file to
+            data (dict): The data to write
+            encoder (ImageEncoder, optional): The encoder to use for the images. Defaults to the pool's encoder.
+
+        Returns:
+            bool: True if the write was queued, False if it was dropped
+        """
+        encoder = encoder if encoder is not None else self.encoder
+        return self.submit(write_images_with_json, file_path, data, images, encoder)
+
+    def submit(self, write_function, *args):
+        """
+        Queue a write, applying the drop policy if the queue is full
+
+        Args:
+            write_function (Callable): The function that does the write
+            *args: The arguments to the function
+
+        Returns:
+            bool: True if the write was queued, False if it was dropped
+        """
+        with self.condition:
+            if self.stopping:
+                raise RuntimeError("Can't submit writes to a stopped image writer pool")
+
+            if len(self.queue) >= self.max_queue_size:
+                if self.drop_policy == "drop_oldest":
+                    self.queue.popleft()
+                    self.num_dropped += 1
+                elif self.drop_policy == "block":
+                    self.condition.wait_for(lambda: len(self.queue) < self.max_queue_size, timeout=self.block_timeout)
+
+                if len(self.queue) >= self.max_queue_size:
+                    self.num_dropped += 1
+                    return False
+
+            self.queue.append((write_function, args))
+            self.condition.notify_all()
+            return True
+
+    def worker_loop(self):
+        """
+        The loop of the writer threads, takes writes off the queue until the pool is stopped and the queue is empty
+        """
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.queue or self.stopping)
+                if not self.queue:
+                    return
+                write_function, args = self.queue.popleft()
+                self.num_in_progress += 1
+                self.condition.notify_all()
+
+            try:
+                write_function(*args)
+                succeeded = True
+            except Exception:
+                logging.exception("Image writer failed to write %s", args[0])
+                succeeded = False
+
+            with self.condition:
+                self.num_in_progress -= 1
+                if succeeded:
+                    self.num_written += 1
+                else:
+                    self.num_errors += 1
+                self.condition.notify_all()
+
+    def flush(self, timeout=None):
+        """
+        Wait until all the queued writes are written
+
+        Args:
+            timeout (float, optional): The maximum time to wait in seconds. Defaults to waiting until done.
+
+        Returns:
+            bool: True if all the writes finished
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.queue and self.num_in_progress == 0, timeout=timeout)
+
+    def stop(self):
+        """
+        Write everything left in the queue and stop the writer threads
+        """
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+
+        for worker in self.workers:
+            worker.join()
+
+
+def write_json(file_path, data):
+    """
+    Write data to a json file
+
+    Args:
+        file_path (str): The path to write the json file to
+        data (dict): The data to write
+    """
+    with open(file_path, 'w') as f:
+        json.dump(data, f, indent=4)
+
+
+def write_images_with_json(file_path, data, images, encoder):
+    """
+    Write images and then data to a json file
+
+    Args:
+        file_path (str): The path to write the json file to
+        data (dict): The data to write
+        images (list): The path to write each image to, without the extension, and the image
+        encoder (ImageEncoder): The encoder to write the images with
+    """
+    for file_path_base, image in images:
+        encoder.write(file_path_base, image)
+    write_json(file_path, data)
@@ -0,0 +1,463 @@
+#!/usr/bin/env python3
+import json
+import socket
+import socketserver
+import sqlite3
+import threading
+import time
+
+# Job queues for running test trials on many machines. A job is leased by one worker at a time, and if the worker doesn't
+# renew the lease before it expires, for example because the machine went down, the job goes back to the queue. Results
+# are keyed by the job, so a job that ends up run twice only keeps its first result. A job that fails, by raising or by
+# its worker going down, goes back to the queue until it has been tried max_attempts times, then it's marked failed so it
+# doesn't take down every worker that leases it.
+#
+# SqliteJobQueue keeps the queue in a sqlite file, which works for workers on a shared file system. JobBroker serves a
+# queue over tcp and BrokerJobQueue is the matching client, which is handy for testing on one machine. Lease times are
+# compared against each machine's clock, so the clocks of the machines need to roughly agree.
+
+# The job queue methods the broker serves
+JOB_QUEUE_METHODS = ("add_jobs", "lease_job", "renew_lease", "post_result", "post_failure", "status", "get_results",
+                     "get_failures", "set_config", "get_config")
+
+
+class SqliteJobQueue:
+    """
+    Job queue stored in a sqlite database file
+    """
+
+    def __init__(self, db_path, timeout=60.0, max_attempts=3):
+        """
+        Args:
+            db_path (str): The path to the database file, made if it doesn't exist. ":memory:" keeps the queue in memory,
+                           only visible to this object.
+            timeout (float, optional): How long to wait for other processes to release the database, in seconds.
+                                       Defaults to 60.0.
+            max_attempts (int, optional): How many times a job is leased before it's marked failed. Defaults to 3.
+        """
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+
+        # Transactions are started explicitly so leasing a job is atomic across processes
+        self.connection = sqlite3.connect(db_path, timeout=timeout, isolation_level=None, check_same_thread=False)
+
+        with self.lock:
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    job_order INTEGER,
+                    test_index INTEGER,
+                    trial_num INTEGER,
+                    seed INTEGER,
+                    state TEXT DEFAULT 'pending',
+                    worker_id TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER DEFAULT 0,
+                    error TEXT
+                );
+                CREATE TABLE IF NOT EXISTS results (
+                    job_id TEXT PRIMARY KEY,
+                    trial_time REAL,
+                    correct_convergence INTEGER,
+                    distance REAL,
+                    stop_reason TEXT,
+                    timing TEXT,
+                    worker_id TEXT
+                );
+                CREATE TABLE IF NOT EXISTS config (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+                CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, job_order);
+            """)
+
+    def add_jobs(self, jobs):
+        """
+        Add jobs to the queue, jobs that are already in the queue are left as they are
+
+        Args:
+            jobs (list): The job id, test index, trial number and seed of each job
+
+        Returns:
+            int: The number of jobs added
+        """
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                num_jobs = self.connection.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+                num_added = 0
+                for job_id, test_index, trial_num, seed in jobs:
+                    cursor = self.connection.execute(
+                        "INSERT OR IGNORE INTO jobs (job_id, job_order, test_index, trial_num, seed) VALUES (?, ?, ?, ?, ?)",
+                        (job_id, num_jobs + num_added, int(test_index), int(trial_num), int(seed)))
+                    num_added += cursor.rowcount
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+        return num_added
+
+    def lease_job(self, worker_id, lease_time):
+        """
+        Lease the next job that is waiting, or whose lease expired
+
+        Args:
+            worker_id (str): The id of the worker leasing the job
+            lease_time (float): How long the lease lasts before the job is given to another worker, in seconds
+
+        Returns:
+            list: The job id, test index, trial number and seed of the job, or None if there are no jobs to lease
+        """
+        now = time.time()
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                # Jobs whose workers went down on every attempt aren't tried again
+                self.connection.execute(
+                    "UPDATE jobs SET state = 'failed', error = COALESCE(error, 'The lease expired') "
+                    "WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?", (now, self.max_attempts))
+                job = self.connection.execute(
+                    "SELECT job_id, test_index, trial_num, seed FROM jobs "
+                    "WHERE state = 'pending' OR (state = 'leased' AND lease_expires < ?) "
+                    "ORDER BY job_order LIMIT 1", (now,)).fetchone()
+                if job is not None:
+                    self.connection.execute(
+                        "UPDATE jobs SET state = 'leased', worker_id = ?, lease_expires = ?, attempts = attempts + 1 "
+                        "WHERE job_id = ?", (worker_id, now + lease_time, job[0]))
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+        return list(job) if job is not None else None
+
+    def renew_lease(self, job_id, worker_id, lease_time):
+        """
+        Extend the lease of a job
+
+        Args:
+            job_id (str): The id of the job
+            worker_id (str): The id of the worker with the lease
+            lease_time (float): How long the lease lasts from now, in seconds
+
+        Returns:
+            bool: True if the worker still had the lease
+        """
+        with self.lock:
+            cursor = self.connection.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE job_id = ? AND worker_id = ? AND state = 'leased'",
+                (time.time() + lease_time, job_id, worker_id))
+        return cursor.rowcount > 0
+
+    def post_result(self, job_id, worker_id, trial_time, correct_convergence, distance, stop_reason=None, timing=None):
+        """
+        Post the result of a job. Only the first result of a job is kept.
+
+        Args:
+            job_id (str): The id of the job
+            worker_id (str): The id of the worker that ran the job
+            trial_time (float): The time the trial took
+            correct_convergence (bool): Whether the trial converged to the correct location
+            distance (float): The distance from the correct location
+            stop_reason (str, optional): Why the trial stopped, see early_stopping. Defaults to None.
+            timing (dict, optional): Where the time of the trial went, see ExecutionClock.get_timing. Defaults to None.
+
+        Returns:
+            bool: True if this was the first result of the job
+        """
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = self.connection.execute(
+                    "INSERT OR IGNORE INTO results (job_id, trial_time, correct_convergence, distance, stop_reason, timing, "
+                    "worker_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, float(trial_time), int(bool(correct_convergence)), float(distance), stop_reason,
+                     json.dumps(timing) if timing is not None else None, worker_id))
+                self.connection.execute("UPDATE jobs SET state = 'done', lease_expires = NULL WHERE job_id = ?",
+                                        (job_id,))
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+        return cursor.rowcount > 0
+
+    def post_failure(self, job_id, worker_id, error):
+        """
+        Post that a job raised, it goes back to the queue unless it has been tried max_attempts times
+
+        Args:
+            job_id (str): The id of the job
+            worker_id (str): The id of the worker that ran the job
+            error (str): The error the job raised
+
+        Returns:
+            bool: True if the job was marked failed rather than put back on the queue
+        """
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                self.connection.execute(
+                    "UPDATE jobs SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                    "lease_expires = NULL, error = ? WHERE job_id = ? AND worker_id = ? AND state = 'leased'",
+                    (self.max_attempts, error, job_id, worker_id))
+                state = self.connection.execute("SELECT state FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+        return state is not None and state[0] == "failed"
+
+    def status(self):
+        """
+        Count the jobs in each state
+
+        Returns:
+            dict: The number of pending, leased, done and failed jobs, where leased jobs with expired leases count as
+                  pending, or as failed if they have been tried max_attempts times
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT CASE WHEN state = 'leased' AND lease_expires < ? THEN "
+                "CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END ELSE state END AS job_state, "
+                "COUNT(*) FROM jobs GROUP BY job_state", (time.time(), self.max_attempts)).fetchall()
+        status = {"pending": 0, "leased": 0, "done": 0, "failed": 0}
+        status.update(dict(rows))
+        return status
+
+    def get_results(self):
+        """
+        Get the results posted so far
+
+        Returns:
+            list: The job id, test index, trial number, trial time, correct convergence, distance, stop reason and timing
+                  of each result
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT results.job_id, jobs.test_index, jobs.trial_num, results.trial_time, "
+                "results.correct_convergence, results.distance, results.stop_reason, results.timing "
+                "FROM results JOIN jobs ON results.job_id = jobs.job_id ORDER BY jobs.job_order").fetchall()
+        return [[job_id, test_index, trial_num, trial_time, bool(correct_convergence), distance, stop_reason,
+                 json.loads(timing) if timing is not None else None]
+                for job_id, test_index, trial_num, trial_time, correct_convergence, distance, stop_reason, timing in rows]
+
+    def get_failures(self):
+        """
+        Get the jobs that failed
+
+        Returns:
+            list: The job id, test index, trial number, number of attempts and last error of each failed job
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT job_id, test_index, trial_num, attempts, error FROM jobs WHERE state = 'failed' "
+                "ORDER BY job_order").fetchall()
+        return [list(row) for row in rows]
+
+    def set_config(self, config):
+        """
+        Store the configuration the workers need to run the jobs
+
+        Args:
+            config (dict): The configuration, must be json serializable
+        """
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO config (key, value) VALUES ('config', ?)",
+                                    (json.dumps(config),))
+
+    def get_config(self):
+        """
+        Get the configuration the workers need to run the jobs
+
+        Returns:
+            dict: The configuration, or None if it hasn't been set
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM config WHERE key = 'config'").fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def close(self):
+        """
+        Close the database connection
+        """
+        with self.lock:
+            self.connection.close()
+
+
+class JobBrokerRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Handles the requests of one client of the job broker, one json request per line
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if request["method"] not in JOB_QUEUE_METHODS:
+                    raise ValueError(f"Unknown method {request['method']}")
+                result = getattr(self.server.job_queue, request["method"])(*request.get("args", []))
+                response = {"result": result}
+            except Exception as e:
+                response = {"error": f"{type(e).__name__}: {e}"}
+
+            self.wfile.write((json.dumps(response) + "\n").encode())
+            self.wfile.flush()
+
+
+class JobBroker(socketserver.ThreadingTCPServer):
+    """
+    Serves a job queue over tcp, so workers that can't share a file can use the same queue
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, job_queue=None, host="127.0.0.1", port=0):
+        """
+        Args:
+            job_queue (SqliteJobQueue, optional): The job queue to serve. Defaults to a queue in memory.
+            host (str, optional): The address to listen on. Defaults to "127.0.0.1".
+            port (int, optional): The port to listen on, 0 picks a free port. Defaults to 0.
+        """
+        self.job_queue = job_queue if job_queue is not None else SqliteJobQueue(":memory:")
+        super().__init__((host, port), JobBrokerRequestHandler)
+
+        self.serve_thread = None
+
+    @property
+    def address(self):
+        """
+        Returns the host and port the broker is listening on
+        """
+        return self.server_address[:2]
+
+    def start(self):
+        """
+        Start serving requests on a background thread
+        """
+        self.serve_thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.serve_thread.start()
+
+    def stop(self):
+        """
+        Stop serving requests
+        """
+        self.shutdown()
+        self.server_close()
+
+
+class BrokerJobQueue:
+    """
+    Client of a JobBroker with the same methods as the SqliteJobQueue
+    """
+
+    def __init__(self, host="127.0.0.1", port=5600, timeout=60.0):
+        """
+        Args:
+            host (str, optional): The address of the broker. Defaults to "127.0.0.1".
+            port (int, optional): The port of the broker. Defaults to 5600.
+            timeout (float, optional): How long to wait for a response, in seconds. Defaults to 60.0.
+        """
+        self.address = (host, port)
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.sock = None
+        self.sock_file = None
+
+    def connect(self):
+        """
+        Connect to the broker if not connected
+        """
+        if self.sock is None:
+            self.sock = socket.create_connection(self.address, timeout=self.timeout)
+            self.sock_file = self.sock.makefile("rwb")
+
+    def call(self, method, *args):
+        """
+        Call a job queue method on the broker
+
+        Args:
+            method (str): The name of the method
+            *args: The arguments of the method
+
+        Returns:
+            The result of the method
+        """
+        with self.lock:
+            try:
+                self.connect()
+                self.sock_file.write((json.dumps({"method": method, "args": list(args)}) + "\n").encode())
+                self.sock_file.flush()
+                line = self.sock_file.readline()
+            except OSError:
+                self.close_connection()
+                raise
+
+            if not line:
+                self.close_connection()
+                raise ConnectionError("The job broker closed the connection")
+
+        response = json.loads(line)
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        return response["result"]
+
+    def close_connection(self):
+        """
+        Close the connection to the broker, it's reopened on the next call
+        """
+        if self.sock is not None:
+            self.sock_file.close()
+            self.sock.close()
+        self.sock = None
+        self.sock_file = None
+
+    def add_jobs(self, jobs):
+        return self.call("add_jobs", [list(job) for job in jobs])
+
+    def lease_job(self, worker_id, lease_time):
+        return self.call("lease_job", worker_id, lease_time)
+
+    def renew_lease(self, job_id, worker_id, lease_time):
+        return self.call("renew_lease", job_id, worker_id, lease_time)
+
+    def post_result(self, job_id, worker_id, trial_time, correct_convergence, distance, stop_reason=None, timing=None):
+        return self.call("post_result", job_id, worker_id, trial_time, correct_convergence, distance, stop_reason,
+                         timing)
+
+    def post_failure(self, job_id, worker_id, error):
+        return self.call("post_failure", job_id, worker_id, error)
+
+    def status(self):
+        return self.call("status")
+
+    def get_results(self):
+        return self.call("get_results")
+
+    def get_failures(self):
+        return self.call("get_failures")
+
+    def set_config(self, config):
+        return self.call("set_config", config)
+
+    def get_config(self):
+        return self.call("get_config")
+
+    def close(self):
+        with self.lock:
+            self.close_connection()
+
+
+def open_job_queue(queue_spec):
+    """
+    Open a job queue from a string, either tcp://host:port for a job broker or the path to a sqlite file
+
+    Args:
+        queue_spec (str): The job queue
+
+    Returns:
+        SqliteJobQueue or BrokerJobQueue: The job queue
+    """
+    if queue_spec.startswith("tcp://"):
+        host, port = queue_spec[len("tcp://"):].rsplit(":", 1)
+        return BrokerJobQueue(host, int(port))
+    return SqliteJobQueue(queue_spec)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+import csv
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from scipy.stats import t as t_distribution
+from .parameters import ParametersPf
+from .pf_evaluation import PfTestRegimen, get_trial_seeds
+from . import parallel_pf_evaluation
+from .parameter_sweep import run_config_trial_job
+
+# Compares two sets of particle filter parameters with common random numbers. Both run every trial of every test with the
+# same trial seed, and the particle filter gives its initialization, motion noise and resampling each their own stream
+# from that seed, so the two runs of a trial only differ by the parameters. The comparison is on the difference between
+# the two runs of each trial, which has much less noise than comparing two independent sets of trials, so fewer trials are
+# needed to tell whether a change helps.
+
+# The trial metrics that are compared, and the index of each in the trial results
+PAIRED_METRICS = {"convergence": 3, "trial_time": 2, "distance": 4, "cpu_time": 5}
+
+
+def paired_difference(values_a, values_b, confidence=0.95):
+    """
+    Get the mean of the paired differences b - a with its confidence interval, from the t distribution
+
+    Args:
+        values_a (np.ndarray): The values of each trial with the first parameters
+        values_b (np.ndarray): The values of the same trials with the second parameters
+        confidence (float, optional): The confidence level of the interval. Defaults to 0.95.
+
+    Returns:
+        dict: The number of pairs, the means of a and b, the mean difference, the standard deviation of the differences,
+              and the lower and upper bounds of the interval on the mean difference
+    """
+    values_a = np.asarray(values_a, dtype=float)
+    values_b = np.asarray(values_b, dtype=float)
+    differences = values_b - values_a
+    num_pairs = len(differences)
+
+    mean_difference = float(np.mean(differences)) if num_pairs > 0 else float("nan")
+    std_difference = float(np.std(differences, ddof=1)) if num_pairs > 1 else float("nan")
+
+    if num_pairs > 1:
+        half_width = t_distribution.ppf(0.5 + confidence / 2, num_pairs - 1) * std_difference / np.sqrt(num_pairs)
+    else:
+        half_width = float("inf")
+
+    return {"num_pairs": num_pairs,
+            "mean_a": float(np.mean(values_a)) if num_pairs > 0 else float("nan"),
+            "mean_b": float(np.mean(values_b)) if num_pairs > 0 else float("nan"),
+            "mean_difference": mean_difference,
+            "std_difference": std_difference,
+            "lower": mean_difference - half_width,
+            "upper": mean_difference + half_width}
+
+
+class PairedComparison:
+    """
+    Runs two sets of particle filter parameters on the same trials of a test regimen, on a pool of worker processes, and
+    compares them trial by trial
+    """
+
+    def __init__(self,
+                 map_data,
+                 parameters_a: ParametersPf,
+                 parameters_b: ParametersPf,
+                 test_info_path: str,
+                 cached_data_files_dir: str,
+                 num_trials,
+                 class_mapping=(1, 2, 0),
+                 convergence_threshold=0.5,
+                 num_workers=None,
+                 seed=None,
+                 confidence=0.95,
+                 data_time_window=60.0,
+                 print_message_func=print):
+        """
+        Args:
+            map_data (MapData): The map data, sent to each worker to make its particle filter engine
+            parameters_a (ParametersPf): The first parameters, the baseline
+            parameters_b (ParametersPf): The second parameters, compared to the first
+            test_info_path (str): The path to the csv file containing the test information
+            cached_data_files_dir (str): The directory containing the cached data files
+            num_trials (int): The number of trials to run for each test
+            class_mapping (tuple, optional): The mapping of classes from the trunk width estimation package to this one. Defaults to (1, 2, 0).
+            convergence_threshold (float, optional): The distance at which the particle filter is considered to have converged. Defaults to 0.5.
+            num_workers (int, optional): The number of worker processes. Defaults to the number of cpus.
+            seed (int, optional): The seed the trial seeds are spawned from. Defaults to None, which uses a random one.
+            confidence (float, optional): The confidence level of the intervals on the differences. Defaults to 0.95.
+            data_time_window (float, optional): How much of the data file after the start time of a test to load at first,
+                                                in seconds. Defaults to 60.0.
+            print_message_func (function, optional): The function to use for printing messages. Defaults to print.
+        """
+        self.map_data = map_data
+        self.parameters_a = parameters_a
+        self.parameters_b = parameters_b
+        self.test_info_path = test_info_path
+        self.cached_data_files_dir = cached_data_files_dir
+        self.num_trials = num_trials
+        self.class_mapping = class_mapping
+        self.convergence_threshold = convergence_threshold
+        self.num_workers = num_workers if num_workers is not None else multiprocessing.cpu_count()
+        self.seed = seed if seed is not None else time.time_ns()
+        self.confidence = confidence
+        self.data_time_window = data_time_window
+        self.print_message_func = print_message_func
+
+        self.test_regimen = PfTestRegimen(test_info_path, print_message_func)
+
+        # The trial results of each set of parameters, keyed by the test index and trial number
+        self.trial_results_a = {}
+        self.trial_results_b = {}
+
+    def run(self, test_indices=None):
+        """
+        Run every trial with both sets of parameters
+
+        Args:
+            test_indices (list, optional): The indices of the tests to run. Defaults to all the tests.
+
+        Returns:
+            dict: The paired difference of each metric, see get_differences
+        """
+        if test_indices is None:
+            test_indices = range(self.test_regimen.num_tests)
+        test_indices = list(test_indices)
+
+        trial_seeds = get_trial_seeds(self.seed, self.test_regimen.num_tests, self.num_trials)
+
+        self.print_message_func("Running {} paired trials on {} workers".format(len(test_indices) * self.num_trials,
+                                                                                 self.num_workers))
+
+        # Spawn the workers rather than forking, so they don't copy threads the calling process may have running
+        with ProcessPoolExecutor(max_workers=self.num_workers,
+                                 mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=parallel_pf_evaluation.init_worker,
+                                 initargs=(self.map_data, self.parameters_a, self.test_info_path,
+                                           self.cached_data_files_dir, self.class_mapping, self.convergence_threshold,
+                                           self.data_time_window)) as executor:
+
+            futures = [executor.submit(run_config_trial_job, config_index, parameters_pf, test_index, trial_num,
+                                       int(trial_seeds[test_index, trial_num]))
+                       for test_index in test_indices
+                       for trial_num in range(self.num_trials)
+                       for config_index, parameters_pf in enumerate((self.parameters_a, self.parameters_b))]
+
+            for future in as_completed(futures):
+                config_index, test_index, trial_num, *trial_result = future.result()
+                trial_results = self.trial_results_a if config_index == 0 else self.trial_results_b
+                trial_results[(test_index, trial_num)] = (test_index, trial_num, *trial_result)
+
+        return self.get_differences()
+
+    def get_differences(self, test_indices=None):
+        """
+        Get the paired differences of the trials run with both sets of parameters
+
+        Args:
+            test_indices (list, optional): Only use the trials of these tests. Defaults to all the tests run.
+
+        Returns:
+            dict: The paired difference of each metric in PAIRED_METRICS, see paired_difference
+        """
+        pairs = sorted(key for key in self.trial_results_a if key in self.trial_results_b and
+                       (test_indices is None or key[0] in test_indices))
+
+        differences = {}
+        for metric, result_index in PAIRED_METRICS.items():
+            values_a = [self.trial_results_a[key][result_index] for key in pairs]
+            values_b = [self.trial_results_b[key][result_index] for key in pairs]
+            differences[metric] = paired_difference(values_a, values_b, self.confidence)
+
+        return differences
+
+    def process_results(self, save_path=None, print_results=True):
+        """
+        Save the paired differences overall and for each test to a csv file, and print the overall ones
+
+        Args:
+            save_path (str, optional): The path to save the results to. Defaults to None.
+            print_results (bool, optional): Whether to print the overall results. Defaults to True.
+        """
+        overall_differences = self.get_differences()
+
+        if print_results:
+            self.print_message_func("Paired differences, b - a:")
+            for metric, difference in overall_differences.items():
+                self.print_message_func("{}: a {:.4f}   b {:.4f}   difference {:.4f}   {:.0f}% interval [{:.4f}, {:.4f}]".format(
+                    metric, difference["mean_a"], difference["mean_b"], difference["mean_difference"],
+                    self.confidence * 100, difference["lower"], difference["upper"]))
+
+        if save_path is None:
+            return
+
+        if not save_path.endswith(".csv"):
+            save_path = save_path + ".csv"
+
+        with open(save_path, "w") as f:
+            writer = csv.writer(f)
+            writer.writerow(["Test", "Metric", "Pairs", "Mean A", "Mean B", "Mean Difference", "Std Difference",
+                             "Lower", "Upper"])
+
+            test_indices = sorted({key[0] for key in self.trial_results_a})
+            rows = [("Overall", overall_differences)]
+            rows += [(self.test_regimen.pf_tests[test_index].test_name, self.get_differences([test_index]))
+                     for test_index in test_indices]
+
+            for test_name, differences in rows:
+                for metric, difference in differences.items():
+                    writer.writerow([test_name, metric, difference["num_pairs"], difference["mean_a"],
+                                     difference["mean_b"], difference["mean_difference"], difference["std_difference"],
+                                     difference["lower"], difference["upper"]])
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+import multiprocessing
+import os
+from multiprocessing.util import Finalize
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from ..pf_engine import PfEngine
+from .parameters import ParametersPf
+from .pf_evaluation import PfTestExecutor, PfTestRegimen, get_trial_seeds, get_test_parameters
+from .dataset_cache import DatasetCache
+from .result_cache import hash_map
+from .early_stopping import EarlyStopping, TEST_MAX_TRIALS, TEST_CONFIDENCE_INTERVAL
+from .trial_telemetry import TrialTelemetryWriter, TELEMETRY_EXTENSION
+
+# Runs the trials of a test regimen on a pool of worker processes. Each worker makes its own PfTestExecutor once, so the
+# map, its KDTree and the parsed data files are loaded once per worker rather than once per trial. Every trial gets its
+# own seed spawned from one SeedSequence, so the results only depend on the seed and not on which worker ran the trial or
+# in what order. That includes stopping a test early, which is decided on the results in trial order, with any later
+# trials that already finished dropped. With a result cache, only the trials that aren't in it are sent to the workers.
+
+
+# The test executor of each worker process, made once when the worker starts
+worker_test_executor = None
+
+
+def init_worker(map_data, parameters_pf, test_info_path, cached_data_files_dir, class_mapping, convergence_threshold,
+                data_time_window, early_stopping=None, telemetry_dir=None, clock=None):
+    """
+    Initialize a worker process
+
+    Args:
+        map_data (MapData): The map data
+        parameters_pf (ParametersPf): The parameters for the particle filter
+        test_info_path (str): The path to the csv file containing the test information
+        cached_data_files_dir (str): The directory containing the cached data files
+        class_mapping (tuple): The mapping of classes from the trunk width estimation package to this one
+        convergence_threshold (float): The distance at which the particle filter is considered to have converged
+        data_time_window (float): How much of the data file after the start time of a test to load at first
+        early_stopping (EarlyStopping, optional): When to stop trials early. Defaults to None.
+        telemetry_dir (str, optional): The directory to write the telemetry of the trials to, each worker writes its own
+                                       file. Defaults to None, which doesn't record telemetry.
+        clock (ExecutionClock, optional): Paces and times the trials. Defaults to None, which runs them as fast as
+                                          possible.
+    """
+    global worker_test_executor
+    worker_test_executor = PfTestExecutor(pf_engine=PfEngine(map_data),
+                                          parameters_pf=parameters_pf,
+                                          test_info_path=test_info_path,
+                                          cached_data_files_dir=cached_data_files_dir,
+                                          num_trials=1,
+                                          class_mapping=class_mapping,
+                                          convergence_threshold=convergence_threshold,
+                                          print_message_func=lambda message: None,
+                                          data_time_window=data_time_window,
+                                          early_stopping=early_stopping,
+                                          clock=clock)
+
+    if telemetry_dir is not None:
+        telemetry = TrialTelemetryWriter(os.path.join(telemetry_dir,
+                                                      "telemetry_{}{}".format(os.getpid(), TELEMETRY_EXTENSION)))
+        worker_test_executor.telemetry = telemetry
+        # Finalize the file when the worker exits, if it doesn't the rows are still recovered from the segments
+        Finalize(telemetry, telemetry.close, exitpriority=10)
+
+
+def run_trial_job(test_index, trial_num, seed):
+    """
+    Run one trial of a test in a worker process
+
+    Args:
+        test_index (int): The index of the test in the test regimen
+        trial_num (int): The number of the trial
+        seed (int): The seed for the random numbers of the trial
+
+    Returns:
+        tuple: The test index, trial number, trial time, whether the trial converged to the correct location, the
+               distance from the correct location, why the trial stopped, and where the time of the trial went, see
+               ExecutionClock.get_timing
+    """
+    test_executor = worker_test_executor
+    test_info = test_executor.test_regimen.pf_tests[test_index]
+
+    test_executor.tests_aborted = False
+    test_executor.reset_for_test(test_info)
+
+    # Each part of the particle filter gets its own stream from the trial seed, so runs with different parameters draw the
+    # same random numbers in the same trial
+    test_executor.pf_engine.set_random_streams(seed)
+
+    if test_executor.telemetry is not None:
+        test_executor.telemetry.start_trial(test_index, trial_num)
+
+    test_executor.run_trial(test_info)
+
+    if test_executor.telemetry is not None:
+        test_executor.telemetry.end_trial()
+
+    trial_time = test_info.results_run_times.pop()
+    correct_convergence = test_info.results_convergence_accuracy.pop()
+    distance = test_info.results_distances.pop()
+    stop_reason = test_info.results_stop_reasons.pop()
+    timing = test_info.results_timings.pop()
+
+    return test_index, trial_num, trial_time, bool(correct_convergence), float(distance), stop_reason, timing
+
+
+class ParallelPfTestExecutor:
+    """
+    Runs the tests of a test regimen on a pool of worker processes, giving the same results structures as the
+    PfTestExecutor
+    """
+
+    def __init__(self,
+                 map_data,
+                 parameters_pf: ParametersPf,
+                 test_info_path: str,
+                 cached_data_files_dir: str,
+                 num_trials,
+                 class_mapping=(1, 2, 0),
+                 save_path=None,
+                 convergence_threshold=0.5,
+                 print_message_func=print,
+                 num_workers=None,
+                 seed=None,
+                 data_time_window=60.0,
+                 early_stopping=None,
+                 result_cache=None,
+                 telemetry_dir=None,
+                 clock=None):
+        """
+        Args:
+            map_data (MapData): The map data, sent to each worker to make its particle filter engine
+            parameters_pf (ParametersPf): The parameters for the particle filter
+            test_info_path (str): The path to the csv file containing the test information
+            cached_data_files_dir (str): The directory containing the cached data files
+            num_trials (int): The number of trials to run for each test
+            class_mapping (tuple, optional): The mapping of classes from the trunk width estimation package to this one. Defaults to (1, 2, 0).
+            save_path (str, optional): The path to save the results to. Defaults to None.
+            convergence_threshold (float, optional): The distance at which the particle filter is considered to have converged. Defaults to 0.5.
+            print_message_func (function, optional): The function to use for printing messages. Defaults to print.
+            num_workers (int, optional): The number of worker processes. Defaults to the number of cpus.
+            seed (int, optional): The seed the trial seeds are spawned from. Defaults to None, which uses a random one.
+            data_time_window (float, optional): How much of the data file after the start time of a test to load at first,
+                                                in seconds. Defaults to 60.0.
+            early_stopping (EarlyStopping, optional): When to stop tests and trials early. Defaults to None.
+            result_cache (ResultCache, optional): Store of trial results, trials already in it aren't run again. Defaults
+                                                  to None.
+            telemetry_dir (str, optional): The directory to write the telemetry of the trials to, see
+                                           trial_telemetry.load_telemetry to read it. Trials taken from the result cache
+                                           have no telemetry. Defaults to None.
+            clock (ExecutionClock, optional): Paces and times the trials on each worker. Defaults to None, which runs
+                                              them as fast as possible.
+        """
+        self.map_data = map_data
+        self.parameters_pf = parameters_pf
+        self.test_info_path = test_info_path
+        self.cached_data_files_dir = cached_data_files_dir
+        self.num_trials = num_trials
+        self.class_mapping = class_mapping
+        self.save_path = save_path
+        self.convergence_threshold = convergence_threshold
+        self.print_message_func = print_message_func
+        self.num_workers = num_workers if num_workers is not None else multiprocessing.cpu_count()
+        self.seed = seed
+        self.data_time_window = data_time_window
+        self.early_stopping = early_stopping if early_stopping is not None else EarlyStopping()
+        self.result_cache = result_cache
+        self.telemetry_dir = telemetry_dir
+        self.clock = clock
+
+        self.test_regimen = PfTestRegimen(test_info_path, print_message_func)
+
+        self.tests_aborted = False
+
+    def stop(self):
+        """
+        Stop running the tests, the trials already running are finished but no more are started
+        """
+        self.tests_aborted = True
+
+    def run_all_tests(self, progress_callback=None):
+        """
+        Run all the tests in the test regimen
+
+        Args:
+            progress_callback (Callable, optional): Called after each trial result is added, see run_tests. Defaults to
+                                                    None.
+        """
+        self.run_tests(range(self.test_regimen.num_tests), progress_callback)
+
+        if self.save_path is not None and not self.tests_aborted:
+            self.process_results(self.save_path)
+
+    def run_tests(self, test_indices, progress_callback=None):
+        """
+        Run the trials of some of the tests on the worker pool. The results are added to the tests in the test regimen in
+        trial order, the same as the PfTestExecutor adds them, and a test is set as completed once all its trials are done
+        or the early stopping settings stop it, which cancels its trials that haven't run yet.
+
+        Args:
+            test_indices (list): The indices of the tests to run
+            progress_callback (Callable, optional): Called after each trial result is added, with the test info, the
+                                                    trial number, the number of trials done and the total number of
+                                                    trials. Defaults to None.
+        """
+        self.tests_aborted = False
+        test_indices = list(test_indices)
+
+        # The trial seeds have to be the same every run for the result cache to find the trials
+        if self.result_cache is not None and self.seed is None:
+            raise ValueError("A seed is needed to use the result cache")
+        trial_seeds = get_trial_seeds(self.seed, self.test_regimen.num_tests, self.num_trials)
+
+        num_total = len(test_indices) * self.num_trials
+        num_done = 0
+
+        # Results that arrived before the results of earlier trials of the same test, and the next trial of each test
+        waiting_results = {}
+        next_trial = {test_index: 0 for test_index in test_indices}
+        stopped_tests = set()
+
+        # The keys of the trials that aren't in the result cache, the ones that are go straight to the waiting results
+        trial_keys = {}
+        if self.result_cache is not None:
+            map_hash = hash_map(self.map_data.all_position_estimates, self.map_data.all_width_estimates)
+            for test_index in test_indices:
+                test_info = self.test_regimen.pf_tests[test_index]
+                test_parameters = get_test_parameters(self.parameters_pf, test_info)
+                data_file_path = DatasetCache.find_data_file(self.cached_data_files_dir, test_info.data_file_name)
+                for trial_num in range(self.num_trials):
+                    trial_key = self.result_cache.trial_key(test_parameters, test_info, map_hash, data_file_path,
+                                                            int(trial_seeds[test_index, trial_num]),
+                                                            self.convergence_threshold, self.class_mapping,
+                                                            self.early_stopping.divergence_distance, self.clock)
+                    cached_result = self.result_cache.get(trial_key)
+                    if cached_result is None:
+                        trial_keys[(test_index, trial_num)] = trial_key
+                    else:
+                        waiting_results[(test_index, trial_num)] = cached_result
+            self.print_message_func("Found {} of {} trials in the result cache".format(len(waiting_results), num_total))
+
+        def add_waiting_results(test_index):
+            # Add the results of the test that are now in order
+            nonlocal num_done, num_total
+            test_info = self.test_regimen.pf_tests[test_index]
+            while (test_index, next_trial[test_index]) in waiting_results:
+                test_info.add_results(*waiting_results.pop((test_index, next_trial[test_index])))
+                next_trial[test_index] += 1
+                num_done += 1
+
+                if next_trial[test_index] == self.num_trials:
+                    test_info.set_completed(TEST_MAX_TRIALS)
+                elif self.early_stopping.test_done(test_info.results_convergence_accuracy):
+                    test_info.set_completed(TEST_CONFIDENCE_INTERVAL)
+                    stopped_tests.add(test_index)
+                    num_total -= self.num_trials - next_trial[test_index]
+                    for later_future in test_futures.get(test_index, {}).values():
+                        later_future.cancel()
+                    for later_trial_num in range(next_trial[test_index], self.num_trials):
+                        waiting_results.pop((test_index, later_trial_num), None)
+
+                if progress_callback is not None:
+                    progress_callback(test_info, next_trial[test_index], num_done, num_total)
+
+                if test_index in stopped_tests:
+                    break
+
+        test_futures = {}
+        for test_index in test_indices:
+            add_waiting_results(test_index)
+
+        # Spawn the workers rather than forking, the app has threads running that shouldn't be copied
+        with ProcessPoolExecutor(max_workers=self.num_workers,
+                                 mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=init_worker,
+                                 initargs=(self.map_data, self.parameters_pf, self.test_info_path,
+                                           self.cached_data_files_dir, self.class_mapping, self.convergence_threshold,
+                                           self.data_time_window, self.early_stopping,
+                                           self.telemetry_dir, self.clock)) as executor:
+
+            for test_index in test_indices:
+                if test_index in stopped_tests:
+                    continue
+                test_futures[test_index] = {trial_num: executor.submit(run_trial_job, test_index, trial_num,
+                                                                       int(trial_seeds[test_index, trial_num]))
+                                            for trial_num in range(self.num_trials)
+                                            if self.result_cache is None or (test_index, trial_num) in trial_keys}
+            pending = {future for futures in test_futures.values() for future in futures.values()}
+
+            self.print_message_func("Running {} trials on {} workers".format(len(pending), self.num_workers))
+
+            while pending:
+                if self.tests_aborted:
+                    for future in pending:
+                        future.cancel()
+                    self.print_message_func("Tests aborted")
+                    break
+
+                done, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    if future.cancelled():
+                        continue
+
+                    test_index, trial_num, trial_time, correct_convergence, distance, stop_reason, timing = future.result()
+                    if test_index in stopped_tests:
+                        # The test was stopped early before this trial
+                        continue
+                    waiting_results[(test_index, trial_num)] = (trial_time, correct_convergence, distance, stop_reason,
+                                                                timing)
+
+                    # Store the result as soon as it's in, so an interrupted run picks up from here
+                    if (test_index, trial_num) in trial_keys:
+                        self.result_cache.put(trial_keys[(test_index, trial_num)], trial_time, correct_convergence,
+                                              distance, stop_reason)
+
+                    add_waiting_results(test_index)
+
+    def process_results(self, save_path):
+        """
+        Process the results of the tests and save them to a csv file
+
+        Args:
+            save_path (str): The path to save the results to
+        """
+        self.test_regimen.process_results(save_path=save_path)
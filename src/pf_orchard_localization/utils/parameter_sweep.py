@@ -0,0 +1,651 @@
+#!/usr/bin/env python3
+import csv
+import itertools
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field, fields, replace, asdict
+import numpy as np
+import yaml
+from .parameters import ParametersPf
+from .pf_evaluation import PfTestRegimen
+from . import parallel_pf_evaluation
+from .parallel_pf_evaluation import get_trial_seeds
+from .early_stopping import EarlyStopping, CONFIG_COMPLETED, CONFIG_DOMINATED, TRIAL_DIVERGED
+
+# Searches for the particle filter parameters that work best over a test regimen. Every configuration is run on the same
+# trials with the same seeds, so the differences between configurations come from the parameters and not the random
+# numbers. The trials of all the configurations being evaluated are spread over one pool of worker processes, which
+# load the map and the data files once for the whole sweep. With early stopping, all the configurations are first run on
+# a few tests and the ones that are clearly worse than the best are dropped before the rest of the tests.
+
+
+@dataclass
+class SweepDimension:
+    """
+    A ParametersPf field to search over, either a list of values or a range
+    """
+    name: str
+    values: list = None
+    low: float = None
+    high: float = None
+    log: bool = False
+    integer: bool = False
+
+    def __post_init__(self):
+        if self.name not in {parameter_field.name for parameter_field in fields(ParametersPf)}:
+            raise ValueError(f"{self.name} is not a particle filter parameter")
+        if self.values is None and (self.low is None or self.high is None):
+            raise ValueError(f"{self.name} needs either values or a low and high")
+
+    def from_unit(self, unit_value):
+        """
+        Get the value at a position in the dimension, scaled to 0 to 1
+
+        Args:
+            unit_value (float): The position, from 0 to 1
+
+        Returns:
+            The value
+        """
+        unit_value = float(np.clip(unit_value, 0.0, 1.0))
+
+        if self.values is not None:
+            return self.values[int(round(unit_value * (len(self.values) - 1)))]
+
+        if self.log:
+            value = float(np.exp(np.log(self.low) + unit_value * (np.log(self.high) - np.log(self.low))))
+        else:
+            value = self.low + unit_value * (self.high - self.low)
+        value = min(max(value, self.low), self.high)
+
+        return int(round(value)) if self.integer else value
+
+    def to_unit(self, value):
+        """
+        Get the position of a value in the dimension, scaled to 0 to 1
+
+        Args:
+            value: The value
+
+        Returns:
+            float: The position, from 0 to 1
+        """
+        if self.values is not None:
+            if len(self.values) == 1:
+                return 0.0
+            return self.values.index(value) / (len(self.values) - 1)
+
+        if self.log:
+            return float((np.log(value) - np.log(self.low)) / (np.log(self.high) - np.log(self.low)))
+        return float((value - self.low) / (self.high - self.low))
+
+    def grid(self, num_points):
+        """
+        Get the values of the dimension on a grid
+
+        Args:
+            num_points (int): The number of values for ranges, lists of values use all their values
+
+        Returns:
+            list: The values
+        """
+        if self.values is not None:
+            return list(self.values)
+
+        values = [self.from_unit(unit_value) for unit_value in np.linspace(0.0, 1.0, num_points)]
+        # Integer ranges can round several points to the same value
+        return list(dict.fromkeys(values))
+
+
+def load_search_space(file_path):
+    """
+    Load a search space from a yaml file, with each parameter to search over mapped to either a list of values or a range,
+    for example:
+
+        particle_density: {values: [100, 200, 400]}
+        range_sd: {low: 0.1, high: 1.0}
+        bearing_sd: {low: 0.05, high: 0.5, log: true}
+        r_angle: {low: 5, high: 30, integer: true}
+
+    Args:
+        file_path (str): The path to the yaml file
+
+    Returns:
+        list: The SweepDimension of each parameter
+    """
+    with open(file_path) as f:
+        space = yaml.safe_load(f)
+
+    return [SweepDimension(name=name, **spec) for name, spec in space.items()]
+
+
+@dataclass
+class SweepObjective:
+    """
+    Weights of the objective the sweep maximizes, the convergence rate minus the costs of the average trial time and the
+    average cpu time of the trials
+    """
+    convergence_weight: float = 1.0
+    time_weight: float = 0.01
+    cost_weight: float = 0.0
+
+    def score(self, convergence_rate, avg_time, avg_cpu_time):
+        """
+        Get the objective of a configuration
+
+        Args:
+            convergence_rate (float): The fraction of the trials that converged to the correct location
+            avg_time (float): The average time of the trials, in seconds
+            avg_cpu_time (float): The average cpu time of the trials, in seconds
+
+        Returns:
+            float: The objective, higher is better
+        """
+        return (self.convergence_weight * convergence_rate - self.time_weight * avg_time
+                - self.cost_weight * avg_cpu_time)
+
+
+@dataclass
+class SweepResult:
+    """
+    The results of one configuration over some or all of the test regimen
+    """
+    config: dict
+    num_tests: int
+    num_trials: int
+    convergence_rate: float
+    avg_time: float
+    avg_time_converged: float
+    avg_cpu_time: float
+    score: float
+    stop_reason: str = CONFIG_COMPLETED
+    trial_results: list = field(default_factory=list, repr=False)
+
+
+def run_config_trial_job(config_index, parameters_pf, test_index, trial_num, seed):
+    """
+    Run one trial of a test with a configuration of the parameters in a worker process
+
+    Args:
+        config_index (int): The index of the configuration in the batch being evaluated
+        parameters_pf (ParametersPf): The parameters of the configuration
+        test_index (int): The index of the test in the test regimen
+        trial_num (int): The number of the trial
+        seed (int): The seed for the random numbers of the trial
+
+    Returns:
+        tuple: The configuration index, test index, trial number, trial time, whether the trial converged to the correct
+               location, the distance from the correct location, the cpu time spent in the particle filter engine and
+               why the trial stopped
+    """
+    parallel_pf_evaluation.worker_test_executor.parameters_pf = parameters_pf
+
+    _, _, trial_time, correct_convergence, distance, stop_reason, timing = parallel_pf_evaluation.run_trial_job(
+        test_index, trial_num, seed)
+    cpu_time = timing["engine_cpu_time"]
+
+    return config_index, test_index, trial_num, trial_time, correct_convergence, distance, cpu_time, stop_reason
+
+
+def expected_improvement(x_train, y_train, x_candidates, length_scale=0.2, noise=1e-3, xi=0.01):
+    """
+    Fit a gaussian process with a squared exponential kernel to the scores of the configurations tried so far, and get the
+    expected improvement over the best score of candidate configurations
+
+    Args:
+        x_train (np.ndarray): The configurations tried so far, scaled to 0 to 1, shape (n, d)
+        y_train (np.ndarray): The scores of the configurations tried so far, shape (n,)
+        x_candidates (np.ndarray): The candidate configurations, scaled to 0 to 1, shape (m, d)
+        length_scale (float, optional): The length scale of the kernel. Defaults to 0.2.
+        noise (float, optional): The noise variance of the scores, relative to their variance. Defaults to 1e-3.
+        xi (float, optional): How much better than the best score a candidate has to be to count. Defaults to 0.01.
+
+    Returns:
+        np.ndarray: The expected improvement of each candidate, shape (m,)
+    """
+    def kernel(a, b):
+        squared_distances = np.sum((a[:, None, :] - b[None, :, :]) ** 2, axis=-1)
+        return np.exp(-0.5 * squared_distances / length_scale ** 2)
+
+    y_mean = np.mean(y_train)
+    y_std = np.std(y_train) if np.std(y_train) > 0 else 1.0
+    y_normalized = (y_train - y_mean) / y_std
+
+    k_train = kernel(x_train, x_train) + noise * np.eye(len(x_train))
+    chol = np.linalg.cholesky(k_train)
+    alpha = np.linalg.solve(chol.T, np.linalg.solve(chol, y_normalized))
+
+    k_candidates = kernel(x_candidates, x_train)
+    mean = k_candidates @ alpha
+    v = np.linalg.solve(chol, k_candidates.T)
+    std = np.sqrt(np.maximum(1.0 - np.sum(v ** 2, axis=0), 1e-12))
+
+    from scipy.stats import norm
+    improvement = mean - np.max(y_normalized) - xi
+    z = improvement / std
+    return improvement * norm.cdf(z) + std * norm.pdf(z)
+
+
+class ParameterSweep:
+    """
+    Evaluates configurations of the particle filter parameters over a test regimen on a pool of worker processes, and
+    searches for the best ones with a grid, random, successive halving or bayesian search
+    """
+
+    def __init__(self,
+                 map_data,
+                 base_parameters: ParametersPf,
+                 test_info_path: str,
+                 cached_data_files_dir: str,
+                 search_space,
+                 num_trials=1,
+                 objective=None,
+                 class_mapping=(1, 2, 0),
+                 convergence_threshold=0.5,
+                 num_workers=None,
+                 seed=None,
+                 data_time_window=60.0,
+                 early_stopping=None,
+                 print_message_func=print):
+        """
+        Args:
+            map_data (MapData): The map data, sent to each worker to make its particle filter engine
+            base_parameters (ParametersPf): The parameters the configurations are made from
+            test_info_path (str): The path to the csv file containing the test information
+            cached_data_files_dir (str): The directory containing the cached data files
+            search_space (list): The SweepDimension of each parameter to search over
+            num_trials (int, optional): The number of trials to run for each test. Defaults to 1.
+            objective (SweepObjective, optional): The objective to maximize. Defaults to SweepObjective().
+            class_mapping (tuple, optional): The mapping of classes from the trunk width estimation package to this one. Defaults to (1, 2, 0).
+            convergence_threshold (float, optional): The distance at which the particle filter is considered to have converged. Defaults to 0.5.
+            num_workers (int, optional): The number of worker processes. Defaults to the number of cpus.
+            seed (int, optional): The seed of the trials and the random searches. Defaults to None.
+            data_time_window (float, optional): How much of the data file after the start time of a test to load at first,
+                                                in seconds. Defaults to 60.0.
+            early_stopping (EarlyStopping, optional): When to stop trials and drop dominated configurations early. The
+                                                      confidence interval rule for tests isn't used, every configuration
+                                                      runs the same trials. Defaults to None.
+            print_message_func (function, optional): The function to use for printing messages. Defaults to print.
+        """
+        self.map_data = map_data
+        self.base_parameters = base_parameters
+        self.test_info_path = test_info_path
+        self.cached_data_files_dir = cached_data_files_dir
+        self.search_space = list(search_space)
+        self.num_trials = num_trials
+        self.objective = objective if objective is not None else SweepObjective()
+        self.class_mapping = class_mapping
+        self.convergence_threshold = convergence_threshold
+        self.num_workers = num_workers if num_workers is not None else multiprocessing.cpu_count()
+        self.data_time_window = data_time_window
+        self.early_stopping = early_stopping if early_stopping is not None else EarlyStopping()
+        self.print_message_func = print_message_func
+
+        self.test_regimen = PfTestRegimen(test_info_path, print_message_func)
+        self.num_tests = self.test_regimen.num_tests
+
+        self.seed = seed if seed is not None else time.time_ns()
+        self.rng = np.random.default_rng(self.seed)
+        # Every configuration runs each trial with the same seed
+        self.trial_seeds = get_trial_seeds(self.seed, self.num_tests, self.num_trials)
+
+        self.results = []
+        self.process_pool = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self):
+        """
+        Start the worker processes
+        """
+        if self.process_pool is not None:
+            return
+
+        # Spawn the workers rather than forking, so they don't copy threads the calling process may have running
+        self.process_pool = ProcessPoolExecutor(max_workers=self.num_workers,
+                                                mp_context=multiprocessing.get_context("spawn"),
+                                                initializer=parallel_pf_evaluation.init_worker,
+                                                initargs=(self.map_data, self.base_parameters, self.test_info_path,
+                                                          self.cached_data_files_dir, self.class_mapping,
+                                                          self.convergence_threshold, self.data_time_window,
+                                                          self.early_stopping))
+
+    def close(self):
+        """
+        Stop the worker processes
+        """
+        if self.process_pool is not None:
+            self.process_pool.shutdown()
+            self.process_pool = None
+
+    def make_parameters(self, config):
+        """
+        Make the particle filter parameters of a configuration
+
+        Args:
+            config (dict): The values of the parameters being searched over
+
+        Returns:
+            ParametersPf: The base parameters with the values of the configuration
+        """
+        return replace(self.base_parameters, **config)
+
+    def evaluate(self, configs, test_indices=None):
+        """
+        Run configurations over the test regimen, with all their trials on the worker pool at once. If the early stopping
+        settings have sweep_min_tests, the configurations are run on that many of the tests first, and the dominated ones
+        are dropped before running the rest.
+
+        Args:
+            configs (list): The configurations, each a dict of the values of the parameters being searched over
+            test_indices (list, optional): The tests to run. Defaults to all the tests.
+
+        Returns:
+            list: The SweepResult of each configuration
+        """
+        self.start()
+
+        if test_indices is None:
+            test_indices = range(self.num_tests)
+        test_indices = list(test_indices)
+
+        min_tests = self.early_stopping.sweep_min_tests
+        if min_tests is None or min_tests >= len(test_indices) or len(configs) <= 1:
+            trial_results = self.run_trials(configs, test_indices)
+            results = [self.summarize(config, len(test_indices), config_trial_results)
+                       for config, config_trial_results in zip(configs, trial_results)]
+        else:
+            trial_results = self.run_trials(configs, test_indices[:min_tests])
+            dominated = self.find_dominated(trial_results)
+            self.print_message_func("Dropping {} of {} configurations after {} tests".format(
+                int(np.sum(dominated)), len(configs), min_tests))
+
+            kept_indices = np.flatnonzero(~dominated)
+            remaining_trial_results = self.run_trials([configs[i] for i in kept_indices], test_indices[min_tests:])
+            for config_index, config_trial_results in zip(kept_indices, remaining_trial_results):
+                trial_results[config_index].extend(config_trial_results)
+
+            results = [self.summarize(config, min_tests, config_trial_results, CONFIG_DOMINATED) if is_dominated
+                       else self.summarize(config, len(test_indices), config_trial_results)
+                       for config, config_trial_results, is_dominated in zip(configs, trial_results, dominated)]
+
+        self.results.extend(results)
+
+        for result in results:
+            self.print_message_func("{} tests, {}: score {:.3f}, convergence rate {:.2f}, average time {:.2f}s, {}".format(
+                result.num_tests, result.stop_reason, result.score, result.convergence_rate, result.avg_time,
+                result.config))
+
+        return results
+
+    def run_trials(self, configs, test_indices):
+        """
+        Run the trials of configurations on tests on the worker pool
+
+        Args:
+            configs (list): The configurations
+            test_indices (list): The tests to run
+
+        Returns:
+            list: The trial results of each configuration, sorted by test and trial, see summarize
+        """
+        trial_results = [[] for _ in configs]
+        futures = []
+        for config_index, config in enumerate(configs):
+            parameters_pf = self.make_parameters(config)
+            for test_index in test_indices:
+                for trial_num in range(self.num_trials):
+                    futures.append(self.process_pool.submit(run_config_trial_job, config_index, parameters_pf,
+                                                            test_index, trial_num,
+                                                            int(self.trial_seeds[test_index, trial_num])))
+
+        for future in as_completed(futures):
+            config_index, *trial_result = future.result()
+            trial_results[config_index].append(tuple(trial_result))
+
+        return [sorted(config_trial_results) for config_trial_results in trial_results]
+
+    def find_dominated(self, trial_results):
+        """
+        Find the configurations whose convergence rate is clearly worse than the best configuration's over the same trials
+
+        Args:
+            trial_results (list): The trial results of each configuration
+
+        Returns:
+            np.ndarray: Whether each configuration is dominated
+        """
+        num_converged = np.array([sum(trial_result[3] for trial_result in config_trial_results)
+                                  for config_trial_results in trial_results])
+        num_trials = np.array([len(config_trial_results) for config_trial_results in trial_results])
+
+        best_index = int(np.argmax(num_converged / np.maximum(num_trials, 1)))
+        return np.array([self.early_stopping.dominated(num_converged[i], num_trials[i], num_converged[best_index],
+                                                       num_trials[best_index])
+                         for i in range(len(trial_results))], dtype=bool)
+
+    def summarize(self, config, num_tests, trial_results, stop_reason=CONFIG_COMPLETED):
+        """
+        Summarize the trial results of a configuration
+
+        Args:
+            config (dict): The configuration
+            num_tests (int): The number of tests the configuration was run on
+            trial_results (list): The test index, trial number, trial time, correct convergence, distance, cpu time and
+                                  stop reason of each trial
+            stop_reason (str, optional): Why the configuration stopped being evaluated. Defaults to CONFIG_COMPLETED.
+
+        Returns:
+            SweepResult: The results of the configuration
+        """
+        trial_times = np.array([trial_result[2] for trial_result in trial_results])
+        convergences = np.array([trial_result[3] for trial_result in trial_results], dtype=bool)
+        cpu_times = np.array([trial_result[5] for trial_result in trial_results])
+
+        convergence_rate = float(np.mean(convergences))
+        avg_time = float(np.mean(trial_times))
+        avg_time_converged = float(np.mean(trial_times[convergences])) if np.any(convergences) else float("nan")
+        avg_cpu_time = float(np.mean(cpu_times))
+
+        return SweepResult(config=config,
+                           num_tests=num_tests,
+                           num_trials=len(trial_results),
+                           convergence_rate=convergence_rate,
+                           avg_time=avg_time,
+                           avg_time_converged=avg_time_converged,
+                           avg_cpu_time=avg_cpu_time,
+                           score=self.objective.score(convergence_rate, avg_time, avg_cpu_time),
+                           stop_reason=stop_reason,
+                           trial_results=trial_results)
+
+    def random_config(self):
+        """
+        Get a random configuration from the search space
+
+        Returns:
+            dict: The configuration
+        """
+        return {dimension.name: dimension.from_unit(self.rng.random()) for dimension in self.search_space}
+
+    def config_to_unit(self, config):
+        """
+        Scale a configuration to the unit cube
+
+        Args:
+            config (dict): The configuration
+
+        Returns:
+            np.ndarray: The position of the configuration in each dimension, from 0 to 1
+        """
+        return np.array([dimension.to_unit(config[dimension.name]) for dimension in self.search_space])
+
+    def grid_search(self, num_points=3):
+        """
+        Evaluate every configuration on a grid over the search space
+
+        Args:
+            num_points (int, optional): The number of values to try of each range. Defaults to 3.
+
+        Returns:
+            list: The SweepResult of each configuration
+        """
+        grids = [dimension.grid(num_points) for dimension in self.search_space]
+        configs = [dict(zip([dimension.name for dimension in self.search_space], values))
+                   for values in itertools.product(*grids)]
+        self.print_message_func("Grid search over {} configurations".format(len(configs)))
+        return self.evaluate(configs)
+
+    def random_search(self, num_configs):
+        """
+        Evaluate random configurations from the search space
+
+        Args:
+            num_configs (int): The number of configurations
+
+        Returns:
+            list: The SweepResult of each configuration
+        """
+        return self.evaluate([self.random_config() for _ in range(num_configs)])
+
+    def successive_halving(self, num_configs, eta=3, min_tests=1):
+        """
+        Evaluate random configurations on a few tests, keep the best 1/eta of them and evaluate those on eta times as many
+        tests, until the configurations left are evaluated on the whole test regimen
+
+        Args:
+            num_configs (int): The number of configurations to start with
+            eta (int, optional): The factor the configurations are cut by and the tests are increased by each round.
+                                 Defaults to 3.
+            min_tests (int, optional): The number of tests in the first round. Defaults to 1.
+
+        Returns:
+            list: The SweepResult of the configurations evaluated on the whole test regimen
+        """
+        configs = [self.random_config() for _ in range(num_configs)]
+
+        # The tests are run in a random order, so the first rounds don't only see the first data files
+        test_order = self.rng.permutation(self.num_tests)
+        num_tests = min(min_tests, self.num_tests)
+
+        while True:
+            self.print_message_func("Successive halving: {} configurations on {} tests".format(len(configs), num_tests))
+            results = self.evaluate(configs, test_order[:num_tests])
+
+            if num_tests >= self.num_tests or len(configs) <= 1:
+                return results
+
+            num_kept = max(1, len(configs) // eta)
+            results.sort(key=lambda result: result.score, reverse=True)
+            configs = [result.config for result in results[:num_kept]]
+            num_tests = min(num_tests * eta, self.num_tests)
+
+    def bayesian_search(self, num_configs, num_initial=None, batch_size=None, num_candidates=2000):
+        """
+        Evaluate random configurations, then repeatedly fit a gaussian process to the scores so far and evaluate the
+        configurations with the highest expected improvement
+
+        Args:
+            num_configs (int): The total number of configurations to evaluate
+            num_initial (int, optional): The number of random configurations to start with. Defaults to twice the number
+                                         of dimensions, at least as many as the workers.
+            batch_size (int, optional): The number of configurations to evaluate at once. Defaults to the number of
+                                        workers.
+            num_candidates (int, optional): The number of random candidates to pick each batch from. Defaults to 2000.
+
+        Returns:
+            list: The SweepResult of each configuration
+        """
+        if batch_size is None:
+            batch_size = self.num_workers
+        if num_initial is None:
+            num_initial = max(2 * len(self.search_space), batch_size)
+
+        results = self.random_search(min(num_initial, num_configs))
+
+        while len(results) < num_configs:
+            x_train = np.array([self.config_to_unit(result.config) for result in results])
+            y_train = np.array([result.score for result in results])
+
+            candidates = [self.random_config() for _ in range(num_candidates)]
+            x_candidates = np.array([self.config_to_unit(config) for config in candidates])
+            improvement = expected_improvement(x_train, y_train, x_candidates)
+
+            # Take the best candidates that aren't already tried or picked
+            tried = {tuple(sorted(result.config.items())) for result in results}
+            batch = []
+            for candidate_index in np.argsort(-improvement):
+                key = tuple(sorted(candidates[candidate_index].items()))
+                if key not in tried:
+                    tried.add(key)
+                    batch.append(candidates[candidate_index])
+                if len(batch) >= min(batch_size, num_configs - len(results)):
+                    break
+
+            if not batch:
+                break
+            results.extend(self.evaluate(batch))
+
+        return results
+
+    def best_results(self, num_best=1, full_regimen_only=True):
+        """
+        Get the best configurations evaluated so far
+
+        Args:
+            num_best (int, optional): The number of configurations. Defaults to 1.
+            full_regimen_only (bool, optional): Only include configurations evaluated on all the tests. Defaults to True.
+
+        Returns:
+            list: The SweepResult of the best configurations, best first
+        """
+        results = [result for result in self.results if not full_regimen_only or result.num_tests == self.num_tests]
+        return sorted(results, key=lambda result: result.score, reverse=True)[:num_best]
+
+    def save_results(self, output_dir, num_best=3):
+        """
+        Save the results of every configuration evaluated to a csv file, and the parameters of the best configurations to
+        yaml files
+
+        Args:
+            output_dir (str): The directory to save the files in
+            num_best (int, optional): The number of best configurations to save the parameters of. Defaults to 3.
+
+        Returns:
+            list: The paths to the parameter files of the best configurations, best first
+        """
+        os.makedirs(output_dir, exist_ok=True)
+
+        dimension_names = [dimension.name for dimension in self.search_space]
+        with open(os.path.join(output_dir, "sweep_results.csv"), "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(dimension_names + ["Tests", "Trials", "Score", "Convergence Rate", "Average Time",
+                                               "Average Time Converged", "Average CPU Time", "Stop Reason",
+                                               "Diverged Trials"])
+            for result in self.results:
+                writer.writerow([result.config[name] for name in dimension_names] +
+                                [result.num_tests, result.num_trials, result.score, result.convergence_rate,
+                                 result.avg_time, result.avg_time_converged, result.avg_cpu_time, result.stop_reason,
+                                 sum(trial_result[6] == TRIAL_DIVERGED for trial_result in result.trial_results)])
+
+        parameter_file_paths = []
+        for rank, result in enumerate(self.best_results(num_best)):
+            parameter_file_path = os.path.join(output_dir, "parameters_pf_best_{}.yaml".format(rank + 1))
+            self.make_parameters(result.config).save_to_yaml(parameter_file_path)
+            parameter_file_paths.append(parameter_file_path)
+
+        # Record how the sweep was run next to the results
+        with open(os.path.join(output_dir, "sweep_settings.yaml"), "w") as f:
+            yaml.dump({"seed": self.seed,
+                       "num_trials": self.num_trials,
+                       "objective": asdict(self.objective),
+                       "early_stopping": asdict(self.early_stopping),
+                       "search_space": [asdict(dimension) for dimension in self.search_space]}, f)
+
+        return parameter_file_paths
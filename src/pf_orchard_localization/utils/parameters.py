@@ -101,6 +101,8 @@ class ParametersCachedData(Parameters):
     Parameters for the cached data version of the app
     """
     data_file_dir: str = None
+    # Directory to save the index of the data files in, defaults to the user's cache directory
+    catalog_index_dir: str = None
     cached_image_dir: str = None
     test_start_info_path: str = None
 
@@ -120,6 +122,8 @@ class ParametersBagData(Parameters):
     """
 
     data_file_dir: str = None
+    # Directory to save the index of the data files in, defaults to the user's cache directory
+    catalog_index_dir: str = None
     depth_topic: str = None
     rgb_topic: str = None
     odom_topic: str = None
@@ -136,6 +140,16 @@ class ParametersBagData(Parameters):
     use_ros_service_for_trunk_width: bool = False
     use_visual_odom: bool = False
 
+    # How many images ahead of the particle filter to segment, 0 to segment each image when the filter reaches it
+    trunk_data_prefetch_depth: int = 0
+    # Host of a trunk data consumer to get the trunk data from instead of segmenting in the app, through shared memory if
+    # it's on this host and listening for it, otherwise over TCP
+    trunk_data_consumer_host: str = None
+    trunk_data_consumer_port: int = 65432
+    # Sqlite file to store the trunk data of the images in, so replaying a bag doesn't segment its images again
+    detection_cache_path: str = None
+    detection_cache_seg_imgs: bool = False
+
 @dataclass
 class ParametersLiveData(Parameters):
     """
@@ -1,10 +1,56 @@
-from ..recorded_data_loaders import CachedDataLoader
 from ..pf_engine import PfEngine
 from .parameters import ParametersPf
+from .dataset_cache import DatasetCache
+from .result_cache import hash_map
+from ..pipeline import (PfPipeline, PipelineObserver, RecordedMessageSource, CachedTrunkSource, FunctionTrunkSource,
+                        CachedOdomSource, ExecutionClock, run_blocking)
+from .early_stopping import EarlyStopping, TRIAL_DIVERGED, TEST_MAX_TRIALS, TEST_CONFIDENCE_INTERVAL
 import numpy as np
 import csv
 import os
-import time
+from dataclasses import replace
+
+# The particle filter parameters set from each test's start info, and the PfTest attribute each is set from
+TEST_START_PARAMETERS = {"start_pose_center_x": "start_x",
+                         "start_pose_center_y": "start_y",
+                         "start_width": "start_width",
+                         "start_height": "start_length",
+                         "start_rotation": "start_rotation",
+                         "start_orientation_center": "orientation_center",
+                         "start_orientation_range": "orientation_range"}
+
+
+def get_test_parameters(parameters_pf, test_info):
+    """
+    Get a copy of the particle filter parameters with the start pose of a test
+
+    Args:
+        parameters_pf (ParametersPf): The parameters for the particle filter
+        test_info (PfTest): The test
+
+    Returns:
+        ParametersPf: The parameters for the test
+    """
+    return replace(parameters_pf, **{parameter_name: getattr(test_info, test_info_name)
+                                     for parameter_name, test_info_name in TEST_START_PARAMETERS.items()})
+
+
+def get_trial_seeds(seed, num_tests, num_trials):
+    """
+    Get the seed of every trial of every test, each from its own independent stream
+
+    Args:
+        seed (int): The seed of the test regimen, or None for a random one
+        num_tests (int): The number of tests
+        num_trials (int): The number of trials per test
+
+    Returns:
+        np.ndarray: The seeds, with shape (num_tests, num_trials)
+    """
+    seed_sequences = np.random.SeedSequence(seed).spawn(num_tests * num_trials)
+    trial_seeds = [int(seed_sequence.generate_state(1)[0]) for seed_sequence in seed_sequences]
+    return np.array(trial_seeds, dtype=np.int64).reshape(num_tests, num_trials)
+
 
 class PfTest:
     """
@@ -26,8 +72,11 @@ class PfTest:
         self.results_distances = []
         self.results_convergence_accuracy = []
         self.results_run_times = []
+        self.results_stop_reasons = []
+        self.results_timings = []
 
         self.test_completed = False
+        self.stop_reason = None
 
     def __repr__(self):
         """
@@ -40,11 +89,14 @@ class PfTest:
         Reset the results for the test
         """
         self.test_completed = False
+        self.stop_reason = None
         self.results_distances = []
         self.results_convergence_accuracy = []
         self.results_run_times = []
+        self.results_stop_reasons = []
+        self.results_timings = []
 
-    def add_results(self, run_time, correct_convergence, distance_to_converge):
+    def add_results(self, run_time, correct_convergence, distance_to_converge, stop_reason=None, timing=None):
         """
         Add the results of a trial to the test info
 
@@ -52,10 +104,15 @@ class PfTest:
             run_time: The time it took for the trial to run
             correct_convergence: Whether the trial converged to the correct location
             distance_to_converge: The distance traveled before converging
+            stop_reason (str, optional): Why the trial stopped, see early_stopping. Defaults to None.
+            timing (dict, optional): Where the time of the trial went, see ExecutionClock.get_timing. Defaults to None,
+                                     for results that weren't timed, like ones from the result cache.
         """
         self.results_distances.append(distance_to_converge)
         self.results_convergence_accuracy.append(correct_convergence)
         self.results_run_times.append(run_time)
+        self.results_stop_reasons.append(stop_reason)
+        self.results_timings.append(timing)
 
     def get_results(self):
         """
@@ -77,11 +134,33 @@ class PfTest:
 
         return convergence_rate, avg_time_all, avg_time_converged
 
-    def set_completed(self):
+    def get_timing_results(self):
+        """
+        Calculate the average timing of the trials that were timed
+
+        Returns:
+            avg_data_time (float): The average data time of the trials
+            avg_engine_cpu_time (float): The average cpu time spent in the particle filter engine
+            avg_overhead_time (float): The average wall time spent outside the engine, not counting pacing
+        """
+        timings = [timing for timing in self.results_timings if timing is not None]
+        if not timings:
+            return np.nan, np.nan, np.nan
+
+        return (np.mean([timing["data_time"] for timing in timings]),
+                np.mean([timing["engine_cpu_time"] for timing in timings]),
+                np.mean([timing["overhead_time"] for timing in timings]))
+
+    def set_completed(self, stop_reason=TEST_MAX_TRIALS):
         """
         Set the test as completed
+
+        Args:
+            stop_reason (str, optional): Why the test stopped running trials, see early_stopping. Defaults to
+                                         TEST_MAX_TRIALS.
         """
         self.test_completed = True
+        self.stop_reason = stop_reason
         
 class PfTestRegimen:
     """
@@ -137,6 +216,10 @@ class PfTestRegimen:
             if pf_test.test_completed:
                 completed_tests.append(pf_test)
 
+        if not completed_tests:
+            self.print_message_func("No tests were completed, there are no results to process")
+            return
+
         avg_convergence_rates = np.zeros(len(completed_tests))
         avg_times_all = np.zeros(len(completed_tests))
         avg_times_converged = np.zeros(len(completed_tests))
@@ -165,9 +248,13 @@ class PfTestRegimen:
             
             with open(save_path, "w") as f:
                 writer = csv.writer(f)
-                writer.writerow(["Start Location", "Convergence Rate", "Average Time", "Average Time Converged"])
+                writer.writerow(["Start Location", "Convergence Rate", "Average Time", "Average Time Converged",
+                                 "Number of Trials", "Stop Reason", "Average Data Time", "Average Engine CPU Time",
+                                 "Average Overhead Time"])
                 for i in range(len(completed_tests)):
-                    writer.writerow([i, avg_convergence_rates[i], avg_times_all[i], avg_times_converged[i]])
+                    writer.writerow([i, avg_convergence_rates[i], avg_times_all[i], avg_times_converged[i],
+                                     len(completed_tests[i].results_distances), completed_tests[i].stop_reason,
+                                     *completed_tests[i].get_timing_results()])
 
                 writer.writerow(["Overall Average Time Converged", overall_avg_time_converged])
                 writer.writerow(["Overall Average Convergence Rate", overall_avg_convergence_rate])
@@ -196,12 +283,14 @@ class PfTestRegimen:
         """
         self.pf_tests[test_num].reset_results()        
 
-class PfTestExecutor:
+class PfTestExecutor(PipelineObserver):
     """
-    Class to execute a set of tests using a particle filter, at this point this is a simplified headless version of what the app does.
+    Class to execute a set of tests using a particle filter. The messages are run through the same PfPipeline as the app,
+    with the executor observing it to record the results.
     """
-    #TODO: explore somehow having a single set of code for running the particle filter, instead of here and in the app. This seems 
-    # difficult, so another option may just be to setup a way to ensure changes to one are reflected in the other.
+
+    # Whether the trunk classes are remapped once when a data file is cached, instead of in get_trunk_data
+    CACHE_REMAPPED_CLASSES = True
     def __init__(self,
                  pf_engine: PfEngine,
                  parameters_pf: ParametersPf,
@@ -211,7 +300,14 @@ class PfTestExecutor:
                  class_mapping=(1, 2, 0),
                  save_path=None,
                  convergence_threshold=0.5,
-                 print_message_func=print):
+                 print_message_func=print,
+                 data_time_window=60.0,
+                 dataset_cache_max_bytes=2 * 1024 ** 3,
+                 early_stopping=None,
+                 seed=None,
+                 result_cache=None,
+                 telemetry=None,
+                 clock=None):
         """
         Args:
             pf_engine (PfEngine): The particle filter engine
@@ -223,6 +319,23 @@ class PfTestExecutor:
             save_path (str, optional): The path to save the results to. Defaults to None.
             convergence_threshold (float, optional): The distance at which the particle filter is considered to have converged. Defaults to 0.5.
             print_message_func (function, optional): The function to use for printing messages. Defaults to print.
+            data_time_window (float, optional): How much of the data file after the start time of a test to load at first,
+                                                in seconds. More is loaded if the test runs past it. None loads the whole
+                                                data file. Defaults to 60.0.
+            dataset_cache_max_bytes (int, optional): The memory budget of the cache of parsed data files shared by the
+                                                     tests. Defaults to 2 GiB.
+            early_stopping (EarlyStopping, optional): When to stop tests and trials early. Defaults to None, which runs
+                                                      every trial of every test to convergence or the end of the data.
+            seed (int, optional): The seed the trial seeds are spawned from, each trial sets the random streams of the
+                                  particle filter from its own seed, the same as the ParallelPfTestExecutor. Defaults to
+                                  None, which doesn't seed the trials.
+            result_cache (ResultCache, optional): Store of trial results, trials already in it aren't run again. Needs a
+                                                  seed. Defaults to None.
+            telemetry (TrialTelemetryWriter, optional): Records a row for each scan update of each trial. Defaults to
+                                                        None.
+            clock (ExecutionClock, optional): Paces the messages of the trials and times them. The trial times are by
+                                              this clock, so a simulated clock gives the data time of the trials.
+                                              Defaults to None, which runs the trials as fast as possible.
         """
 
         self.convergence_threshold = convergence_threshold
@@ -230,13 +343,45 @@ class PfTestExecutor:
         
         self.test_regimen = PfTestRegimen(test_info_path, print_message_func)
         self.cached_data_files_dir = cached_data_files_dir
-        self.pf_active = False
         self.pf_engine = pf_engine
         self.parameters_pf = parameters_pf
         self.num_trials = num_trials
         self.class_mapping = class_mapping
         
         self.save_path = save_path
+        self.data_time_window = data_time_window
+        self.early_stopping = early_stopping if early_stopping is not None else EarlyStopping()
+        self.trial_stop_reason = None
+        self.tests_aborted = False
+
+        if result_cache is not None and seed is None:
+            raise ValueError("A seed is needed to use the result cache")
+        self.seed = seed
+        self.result_cache = result_cache
+        self.trial_seeds = None
+        if seed is not None:
+            self.trial_seeds = get_trial_seeds(seed, self.test_regimen.num_tests, num_trials)
+        self.map_hash = None
+
+        self.telemetry = telemetry
+        self.scan_updated = False
+
+        self.clock = clock if clock is not None else ExecutionClock()
+
+        # The data loader of the message source is set for each test
+        self.message_source = RecordedMessageSource(None)
+        self.cached_trunk_source = CachedTrunkSource(None if self.CACHE_REMAPPED_CLASSES else class_mapping)
+        self.pipeline = PfPipeline(pf_engine=pf_engine,
+                                   message_source=self.message_source,
+                                   trunk_source=FunctionTrunkSource(self.get_trunk_data),
+                                   odom_source=CachedOdomSource(),
+                                   clock=self.clock,
+                                   observers=[self],
+                                   check_convergence_every_msg=True)
+
+        # Each data file is parsed once, with the classes remapped, and shared by all the tests that use it
+        self.dataset_cache = DatasetCache(max_bytes=dataset_cache_max_bytes,
+                                          class_mapping=class_mapping if self.CACHE_REMAPPED_CLASSES else None)
         
         self.data_manager = None
         
@@ -280,8 +425,8 @@ class PfTestExecutor:
         """
         Stop the particle filter gracefully
         """
-        self.pf_active = False
         self.tests_aborted = True
+        self.pipeline.stop()
         
     def run_all_tests(self):
         """
@@ -298,8 +443,6 @@ class PfTestExecutor:
             if self.tests_aborted:
                 break
             
-            test_info.test_completed = True
-            
         if self.save_path is not None and not self.tests_aborted:
             self.process_results(self.save_path)
 
@@ -329,20 +472,60 @@ class PfTestExecutor:
 
         self.print_message_func("Running test: " + test_info.test_name)
 
-        self.reset_for_test(test_info)
-        
-        if self.tests_aborted:
-                return
+        test_index = self.test_regimen.pf_tests.index(test_info)
+        test_reset = False
 
         for trial_num in range(self.num_trials):
+            trial_key = None
+            if self.result_cache is not None:
+                trial_key = self.get_trial_key(test_info, int(self.trial_seeds[test_index, trial_num]))
+                cached_result = self.result_cache.get(trial_key)
+                if cached_result is not None:
+                    self.print_message_func("Trial {} found in the result cache".format(trial_num + 1))
+                    test_info.add_results(*cached_result)
+                    self.signal_update_ui_with_trial_results(test_info)
+                    if self.early_stopping.test_done(test_info.results_convergence_accuracy):
+                        test_info.set_completed(TEST_CONFIDENCE_INTERVAL)
+                        return
+                    continue
+
+            # The data is only loaded once there's a trial to run
+            if not test_reset:
+                self.reset_for_test(test_info)
+                test_reset = True
+
+                if self.tests_aborted:
+                    return
+
             self.print_message_func("Starting trial " + str(trial_num + 1))
             self.signal_update_trial_number(trial_num + 1)
+
+            if self.trial_seeds is not None:
+                self.pf_engine.set_random_streams(int(self.trial_seeds[test_index, trial_num]))
+            if self.telemetry is not None:
+                self.telemetry.start_trial(test_index, trial_num)
+
             self.run_trial(test_info)
+
+            if self.telemetry is not None:
+                self.telemetry.end_trial()
             
             if self.tests_aborted:
                 return
+
+            if trial_key is not None:
+                self.result_cache.put(trial_key, test_info.results_run_times[-1],
+                                      test_info.results_convergence_accuracy[-1], test_info.results_distances[-1],
+                                      test_info.results_stop_reasons[-1])
             
             self.signal_update_ui_with_trial_results(test_info)
+
+            if self.early_stopping.test_done(test_info.results_convergence_accuracy):
+                self.print_message_func("Confidence interval reached after {} trials".format(trial_num + 1))
+                test_info.set_completed(TEST_CONFIDENCE_INTERVAL)
+                return
+
+        test_info.set_completed(TEST_MAX_TRIALS)
             
     def reset_for_test(self, test_info):
         """
@@ -352,19 +535,39 @@ class PfTestExecutor:
             test_info (PfTest): The test info for the test to reset for
         """
         
-        data_file_path = os.path.join(self.cached_data_files_dir, test_info.data_file_name + ".json")
-        self.data_manager = CachedDataLoader(data_file_path)
+        # Only load the data after the start of the test, the data loader loads more if the test runs past the window
+        time_window = None
+        if self.data_time_window is not None:
+            time_window = (test_info.start_time, test_info.start_time + self.data_time_window)
 
-        self.parameters_pf.start_pose_center_x = test_info.start_x
-        self.parameters_pf.start_pose_center_y = test_info.start_y
-        self.parameters_pf.start_width = test_info.start_width
-        self.parameters_pf.start_height = test_info.start_length
-        self.parameters_pf.start_rotation = test_info.start_rotation
-        self.parameters_pf.start_orientation_center = test_info.orientation_center
-        self.parameters_pf.start_orientation_range = test_info.orientation_range
+        # Use the binary version of the data file if it has been converted
+        data_file_path = self.dataset_cache.find_data_file(self.cached_data_files_dir, test_info.data_file_name)
+        self.data_manager = self.dataset_cache.get_data_loader(data_file_path, time_window)
+
+        for parameter_name, test_info_name in TEST_START_PARAMETERS.items():
+            setattr(self.parameters_pf, parameter_name, getattr(test_info, test_info_name))
 
         self.reset_for_trial(test_info)
 
+    def get_trial_key(self, test_info, seed):
+        """
+        Get the key of a trial in the result cache
+
+        Args:
+            test_info (PfTest): The test
+            seed (int): The seed of the trial
+
+        Returns:
+            str: The key
+        """
+        if self.map_hash is None:
+            self.map_hash = hash_map(self.pf_engine.map_positions, self.pf_engine.map_widths)
+
+        data_file_path = self.dataset_cache.find_data_file(self.cached_data_files_dir, test_info.data_file_name)
+        return self.result_cache.trial_key(get_test_parameters(self.parameters_pf, test_info), test_info, self.map_hash, data_file_path, seed,
+                                           self.convergence_threshold, self.class_mapping,
+                                           self.early_stopping.divergence_distance, self.clock)
+
     def reset_for_trial(self, test_info):
         """
         Reset the particle filter for a new trial of the test
@@ -394,130 +597,102 @@ class PfTestExecutor:
 
         self.reset_for_trial(test_info)
 
-        self.trial_start_time = time.time()
-        
-        self.pf_active = True
+        self.position_gt = None
+        self.message_source.data_manager = self.data_manager
 
-        while self.pf_active:
-            self.send_next_msg()
+        # The trial is timed by the pipeline's clock from after the reset, which may wait on a UI
+        self.trial_stop_reason = run_blocking(self.pipeline)
 
         if self.tests_aborted:
             self.print_message_func("Test aborted")
             return
 
-        trial_time = time.time() - self.trial_start_time
+        trial_time = self.clock.elapsed()
         
         correct_convergence, distance = self.check_converged_location()
 
-        test_info.add_results(trial_time, correct_convergence, distance)
+        test_info.add_results(trial_time, correct_convergence, distance, self.trial_stop_reason, self.clock.get_timing())
 
-    def send_next_msg(self):
-        """
-        Send the next message to the particle filter
+    def on_message(self, current_msg):
         """
-        current_msg = self.data_manager.get_next_msg()
-
-        if current_msg is None:
-            self.pf_active = False
-            return
-
-        self.signal_set_time_line(self.data_manager.current_data_file_time_stamp)
-
-        if current_msg['topic'] == 'odom':
-            x_odom, theta_odom, time_stamp_odom = self.get_odom_data(current_msg)
-            self.pf_engine.handle_odom(x_odom, theta_odom, time_stamp_odom)
-
-        elif current_msg['topic'] == 'image':
+        Update the time line before each message is processed
 
-            self.get_data_from_image_msg(current_msg)
-
-        self.converged = self.pf_engine.check_convergence()
-        
-        if self.converged:
-            self.pf_active = False
-            
-        self.signal_update_trial_info()
-        
-    def get_odom_data(self, current_msg):
-        """
-        Get the odometry data from the current message
-        
         Args:
             current_msg (dict): The current message
-            
-        Returns:
-            x_odom (float): The x odometry value
-            theta_odom (float): The theta odometry value
-            time_stamp_odom (float): The odometry time stamp
         """
-        odom_data = current_msg['data']
-        x_odom = odom_data['x_odom']
-        theta_odom = odom_data['theta_odom']
-        time_stamp_odom = current_msg['timestamp']
-
-        return x_odom, theta_odom, time_stamp_odom 
+        self.scan_updated = False
+        self.signal_set_time_line(self.data_manager.current_data_file_time_stamp)
 
-    def get_data_from_image_msg(self, current_msg):
+    def on_image(self, current_msg, tree_data):
         """
-        Get the data from the image message
+        Get the ground truth position after a scan update, and stop the trial if the particles diverged from it
 
         Args:
-            current_msg (dict): The current message
+            current_msg (dict): The image message
+            tree_data (dict): The trunk data of the scan update, or None if there was none
         """
-        positions, widths, class_estimates = self.get_trunk_data(current_msg)
-
-        if positions is None:
+        if tree_data is None:
             return
 
-        tree_data = {'positions': positions, 'widths': widths, 'classes': class_estimates}
-        self.pf_engine.scan_update(tree_data)
+        self.scan_updated = True
 
         actual_position = current_msg['data']['location_estimate']
         self.position_gt = np.array([actual_position['x'], actual_position['y']])
+
+        if self.early_stopping.trial_diverged(self.pf_engine.particles, self.position_gt):
+            self.pipeline.stop(TRIAL_DIVERGED)
         
         self.signal_plot_gt_position()
         self.signal_plot_particles()
         self.signal_update_image_number()
-        
-    def get_trunk_data(self, current_msg):
+
+    def on_message_processed(self, current_msg):
         """
-        Get the trunk data for the current message
+        Record the telemetry after a scan update and update the trial info
 
         Args:
             current_msg (dict): The current message
-
-        Returns:
-            positions (np.array): The trunk positions
-            widths (np.array): The trunk widths
-            class_estimates (np.array): The class estimates for the trunks
         """
-        if current_msg['data'] is None:
-            return None, None, None
-
-        msg_data = current_msg['data']['tree_data']
-        self.positions = np.array(msg_data['positions'])
-        self.widths = np.array(msg_data['widths'])
-        self.class_estimates = np.array(msg_data['classes'], dtype=np.int32)
+        if self.telemetry is not None and self.scan_updated:
+            self.record_telemetry(current_msg)
+            
+        self.signal_update_trial_info()
+        
+    def record_telemetry(self, current_msg):
+        """
+        Record the state of the particle filter after a scan update
 
-        self.class_estimates = self.remap_classes(self.class_estimates)
+        Args:
+            current_msg (dict): The image message of the scan update
+        """
+        error = np.linalg.norm(self.pf_engine.best_particle[0:2] - self.position_gt[0:2])
+
+        self.telemetry.record(data_time=current_msg['timestamp'],
+                              trial_time=self.clock.elapsed(),
+                              num_particles=self.pf_engine.particles.shape[0],
+                              effective_sample_size=self.pf_engine.effective_sample_size,
+                              num_clusters=self.pf_engine.num_clusters,
+                              error=error,
+                              converged=self.pipeline.converged,
+                              scan_time=self.pipeline.scan_time,
+                              weight_time=self.pf_engine.weight_time,
+                              resample_time=self.pf_engine.resample_time,
+                              convergence_time=self.pipeline.convergence_time)
 
-        return self.positions, self.widths, self.class_estimates
-    
-    def remap_classes(self, class_estimates):
+    def get_trunk_data(self, current_msg):
         """
-        Remap the classes from the trunk width estimation package to this one
+        Get the trunk data for the current message
 
         Args:
-            class_estimates (np.array): The class estimates
+            current_msg (dict): The current message
 
         Returns:
-            np.array: The remapped class estimates
+            positions (np.array): The trunk positions
+            widths (np.array): The trunk widths
+            class_estimates (np.array): The class estimates for the trunks
         """
-        class_estimates_copy = class_estimates.copy()
-        for i, class_num in enumerate(self.class_mapping):
-            class_estimates_copy[class_estimates == i] = class_num
-
-        return class_estimates_copy
+        # The classes in the dataset cache are usually already remapped
+        return self.cached_trunk_source.get_trunk_data(current_msg)
     
     def check_converged_location(self):
         """
@@ -525,8 +700,12 @@ class PfTestExecutor:
 
         Returns:
             correct_convergence (bool): Whether the particle filter converged to the correct location
-            distance (float): The distance the particle filter traveled before converging
+            distance (float): The distance the particle filter traveled before converging, nan if the trial ended before
+                              a scan update gave a ground truth position
         """
+        if self.position_gt is None:
+            return False, float("nan")
+
         position_estimate = self.pf_engine.best_particle[0:2]
 
         actual_position = self.position_gt[0:2]
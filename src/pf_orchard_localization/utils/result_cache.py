@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from dataclasses import asdict
+import numpy as np
+from ..pf_engine import PF_ENGINE_VERSION
+from ..pipeline.execution_clock import ExecutionClock
+
+# Stores the results of test trials keyed by a hash of everything the result depends on: the particle filter parameters,
+# the map, the contents of the data file, the test start row, the trial seed, the evaluation settings, the clock the
+# trial is timed by and the particle filter engine version. Running a test regimen again only runs the trials whose
+# inputs changed, and a regimen that was interrupted picks up where it stopped, since each result is stored as soon as
+# its trial finishes. Changing any of the inputs changes the key, so old results are never served for new inputs.
+# PF_ENGINE_VERSION has to be bumped when a change to the particle filter changes its results.
+
+# Bump when what goes into the key changes, so keys made the old way aren't matched
+TRIAL_KEY_VERSION = 2
+
+# The columns of the test info csv file that are part of the key
+TEST_ROW_FIELDS = ("test_name", "start_x", "start_y", "start_width", "start_length", "start_rotation",
+                   "orientation_center", "orientation_range", "data_file_name", "start_time")
+
+
+def hash_map(map_positions, map_widths):
+    """
+    Hash the tree positions and widths of a map
+
+    Args:
+        map_positions (np.ndarray): The positions of the trees
+        map_widths (np.ndarray): The widths of the trees
+
+    Returns:
+        str: The hex digest of the map
+    """
+    map_hash = hashlib.sha256()
+    for array in (map_positions, map_widths):
+        array = np.ascontiguousarray(array, dtype=np.float64)
+        map_hash.update(str(array.shape).encode())
+        map_hash.update(array.tobytes())
+    return map_hash.hexdigest()
+
+
+class ResultCache:
+    """
+    Content addressed store of test trial results, in a sqlite database file
+    """
+
+    def __init__(self, db_path, timeout=60.0):
+        """
+        Args:
+            db_path (str): The path to the database file, made if it doesn't exist
+            timeout (float, optional): How long to wait for other processes to release the database, in seconds.
+                                       Defaults to 60.0.
+        """
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, timeout=timeout, check_same_thread=False)
+
+        with self.lock:
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY,
+                    trial_time REAL,
+                    correct_convergence INTEGER,
+                    distance REAL,
+                    stop_reason TEXT
+                );
+                CREATE TABLE IF NOT EXISTS file_hashes (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER,
+                    mtime_ns INTEGER,
+                    digest TEXT
+                );
+            """)
+
+        self.num_hits = 0
+        self.num_misses = 0
+
+    def hash_file(self, file_path):
+        """
+        Hash the contents of a file. The hash is stored with the size and modification time of the file, so the file is
+        only read again once it changes.
+
+        Args:
+            file_path (str): The path to the file
+
+        Returns:
+            str: The hex digest of the file
+        """
+        file_path = os.path.abspath(file_path)
+        file_stat = os.stat(file_path)
+
+        with self.lock:
+            row = self.connection.execute("SELECT size, mtime_ns, digest FROM file_hashes WHERE path = ?",
+                                          (file_path,)).fetchone()
+        if row is not None and row[0] == file_stat.st_size and row[1] == file_stat.st_mtime_ns:
+            return row[2]
+
+        file_hash = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                file_hash.update(chunk)
+        digest = file_hash.hexdigest()
+
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO file_hashes (path, size, mtime_ns, digest) VALUES (?, ?, ?, ?)",
+                                    (file_path, file_stat.st_size, file_stat.st_mtime_ns, digest))
+        return digest
+
+    def trial_key(self, parameters_pf, test_info, map_hash, data_file_path, seed, convergence_threshold, class_mapping,
+                  divergence_distance=None, clock=None):
+        """
+        Make the key of a trial
+
+        Args:
+            parameters_pf (ParametersPf): The parameters for the particle filter, with the start pose of the test, see
+                                          get_test_parameters
+            test_info (PfTest): The test
+            map_hash (str): The hash of the map, see hash_map
+            data_file_path (str): The path to the data file of the test
+            seed (int): The seed of the trial
+            convergence_threshold (float): The distance at which the particle filter is considered to have converged
+            class_mapping (tuple): The mapping of classes from the trunk width estimation package to this one
+            divergence_distance (float, optional): The distance trials are stopped at if no particle is within it of the
+                                                   ground truth. Defaults to None.
+            clock (ExecutionClock, optional): The clock the trial is paced and timed by, a trial time is data time with a
+                                              simulated clock and wall time otherwise. Defaults to None, the default
+                                              ExecutionClock.
+
+        Returns:
+            str: The key
+        """
+        if clock is None:
+            clock = ExecutionClock()
+
+        inputs = {"key_version": TRIAL_KEY_VERSION,
+                  "engine_version": PF_ENGINE_VERSION,
+                  "parameters_pf": asdict(parameters_pf),
+                  "test_row": {name: getattr(test_info, name) for name in TEST_ROW_FIELDS},
+                  "map": map_hash,
+                  "data_file": self.hash_file(data_file_path),
+                  "seed": int(seed),
+                  "convergence_threshold": convergence_threshold,
+                  "class_mapping": list(class_mapping),
+                  "divergence_distance": divergence_distance,
+                  "clock": {"mode": clock.mode, "speed_factor": clock.speed_factor, "added_delay": clock.added_delay}}
+
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get(self, key):
+        """
+        Get the result of a trial
+
+        Args:
+            key (str): The key of the trial
+
+        Returns:
+            tuple: The trial time, whether the trial converged to the correct location, the distance from the correct
+                   location and why the trial stopped, or None if the trial isn't in the cache
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT trial_time, correct_convergence, distance, stop_reason FROM results "
+                                          "WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.num_misses += 1
+            return None
+
+        self.num_hits += 1
+        trial_time, correct_convergence, distance, stop_reason = row
+        return trial_time, bool(correct_convergence), distance, stop_reason
+
+    def put(self, key, trial_time, correct_convergence, distance, stop_reason=None):
+        """
+        Store the result of a trial
+
+        Args:
+            key (str): The key of the trial
+            trial_time (float): The time the trial took
+            correct_convergence (bool): Whether the trial converged to the correct location
+            distance (float): The distance from the correct location
+            stop_reason (str, optional): Why the trial stopped. Defaults to None.
+        """
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO results (key, trial_time, correct_convergence, distance, "
+                                    "stop_reason) VALUES (?, ?, ?, ?, ?)",
+                                    (key, float(trial_time), int(bool(correct_convergence)), float(distance),
+                                     stop_reason))
+
+    def clear(self):
+        """
+        Remove all the stored results
+        """
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM results")
+
+    def close(self):
+        """
+        Close the database
+        """
+        with self.lock:
+            self.connection.close()
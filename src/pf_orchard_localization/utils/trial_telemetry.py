@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+import glob
+import os
+import numpy as np
+from ..recorded_data_loaders.array_file import (ArrayFileWriter, open_array_file, read_footer, scan_segments,
+                                                index_segments)
+
+# Records a time series for each test trial, one row per scan update, in an array file with one array per column. The
+# rows are kept in preallocated buffers and written to the file as one segment per column at the end of each trial or
+# when the buffers fill up, so recording a row only costs a few array assignments. Files that were never finalized, for
+# example from a worker process that was shut down, are read by scanning their segments.
+
+TELEMETRY_EXTENSION = ".pft"
+
+# The columns of the telemetry and their dtypes
+TELEMETRY_COLUMNS = {
+    "test_index": np.int32,
+    "trial_num": np.int32,
+    "step": np.int32,               # The number of the scan update in the trial
+    "data_time": np.float64,        # The time stamp of the image message, in seconds
+    "trial_time": np.float64,       # The time since the start of the trial, in seconds
+    "num_particles": np.int32,
+    "effective_sample_size": np.float64,
+    "num_clusters": np.int32,       # The number of clusters found by the last convergence check
+    "error": np.float64,            # The distance from the best particle to the ground truth position, in meters
+    "converged": np.bool_,
+    "scan_time": np.float64,        # The time of the whole scan update, in seconds
+    "weight_time": np.float64,      # The time spent weighting the particles, in seconds
+    "resample_time": np.float64,    # The time spent resampling the particles, in seconds
+    "convergence_time": np.float64, # The time spent checking for convergence, in seconds
+}
+
+
+class TrialTelemetryWriter:
+    """
+    Writes the telemetry of test trials to an array file
+    """
+
+    def __init__(self, file_path, buffer_rows=4096, metadata=None):
+        """
+        Args:
+            file_path (str): The path to write the telemetry to
+            buffer_rows (int, optional): The number of rows to buffer before writing them to the file. Defaults to 4096.
+            metadata (dict, optional): Json serializable metadata to store in the file. Defaults to None.
+        """
+        self.file_path = file_path
+        self.buffer_rows = buffer_rows
+        self.writer = ArrayFileWriter(file_path, metadata=metadata)
+
+        self.buffers = {name: np.zeros(buffer_rows, dtype=dtype) for name, dtype in TELEMETRY_COLUMNS.items()}
+        self.num_buffered = 0
+
+        self.test_index = -1
+        self.trial_num = -1
+        self.step = 0
+
+    def start_trial(self, test_index, trial_num):
+        """
+        Start recording a new trial
+
+        Args:
+            test_index (int): The index of the test in the test regimen
+            trial_num (int): The number of the trial
+        """
+        self.test_index = test_index
+        self.trial_num = trial_num
+        self.step = 0
+
+    def record(self, **values):
+        """
+        Record a row of the current trial
+
+        Args:
+            **values: The value of each column in TELEMETRY_COLUMNS other than test_index, trial_num and step
+        """
+        row = self.num_buffered
+        self.buffers["test_index"][row] = self.test_index
+        self.buffers["trial_num"][row] = self.trial_num
+        self.buffers["step"][row] = self.step
+        for name, value in values.items():
+            self.buffers[name][row] = value
+
+        self.step += 1
+        self.num_buffered += 1
+        if self.num_buffered == self.buffer_rows:
+            self.write_buffers()
+
+    def end_trial(self):
+        """
+        Write the rows of the trial to the file
+        """
+        self.write_buffers()
+        self.writer.flush()
+
+    def write_buffers(self):
+        """
+        Append the buffered rows to the file
+        """
+        if self.num_buffered == 0:
+            return
+
+        for name, buffer in self.buffers.items():
+            self.writer.append(name, buffer[:self.num_buffered])
+        self.num_buffered = 0
+
+    def close(self):
+        """
+        Write the remaining rows and finalize the file
+        """
+        self.write_buffers()
+        self.writer.finalize()
+
+
+def open_telemetry_file(file_path):
+    """
+    Open a telemetry file, recovering the rows written to it if it was never finalized
+
+    Args:
+        file_path (str): The path to the telemetry file
+
+    Returns:
+        dict: The columns of the telemetry
+    """
+    try:
+        read_footer(file_path)
+    except ValueError:
+        arrays_index = index_segments(scan_segments(file_path))
+        file_map = np.memmap(file_path, dtype=np.uint8, mode="r") if arrays_index else None
+        columns = {}
+        for name, array_index in arrays_index.items():
+            dtype = np.dtype(array_index["dtype"])
+            columns[name] = np.concatenate([np.frombuffer(file_map, dtype=dtype, count=rows, offset=offset)
+                                            for offset, rows in array_index["segments"]])
+    else:
+        columns, _ = open_array_file(file_path)
+
+    # Only keep the rows written to every column, a file cut short may be missing the last segments of some columns
+    num_rows = min((len(column) for column in columns.values()), default=0)
+    return {name: columns[name][:num_rows] if name in columns else np.zeros(0, dtype=dtype)
+            for name, dtype in TELEMETRY_COLUMNS.items()}
+
+
+def load_telemetry(path):
+    """
+    Load the telemetry of a test regimen as one table, sorted by test, trial and step
+
+    Args:
+        path (str): A telemetry file, or a directory of telemetry files such as the ones written by each worker process
+
+    Returns:
+        dict: The columns of the telemetry
+    """
+    if os.path.isdir(path):
+        file_paths = sorted(glob.glob(os.path.join(path, "*" + TELEMETRY_EXTENSION)))
+    else:
+        file_paths = [path]
+
+    tables = [open_telemetry_file(file_path) for file_path in file_paths]
+    if not tables:
+        return {name: np.zeros(0, dtype=dtype) for name, dtype in TELEMETRY_COLUMNS.items()}
+
+    telemetry = {name: np.concatenate([table[name] for table in tables]) for name in TELEMETRY_COLUMNS}
+
+    order = np.lexsort((telemetry["step"], telemetry["trial_num"], telemetry["test_index"]))
+    return {name: column[order] for name, column in telemetry.items()}
+
+
+def select_trial(telemetry, test_index, trial_num=None):
+    """
+    Get the rows of a test, or of one trial of it, from a telemetry table
+
+    Args:
+        telemetry (dict): The columns of the telemetry, see load_telemetry
+        test_index (int): The index of the test
+        trial_num (int, optional): The number of the trial. Defaults to None, which gets every trial of the test.
+
+    Returns:
+        dict: The columns of the selected rows
+    """
+    mask = telemetry["test_index"] == test_index
+    if trial_num is not None:
+        mask &= telemetry["trial_num"] == trial_num
+    return {name: column[mask] for name, column in telemetry.items()}